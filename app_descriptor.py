@@ -0,0 +1,101 @@
+"""
+App Descriptor for ESP32 firmware images
+Parses esp_app_desc_t (project name, version, ELF SHA-256...) from an app
+image file or from the first bytes of an app partition read off the device
+"""
+
+import struct
+
+
+class AppDescriptor:
+    """esp_app_desc_t embedded at the start of every ESP-IDF / Arduino app image"""
+
+    MAGIC = 0xABCD5432
+    IMAGE_MAGIC = 0xE9
+    # esp_image_header_t chip_id -> esptool chip name
+    CHIP_IDS = {0: "esp32", 2: "esp32s2", 5: "esp32c3", 9: "esp32s3", 12: "esp32c2", 13: "esp32c6", 16: "esp32h2"}
+    # esp_image_header_t (24 bytes) + first esp_image_segment_header_t (8 bytes)
+    OFFSET = 0x20
+    SIZE = 256
+    READ_SIZE = OFFSET + SIZE
+
+    # magic, secure_version, reserv1[2], version, project_name, time, date, idf_ver, app_elf_sha256
+    _FORMAT = '<II8x32s32s16s16s32s32s'
+
+    def __init__(self, project_name, version, elf_sha256, idf_ver='', date='', time='', secure_version=0):
+        self.project_name = project_name
+        self.version = version
+        self.elf_sha256 = elf_sha256
+        self.idf_ver = idf_ver
+        self.date = date
+        self.time = time
+        self.secure_version = secure_version
+
+    @staticmethod
+    def _text(raw):
+        return raw.split(b'\x00', 1)[0].decode('utf-8', errors='replace')
+
+    @classmethod
+    def from_image(cls, data):
+        """
+        Parse the descriptor from the start of an app image
+
+        Args:
+            data: At least READ_SIZE bytes from the start of the image / partition
+
+        Returns:
+            AppDescriptor, or None if the data is not an app image with a descriptor
+        """
+        if len(data) < cls.READ_SIZE or data[0] != cls.IMAGE_MAGIC:
+            return None
+        (magic, secure_version, version, project_name, time_str, date,
+         idf_ver, elf_sha256) = struct.unpack_from(cls._FORMAT, data, cls.OFFSET)
+        if magic != cls.MAGIC:
+            return None
+        return cls(cls._text(project_name), cls._text(version), elf_sha256.hex(),
+                   idf_ver=cls._text(idf_ver), date=cls._text(date), time=cls._text(time_str),
+                   secure_version=secure_version)
+
+    @classmethod
+    def image_chip(cls, data):
+        """Target chip from an ESP image header, None if not an ESP image or unknown chip id"""
+        if len(data) < 14 or data[0] != cls.IMAGE_MAGIC:
+            return None
+        return cls.CHIP_IDS.get(struct.unpack_from('<H', data, 12)[0])
+
+    @classmethod
+    def from_file(cls, path):
+        """Descriptor of an app .bin file, None if unreadable or not an app image"""
+        try:
+            with open(path, 'rb') as f:
+                return cls.from_image(f.read(cls.READ_SIZE))
+        except OSError:
+            return None
+
+    def to_dict(self):
+        """Fields as kept in the artifact store and project manifests (AppDescriptor(**fields))"""
+        return {"project_name": self.project_name, "version": self.version, "elf_sha256": self.elf_sha256,
+                "idf_ver": self.idf_ver, "date": self.date, "time": self.time,
+                "secure_version": self.secure_version}
+
+    @property
+    def has_elf_sha(self):
+        """False when the build did not embed the ELF hash (all zeros)"""
+        return self.elf_sha256.strip('0') != ''
+
+    def matches(self, other):
+        """
+        Same build: project name, version and ELF SHA-256 all equal.
+        Without an embedded ELF hash the builds cannot be told apart, so
+        that never counts as a match.
+        """
+        return (other is not None and self.has_elf_sha
+                and self.project_name == other.project_name
+                and self.version == other.version
+                and self.elf_sha256 == other.elf_sha256)
+
+    def __str__(self):
+        return f"{self.project_name} {self.version} (ELF {self.elf_sha256[:16]}, IDF {self.idf_ver})"
+
+    def __repr__(self):
+        return f"AppDescriptor({self})"
@@ -0,0 +1,302 @@
+"""
+Artifact Store for ESP32 firmware binaries
+Content-addressed (SHA-256) store of every binary the tool flashes, with the
+digests and parsed image metadata computed once per unique blob, and named
+references (projects, extracted bootloaders...) counted so unused blobs can
+be collected
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+from app_descriptor import AppDescriptor
+
+
+class Artifact:
+    """One unique blob and what is known about it"""
+
+    KIND_APP = "app"                  # image with esp_app_desc_t
+    KIND_IMAGE = "image"              # other ESP image (bootloader)
+    KIND_PARTITIONS = "partition_table"
+    KIND_DATA = "data"
+
+    def __init__(self, sha256, md5, size, kind, chip=None, app=None, created=None, path=None):
+        """
+        Args:
+            sha256: SHA-256 of the contents (the blob's address)
+            md5: MD5 of the contents padded to 4 bytes (what the device reports after writing)
+            size: Size in bytes
+            kind: One of the KIND_* values
+            chip: Target chip from the image header (ESP images only)
+            app: AppDescriptor fields (app images only)
+            created: When the blob entered the store
+            path: Blob file inside the store
+        """
+        self.sha256 = sha256
+        self.md5 = md5
+        self.size = size
+        self.kind = kind
+        self.chip = chip
+        self.app = app
+        self.created = created or time.time()
+        self.path = path
+
+    @property
+    def padded_size(self):
+        return self.size + (-self.size % 4)
+
+    def app_descriptor(self):
+        return AppDescriptor(**self.app) if self.app else None
+
+    @classmethod
+    def describe(cls, data):
+        """(kind, chip, app fields) parsed from the contents"""
+        if data[:2] == b'\xAA\x50':
+            return cls.KIND_PARTITIONS, None, None
+        if len(data) < 16 or data[0] != AppDescriptor.IMAGE_MAGIC:
+            return cls.KIND_DATA, None, None
+        chip = AppDescriptor.image_chip(data)
+        descriptor = AppDescriptor.from_image(data[:AppDescriptor.READ_SIZE])
+        if descriptor is None:
+            return cls.KIND_IMAGE, chip, None
+        return cls.KIND_APP, chip, descriptor.to_dict()
+
+    def __repr__(self):
+        return f"Artifact({self.sha256[:12]} {self.kind} {self.size} bytes{' ' + self.chip if self.chip else ''})"
+
+
+class ArtifactStore:
+    """Blobs under <root>/blobs/<sha[:2]>/<sha>.bin, metadata and references in SQLite"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            md5 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            chip TEXT,
+            app TEXT,
+            created REAL NOT NULL,
+            used REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS refs (
+            ref TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_refs_sha ON refs(sha256);
+        CREATE TABLE IF NOT EXISTS paths (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, root, logger=None):
+        """
+        Initialize artifact store
+
+        Args:
+            root: Store directory (created if missing)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.compressed_dir = os.path.join(root, "compressed")
+        self.logger = logger or self._default_logger
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "store.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256[:2], f"{sha256}.bin")
+
+    def _artifact(self, row):
+        sha256, md5, size, kind, chip, app, created, _ = row
+        return Artifact(sha256, md5, size, kind, chip, json.loads(app) if app else None, created,
+                        self.blob_path(sha256))
+
+    def get(self, sha256):
+        """Artifact of a blob, None if the store does not have it"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return self._artifact(row) if row else None
+
+    # ------------------------------------------------------------------ #
+    #  Adding blobs                                                        #
+    # ------------------------------------------------------------------ #
+
+    def lookup(self, path):
+        """Artifact of a file already added with the same mtime and size (no read), else None"""
+        st = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT b.* FROM paths p JOIN blobs b ON b.sha256 = p.sha256 "
+                "WHERE p.path = ? AND p.mtime_ns = ? AND p.size = ?",
+                (os.path.abspath(path), st.st_mtime_ns, st.st_size)).fetchone()
+        return self._artifact(row) if row and os.path.exists(self.blob_path(row[0])) else None
+
+    def _store(self, data):
+        """Insert a blob (file + metadata) unless it is already there"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        artifact = self.get(sha256)
+        if artifact is not None and os.path.exists(artifact.path):
+            return artifact
+
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # Blobs are copies, never links: rewriting a project file in place must not touch the store
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, blob_path)
+
+        kind, chip, app = Artifact.describe(data)
+        md5 = hashlib.md5(data + b'\xff' * (-len(data) % 4)).hexdigest()
+        artifact = Artifact(sha256, md5, len(data), kind, chip, app, path=blob_path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (sha256, md5, len(data), kind, chip, json.dumps(app) if app else None,
+                                artifact.created, artifact.created))
+            self._conn.commit()
+        self.log(f"Artefacto nuevo: {artifact}", "debug")
+        return artifact
+
+    def put(self, path, ref=None):
+        """
+        Add a file (once per unique content) and optionally point a reference at it
+
+        A file already seen with the same mtime and size is not read again.
+
+        Args:
+            path: File to add
+            ref: Optional reference name, e.g. 'project:secafe/firmware'
+
+        Returns:
+            Artifact
+        """
+        artifact = self.lookup(path)
+        if artifact is None:
+            st = os.stat(path)
+            with open(path, 'rb') as f:
+                artifact = self._store(f.read())
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)",
+                                   (os.path.abspath(path), st.st_mtime_ns, st.st_size, artifact.sha256))
+                self._conn.commit()
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET used = ? WHERE sha256 = ?", (time.time(), artifact.sha256))
+            self._conn.commit()
+        if ref:
+            self.ref(ref, artifact.sha256)
+        return artifact
+
+    def put_bytes(self, data, ref=None):
+        """Add contents that have no file of their own (e.g. read from a device)"""
+        artifact = self._store(data)
+        if ref:
+            self.ref(ref, artifact.sha256)
+        return artifact
+
+    # ------------------------------------------------------------------ #
+    #  References                                                          #
+    # ------------------------------------------------------------------ #
+
+    def ref(self, ref, sha256):
+        """Point a named reference at a blob (replacing what it pointed at before)"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?)", (ref, sha256, time.time()))
+            self._conn.commit()
+
+    def resolve(self, ref):
+        """Artifact a reference points at, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM refs WHERE ref = ?", (ref,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def release(self, ref_prefix):
+        """Drop every reference starting with ref_prefix, returns how many were dropped"""
+        pattern = ref_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self._lock:
+            count = self._conn.execute("DELETE FROM refs WHERE ref LIKE ? ESCAPE '\\'", (pattern,)).rowcount
+            self._conn.commit()
+        return count
+
+    def refcount(self, sha256):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM refs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+
+    def gc(self, min_age=0):
+        """
+        Delete blobs no reference points at (and their compressed payloads)
+
+        Args:
+            min_age: Keep unreferenced blobs used less than this many seconds ago
+                     (loose files flashed recently are likely to be flashed again)
+
+        Returns:
+            (blobs removed, bytes freed)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT sha256, size FROM blobs WHERE sha256 NOT IN (SELECT sha256 FROM refs) AND used <= ?",
+                (time.time() - min_age,)).fetchall()
+            self._conn.executemany("DELETE FROM blobs WHERE sha256 = ?", [(sha,) for sha, _ in rows])
+            self._conn.executemany("DELETE FROM paths WHERE sha256 = ?", [(sha,) for sha, _ in rows])
+            self._conn.commit()
+        freed = 0
+        for sha256, size in rows:
+            for path in [self.blob_path(sha256)] + self._compressed_files(sha256):
+                try:
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    pass
+        if rows:
+            self.log(f"Artefactos sin referencias eliminados: {len(rows)} ({freed // 1024} KB)", "info")
+        return len(rows), freed
+
+    def _compressed_files(self, sha256):
+        """Compressed payloads a PayloadCache keeps for a blob in compressed_dir"""
+        if not os.path.isdir(self.compressed_dir):
+            return []
+        return [os.path.join(self.compressed_dir, name) for name in os.listdir(self.compressed_dir)
+                if name.startswith(f"{sha256}_z")]
+
+    def stats(self):
+        """(unique blobs, references, total blob bytes)"""
+        with self._lock:
+            blobs, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            refs = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return blobs, refs, total
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,521 @@
+"""
+Asyncio Flash Engine
+Coroutines for the flash operations (connect, read, erase, write, verify,
+monitor) on top of FlashManager, with per-call timeouts and cancellation, so
+one event loop can drive many ports. esptool calls are blocking: they run on
+a small shared thread pool (not one thread per port), and a call that times
+out or is cancelled closes its serial port so the blocked read returns and
+frees the worker. Serial monitors need no threads at all: the loop watches
+the port's file descriptor (polling in_waiting where there is none).
+
+Usage:
+    python async_engine.py flash --chip esp32s3 --ports COM3,COM4,COM5 firmware.bin [--address 0x10000] [--verify]
+    python async_engine.py read --port COM3 --address 0x8000 --size 0xC00 table.bin
+    python async_engine.py monitor --ports COM3,COM4 [--baud 115200] [--seconds 30]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import argparse
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from network_ports import is_network_port, tune
+
+
+class EngineError(Exception):
+    """A flash operation failed (the session may still be usable)"""
+
+
+class EngineTimeout(EngineError):
+    """A flash operation did not finish in time (its session was aborted)"""
+
+
+class AsyncSession:
+    """An open esptool session on one port (calls on it run one at a time)"""
+
+    def __init__(self, port, esp):
+        self.port = port
+        self.esp = esp
+        self.lock = asyncio.Lock()
+        self.closed = False
+
+    def abort(self):
+        """Close the serial port under a blocked esptool call (it fails and returns)"""
+        self.closed = True
+        try:
+            self.esp._port.close()
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return f"AsyncSession({self.port}{' closed' if self.closed else ''})"
+
+
+class MonitorStream:
+    """Serial monitor of one port: async iteration yields received chunks"""
+
+    POLL_INTERVAL = 0.02  # Ports without a pollable descriptor (Windows, rfc2217://)
+
+    def __init__(self, port, serial_port, loop):
+        self.port = port
+        self.serial = serial_port
+        self._loop = loop
+        self._chunks = asyncio.Queue()
+        self._fd = self._descriptor(port, serial_port)
+        self._poller = None
+        if self._fd is not None:
+            loop.add_reader(self._fd, self._on_readable)
+        else:
+            self._poller = loop.create_task(self._poll())
+
+    @staticmethod
+    def _descriptor(port, serial_port):
+        """File descriptor the loop can watch, None when reads must be polled"""
+        if sys.platform == "win32" or str(port).lower().startswith("rfc2217://"):
+            return None  # rfc2217 reads from its own telnet queue, not from the socket
+        sock = getattr(serial_port, "_socket", None)
+        if sock is not None:
+            return sock.fileno()
+        try:
+            return serial_port.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def _on_readable(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except Exception as e:
+            self._finish(e)
+            return
+        if data:
+            self._chunks.put_nowait(data)
+
+    async def _poll(self):
+        try:
+            while True:
+                waiting = self.serial.in_waiting
+                if waiting:
+                    self._chunks.put_nowait(self.serial.read(waiting))
+                else:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._finish(e)
+
+    def _finish(self, error=None):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        self._chunks.put_nowait(error)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.serial is None:
+            raise StopAsyncIteration
+        item = await self._chunks.get()
+        if item is None:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise EngineError(f"lectura de {self.port} fallida: {item}") from item
+        return item
+
+    def write(self, data):
+        self.serial.write(data)
+
+    async def close(self):
+        if self.serial is None:
+            return
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        self._finish()
+        self.serial.close()
+        self.serial = None
+
+
+class _ExecutorCall:
+    """
+    A blocking call queued on the engine's thread pool. Its timeout starts when
+    a worker picks it up: time spent waiting behind other ports' calls is not
+    on the clock, and a call given up while still queued never runs.
+    """
+
+    def __init__(self, executor, fn):
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._running = False
+        self._dropped = False
+        self.started = self._loop.create_future()
+        self.future = self._loop.run_in_executor(executor, self._run, fn)
+
+    def _run(self, fn):
+        with self._lock:
+            if self._dropped:
+                return None
+            self._running = True
+        self._loop.call_soon_threadsafe(self._mark_started)
+        return fn()
+
+    def _mark_started(self):
+        if not self.started.done():
+            self.started.set_result(None)
+
+    async def result(self, timeout):
+        await asyncio.wait({self.started, self.future}, return_when=asyncio.FIRST_COMPLETED)
+        # shield: a timeout must not leave the worker's future unawaited
+        return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+
+    def drop(self):
+        """Give up on the call: True if it had not started (it will be skipped)"""
+        with self._lock:
+            if not self._running:
+                self._dropped = True
+            return self._dropped
+
+
+class AsyncFlashEngine:
+    """Flash operations as coroutines, independent of any UI"""
+
+    CONNECT_TIMEOUT = 30.0
+    CLOSE_TIMEOUT = 10.0
+    BASE_TIMEOUT = 10.0       # Fixed part of a data operation's default timeout...
+    MIN_RATE = 8 * 1024       # ...plus its size at the slowest acceptable rate (bytes/s)
+
+    def __init__(self, flash_manager=None, max_workers=8, logger=None):
+        """
+        Initialize engine
+
+        Args:
+            flash_manager: FlashManager doing the esptool work (default: a plain one)
+            max_workers: Blocking esptool calls running at the same time, over all ports
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.logger = logger or self._default_logger
+        if flash_manager is None:
+            from flash_utils import FlashManager
+            flash_manager = FlashManager(logger=self.logger)
+        self.flash_manager = flash_manager
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="esptool")
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    # ------------------------------------------------------------------ #
+    #  Background loop (for synchronous callers such as the GUI)           #
+    # ------------------------------------------------------------------ #
+
+    def submit(self, coro):
+        """
+        Run a coroutine on the engine's own loop thread (started on first use)
+
+        Returns:
+            concurrent.futures.Future (future.cancel() cancels the coroutine)
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True, name="flash-engine").start()
+                self._loop = loop
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def shutdown(self):
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        self._executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------ #
+    #  Calls                                                               #
+    # ------------------------------------------------------------------ #
+
+    def _timeout(self, size):
+        return self.BASE_TIMEOUT + size / self.MIN_RATE
+
+    @staticmethod
+    def _progress(callback):
+        """Thread-safe progress callback that runs the caller's callback on the loop"""
+        if callback is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return lambda *args: loop.call_soon_threadsafe(callback, *args)
+
+    async def _call(self, session, what, fn, *args, timeout=None, **kwargs):
+        """Run a blocking FlashManager/esptool call for a session, with timeout and cancellation"""
+        if session.closed:
+            raise EngineError(f"{what}: la sesión de {session.port} está cerrada")
+        async with session.lock:
+            call = _ExecutorCall(self._executor, functools.partial(fn, *args, **kwargs))
+            try:
+                return await call.result(timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if not call.drop():
+                    session.abort()
+                    # The aborted call fails once the port is closed: nobody waits for that error
+                    call.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise EngineTimeout(f"{what} en {session.port}: sin respuesta tras {timeout:g}s")
+
+    # ------------------------------------------------------------------ #
+    #  Operations                                                          #
+    # ------------------------------------------------------------------ #
+
+    async def connect(self, port, chip=None, baud="auto", timeout=CONNECT_TIMEOUT):
+        """
+        Open a session (stub loaded, baud negotiated like FlashManager.open_session)
+
+        Returns:
+            AsyncSession
+
+        Raises:
+            EngineError: The board did not answer
+            EngineTimeout: Connecting took longer than timeout
+        """
+        call = _ExecutorCall(self._executor, functools.partial(self.flash_manager.open_session, port, chip, baud))
+        try:
+            esp = await call.result(timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not call.drop():
+                # The session may still open after giving up: release it when it does
+                call.future.add_done_callback(self._release_late)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise EngineTimeout(f"conexión con {port}: sin respuesta tras {timeout:g}s")
+        if esp is None:
+            raise EngineError(f"no se pudo conectar con {port}")
+        return AsyncSession(port, esp)
+
+    def _release_late(self, future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            self._executor.submit(self.flash_manager.close_session, future.result(), 'no-reset')
+
+    async def close(self, session, reset_mode='hard-reset'):
+        """Reset the board (reset_mode as in esptool) and release the port"""
+        if session.closed:
+            return
+        try:
+            await self._call(session, "reset", self.flash_manager.close_session, session.esp, reset_mode,
+                             timeout=self.CLOSE_TIMEOUT)
+        finally:
+            session.abort()
+
+    async def read(self, session, address, size, progress=None, timeout=None):
+        """Read size bytes of flash at address (progress: optional callback(bytes_read, total))"""
+        kwargs = {"progress_fn": self._progress(progress)} if progress else {}
+        return await self._call(session, f"lectura de 0x{address:X}", session.esp.read_flash, address, size,
+                                timeout=timeout or self._timeout(size), **kwargs)
+
+    async def erase(self, session, ranges, progress=None, timeout=None):
+        """
+        Erase flash ranges
+
+        Args:
+            ranges: EraseRange list (ErasePlanner) or (offset, size) tuples
+            progress: Optional callback(percent, message), called on the loop
+        """
+        from erase_planner import EraseRange
+        ranges = [r if isinstance(r, EraseRange) else EraseRange(*r) for r in ranges]
+        # Erasing runs at roughly the slowest write rate
+        ok = await self._call(session, "borrado", self.flash_manager.erase_ranges, session.esp, ranges,
+                              self._progress(progress),
+                              timeout=timeout or self._timeout(sum(r.size for r in ranges)))
+        if not ok:
+            raise EngineError(f"borrado en {session.port} fallido")
+
+    async def write(self, session, address, path, progress=None, delta=False, timeout=None):
+        """
+        Write a file at address (delta=True writes only the sectors that differ)
+
+        Args:
+            progress: Optional callback(percent, message), called on the loop
+
+        Returns:
+            Bytes written (0 when a delta write found the flash already identical)
+        """
+        size = os.path.getsize(path)
+        label = os.path.basename(path)
+        if delta:
+            written = await self._call(session, f"escritura de {label}", self.flash_manager.write_delta,
+                                       session.esp, address, path, self._progress(progress), label,
+                                       timeout=timeout or self._timeout(size))
+            if written is None:
+                raise EngineError(f"escritura de {label} en {session.port} fallida")
+            return written
+        ok = await self._call(session, f"escritura de {label}", self.flash_manager.write_file,
+                              session.esp, address, path, self._progress(progress), label,
+                              timeout=timeout or self._timeout(size))
+        if not ok:
+            raise EngineError(f"escritura de {label} en {session.port} fallida")
+        return size
+
+    async def verify(self, session, address, path, timeout=None):
+        """True if the flash at address holds the file (device-side MD5, padded like esptool writes)"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        data += b'\xff' * (-len(data) % 4)
+        expected = hashlib.md5(data).hexdigest()
+        digests = await self._call(session, "verificación", self.flash_manager.flash_md5_ranges,
+                                   session.esp, [(address, len(data))], timeout=timeout or self._timeout(len(data)))
+        return digests[0] == expected
+
+    async def monitor(self, port, baud=115200):
+        """
+        Open a serial monitor (no thread: the loop watches the port)
+
+        Returns:
+            MonitorStream - iterate it for received bytes, write() to send, close() when done
+        """
+        import serial
+        serial_port = serial.serial_for_url(port, baudrate=baud, timeout=0, write_timeout=1)
+        if is_network_port(port):
+            tune(serial_port)
+        return MonitorStream(port, serial_port, asyncio.get_running_loop())
+
+    async def flash(self, port, files, chip=None, baud="auto", verify=False, delta=False,
+                    reset_mode='hard-reset', progress=None, timeout=None):
+        """
+        Connect, write every (address, path) file, optionally verify, and reset
+
+        Args:
+            progress: Optional callback(port, percent, message), called on the loop
+
+        Returns:
+            Seconds the whole operation took
+        """
+        t = time.perf_counter()
+        session = await self.connect(port, chip, baud)
+        try:
+            for address, path in files:
+                callback = functools.partial(progress, port) if progress else None
+                await self.write(session, address, path, callback, delta=delta, timeout=timeout)
+                if verify and not await self.verify(session, address, path):
+                    raise EngineError(f"{os.path.basename(path)} en {port}: la verificación MD5 no coincide")
+        except BaseException:
+            if not session.closed:
+                await self.close(session, reset_mode='no-reset')
+            raise
+        await self.close(session, reset_mode)
+        return time.perf_counter() - t
+
+
+# ---------------------------------------------------------------------- #
+#  CLI                                                                     #
+# ---------------------------------------------------------------------- #
+
+def _ports(value):
+    return [port.strip() for port in value.split(',') if port.strip()]
+
+
+async def _flash_all(engine, args):
+    address = int(args.address, 0)
+    results = await asyncio.gather(*(engine.flash(port, [(address, args.file)], args.chip, args.baud,
+                                                  verify=args.verify, delta=args.delta, timeout=args.timeout)
+                                     for port in _ports(args.ports)), return_exceptions=True)
+    failed = 0
+    for port, result in zip(_ports(args.ports), results):
+        if isinstance(result, BaseException):
+            failed += 1
+            engine.log(f"{port}: {result}", "error")
+        else:
+            engine.log(f"{port}: flasheado en {result:.1f}s", "success")
+    return 1 if failed else 0
+
+
+async def _read(engine, args):
+    session = await engine.connect(args.port, args.chip, args.baud)
+    try:
+        data = await engine.read(session, int(args.address, 0), int(args.size, 0), timeout=args.timeout)
+    finally:
+        await engine.close(session)
+    with open(args.file, 'wb') as f:
+        f.write(data)
+    engine.log(f"{len(data)} bytes guardados en {args.file}", "success")
+    return 0
+
+
+async def _monitor_all(engine, args):
+    async def follow(port):
+        stream = await engine.monitor(port, args.baud)
+        try:
+            async for chunk in stream:
+                for line in chunk.decode('utf-8', errors='replace').splitlines():
+                    print(f"[{port}] {line}")
+        finally:
+            await stream.close()
+
+    tasks = [asyncio.ensure_future(follow(port)) for port in _ports(args.ports)]
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks), args.seconds)
+    except asyncio.TimeoutError:
+        pass
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Motor de flasheo asíncrono: muchos puertos desde un solo proceso")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    flash = sub.add_parser("flash", help="Flashea una imagen en varios puertos a la vez")
+    flash.add_argument("file")
+    flash.add_argument("--ports", required=True, help="Puertos separados por comas")
+    flash.add_argument("--address", default="0x10000")
+    flash.add_argument("--verify", action="store_true", help="Comprobar el MD5 tras escribir")
+    flash.add_argument("--delta", action="store_true", help="Escribir solo los sectores distintos")
+
+    read = sub.add_parser("read", help="Lee una región de flash a un archivo")
+    read.add_argument("file")
+    read.add_argument("--port", required=True)
+    read.add_argument("--address", required=True)
+    read.add_argument("--size", required=True)
+
+    for command in (flash, read):
+        command.add_argument("--chip", default=None, help="Chip esperado (por defecto: cualquiera)")
+        command.add_argument("--baud", default="auto")
+        command.add_argument("--timeout", type=float, default=None, help="Segundos por operación")
+        command.add_argument("--workers", type=int, default=8, help="Llamadas esptool simultáneas")
+
+    monitor = sub.add_parser("monitor", help="Monitor serie de varios puertos")
+    monitor.add_argument("--ports", required=True)
+    monitor.add_argument("--baud", type=int, default=115200)
+    monitor.add_argument("--seconds", type=float, default=None, help="Duración (por defecto: hasta Ctrl+C)")
+    args = parser.parse_args(argv)
+
+    engine = AsyncFlashEngine(max_workers=getattr(args, "workers", 1))
+    command = {"flash": _flash_all, "read": _read, "monitor": _monitor_all}[args.command]
+    try:
+        return asyncio.run(command(engine, args))
+    except KeyboardInterrupt:
+        return 130
+    except EngineError as e:
+        engine.log(str(e), "error")
+        return 1
+    finally:
+        engine.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Baud Rate Benchmark for ESP32 flashing
+Sweeps baud rates and compression settings on a scratch flash region to
+qualify USB cables and hubs, and recommends the best setting for a port
+
+Usage:
+    python baud_benchmark.py --list
+    python baud_benchmark.py --port COM3 [--chip esp32s3] [--rates 921600,460800] [--size 64K]
+"""
+
+import sys
+import time
+import zlib
+import random
+import hashlib
+import argparse
+
+from flash_utils import FlashManager, list_serial_ports
+from payload_cache import CompressedPayload, PayloadCache
+from baud_manager import BaudManager
+
+
+class BenchmarkResult:
+    """Measurements for one (baud rate, compression) combination"""
+
+    def __init__(self, baud, compress, size):
+        self.baud = baud
+        self.compress = compress
+        self.size = size
+        self.attempts = 0
+        self.errors = 0
+        self.retries = 0
+        self.write_time = 0.0
+        self.read_time = 0.0
+        self.passes = 0
+        self.failed = False
+        self.error_message = None
+
+    @property
+    def error_rate(self):
+        return self.errors / self.attempts if self.attempts else 1.0
+
+    @property
+    def write_kbps(self):
+        return self.size * self.passes / 1024 / self.write_time if self.write_time else 0.0
+
+    @property
+    def read_kbps(self):
+        return self.size * self.passes / 1024 / self.read_time if self.read_time else 0.0
+
+    @property
+    def total_kbps(self):
+        """Effective throughput of a write + read-back cycle"""
+        elapsed = self.write_time + self.read_time
+        return self.size * self.passes / 1024 / elapsed if elapsed else 0.0
+
+    def __repr__(self):
+        return (f"BenchmarkResult({self.baud}, {'z' if self.compress else 'raw'}, "
+                f"{self.total_kbps:.1f} KB/s, errors {self.errors}/{self.attempts})")
+
+
+class BaudBenchmark:
+    """Write/read-back throughput sweep over baud rates and compression settings"""
+
+    MAX_RETRIES = 2
+    DEFAULT_SIZE = 0x10000  # 64 KB - one flash block
+
+    def __init__(self, logger=None):
+        """
+        Initialize benchmark
+
+        Args:
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.logger = logger or self._default_logger
+        # Fixed-rate sessions: no BaudManager, every rate is measured as requested
+        self.flash_manager = FlashManager(logger=self._quiet_logger)
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def _quiet_logger(self, message, level='info'):
+        """Flash manager messages are only interesting at debug level here"""
+        self.logger(message, 'debug' if level in ('info', 'success') else level)
+
+    @staticmethod
+    def make_pattern(size, seed=0x5EA1):
+        """
+        Firmware-like test data: random runs mixed with 0xFF/zero padding,
+        so compressed writes see a realistic compression ratio (~50%).
+        """
+        rng = random.Random(seed)
+        chunks = []
+        while sum(len(c) for c in chunks) < size:
+            run = rng.randint(64, 1024)
+            kind = rng.random()
+            if kind < 0.5:
+                chunks.append(bytes(rng.getrandbits(8) for _ in range(run)))
+            elif kind < 0.8:
+                chunks.append(b'\xff' * run)
+            else:
+                chunks.append(b'\x00' * run)
+        return b''.join(chunks)[:size]
+
+    @staticmethod
+    def _payload(data):
+        image = PayloadCache.pad_image(data)
+        return CompressedPayload(hashlib.sha256(data).hexdigest(), hashlib.md5(image).hexdigest(),
+                                 len(image), PayloadCache.DEFAULT_LEVEL,
+                                 zlib.compress(image, PayloadCache.DEFAULT_LEVEL))
+
+    @staticmethod
+    def _write_raw(esp, offset, data):
+        """Uncompressed write (flash_begin/flash_block), like write-flash -u"""
+        from esptool.loader import ESPLoader
+        block_size = esp.FLASH_WRITE_SIZE
+        esp.flash_begin(len(data), offset, logging=False)
+        for seq in range((len(data) + block_size - 1) // block_size):
+            block = data[seq * block_size:(seq + 1) * block_size]
+            esp.flash_block(block + b'\xff' * (block_size - len(block)), seq)
+        if esp.IS_STUB:
+            # Stub writes the last block asynchronously - wait for it
+            esp.read_reg(ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR)
+
+    def _cycle(self, esp, offset, pattern, payload, compress, result):
+        """One write + read-back cycle, with retries. Updates result in place."""
+        for attempt in range(self.MAX_RETRIES + 1):
+            result.attempts += 1
+            try:
+                t = time.time()
+                if compress:
+                    if not self.flash_manager.write_payload(esp, offset, payload):
+                        raise RuntimeError("escritura comprimida no verificada (MD5)")
+                else:
+                    self._write_raw(esp, offset, pattern)
+                write_time = time.time() - t
+
+                t = time.time()
+                data = esp.read_flash(offset, len(pattern))
+                read_time = time.time() - t
+
+                if data != pattern:
+                    raise RuntimeError("los datos leídos no coinciden con los escritos")
+
+                result.write_time += write_time
+                result.read_time += read_time
+                result.passes += 1
+                return True
+            except Exception as e:
+                result.errors += 1
+                result.error_message = str(e)
+                self.log(f"  {result.baud} baud ({'z' if compress else 'raw'}) intento {attempt + 1}: {e}", "debug")
+                if attempt < self.MAX_RETRIES:
+                    result.retries += 1
+        return False
+
+    def _pick_offset(self, esp, size):
+        """Default scratch region: the top of the flash (restored afterwards)"""
+        flash_size = self.flash_manager.session_flash_size(esp) or 0x400000
+        return flash_size - size
+
+    def run(self, port, chip=None, rates=None, compression=(True, False),
+            size=DEFAULT_SIZE, offset=None, repeats=1, progress_callback=None):
+        """
+        Sweep baud rates and compression settings.
+
+        The scratch region is backed up at the ROM baud rate first and restored
+        (MD5 verified) at the end, so the benchmark is non-destructive.
+
+        Args:
+            port: Serial port
+            chip: Expected chip type, or None to accept any
+            rates: Baud rates to test (default BaudManager.RATES)
+            compression: Compression settings to test (True = zlib, False = raw)
+            size: Scratch region size in bytes (multiple of 4 KB)
+            offset: Scratch region offset (default: top of flash)
+            repeats: Write/read cycles per combination
+            progress_callback: Optional callback(percent, message)
+
+        Returns:
+            List of BenchmarkResult (empty if the device could not be reached)
+        """
+        rates = list(rates or BaudManager.RATES)
+        size = (size + 0xFFF) // 0x1000 * 0x1000
+        pattern = self.make_pattern(size)
+        payload = self._payload(pattern)
+
+        self.log(f"Respaldando región de prueba en {port}...", "info")
+        esp = self.flash_manager.open_session(port, chip, BaudManager.ROM_BAUD)
+        if esp is None:
+            self.log("No se pudo conectar con el dispositivo", "error")
+            return []
+        try:
+            if offset is None:
+                offset = self._pick_offset(esp, size)
+            backup = esp.read_flash(offset, size)
+        finally:
+            self.flash_manager.close_session(esp, reset_mode='no-reset')
+        self.log(f"Región de prueba: 0x{offset:X} ({size // 1024} KB)", "info")
+
+        results = []
+        total = len(rates) * len(compression)
+        try:
+            for rate in rates:
+                esp = self.flash_manager.open_session(port, chip, rate)
+                for compress in compression:
+                    result = BenchmarkResult(rate, compress, size)
+                    if esp is None:
+                        result.failed = True
+                        result.attempts = result.errors = 1
+                        result.error_message = "no se pudo abrir sesión a esta velocidad"
+                    else:
+                        for _ in range(repeats):
+                            if not self._cycle(esp, offset, pattern, payload, compress, result):
+                                result.failed = True
+                                break
+                    results.append(result)
+                    self.log(self.format_row(result), "error" if result.failed else "info")
+                    if progress_callback:
+                        progress_callback(100.0 * len(results) / total,
+                                          f"Benchmark {rate} baud ({'z' if compress else 'raw'})")
+                self.flash_manager.close_session(esp, reset_mode='no-reset')
+        finally:
+            self._restore(port, chip, offset, backup)
+
+        return results
+
+    def _restore(self, port, chip, offset, backup):
+        """Write the original contents of the scratch region back"""
+        esp = self.flash_manager.open_session(port, chip, BaudManager.ROM_BAUD)
+        if esp is None:
+            self.log(f"¡No se pudo restaurar la región 0x{offset:X}! Reintenta el benchmark", "error")
+            return False
+        try:
+            ok = self.flash_manager.write_payload(esp, offset, self._payload(backup))
+            if ok:
+                self.log(f"Región 0x{offset:X} restaurada", "success")
+            else:
+                self.log(f"¡La restauración de 0x{offset:X} no se pudo verificar!", "error")
+            return ok
+        finally:
+            self.flash_manager.close_session(esp)
+
+    @staticmethod
+    def recommend(results, max_error_rate=0.0):
+        """
+        Best setting: highest effective throughput among combinations that
+        never failed and stayed within the allowed error rate.
+
+        Returns:
+            BenchmarkResult, or None if nothing passed
+        """
+        passing = [r for r in results if not r.failed and r.error_rate <= max_error_rate]
+        if not passing:
+            passing = [r for r in results if not r.failed]
+        return max(passing, key=lambda r: r.total_kbps, default=None)
+
+    @staticmethod
+    def format_row(result):
+        mode = "zlib" if result.compress else "raw "
+        if result.failed and not result.passes:
+            return f"{result.baud:>8} {mode}  FALLO ({result.error_message})"
+        return (f"{result.baud:>8} {mode}  escritura {result.write_kbps:7.1f} KB/s  "
+                f"lectura {result.read_kbps:7.1f} KB/s  total {result.total_kbps:7.1f} KB/s  "
+                f"reintentos {result.retries}  errores {result.error_rate:.0%}")
+
+    @classmethod
+    def format_report(cls, results):
+        """Plain text report with the recommendation at the end"""
+        lines = ["Baud rate  modo  rendimiento", "-" * 100]
+        lines += [cls.format_row(r) for r in results]
+        best = cls.recommend(results)
+        lines.append("-" * 100)
+        if best:
+            lines.append(f"Recomendado: {best.baud} baud, {'con' if best.compress else 'sin'} compresión "
+                         f"({best.total_kbps:.1f} KB/s)")
+        else:
+            lines.append("Ninguna configuración pasó - revisa cable/hub")
+        return "\n".join(lines)
+
+
+def _parse_size(value):
+    value = value.strip().upper()
+    if value.endswith('K'):
+        return int(value[:-1], 0) * 1024
+    if value.endswith('M'):
+        return int(value[:-1], 0) * 1024 * 1024
+    return int(value, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de baud rate / compresión para ESP32")
+    parser.add_argument("--list", action="store_true", help="Listar puertos serie y salir")
+    parser.add_argument("--port", help="Puerto serie (ej. COM3, /dev/ttyUSB0)")
+    parser.add_argument("--chip", default=None, help="Tipo de chip esperado (ej. esp32s3)")
+    parser.add_argument("--rates", default=None, help="Baud rates separados por comas")
+    parser.add_argument("--size", default="64K", help="Tamaño de la región de prueba (ej. 64K)")
+    parser.add_argument("--offset", default=None, help="Offset de la región de prueba (por defecto: final del flash)")
+    parser.add_argument("--repeats", type=int, default=1, help="Ciclos por combinación")
+    parser.add_argument("--no-raw", action="store_true", help="Probar solo escritura comprimida")
+    args = parser.parse_args(argv)
+
+    if args.list or not args.port:
+        for device, description in list_serial_ports():
+            print(f"{device} - {description}")
+        return 0 if args.list else 2
+
+    rates = [int(r) for r in args.rates.split(',')] if args.rates else None
+    compression = (True,) if args.no_raw else (True, False)
+    offset = int(args.offset, 0) if args.offset else None
+
+    benchmark = BaudBenchmark()
+    results = benchmark.run(args.port, args.chip, rates, compression,
+                            size=_parse_size(args.size), offset=offset, repeats=args.repeats)
+    if not results:
+        return 1
+    print(BaudBenchmark.format_report(results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Baud Rate Manager for ESP32 flashing
+Negotiates the fastest stable baud rate per port and remembers it per
+USB serial number, stepping down on sync/checksum errors and probing
+back up once the lower rate has proven stable
+"""
+
+import os
+import json
+import time
+import threading
+
+from network_ports import supports_baud_change
+
+
+class BaudManager:
+    """Picks and remembers the best working baud rate for each serial port"""
+
+    # Highest first - the stub flasher supports all of these on CP210x/CH34x/native USB
+    RATES = [2000000, 1500000, 921600, 460800, 230400, 115200]
+    ROM_BAUD = 115200
+    AUTO = "auto"
+    # Clean operations at a rate lowered by link errors before probing one step higher
+    PROBE_AFTER = 20
+
+    # esptool messages that mean "the link is unreliable at this speed"
+    LINK_ERRORS = (
+        "Invalid head of packet",
+        "Serial data stream stopped",
+        "Packet content transfer stopped",
+        "Timed out waiting for packet",
+        "Digest mismatch",
+        "checksum",
+        "MD5 of file does not match",
+        "corrupt",
+    )
+
+    def __init__(self, profile_path=None, logger=None):
+        """
+        Initialize baud manager
+
+        Args:
+            profile_path: JSON file where the best rate per port is stored (None = memory only)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.profile_path = profile_path
+        self.logger = logger or self._default_logger
+        self._lock = threading.Lock()
+        self._profiles = self._load()
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    # ------------------------------------------------------------------ #
+    #  Persistence                                                         #
+    # ------------------------------------------------------------------ #
+
+    def _load(self):
+        if not self.profile_path or not os.path.exists(self.profile_path):
+            return {}
+        try:
+            with open(self.profile_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """Write profiles to disk (caller holds the lock)"""
+        if not self.profile_path:
+            return
+        try:
+            tmp_path = self.profile_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._profiles, f, indent=2)
+            os.replace(tmp_path, self.profile_path)
+        except OSError as e:
+            self.log(f"No se pudo guardar perfil de baudios: {e}", "warning")
+
+    # ------------------------------------------------------------------ #
+    #  Port identity                                                       #
+    # ------------------------------------------------------------------ #
+
+    # Serial numbers shared by every adapter of a model (CP210x default
+    # "0001", clones): they identify the adapter type, not the board
+    NON_UNIQUE_SERIALS = {"0", "0000", "0001", "1", "1234", "12345678", "123456789", "A", "ABCDEF"}
+    # Port keys are resolved once per session, not on every lookup
+    KEY_TTL = 60.0
+
+    _keys = {}
+    _keys_lock = threading.Lock()
+
+    @classmethod
+    def port_key(cls, port):
+        """
+        Stable key for a port: USB VID/PID/serial number when available,
+        so the profile follows the board/adapter even if the COM number changes.
+        Adapters without a unique serial number fall back to the port name.
+        """
+        now = time.monotonic()
+        with cls._keys_lock:
+            cached = cls._keys.get(port)
+        if cached and now - cached[1] < cls.KEY_TTL:
+            return cached[0]
+
+        key = f"port:{port}"
+        try:
+            import serial.tools.list_ports
+            for info in serial.tools.list_ports.comports():
+                if info.device == port:
+                    serial_number = (info.serial_number or "").strip()
+                    if (info.vid is not None and serial_number
+                            and serial_number.upper() not in cls.NON_UNIQUE_SERIALS):
+                        key = f"usb:{info.vid:04X}:{info.pid:04X}:{serial_number}"
+                    break
+        except Exception:
+            pass
+        with cls._keys_lock:
+            cls._keys[port] = (key, now)
+        return key
+
+    @classmethod
+    def forget_port(cls, port):
+        """Drop the resolved key of a port (board unplugged, adapter swapped)"""
+        with cls._keys_lock:
+            cls._keys.pop(port, None)
+
+    # ------------------------------------------------------------------ #
+    #  Rate selection                                                      #
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def is_auto(cls, baud):
+        return str(baud).strip().lower() == cls.AUTO
+
+    def best_rate(self, port, default=None):
+        """Remembered best stable rate for a port, or default if unknown"""
+        with self._lock:
+            profile = self._profiles.get(self.port_key(port))
+        return profile["rate"] if profile else default
+
+    def candidates(self, port, requested=AUTO):
+        """
+        Rates to try, fastest first.
+
+        Starts at the remembered best rate (or the top rate / requested ceiling
+        for an unknown port) and steps down to the ROM rate. A rate lowered by
+        link errors is probed one step higher again after PROBE_AFTER clean
+        operations, so a single transient error does not cap the port forever.
+        Raw socket:// bridges only get the ROM rate (their remote UART speed is fixed).
+
+        Args:
+            port: Serial port
+            requested: Selected baud rate (acts as ceiling) or 'auto'
+
+        Returns:
+            List of int baud rates
+        """
+        if not supports_baud_change(port):
+            return [self.ROM_BAUD]
+        ceiling = self.RATES[0] if self.is_auto(requested) else int(requested)
+        with self._lock:
+            profile = dict(self._profiles.get(self.port_key(port)) or {})
+        start = profile.get("rate", ceiling)
+        if profile.get("lowered_from") and profile.get("successes", 0) >= self.PROBE_AFTER:
+            higher = [r for r in self.RATES if start < r <= profile["lowered_from"]]
+            if higher:
+                start = higher[-1]
+                self.log(f"Probando de nuevo {start} baud en {port}", "debug")
+        start = min(start, ceiling)
+        rates = [r for r in self.RATES if r <= start]
+        if start not in rates:
+            rates.insert(0, start)
+        return rates or [self.ROM_BAUD]
+
+    def record_success(self, port, baud):
+        """Remember a rate that completed an operation without link errors"""
+        key = self.port_key(port)
+        baud = int(baud)
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile and profile["rate"] == baud:
+                profile["successes"] = profile.get("successes", 0) + 1
+                profile["updated"] = time.time()
+                self._save()
+                return
+            new_profile = {"rate": baud, "successes": 1, "failures": 0,
+                           "port": port, "updated": time.time()}
+            # A successful probe climbs one step: keep aiming for the rate that first failed
+            lowered_from = (profile or {}).get("lowered_from")
+            if lowered_from and baud < lowered_from:
+                new_profile["lowered_from"] = lowered_from
+            self._profiles[key] = new_profile
+            self._save()
+        self.log(f"Baud rate estable para {port}: {baud}", "debug")
+
+    def record_failure(self, port, baud):
+        """
+        Step the remembered rate down below a rate that failed
+
+        Returns:
+            Next lower rate to try, or None if already at the ROM rate
+        """
+        lower = [r for r in self.RATES if r < int(baud)]
+        next_rate = lower[0] if lower else None
+        key = self.port_key(port)
+        with self._lock:
+            previous = self._profiles.get(key, {})
+            self._profiles[key] = {"rate": next_rate or self.ROM_BAUD, "successes": 0,
+                                   "failures": previous.get("failures", 0) + 1,
+                                   "lowered_from": max(int(baud), previous.get("lowered_from", 0)),
+                                   "port": port, "updated": time.time()}
+            self._save()
+        if next_rate:
+            self.log(f"Errores de enlace a {baud} baud en {port}, bajando a {next_rate}", "warning")
+        return next_rate
+
+    @classmethod
+    def is_link_error(cls, error):
+        """True if an exception/output text looks like a speed-related link failure"""
+        text = str(error).lower()
+        return any(marker.lower() in text for marker in cls.LINK_ERRORS)
+
+    def run(self, port, operation, requested=AUTO):
+        """
+        Run operation(baud) at the fastest working rate, stepping down on link errors.
+
+        The operation signals failure by raising, or by returning an object with
+        a non-zero returncode and esptool output in stdout/stderr.
+
+        Args:
+            port: Serial port
+            operation: Callable taking the baud rate (int)
+            requested: Selected baud rate (ceiling) or 'auto'
+
+        Returns:
+            Result of the last attempt (re-raises the last link exception)
+        """
+        result = None
+        rates = self.candidates(port, requested)
+        for idx, baud in enumerate(rates):
+            last = idx == len(rates) - 1
+            try:
+                result = operation(baud)
+            except Exception as e:
+                if not self.is_link_error(e) or last:
+                    raise
+                self.record_failure(port, baud)
+                continue
+
+            returncode = getattr(result, "returncode", 0)
+            output = f"{getattr(result, 'stdout', '')}\n{getattr(result, 'stderr', '')}"
+            if returncode != 0 and self.is_link_error(output) and not last:
+                self.record_failure(port, baud)
+                continue
+            if returncode == 0:
+                self.record_success(port, baud)
+            return result
+        return result
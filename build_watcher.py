@@ -0,0 +1,183 @@
+"""
+PlatformIO Build Watcher
+Notices new builds in .pio/build/<env>/ (filesystem events with watchdog when
+installed, stat polling otherwise) and reports each one once its files have
+stopped changing
+"""
+
+import os
+import time
+import threading
+
+
+class BuildWatcher:
+    """Calls back when a PlatformIO environment produces a new firmware.bin"""
+
+    # Files PlatformIO writes into .pio/build/<env>/ at the end of a build
+    WATCHED = ("firmware.bin", "bootloader.bin", "partitions.bin", "spiffs.bin")
+
+    def __init__(self, roots, on_build, debounce=1.5, interval=0.5, logger=None):
+        """
+        Initialize build watcher
+
+        Args:
+            roots: .pio/build directories to watch (missing ones are picked up when created)
+            on_build: Callback(env_path, changed_file_names) for a finished build (runs on the watcher thread)
+            debounce: Seconds without changes before a build counts as finished
+            interval: Polling interval in seconds (also the settle check with watchdog)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.on_build = on_build
+        self.debounce = debounce
+        self.interval = interval
+        self.logger = logger or self._default_logger
+
+        self._baseline = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def snapshot(self):
+        """{path: (size, mtime_ns)} of the watched files of every environment"""
+        files = {}
+        for root in self.roots:
+            try:
+                envs = [entry.path for entry in os.scandir(root) if entry.is_dir()]
+            except OSError:
+                continue
+            for env in envs:
+                for name in self.WATCHED:
+                    path = os.path.join(env, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start watching. Builds already on disk are not reported."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._baseline = self.snapshot()
+        self._observer = self._start_observer()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        self.log(f"Vigilando builds de PlatformIO ({'eventos' if self._observer else 'sondeo'}) en "
+                 f"{', '.join(root for root in self.roots if os.path.isdir(root)) or 'directorios aún inexistentes'}",
+                 "debug")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=2)
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _start_observer(self):
+        """Filesystem event observer (watchdog), None to fall back to polling"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+
+        wake = self._wake
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+
+        observer = Observer()
+        watched = 0
+        for root in self.roots:
+            if os.path.isdir(root):
+                observer.schedule(Handler(), root, recursive=True)
+                watched += 1
+        if not watched:
+            return None
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def _loop(self):
+        """
+        Wait for a change, then re-stat every interval until nothing changed for
+        `debounce` seconds, and report the environments whose firmware.bin moved
+        """
+        # With events the idle wait is only a safety net (roots created later)
+        idle = self.interval * 10 if self._observer else self.interval
+        last = self._baseline
+        settle_at = None
+        while not self._stop.is_set():
+            self._wake.wait(self.interval if settle_at else idle)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                current = self.snapshot()
+            except Exception as e:
+                self.log(f"Error leyendo .pio/build: {e}", "warning")
+                continue
+            if current != last:
+                # Still being written - restart the quiet period
+                last = current
+                settle_at = time.monotonic() + self.debounce
+            elif settle_at and time.monotonic() >= settle_at:
+                settle_at = None
+                self._report(current)
+
+    def _report(self, current):
+        """Fire on_build for every environment with a new, complete firmware.bin"""
+        changed = {}
+        for path, stat in current.items():
+            if self._baseline.get(path) != stat:
+                changed.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+        self._baseline = current
+
+        for env_path, names in sorted(changed.items()):
+            if "firmware.bin" not in names:
+                continue
+            if not self._is_image(os.path.join(env_path, "firmware.bin")):
+                self.log(f"Build en {env_path}: firmware.bin incompleto o inválido - ignorado", "warning")
+                continue
+            self.log(f"Build nuevo: {os.path.basename(env_path)} ({', '.join(sorted(names))})", "debug")
+            try:
+                self.on_build(env_path, sorted(names))
+            except Exception as e:
+                self.log(f"Error en callback de build: {e}", "error")
+
+    @staticmethod
+    def _is_image(path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read(1) == b'\xE9'
+        except OSError:
+            return False
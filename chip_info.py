@@ -0,0 +1,205 @@
+"""
+Chip Information for ESP32 boards
+Snapshot of chip type, features, crystal, MAC, SPI flash and eFuse security
+state read over one esptool session, cached per MAC so the info dialog and
+the pre-flight checks of a flash run do not reconnect to the board
+"""
+
+import os
+import json
+import time
+import threading
+
+
+class ChipInfo:
+    """Everything the info dialog and the pre-flight checks need about one board"""
+
+    FIELDS = ("mac", "chip", "description", "features", "crystal_mhz", "revision",
+              "flash_id", "flash_manufacturer", "flash_device", "flash_size",
+              "flash_encryption", "secure_boot", "security_flags", "flash_crypt_cnt",
+              "key_purposes", "collected")
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+        if self.collected is None:
+            self.collected = time.time()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.FIELDS})
+
+    @property
+    def age(self):
+        """Seconds since the info was read from the board"""
+        return time.time() - self.collected
+
+    @property
+    def flash_size_bytes(self):
+        """Detected flash size in bytes (None if unknown)"""
+        if not self.flash_size:
+            return None
+        size = str(self.flash_size).upper()
+        if size.endswith("MB"):
+            return int(size[:-2]) * 1024 * 1024
+        if size.endswith("KB"):
+            return int(size[:-2]) * 1024
+        return None
+
+    def preflight_issues(self, highest_write_end=None):
+        """
+        Reasons why plain (unencrypted) flashing of this board would fail or brick it
+
+        Args:
+            highest_write_end: End offset (bytes) of the furthest image to be written
+
+        Returns:
+            List of (level, message): 'error' blocks the flash, 'warning' only informs
+        """
+        issues = []
+        size = self.flash_size_bytes
+        if highest_write_end and size and highest_write_end > size:
+            issues.append(("error", f"El firmware llega hasta 0x{highest_write_end:X} pero la flash "
+                                    f"del chip es de {self.flash_size} (0x{size:X})"))
+        if self.flash_encryption:
+            issues.append(("error", "Flash encryption está activado: las imágenes sin cifrar no arrancarán"))
+        if self.secure_boot:
+            issues.append(("warning", "Secure boot está activado: el bootloader y la app deben estar firmados"))
+        return issues
+
+    def format_report(self):
+        """Multi-line Spanish summary for the info dialog"""
+        def yes_no(value):
+            return "desconocido" if value is None else ("ACTIVADO" if value else "desactivado")
+
+        lines = [
+            "=" * 70,
+            "INFORMACIÓN DEL CHIP ESP32",
+            "=" * 70,
+            "",
+            f"Chip type:        {self.description or self.chip or 'desconocido'}",
+            f"Revisión:         {self.revision or 'desconocida'}",
+            f"Features:         {', '.join(self.features) if self.features else 'desconocidas'}",
+            f"Crystal:          {f'{self.crystal_mhz} MHz' if self.crystal_mhz else 'desconocido'}",
+            f"MAC:              {self.mac or 'desconocida'}",
+            "",
+            "--- FLASH ---",
+            f"Flash ID:         {self.flash_id or 'desconocido'}",
+            f"Manufacturer:     {self.flash_manufacturer or '-'}",
+            f"Device:           {self.flash_device or '-'}",
+            f"Flash size:       {self.flash_size or 'desconocido'}",
+            "",
+            "--- SEGURIDAD / eFuses ---",
+            f"Flash Encryption: {yes_no(self.flash_encryption)}",
+            f"Secure Boot:      {yes_no(self.secure_boot)}",
+        ]
+        if self.security_flags is not None:
+            lines.append(f"Security flags:   0x{self.security_flags:08X}")
+        if self.flash_crypt_cnt is not None:
+            lines.append(f"FLASH_CRYPT_CNT:  {self.flash_crypt_cnt}")
+        if self.key_purposes:
+            lines.append(f"Key purposes:     {self.key_purposes}")
+        lines += ["", "=" * 70,
+                  f"Leído: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.collected))}"]
+        return "\n".join(lines) + "\n"
+
+
+class ChipInfoCache:
+    """ChipInfo per MAC (persisted as JSON) plus the last MAC seen on each port"""
+
+    def __init__(self, cache_path=None, logger=None):
+        """
+        Initialize chip info cache
+
+        Args:
+            cache_path: JSON file where chip info is stored (None = memory only)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.cache_path = cache_path
+        self.logger = logger or self._default_logger
+        self._lock = threading.Lock()
+        data = self._load()
+        self._devices = data.get("devices", {})
+        self._ports = data.get("ports", {})
+        self._port_keys = {}  # port name -> key it was stored under (the port may be gone when forgotten)
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """Write the cache to disk (caller holds the lock)"""
+        if not self.cache_path:
+            return
+        try:
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"devices": self._devices, "ports": self._ports}, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            self.log(f"No se pudo guardar la caché de chips: {e}", "warning")
+
+    def _port_key(self, port):
+        from baud_manager import BaudManager
+        key = BaudManager.port_key(port)
+        self._port_keys[port] = key
+        return key
+
+    def get(self, mac):
+        """Cached ChipInfo of a board, or None"""
+        if not mac:
+            return None
+        with self._lock:
+            data = self._devices.get(mac.lower())
+        return ChipInfo.from_dict(data) if data else None
+
+    def for_port(self, port):
+        """ChipInfo of the board last seen on a port (may be stale if boards were swapped)"""
+        with self._lock:
+            mac = self._ports.get(self._port_key(port))
+        return self.get(mac)
+
+    def put(self, info, port=None):
+        """Store a freshly collected ChipInfo (ignored without a MAC)"""
+        if info is None or not info.mac:
+            return
+        port_key = self._port_key(port) if port else None
+        with self._lock:
+            self._devices[info.mac.lower()] = info.to_dict()
+            if port_key:
+                self._ports[port_key] = info.mac.lower()
+            self._save()
+
+    def forget_port(self, port):
+        """Drop the board remembered on a port (unplugged: the next one may be another board)"""
+        key = self._port_keys.pop(port, None)
+        if key is None:
+            from baud_manager import BaudManager
+            key = BaudManager.port_key(port)
+        with self._lock:
+            if self._ports.pop(key, None) is not None:
+                self._save()
@@ -0,0 +1,176 @@
+"""
+Device History for ESP32 flashing
+Persistent SQLite record of every flashed board (MAC, chip, flash ID,
+project, firmware hash, stage timings, result) with indexed lookups
+"""
+
+import json
+import time
+import sqlite3
+import threading
+
+
+class DeviceHistory:
+    """Embedded SQLite history of flash operations, safe to share between threads"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS flashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mac TEXT,
+            chip TEXT,
+            flash_id TEXT,
+            project TEXT,
+            firmware_hash TEXT,
+            port TEXT,
+            timestamp REAL NOT NULL,
+            result TEXT NOT NULL,
+            duration REAL,
+            stage_timings TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_flashes_mac ON flashes(mac, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_flashes_firmware ON flashes(firmware_hash);
+    """
+
+    RESULT_OK = "ok"
+    RESULT_FAILED = "failed"
+    RESULT_REJECTED = "rejected"
+    RESULT_SKIPPED = "skipped"    # board already ran the same build
+
+    def __init__(self, db_path=None, logger=None):
+        """
+        Initialize device history
+
+        Args:
+            db_path: SQLite database file (None = in-memory, lost on exit)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.db_path = db_path or ":memory:"
+        self.logger = logger or self._default_logger
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if db_path:
+            # Concurrent readers while a worker thread writes; fsync only at checkpoints
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+        self._unique = self._conn.execute(
+            "SELECT COUNT(DISTINCT mac) FROM flashes WHERE mac IS NOT NULL").fetchone()[0]
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    @staticmethod
+    def _normalize_mac(mac):
+        return mac.strip().lower().replace('-', ':') if mac else None
+
+    # ------------------------------------------------------------------ #
+    #  Recording                                                           #
+    # ------------------------------------------------------------------ #
+
+    def record(self, mac, result, chip=None, flash_id=None, project=None, firmware_hash=None,
+               port=None, stage_timings=None, timestamp=None):
+        """
+        Store one flash operation
+
+        Args:
+            mac: Base MAC address (None if the board never answered)
+            result: RESULT_OK, RESULT_FAILED, RESULT_REJECTED or RESULT_SKIPPED
+            chip: Chip type (e.g. 'esp32s3')
+            flash_id: SPI flash JEDEC ID (e.g. '0xEF4018')
+            project: Project / firmware name
+            firmware_hash: SHA-256 of the application image
+            port: Serial port used
+            stage_timings: List of (stage, seconds)
+            timestamp: Epoch seconds (default: now)
+
+        Returns:
+            Row id, or None if the database could not be written
+        """
+        mac = self._normalize_mac(mac)
+        timings = list(stage_timings or [])
+        duration = sum(seconds for _, seconds in timings) if timings else None
+        try:
+            with self._lock:
+                new_device = mac is not None and self._conn.execute(
+                    "SELECT 1 FROM flashes WHERE mac = ? LIMIT 1", (mac,)).fetchone() is None
+                cursor = self._conn.execute(
+                    "INSERT INTO flashes (mac, chip, flash_id, project, firmware_hash, port, timestamp, "
+                    "result, duration, stage_timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (mac, chip, flash_id, project, firmware_hash, port, timestamp or time.time(), result,
+                     duration, json.dumps([[name, round(seconds, 4)] for name, seconds in timings])))
+                self._conn.commit()
+                if new_device:
+                    self._unique += 1
+                return cursor.lastrowid
+        except sqlite3.Error as e:
+            self.log(f"No se pudo guardar en el historial: {e}", "warning")
+            return None
+
+    # ------------------------------------------------------------------ #
+    #  Queries                                                             #
+    # ------------------------------------------------------------------ #
+
+    def _rows(self, query, params=()):
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        result = []
+        for row in rows:
+            entry = dict(row)
+            entry["stage_timings"] = json.loads(entry["stage_timings"]) if entry.get("stage_timings") else []
+            result.append(entry)
+        return result
+
+    def device(self, mac):
+        """Every flash of one board, newest first"""
+        return self._rows("SELECT * FROM flashes WHERE mac = ? ORDER BY timestamp DESC",
+                          (self._normalize_mac(mac),))
+
+    def last_flash(self, mac):
+        """Most recent flash of a board, or None if it was never flashed"""
+        rows = self._rows("SELECT * FROM flashes WHERE mac = ? ORDER BY timestamp DESC LIMIT 1",
+                          (self._normalize_mac(mac),))
+        return rows[0] if rows else None
+
+    def by_firmware(self, firmware_hash, limit=None):
+        """Flashes of a firmware image, newest first"""
+        query = "SELECT * FROM flashes WHERE firmware_hash = ? ORDER BY timestamp DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return self._rows(query, (firmware_hash,))
+
+    def macs(self, offset=0, limit=100):
+        """One page of distinct MACs in sorted order (served from the MAC index)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT mac FROM flashes WHERE mac IS NOT NULL ORDER BY mac LIMIT ? OFFSET ?",
+                (limit, offset)).fetchall()
+        return [row[0] for row in rows]
+
+    @property
+    def unique_devices(self):
+        """Number of distinct boards ever flashed (kept up to date without a query)"""
+        return self._unique
+
+    def count(self):
+        """Total flash operations stored"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM flashes").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,169 @@
+"""
+Erase Planner for ESP32 flashing
+Computes the minimal set of aligned erase ranges for a flash plan, so the
+whole erase step runs as a few erase-region commands on one connection
+"""
+
+from partition_table import PartitionTable
+
+
+SECTOR_SIZE = 0x1000    # 4 KB - smallest erasable unit
+
+
+class EraseRange:
+    """
+    A contiguous, sector-aligned flash range to erase.
+
+    Each range is sent as a single erase-region command; the flasher stub
+    picks block or sector erases inside it, so the planner only decides
+    which ranges and how few.
+    """
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    def __repr__(self):
+        return f"EraseRange(0x{self.offset:X}-0x{self.end:X}, {self.size // 1024} KB)"
+
+
+def _align_down(value, alignment):
+    return value // alignment * alignment
+
+
+def _align_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _merge(ranges):
+    """Merge overlapping and adjacent (start, end) tuples"""
+    merged = []
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(ranges, holes):
+    """Remove every hole from a merged list of (start, end) ranges"""
+    result = []
+    holes = _merge(holes)
+    for start, end in ranges:
+        cursor = start
+        for h_start, h_end in holes:
+            if h_end <= cursor or h_start >= end:
+                continue
+            if h_start > cursor:
+                result.append((cursor, h_start))
+            cursor = max(cursor, h_end)
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+class ErasePlanner:
+    """Builds erase plans from a PartitionTable and the list of files to write"""
+
+    def __init__(self, partition_table=None, flash_size=None):
+        """
+        Args:
+            partition_table: PartitionTable of the layout being flashed (optional)
+            flash_size: Flash size in bytes; defaults to the end of the partition table
+        """
+        self.partition_table = partition_table
+        self.flash_size = flash_size
+
+    @property
+    def flash_end_known(self):
+        """True if complete mode knows where the flash ends (flash size or partition table)"""
+        return bool(self.flash_size or self.partition_table)
+
+    @staticmethod
+    def write_coverage(writes):
+        """
+        Ranges the write step erases by itself.
+
+        The flasher stub erases every sector it writes to, so these ranges
+        never need a separate erase.
+
+        Args:
+            writes: List of (address, size) tuples
+
+        Returns:
+            List of sector-aligned (start, end) tuples
+        """
+        return _merge((_align_down(addr, SECTOR_SIZE), _align_up(addr + size, SECTOR_SIZE))
+                      for addr, size in writes)
+
+    def _flash_end(self, writes):
+        if self.flash_size:
+            return self.flash_size
+        if not self.partition_table:
+            # The end of the last write would leave every partition after it intact
+            raise ValueError("tamaño de flash desconocido y sin tabla de particiones")
+        ends = [addr + size for addr, size in writes] + [self.partition_table.end]
+        return _align_up(max(ends), SECTOR_SIZE)
+
+    def targets(self, writes, mode, preserve_nvs=False):
+        """
+        Ranges that must be blank after flashing, before write coverage is removed.
+
+        - simple: only the app regions being written (same as the old per-region erase)
+        - complete: the whole flash, except NVS partitions when preserve_nvs is set
+
+        Args:
+            writes: List of (address, size) tuples from the flash plan
+            mode: 'simple' or 'complete'
+            preserve_nvs: Keep NVS/NVS keys partitions intact (complete mode)
+
+        Returns:
+            List of (start, end) tuples
+        """
+        if mode == "simple":
+            return self.write_coverage(writes)
+
+        targets = [(0, self._flash_end(writes))]
+        if preserve_nvs and self.partition_table:
+            keep = [(p.offset, p.end) for p in self.partition_table.nvs_partitions]
+            targets = _subtract(targets, keep)
+        return targets
+
+    def plan(self, writes, mode, preserve_nvs=False):
+        """
+        Compute the minimal erase plan.
+
+        Targets are aligned to sectors and merged, then everything the write
+        step already covers is dropped.
+
+        Args:
+            writes: List of (address, size) tuples from the flash plan
+            mode: 'simple' or 'complete'
+            preserve_nvs: Keep NVS partitions intact (complete mode)
+
+        Returns:
+            List of EraseRange, sorted by offset (may be empty)
+        """
+        targets = _merge((_align_down(s, SECTOR_SIZE), _align_up(e, SECTOR_SIZE))
+                         for s, e in self.targets(writes, mode, preserve_nvs))
+        remaining = _subtract(targets, self.write_coverage(writes))
+        return [EraseRange(start, end - start) for start, end in remaining]
+
+    @staticmethod
+    def describe(plan):
+        """Human readable one-line summary of a plan"""
+        if not plan:
+            return "nada que borrar (la escritura cubre todas las regiones)"
+        total = sum(r.size for r in plan)
+        return f"{len(plan)} rango(s), {total // 1024} KB"
+
+
+def plan_from_partition_file(partitions_path, writes, mode, preserve_nvs=False, flash_size=None):
+    """Convenience wrapper: load the partition table file and build the plan"""
+    table = PartitionTable.from_file(partitions_path) if partitions_path else None
+    return ErasePlanner(table, flash_size).plan(writes, mode, preserve_nvs)
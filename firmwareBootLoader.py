@@ -1,30 +1,57 @@
 ﻿import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, filedialog
+from tkinter import ttk, messagebox, scrolledtext, filedialog, simpledialog
 import serial.tools.list_ports
 import subprocess
 import os
 import sys
 import threading
+import queue
 import struct
 import tempfile
 import hashlib
 import re
 import time
 
+from flash_utils import FlashManager, list_serial_ports
+from payload_cache import PayloadCache
+from artifact_store import ArtifactStore
+from partition_table import PartitionTable, load_partition_table
+from erase_planner import ErasePlanner
+from baud_manager import BaudManager
+from baud_benchmark import BaudBenchmark
+from hotplug_watcher import HotplugWatcher
+from network_ports import NetworkPorts, is_network_port
+from build_watcher import BuildWatcher
+from job_scheduler import JobScheduler, FlashJob, FlashPlan
+from flash_api import FlashAPI
+from async_engine import AsyncFlashEngine, EngineError
+from stage_metrics import SessionMetrics
+from tracing import TRACER, start_from_env
+from device_history import DeviceHistory
+from virtual_list import VirtualListbox
+from app_descriptor import AppDescriptor
+from chip_info import ChipInfoCache
+from fleet_inventory import FleetInventory, InventoryEntry, esp_ports
+from flash_backup import FlashBackup
+from nvs_image import NvsBatch
+from spiffs_image import SpiffsBatch
+from provisioning import ProvisioningManifest
+from project_index import ProjectIndex
+
 def check_and_install_dependencies():
     """Check if required packages are installed and offer to install them"""
     missing_packages = []
     
+    # Only locate the packages here - esptool is heavy and is imported lazily
+    # the first time a device operation needs it
+    import importlib.util
+    
     # Check esptool
-    try:
-        import esptool
-    except ImportError:
+    if importlib.util.find_spec('esptool') is None:
         missing_packages.append('esptool')
     
     # Check pyserial
-    try:
-        import serial
-    except ImportError:
+    if importlib.util.find_spec('serial') is None:
         missing_packages.append('pyserial')
     
     if missing_packages:
@@ -114,8 +141,20 @@ def check_and_install_dependencies():
     return True
 
 class ESP32Flasher:
-    def __init__(self, root):
+    HOTPLUG_COOLDOWN_S = 8  # Seconds to ignore a port after auto-flashing it
+    WRITE_RETRIES = 2       # Reconnect-and-resume attempts for a component write
+    LOG_POLL_MS = 50        # Interval of the Tk-thread drain of worker-thread log messages
+    
+    def __init__(self, root, startup_t0=None):
         self.root = root
+        self._startup_t0 = startup_t0 or time.perf_counter()
+        # Widgets are only touched on the Tk thread: other threads queue (message, level)
+        # and widget updates (see _ui)
+        self._ui_thread = threading.current_thread()
+        self._log_queue = queue.Queue()
+        self._ui_queue = queue.Queue()      # (callable, args) to run on the Tk thread
+        self._serial_queue = queue.Queue()  # (text, tag) received by the serial monitor
+        self._draining_logs = False
         self.root.title("ESP32 Firmware Flasher")
         self.root.geometry("1100x800")  # Increased height for better layout
         self.root.resizable(True, True)  # Permitir redimensionar
@@ -127,7 +166,7 @@ class ESP32Flasher:
         self.partitions_path = None
         self.selected_port = tk.StringVar()
         self.selected_chip = tk.StringVar(value="esp32s3")  # Valor por defecto para ESP32-S3
-        self.selected_baud = tk.StringVar(value="460800")  # Baud rate por defecto (faster)
+        self.selected_baud = tk.StringVar(value="auto")  # Negociado por puerto (BaudManager)
         self.flash_mode = tk.StringVar(value="simple")  # "simple" or "complete"
         self.is_flashing = False
         self.verbose_mode = tk.BooleanVar(value=False)
@@ -140,7 +179,7 @@ class ESP32Flasher:
         
         # Serial terminal variables
         self.serial_connected = False
-        self.serial_thread = None
+        self.serial_monitor = None   # async_engine.MonitorStream of the open port
         self.serial_baud = tk.StringVar(value="115200")
         self.serial_port_obj = None  # serial.Serial object
         self.command_history = []    # Sent command history
@@ -157,14 +196,68 @@ class ESP32Flasher:
             "app_with_ota": "0x50000"         # App with OTA (typical)
         }
         
+        # Content-addressed copy of every binary (digests and image metadata computed once per blob)
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.artifact_store = ArtifactStore(os.path.join(script_dir, ".artifacts"), logger=self._engine_log)
+        # Compressed payloads shared by every flash operation (memory + disk), keyed by blob
+        self.payload_cache = PayloadCache(self.artifact_store.compressed_dir, logger=self._engine_log,
+                                          store=self.artifact_store)
+        # rfc2217:// and socket:// endpoints of boards attached to other hosts, listed with the local ports
+        self.network_ports = NetworkPorts(os.path.join(script_dir, ".network_ports.json"), logger=self._engine_log)
+        # Best stable baud rate per port / USB serial number
+        self.baud_manager = BaudManager(os.path.join(script_dir, ".baud_profiles.json"),
+                                        logger=self._engine_log)
+        # Every flashed board, persisted across sessions (SQLite)
+        self.device_history = DeviceHistory(os.path.join(script_dir, ".device_history.sqlite3"),
+                                            logger=self._engine_log)
+        # Chip / flash / eFuse info per board, so the info dialog and pre-flight checks don't reconnect
+        self.chip_info_cache = ChipInfoCache(os.path.join(script_dir, ".chip_info_cache.json"),
+                                             logger=self._engine_log)
+        # Manifests of proyect_firmware/* (hashes, partition table, app descriptor), rebuilt on mtime change
+        self.project_index = ProjectIndex(os.path.join(script_dir, "proyect_firmware"), logger=self._engine_log,
+                                          store=self.artifact_store)
+        self.project = None
+        self.selected_project = tk.StringVar(value="generic")
+        # Per-device images (MAC/serial -> NVS, SPIFFS) loaded with the Aprovisionar tools
+        self.provisioning = None
+        # Per-stage timings of every flash run (p50/p95 in the session panel)
+        self.stage_metrics = SessionMetrics()
+        self.flash_manager = FlashManager(logger=self._engine_log, payload_cache=self.payload_cache,
+                                          baud_manager=self.baud_manager, metrics=self.stage_metrics)
+        
+        # Coroutine API over the same flash manager; its loop thread runs the serial monitor
+        self.async_engine = AsyncFlashEngine(self.flash_manager, logger=self._engine_log)
+        
+        # Unattended production flashing: per-port workers with stage retries
+        self.job_scheduler = JobScheduler(self.flash_manager, logger=self._engine_log,
+                                          on_job_update=self._on_job_update,
+                                          chip_info_cache=self.chip_info_cache)
+        
+        # Opt-in span tracing (also enabled from start-up by SENSEAI_TRACE=<file>)
+        self.trace_enabled = tk.BooleanVar(value=TRACER.enabled)
+        
+        # Local HTTP/JSON API (MES integration) on the same scheduler
+        self.http_api_enabled = tk.BooleanVar(value=False)
+        self.http_api = FlashAPI(self.job_scheduler, history=self.device_history, project_index=self.project_index,
+                                 network_ports=self.network_ports, logger=self._engine_log)
+        
+        # USB hot-plug auto-flash (advanced options)
+        self.hotplug_enabled = tk.BooleanVar(value=False)
+        self._hotplug_plan = None
+        self._hotplug_cooldown = {}  # port -> time until re-enumeration is ignored
+        self.hotplug_watcher = HotplugWatcher(self._on_hotplug_added, self._on_hotplug_removed,
+                                              logger=self._engine_log)
+        # Developer loop: each new .pio/build/<env>/firmware.bin is delta-flashed to the selected port
+        self.build_watch_enabled = tk.BooleanVar(value=False)
+        self.build_watcher = BuildWatcher(self._pio_build_roots(), self._on_pio_build, logger=self._engine_log)
+        
         # Configurar interfaz
         self.setup_ui()
+        self.root.after(self.LOG_POLL_MS, self._drain_log_queue)
         
-        # Buscar firmware al iniciar
-        self.search_firmware()
-        
-        # Actualizar puertos COM
-        self.refresh_ports()
+        # Firmware search and port enumeration run in the background once the
+        # window is on screen (see _on_first_paint)
+        self.root.after_idle(self._on_first_paint)
     
     def setup_ui(self):
         # Main container with flex layout
@@ -272,31 +365,43 @@ class ESP32Flasher:
         files_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=3, padx=5)
         files_frame.columnconfigure(1, weight=1)
         
+        # Project selector (proyect_firmware/<project>, indexed once)
+        ttk.Label(files_frame, text="Proyecto:", font=('Arial', 9, 'bold')).grid(row=0, column=0, sticky=tk.W, pady=5)
+        self.project_combo = ttk.Combobox(files_frame, textvariable=self.selected_project, state="readonly", width=30)
+        self.project_combo['values'] = ['generic'] + self.project_index.projects()
+        self.project_combo.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5)
+        self.project_combo.bind('<<ComboboxSelected>>', lambda e: self.on_project_change())
+        self.project_refresh_btn = ttk.Button(files_frame, text="🔄", command=self.refresh_projects, width=5)
+        self.project_refresh_btn.grid(row=0, column=2, padx=2)
+        
         # Firmware file
-        ttk.Label(files_frame, text="Firmware:", font=('Arial', 9, 'bold')).grid(row=0, column=0, sticky=tk.W, pady=5)
+        ttk.Label(files_frame, text="Firmware:", font=('Arial', 9, 'bold')).grid(row=1, column=0, sticky=tk.W, pady=5)
         self.firmware_label = ttk.Label(files_frame, text="No seleccionado", foreground="gray")
-        self.firmware_label.grid(row=0, column=1, sticky=tk.W, padx=5)
+        self.firmware_label.grid(row=1, column=1, sticky=tk.W, padx=5)
         self.firmware_btn = ttk.Button(files_frame, text="📁", command=self.select_firmware_file, width=5)
-        self.firmware_btn.grid(row=0, column=2, padx=2)
+        self.firmware_btn.grid(row=1, column=2, padx=2)
         
         # Bootloader file (Complete mode only)
-        ttk.Label(files_frame, text="Bootloader:", font=('Arial', 9, 'bold')).grid(row=1, column=0, sticky=tk.W, pady=5)
+        ttk.Label(files_frame, text="Bootloader:", font=('Arial', 9, 'bold')).grid(row=2, column=0, sticky=tk.W, pady=5)
         self.bootloader_label = ttk.Label(files_frame, text="No requerido (Simple Mode)", foreground="gray")
-        self.bootloader_label.grid(row=1, column=1, sticky=tk.W, padx=5)
+        self.bootloader_label.grid(row=2, column=1, sticky=tk.W, padx=5)
         self.bootloader_btn = ttk.Button(files_frame, text="📁", command=self.select_bootloader_file, width=5, state='disabled')
-        self.bootloader_btn.grid(row=1, column=2, padx=2)
+        self.bootloader_btn.grid(row=2, column=2, padx=2)
         
         # Partitions file (Complete mode only)
-        ttk.Label(files_frame, text="Partitions:", font=('Arial', 9, 'bold')).grid(row=2, column=0, sticky=tk.W, pady=5)
+        ttk.Label(files_frame, text="Partitions:", font=('Arial', 9, 'bold')).grid(row=3, column=0, sticky=tk.W, pady=5)
         self.partitions_label = ttk.Label(files_frame, text="No requerido (Simple Mode)", foreground="gray")
-        self.partitions_label.grid(row=2, column=1, sticky=tk.W, padx=5)
+        self.partitions_label.grid(row=3, column=1, sticky=tk.W, padx=5)
         self.partitions_btn = ttk.Button(files_frame, text="📁", command=self.select_partitions_file, width=5, state='disabled')
-        self.partitions_btn.grid(row=2, column=2, padx=2)
+        self.partitions_btn.grid(row=3, column=2, padx=2)
         
         # Auto-detect button
         self.auto_detect_btn = ttk.Button(files_frame, text="🔍 Auto-detectar archivos PlatformIO", 
                                          command=self.auto_detect_pio_files, width=50, state='disabled')
-        self.auto_detect_btn.grid(row=3, column=0, columnspan=3, pady=5, sticky=(tk.W, tk.E))
+        self.auto_detect_btn.grid(row=4, column=0, columnspan=3, pady=5, sticky=(tk.W, tk.E))
+        ttk.Checkbutton(files_frame, text="👁️ Vigilar .pio/build y flashear cada build nuevo (solo sectores cambiados)",
+                        variable=self.build_watch_enabled, command=self.toggle_build_watch).grid(
+                            row=5, column=0, columnspan=3, sticky=tk.W)
         
         # === DEVICE CONFIGURATION ===
         device_frame = ttk.LabelFrame(main_frame, text="Configuración del Dispositivo", padding="5")
@@ -317,6 +422,9 @@ class ESP32Flasher:
         self.detect_btn = ttk.Button(port_buttons_frame, text="🔍", command=self.detect_device_partitions, width=5)
         self.detect_btn.pack(side=tk.LEFT, padx=2)
         
+        self.network_port_btn = ttk.Button(port_buttons_frame, text="🌐", command=self.edit_network_port, width=5)
+        self.network_port_btn.pack(side=tk.LEFT, padx=2)
+        
         # Tipo de chip
         ttk.Label(device_frame, text="Chip:", font=('Arial', 9, 'bold')).grid(row=1, column=0, sticky=tk.W, pady=5)
         self.chip_combo = ttk.Combobox(device_frame, textvariable=self.selected_chip, state="readonly", width=20)
@@ -329,7 +437,7 @@ class ESP32Flasher:
         # Baud rate
         ttk.Label(device_frame, text="Baud Rate:", font=('Arial', 9, 'bold')).grid(row=2, column=0, sticky=tk.W, pady=5)
         self.baud_combo = ttk.Combobox(device_frame, textvariable=self.selected_baud, state="readonly", width=20)
-        self.baud_combo['values'] = ['115200', '230400', '460800', '921600']
+        self.baud_combo['values'] = ['auto', '115200', '230400', '460800', '921600', '1500000', '2000000']
         self.baud_combo.grid(row=2, column=1, sticky=(tk.W, tk.E), padx=5)
         
         # === OPTIONS ===
@@ -368,6 +476,16 @@ class ESP32Flasher:
         ttk.Checkbutton(options_frame, text="Modo Verbose (debug detallado)", 
                        variable=self.verbose_mode).grid(row=2, column=0, sticky=tk.W, pady=2)
         
+        # Skip boards that already run the selected build (rework returns)
+        self.skip_if_current = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="⏭️ Omitir si la placa ya tiene este firmware", 
+                       variable=self.skip_if_current).grid(row=3, column=0, sticky=tk.W, pady=2)
+        
+        # Per-device NVS / SPIFFS images generated for provisioning
+        self.write_device_images = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="📇 Escribir NVS/SPIFFS por dispositivo al flashear (aprovisionamiento)", 
+                       variable=self.write_device_images).grid(row=4, column=0, sticky=tk.W, pady=2)
+        
         # === MAIN ACTION BUTTONS ===
         main_buttons_frame = ttk.Frame(main_frame)
         main_buttons_frame.grid(row=5, column=0, pady=5, sticky=(tk.W, tk.E))
@@ -416,6 +534,31 @@ class ESP32Flasher:
         ttk.Label(tools_frame, text="SPIFFS Tools:", font=('Segoe UI', 9, 'bold')).grid(row=0, column=0, sticky=tk.W)
         self.install_mkspiffs_btn = ttk.Button(tools_frame, text="Install mkspiffs", command=self.install_mkspiffs, width=20)
         self.install_mkspiffs_btn.grid(row=0, column=1, sticky=(tk.E))
+        ttk.Label(tools_frame, text="Cable/Hub:", font=('Segoe UI', 9, 'bold')).grid(row=0, column=2, sticky=tk.W, padx=(15, 0))
+        self.benchmark_btn = ttk.Button(tools_frame, text="📊 Benchmark Baud", command=self.start_baud_benchmark, width=20)
+        self.benchmark_btn.grid(row=0, column=3, sticky=(tk.E))
+        ttk.Checkbutton(tools_frame, text="⚡ Auto-flash al conectar (sin confirmación)",
+                        variable=self.hotplug_enabled, command=self.toggle_hotplug).grid(
+                            row=1, column=0, columnspan=4, sticky=tk.W, pady=(5, 0))
+        ttk.Checkbutton(tools_frame, text="🧭 Grabar traza de tiempos (Perfetto / chrome://tracing)",
+                        variable=self.trace_enabled, command=self.toggle_tracing).grid(
+                            row=2, column=0, columnspan=4, sticky=tk.W)
+        ttk.Label(tools_frame, text="Flota:", font=('Segoe UI', 9, 'bold')).grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        self.inventory_btn = ttk.Button(tools_frame, text="📋 Inventario", command=self.show_fleet_inventory, width=20)
+        self.inventory_btn.grid(row=3, column=1, sticky=(tk.E), pady=(5, 0))
+        ttk.Label(tools_frame, text="Backup:", font=('Segoe UI', 9, 'bold')).grid(row=3, column=2, sticky=tk.W, padx=(15, 0), pady=(5, 0))
+        self.backup_btn = ttk.Button(tools_frame, text="💾 Backup Flash", command=self.start_backup, width=20)
+        self.backup_btn.grid(row=3, column=3, sticky=(tk.E), pady=(5, 0))
+        self.restore_btn = ttk.Button(tools_frame, text="♻️ Restaurar Backup", command=self.start_restore, width=20)
+        self.restore_btn.grid(row=4, column=3, sticky=(tk.E), pady=(2, 0))
+        ttk.Label(tools_frame, text="Aprovisionar:", font=('Segoe UI', 9, 'bold')).grid(row=5, column=0, sticky=tk.W, pady=(5, 0))
+        self.nvs_generate_btn = ttk.Button(tools_frame, text="📇 Generar NVS (CSV)", command=self.start_nvs_generation, width=20)
+        self.nvs_generate_btn.grid(row=5, column=1, sticky=(tk.E), pady=(5, 0))
+        self.spiffs_generate_btn = ttk.Button(tools_frame, text="🗂️ Generar SPIFFS (certs)", command=self.start_spiffs_generation, width=20)
+        self.spiffs_generate_btn.grid(row=5, column=3, sticky=(tk.E), pady=(5, 0))
+        ttk.Checkbutton(tools_frame, text=f"🔗 API HTTP local para MES (http://127.0.0.1:{self.http_api.port})",
+                        variable=self.http_api_enabled, command=self.toggle_http_api).grid(
+                            row=6, column=0, columnspan=4, sticky=tk.W, pady=(5, 0))
 
         
         # === PROGRESS BAR ===
@@ -579,12 +722,28 @@ class ESP32Flasher:
         self.unique_devices_label.grid(row=2, column=1, sticky=tk.W)
         
         # MAC addresses
-        self.mac_text = scrolledtext.ScrolledText(session_frame, height=4, width=35, state='disabled', 
-                                                   wrap=tk.WORD, font=('Consolas', 7))
-        self.mac_text.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=2)
-        
-        # Reset button
-        ttk.Button(session_frame, text="🔄", command=self.reset_session_stats, width=5).grid(row=4, column=0, columnspan=2, pady=2)
+        # MAC addresses (only the visible rows are rendered)
+        self.mac_list = VirtualListbox(session_frame, height=4, width=35, font=('Consolas', 7))
+        self.mac_list.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=2)
+        
+        # Job scheduler (auto-flash): queue depth / throughput / rejects
+        self.queue_status_label = ttk.Label(session_frame, text="Cola: 0 | En curso: 0 | 0.0 placas/h | Rechazadas: 0",
+                                            foreground="gray", font=('Arial', 8))
+        self.queue_status_label.grid(row=4, column=0, columnspan=2, sticky=tk.W)
+        
+        # Stage timings: p50/p95 per stage over the session
+        self.stage_text = scrolledtext.ScrolledText(session_frame, height=6, width=35, state='disabled',
+                                                    wrap=tk.NONE, font=('Consolas', 7))
+        self.stage_text.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=2)
+        
+        # Reset / export buttons
+        buttons_frame = ttk.Frame(session_frame)
+        buttons_frame.grid(row=6, column=0, columnspan=2, pady=2)
+        ttk.Button(buttons_frame, text="🔄", command=self.reset_session_stats, width=5).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons_frame, text="CSV", command=lambda: self.export_stage_metrics("csv"),
+                   width=5).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons_frame, text="JSON", command=lambda: self.export_stage_metrics("json"),
+                   width=5).pack(side=tk.LEFT, padx=2)
     
     def clear_text(self, text_widget):
         """Clear a text widget"""
@@ -597,30 +756,221 @@ class ESP32Flasher:
         self.total_flashes = 0
         self.successful_flashes = 0
         self.flashed_devices.clear()
+        self.mac_list.clear()
+        self.stage_metrics.clear()
         self.update_session_display()
         self.log_debug("Estadísticas de sesión reiniciadas")
     
+    def toggle_tracing(self):
+        """Start recording trace spans, or stop and save them as Chrome trace JSON"""
+        if self.trace_enabled.get():
+            TRACER.start()
+            self.log("Traza activada: se registran esptool, subprocesos, lecturas de archivo y refrescos de UI", "info")
+            return
+        
+        TRACER.stop()
+        count = TRACER.event_count
+        if not count:
+            self.log("Traza detenida (sin eventos)", "info")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Guardar traza",
+            defaultextension=".json",
+            initialfile=f"traza_flasheo_{time.strftime('%Y%m%d_%H%M%S')}.json",
+            filetypes=[("Chrome trace JSON", "*.json"), ("Todos", "*.*")])
+        if not path:
+            self.log(f"Traza descartada ({count} eventos)", "warning")
+            return
+        try:
+            TRACER.export(path)
+            self.log(f"Traza guardada: {path} ({count} eventos) - ábrela en https://ui.perfetto.dev", "success")
+        except OSError as e:
+            self.log(f"Error guardando traza: {e}", "error")
+    
+    def toggle_http_api(self):
+        """Start/stop the local HTTP API from the advanced options checkbox"""
+        if not self.http_api_enabled.get():
+            self.http_api.stop()
+            return
+        try:
+            self.http_api.start()
+        except OSError as e:
+            self.http_api_enabled.set(False)
+            messagebox.showerror("API HTTP", f"No se pudo abrir el puerto {self.http_api.port}:\n{e}")
+            return
+        self.log(f"🔗 API HTTP activa: POST /jobs, GET /jobs/<id>, GET /events, GET /devices/<mac> "
+                 f"en http://{self.http_api.host}:{self.http_api.port}", "info")
+    
+    def export_stage_metrics(self, fmt):
+        """Export per-stage timings of the session (fmt: 'csv' or 'json')"""
+        if not self.stage_metrics.runs:
+            messagebox.showinfo("Exportar tiempos", "No hay tiempos de etapas registrados en esta sesión")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Exportar tiempos por etapa",
+            defaultextension=f".{fmt}",
+            initialfile=f"tiempos_flasheo_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}",
+            filetypes=[(fmt.upper(), f"*.{fmt}"), ("Todos", "*.*")])
+        if not path:
+            return
+        try:
+            if fmt == "csv":
+                self.stage_metrics.export_csv(path)
+            else:
+                self.stage_metrics.export_json(path)
+            self.log(f"Tiempos por etapa exportados a {path}", "success")
+        except OSError as e:
+            self.log(f"Error exportando tiempos: {e}", "error")
+            messagebox.showerror("Error", f"No se pudo exportar:\n\n{e}")
+    
     def update_session_display(self):
         """Update session statistics display"""
         self.total_flashes_label.config(text=str(self.total_flashes))
         self.successful_flashes_label.config(text=str(self.successful_flashes))
-        self.unique_devices_label.config(text=str(len(self.flashed_devices)))
-        
-        # Update MAC list
-        self.mac_text.config(state='normal')
-        self.mac_text.delete(1.0, tk.END)
-        for mac in sorted(self.flashed_devices):
-            self.mac_text.insert(tk.END, f"{mac}\n")
-        self.mac_text.config(state='disabled')
+        self.unique_devices_label.config(
+            text=f"{len(self.flashed_devices)} (historial: {self.device_history.unique_devices})")
+        
+        stats = self.job_scheduler.stats()
+        self.queue_status_label.config(
+            text=f"Cola: {stats['queued']} | En curso: {stats['running']} | "
+                 f"{stats['throughput_per_hour']:.1f} placas/h | Rechazadas: {stats['rejected']}",
+            foreground="red" if stats['rejected'] else "gray")
+        
+        self.stage_text.config(state='normal')
+        self.stage_text.delete(1.0, tk.END)
+        self.stage_text.insert(tk.END, self.stage_metrics.format_summary())
+        self.stage_text.config(state='disabled')
+    
+    def _add_session_mac(self, mac):
+        """Add a flashed board to the session set and the MAC list (incremental insert)"""
+        mac = mac.lower()
+        if mac not in self.flashed_devices:
+            self.flashed_devices.add(mac)
+            self.mac_list.insert_sorted(mac)
+    
+    def _record_history(self, port, mac, result, chip, files, flash_id=None, timings=None):
+        """Store a flash operation in the device history
+        
+        files are the (address, path, description) entries that were written;
+        the application image identifies the firmware (hash) and the project.
+        """
+        app_path = next((path for _, path, desc in files if "Firmware" in desc), None) or \
+            (files[-1][1] if files else None)
+        firmware_hash = project = None
+        active = self._active_project()
+        if active is not None and app_path == active.file("firmware"):
+            firmware_hash = active.digest("firmware")
+            project = active.name
+        elif app_path and os.path.exists(app_path):
+            firmware_hash = self.payload_cache.file_sha256(app_path)
+            project = os.path.splitext(os.path.basename(app_path))[0]
+        
+        if mac:
+            previous = self.device_history.last_flash(mac)
+            if previous:
+                when = time.strftime('%Y-%m-%d %H:%M', time.localtime(previous["timestamp"]))
+                same = " (mismo firmware)" if firmware_hash and previous["firmware_hash"] == firmware_hash else ""
+                self.log_debug(f"Placa {mac} ya registrada: último flasheo {when}, "
+                               f"{previous['project'] or '?'}, {previous['result']}{same}")
+        
+        self.device_history.record(mac, result, chip=chip, flash_id=flash_id, project=project,
+                                   firmware_hash=firmware_hash, port=port, stage_timings=timings)
     
     def log_debug(self, message, tag="debug"):
         """Log debug message to debug panel"""
+        if self._off_ui_thread():
+            self._log_queue.put((message, tag))
+            return
         if self.verbose_mode.get() or tag != "verbose":
             self.debug_text.config(state='normal')
             self.debug_text.insert(tk.END, f"[DEBUG] {message}\n", tag)
             self.debug_text.see(tk.END)
             self.debug_text.config(state='disabled')
-            self.root.update()
+            self._flush_ui()
+
+    def _engine_log(self, message, level='info'):
+        """Logger callback for helper managers (FlashManager, PayloadCache...), any thread"""
+        if self._off_ui_thread():
+            self._log_queue.put((message, level))
+        else:
+            self._show_log(message, level)
+
+    def _off_ui_thread(self):
+        return threading.current_thread() is not self._ui_thread
+
+    def _ui(self, func, *args):
+        """Run a widget update on the Tk thread: now when already there, else at the next drain"""
+        if self._off_ui_thread():
+            self._ui_queue.put((func, args))
+        else:
+            func(*args)
+
+    def set_status(self, text):
+        """Status bar text (any thread)"""
+        self._ui(lambda: self.status_label.config(text=text))
+
+    def set_progress(self, value):
+        """Progress bar value (any thread)"""
+        self._ui(self.progress.__setitem__, 'value', value)
+
+    def _show_log(self, message, level):
+        """Tk thread: route a queued (message, level) to its panel"""
+        if level in ('tx', 'rx'):
+            self.log_serial(message, level)
+        elif level in ('debug', 'verbose'):
+            self.log_debug(message, level)
+        else:
+            self.log(message, level)
+
+    def _drain_log_queue(self):
+        """Tk thread: show the messages, widget updates and serial data queued by other threads, then poll again"""
+        self._draining_logs = True
+        try:
+            while True:
+                try:
+                    message, level = self._log_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._show_log(message, level)
+            while True:
+                try:
+                    func, args = self._ui_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    func(*args)
+                except Exception as e:
+                    self.log_debug(f"Error actualizando la interfaz: {e}")
+            # Serial monitor data: consecutive chunks of the same kind in one insert
+            pending = []
+            while True:
+                try:
+                    text, tag = self._serial_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending and pending[-1][1] == tag:
+                    pending[-1][0].append(text)
+                else:
+                    pending.append(([text], tag))
+            for texts, tag in pending:
+                self.write_to_serial_terminal("".join(texts), tag)
+        finally:
+            self._draining_logs = False
+        self.root.after(self.LOG_POLL_MS, self._drain_log_queue)
+
+    def _on_flash_progress(self, percent, message):
+        """Progress callback for in-process flash operations"""
+        if self._off_ui_thread():
+            self._ui(self._on_flash_progress, percent, message)
+            return
+        if percent is not None:
+            self.set_progress(percent)
+        if message:
+            if "Hash of data verified" in message:
+                self.set_status("✅ Verifying upload...")
+            elif "Writing at" in message:
+                self.set_status("📤 Uploading data...")
+            self.log_debug(f"esptool: {message}", "verbose")
 
     def _get_subprocess_python(self):
         """Return a suitable Python executable for subprocess calls.
@@ -665,7 +1015,8 @@ class ESP32Flasher:
             out_buf = io.StringIO()
             err_buf = io.StringIO()
             try:
-                with contextlib.redirect_stdout(out_buf), contextlib.redirect_stderr(err_buf):
+                with contextlib.redirect_stdout(out_buf), contextlib.redirect_stderr(err_buf), \
+                        TRACER.span("esptool (in-process)", "esptool", args=' '.join(esptool_args)):
                     try:
                         esptool.main(esptool_args)
                         return Result(0, out_buf.getvalue(), err_buf.getvalue())
@@ -679,27 +1030,51 @@ class ESP32Flasher:
             python_exe = self._get_subprocess_python()
             cmd = [python_exe, "-m", "esptool"] + list(esptool_args)
             try:
-                proc = subprocess.run(cmd, capture_output=capture_output, text=True, timeout=timeout)
+                with TRACER.span("esptool (subprocess)", "subprocess", args=' '.join(esptool_args)):
+                    proc = subprocess.run(cmd, capture_output=capture_output, text=True, timeout=timeout)
                 return Result(proc.returncode, proc.stdout if proc.stdout else '', proc.stderr if proc.stderr else '')
             except Exception as e:
                 return Result(1, '', str(e))
     
+    def get_operation_baud(self, port):
+        """Baud rate for a one-shot esptool command: selected rate, or best known for 'auto'"""
+        return str(self.flash_manager.resolve_baud(port, self.selected_baud.get()))
+    
+    def _run_esptool_adaptive(self, port, build_args, timeout=None):
+        """Run esptool at the fastest working baud rate for the port.
+        
+        build_args(baud) must return the esptool argument list for that rate.
+        On sync/checksum errors the command is retried one rate lower and the
+        result is remembered by the BaudManager.
+        """
+        def attempt(baud):
+            self.log_debug(f"esptool @ {baud} baud: {' '.join(build_args(baud))}", "verbose")
+            return self._run_esptool(build_args(baud), capture_output=True, timeout=timeout)
+        
+        return self.baud_manager.run(port, attempt, self.selected_baud.get())
+    
     def log_serial(self, message, direction="rx"):
         """Log serial communication to debug panel (for esptool communication)"""
+        if self._off_ui_thread():
+            self._log_queue.put((message, direction))
+            return
         prefix = "→ TX:" if direction == "tx" else "← RX:"
         self.debug_text.config(state='normal')
         self.debug_text.insert(tk.END, f"{prefix} {message}\n", "verbose")
         self.debug_text.see(tk.END)
         self.debug_text.config(state='disabled')
-        self.root.update()
+        self._flush_ui()
     
     def write_to_serial_terminal(self, message, tag="rx"):
-        """Write to the serial terminal (for actual serial data)"""
+        """Write to the serial terminal (for actual serial data), from any thread"""
+        if self._off_ui_thread():
+            self._serial_queue.put((message, tag))
+            return
         self.serial_text.config(state='normal')
         self.serial_text.insert(tk.END, f"{message}", tag)
         self.serial_text.see(tk.END)
         self.serial_text.config(state='disabled')
-        self.root.update()
+        self._flush_ui()
     
     def toggle_serial_connection(self):
         """Connect or disconnect from serial port"""
@@ -718,13 +1093,10 @@ class ESP32Flasher:
         baud_rate = int(self.serial_baud.get())
         
         try:
-            import serial
-            self.serial_port_obj = serial.Serial(
-                port=port_name,
-                baudrate=baud_rate,
-                timeout=0.1,
-                write_timeout=1
-            )
+            # The engine opens rfc2217:// and socket:// ports too (tuned for throughput)
+            self.serial_monitor = self.async_engine.submit(
+                self.async_engine.monitor(port_name, baud_rate)).result(timeout=10)
+            self.serial_port_obj = self.serial_monitor.serial
             
             self.serial_connected = True
             self.connect_btn.config(text="🔌 Disconnect")
@@ -732,9 +1104,8 @@ class ESP32Flasher:
             self.write_to_serial_terminal(f"Connected to {port_name} at {baud_rate} baud\n", "info")
             self.log_debug(f"Serial connected to {port_name}@{baud_rate}")
             
-            # Start reading thread
-            self.serial_thread = threading.Thread(target=self._serial_read_thread, daemon=True)
-            self.serial_thread.start()
+            # Received data is pumped on the engine's loop (no reader thread per port)
+            self.async_engine.submit(self._serial_read_loop(self.serial_monitor))
             
         except Exception as e:
             messagebox.showerror("Error", f"Error conectando al puerto serial:\n\n{str(e)}")
@@ -743,8 +1114,13 @@ class ESP32Flasher:
     def disconnect_serial(self):
         """Disconnect from serial port"""
         self.serial_connected = False
-        if self.serial_port_obj and self.serial_port_obj.is_open:
-            self.serial_port_obj.close()
+        if self.serial_monitor is not None:
+            # Wait for the port to be released: hot-plug and build-watch flashes open it right after
+            try:
+                self.async_engine.submit(self.serial_monitor.close()).result(timeout=5)
+            except Exception as e:
+                self.log_debug(f"Serial close failed: {e}")
+            self.serial_monitor = None
         
         self.connect_btn.config(text="🔌 Connect")
         self.serial_baud_combo.config(state='readonly')
@@ -752,28 +1128,21 @@ class ESP32Flasher:
         self.log_debug("Serial disconnected")
         self.serial_port_obj = None
     
-    def _serial_read_thread(self):
-        """Thread to continuously read from serial port"""
-        while self.serial_connected and self.serial_port_obj and self.serial_port_obj.is_open:
-            try:
-                if self.serial_port_obj.in_waiting > 0:
-                    data = self.serial_port_obj.read(self.serial_port_obj.in_waiting)
-                    if data:
-                        # Try to decode as UTF-8, fallback to latin-1
-                        try:
-                            text = data.decode('utf-8')
-                        except UnicodeDecodeError:
-                            text = data.decode('latin-1')
-                        
-                        self.write_to_serial_terminal(text, "rx")
-                
-                time.sleep(0.01)  # Small delay to prevent busy waiting
+    async def _serial_read_loop(self, stream):
+        """Engine-loop coroutine: queue everything the monitor receives for the Tk thread until it is closed"""
+        try:
+            async for data in stream:
+                # Try to decode as UTF-8, fallback to latin-1
+                try:
+                    text = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    text = data.decode('latin-1')
                 
-            except Exception as e:
-                if self.serial_connected:  # Only log if not intentionally disconnected
-                    self.log_debug(f"Serial read error: {e}")
-                    self.write_to_serial_terminal(f"Read error: {e}\n", "info")
-                break
+                self.write_to_serial_terminal(text, "rx")
+        except EngineError as e:
+            if self.serial_connected:  # Only log if not intentionally disconnected
+                self.log_debug(f"Serial read error: {e}")
+                self.write_to_serial_terminal(f"Read error: {e}\n", "info")
     
     # ------------------------------------------------------------------ #
     #  UART command sending                                                #
@@ -892,10 +1261,10 @@ class ESP32Flasher:
             try:
                 self._download_mkspiffs(dest)
                 self.log("✅ mkspiffs instalado correctamente", "success")
-                messagebox.showinfo("Instalación completada", f"mkspiffs fue instalado en:\n{dest}")
+                self._ui(messagebox.showinfo, "Instalación completada", f"mkspiffs fue instalado en:\n{dest}")
             except Exception as e:
                 self.log(f"❌ Error instalando mkspiffs: {e}", "error")
-                messagebox.showerror("Error", f"No se pudo instalar mkspiffs:\n{e}")
+                self._ui(messagebox.showerror, "Error", f"No se pudo instalar mkspiffs:\n{e}")
 
         finally:
             self.set_buttons_state('normal')
@@ -1067,6 +1436,70 @@ class ESP32Flasher:
             self.auto_detect_btn.config(state='normal')
             self.log("Modo Completo: Bootloader + Partitions + Firmware (flasheo total)", "info")
     
+    def refresh_projects(self):
+        """Re-scan proyect_firmware/ and re-index the projects whose files changed"""
+        manifests = self.project_index.refresh()
+        self.project_combo['values'] = ['generic'] + [m.name for m in manifests]
+        self.log(f"Proyectos indexados: {len(manifests)}", "info")
+        for manifest in manifests:
+            self.log_debug(f"  {manifest.summary()}")
+        # Blobs of removed projects / loose files not used for a week
+        self.artifact_store.gc(min_age=7 * 24 * 3600)
+        blobs, refs, total = self.artifact_store.stats()
+        self.log_debug(f"Almacén de artefactos: {blobs} blob(s), {refs} referencia(s), {total // 1024} KB")
+        if self.selected_project.get() != "generic":
+            self.on_project_change()
+    
+    def on_project_change(self):
+        """Load the selected project's files from its manifest (no rescanning or reparsing)"""
+        name = self.selected_project.get()
+        if name == "generic":
+            self.project = None
+            self.firmware_path = self.bootloader_path = self.partitions_path = None
+            self.firmware_label.config(text="No seleccionado", foreground="gray")
+            self.on_mode_change()
+            self.log("Modo genérico - selecciona archivos manualmente", "info")
+            return
+        
+        manifest = self.project_index.get(name)
+        if manifest is None or manifest.file("firmware") is None:
+            messagebox.showwarning("Proyecto no encontrado",
+                                   f"La carpeta del proyecto no existe o no tiene firmware.bin:\n"
+                                   f"{os.path.join(self.project_index.root, name)}")
+            self.selected_project.set("generic")
+            self.project = None
+            return
+        
+        self.project = manifest
+        self.firmware_path = manifest.file("firmware")
+        self.bootloader_path = manifest.file("bootloader")
+        self.partitions_path = manifest.file("partitions")
+        if self.partitions_path is None and manifest.file("partitions_csv"):
+            self.partitions_path = self.convert_csv_to_bin(manifest.file("partitions_csv"))
+        
+        for label, role in ((self.firmware_label, "firmware"), (self.bootloader_label, "bootloader"),
+                            (self.partitions_label, "partitions")):
+            component = manifest.components.get(role)
+            if component:
+                label.config(text=f"✓ {name}/{component['file']} ({self.get_file_size(manifest.file(role))})",
+                             foreground="green")
+        if manifest.chip and manifest.chip != self.selected_chip.get():
+            self.selected_chip.set(manifest.chip)
+            self.log(f"Chip ajustado a {manifest.chip} según la imagen del proyecto", "info")
+        
+        self.log(f"Proyecto cargado: {manifest.summary()}", "success")
+        if manifest.has_ota:
+            self.log(f"ℹ️ {name} usa OTA (firmware @ 0x{manifest.app_address:X})", "info")
+    
+    def _active_project(self):
+        """Manifest of the selected project while its files are the ones loaded, else None"""
+        project = self.project
+        if project is None or project.file("firmware") != self.firmware_path:
+            return None
+        if self.partitions_path and self.partitions_path != project.file("partitions"):
+            return None
+        return project
+    
     def select_firmware_file(self):
         """Open file dialog to select firmware.bin"""
         filename = filedialog.askopenfilename(
@@ -1076,6 +1509,8 @@ class ESP32Flasher:
         )
         if filename:
             self.firmware_path = filename
+            self.selected_project.set("generic")
+            self.project = None
             self.firmware_label.config(text=f"{os.path.basename(filename)} ({self.get_file_size(filename)})", 
                                       foreground="green")
             self.log(f"Firmware seleccionado: {os.path.basename(filename)}", "success")
@@ -1157,15 +1592,32 @@ class ESP32Flasher:
                 self.log(f"Partition table auto-detectada: {candidate}", "success")
                 break
     
-    def auto_detect_pio_files(self):
-        """Auto-detect PlatformIO build files"""
-        search_paths = [
+    def _pio_build_roots(self):
+        """.pio/build directories searched for PlatformIO builds"""
+        return [
             os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pio", "build"),
             os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".pio", "build")
         ]
-        
+    
+    def _load_pio_build(self, board_path):
+        """Select the firmware (and bootloader/partitions when present) of one build directory"""
+        self.project = None
+        self.selected_project.set("generic")
+        self.firmware_path = os.path.join(board_path, "firmware.bin")
+        self.firmware_label.config(text=f"✓ {os.path.basename(self.firmware_path)}", foreground="green")
+        bl = os.path.join(board_path, "bootloader.bin")
+        if os.path.exists(bl):
+            self.bootloader_path = bl
+            self.bootloader_label.config(text=f"✓ {os.path.basename(bl)}", foreground="green")
+        pt = os.path.join(board_path, "partitions.bin")
+        if os.path.exists(pt):
+            self.partitions_path = pt
+            self.partitions_label.config(text=f"✓ {os.path.basename(pt)}", foreground="green")
+    
+    def auto_detect_pio_files(self):
+        """Auto-detect PlatformIO build files"""
         found = False
-        for search_path in search_paths:
+        for search_path in self._pio_build_roots():
             if os.path.exists(search_path):
                 # Find build directories
                 for board_dir in os.listdir(search_path):
@@ -1176,14 +1628,7 @@ class ESP32Flasher:
                         pt = os.path.join(board_path, "partitions.bin")
                         
                         if os.path.exists(fw) and os.path.exists(bl) and os.path.exists(pt):
-                            self.firmware_path = fw
-                            self.bootloader_path = bl
-                            self.partitions_path = pt
-                            
-                            self.firmware_label.config(text=f"✓ {os.path.basename(fw)}", foreground="green")
-                            self.bootloader_label.config(text=f"✓ {os.path.basename(bl)}", foreground="green")
-                            self.partitions_label.config(text=f"✓ {os.path.basename(pt)}", foreground="green")
-                            
+                            self._load_pio_build(board_path)
                             self.log(f"Archivos PlatformIO detectados en: {board_path}", "success")
                             found = True
                             break
@@ -1196,14 +1641,127 @@ class ESP32Flasher:
                                  "Busca en: .pio/build/<board_name>/")
             self.log("No se encontraron archivos PlatformIO", "warning")
     
-    def show_chip_info(self):
-        """Get and display comprehensive chip information"""
+    # ------------------------------------------------------------------ #
+    #  PlatformIO build watch                                              #
+    # ------------------------------------------------------------------ #
+    
+    def toggle_build_watch(self):
+        """Start/stop watching .pio/build from the files checkbox"""
+        if self.build_watch_enabled.get():
+            if not self.selected_port.get():
+                self.build_watch_enabled.set(False)
+                messagebox.showerror("Error", "Selecciona un puerto COM primero")
+                return
+            if not self.flash_manager.esptool_available():
+                self.build_watch_enabled.set(False)
+                messagebox.showerror("Error", "esptool no está instalado.\n\nEjecuta: pip install esptool")
+                return
+            self.build_watcher.start()
+            self.log("👁️ Vigilando .pio/build: cada build nuevo se flashea en "
+                     f"{self.selected_port.get().split(' - ')[0]} (solo sectores cambiados)", "info")
+        else:
+            self.build_watcher.stop()
+            self.log("Vigilancia de builds desactivada", "info")
+    
+    def _on_pio_build(self, env_path, changed):
+        """Watcher thread callback - hand over to the Tk thread"""
+        self._ui(lambda: self._start_watch_flash(env_path))
+    
+    def _start_watch_flash(self, env_path):
+        """Load a finished build and delta-flash it unless something else is flashing"""
+        if not self.build_watch_enabled.get():
+            return
+        self._load_pio_build(env_path)
+        self.log(f"🆕 Build nuevo en {env_path}", "info")
+        if self.is_flashing:
+            self.log("Hay una operación en curso - este build no se flashea automáticamente", "warning")
+            return
+        if not self.selected_port.get():
+            self.log("Sin puerto seleccionado - build no flasheado", "warning")
+            return
+        
+        port = self.selected_port.get().split(' - ')[0]
+        # The serial monitor holds the port: release it for the flash, reopen it afterwards
+        reconnect = self.serial_connected
+        if reconnect:
+            self.disconnect_serial()
+        self.is_flashing = True
+        self.set_buttons_state('disabled')
+        self.set_progress(0)
+        threading.Thread(target=self._watch_flash, args=(port, env_path, reconnect),
+                         daemon=True, name=f"watch-flash-{port}").start()
+    
+    def _watch_flash(self, port, env_path, reconnect):
+        """Write the changed sectors of the new build over one session and reset the board (worker thread)"""
+        esp = None
+        ok = False
+        t = time.time()
+        try:
+            self.log("=" * 60, "info")
+            self.log(f"FLASH DELTA de {os.path.basename(env_path)} en {port}", "info")
+            self.log("=" * 60, "info")
+            self.set_status("👁️ Flash delta del build nuevo...")
+            chip, baud = self.selected_chip.get(), self.selected_baud.get()
+            esp = self.flash_manager.open_session(port, chip, baud)
+            if esp is None:
+                self.log(f"❌ No se pudo conectar con {port}", "error")
+                return
+            
+            # Bootloader is left alone: esptool patches its header, and builds rarely change it.
+            # The app goes where the build's own table puts it (written in this same pass);
+            # the table on the device only when the build has none
+            build_table = os.path.join(env_path, "partitions.bin")
+            table = load_partition_table(build_table)
+            app, source = (table.boot_app() if table else None), "build"
+            if app is None:
+                device_table = self.flash_manager.read_partition_table(esp)
+                app, source = (device_table.boot_app() if device_table else None), "dispositivo"
+            address = app.offset if app is not None else 0x10000
+            self.log_debug(f"Dirección de firmware: 0x{address:X} ({source if app else 'por defecto'})")
+            files = []
+            if table is not None:
+                files.append((int(self.get_partition_table_address(), 16), build_table, "Partition Table"))
+            files.append((address, self.firmware_path, "Firmware (app)"))
+            
+            written = 0
+            for addr, path, desc in files:
+                result = self.flash_manager.write_delta(esp, addr, path, progress_callback=self._on_flash_progress,
+                                                        label=desc)
+                if result is None:
+                    self.log(f"❌ Error escribiendo {desc} en 0x{addr:X}", "error")
+                    return
+                written += result
+            ok = True
+            self.log(f"✓ Build flasheado en {time.time() - t:.1f}s ({written // 1024} KB escritos)", "success")
+        except Exception as e:
+            self.log(f"❌ Error en flash delta: {e}", "error")
+        finally:
+            if esp is not None:
+                # Hard reset so the new build starts running
+                self.flash_manager.close_session(esp)
+            self.is_flashing = False
+            self.set_buttons_state('normal')
+            self.set_status("Idle")
+            self.set_progress(100 if ok else 0)
+            if reconnect:
+                self.root.after(500, self.connect_serial)
+    
+    def show_chip_info(self, refresh=False):
+        """Show chip information: from the per-board cache, or read over one esptool session"""
         if not self.selected_port.get():
             messagebox.showerror("Error", "Selecciona un puerto COM primero.")
             return
         
         port = self.selected_port.get().split(' - ')[0]
-        chip = self.selected_chip.get()
+        # Board last seen on this port: only its MAC is read to confirm it was not swapped
+        cached = None if refresh else self.chip_info_cache.for_port(port)
+        
+        if self.is_flashing:
+            messagebox.showwarning("Ocupado", "Ya hay un flasheo en progreso")
+            return
+        if not self.flash_manager.esptool_available():
+            messagebox.showerror("Error", "esptool no está instalado.\n\nEjecuta: pip install esptool")
+            return
         
         # Show progress window
         progress_window = tk.Toplevel(self.root)
@@ -1222,138 +1780,232 @@ class ESP32Flasher:
                                    font=('Segoe UI', 10), justify='center')
         progress_label.pack(expand=True, pady=20)
         
-        progress_window.update()
+        def collect():
+            info = None
+            error = None
+            esp = None
+            try:
+                # Any chip: the dialog reports what is really connected
+                esp = self.flash_manager.open_session(port, None, self.selected_baud.get())
+                if esp is not None:
+                    mac = self.flash_manager.read_mac(esp)
+                    if cached is not None and mac and mac == (cached.mac or "").lower():
+                        # Same board: identity from the cache, eFuse security read again
+                        self.log_debug(f"Chip info de caché ({cached.mac}, hace {cached.age:.0f}s)")
+                        info = self.flash_manager.refresh_security_info(esp, cached)
+                        self.chip_info_cache.put(info, port)
+                    else:
+                        info = self._collect_chip_info(port, esp)
+            except Exception as e:
+                error = e
+            finally:
+                self.flash_manager.close_session(esp)
+            self._ui(lambda: finished(info, error))
         
-        try:
-            # Get Python executable
-            python_exe = self._get_subprocess_python()
-            if not python_exe or python_exe == '':
-                esptool_args = ["--chip", chip, "--port", port, "--baud", "115200", "read_mac"]
-                result = self._run_esptool(esptool_args, capture_output=True, timeout=15)
-                esptool_args = ["--chip", chip, "--port", port, "--baud", "115200", "chip_id"]
-                result = self._run_esptool(esptool_args, capture_output=True, timeout=15)
-                esptool_args = ["--chip", chip, "--port", port, "--baud", "115200", "read_flash", "0x1000", "0x100"]
-                result = self._run_esptool(esptool_args, capture_output=True, timeout=15)
-                esptool_args = ["--chip", chip, "--port", port, "--baud", "115200", "get-security-info"]
-                result_security = self._run_esptool(esptool_args, capture_output=True, timeout=30)
-            
+        def finished(info, error):
             progress_window.destroy()
-            
-            # Combine outputs
-            full_output = "=" * 70 + "\n"
-            full_output += "INFORMACIÓN DEL CHIP ESP32\n"
-            full_output += "=" * 70 + "\n\n"
-            
-            if result.returncode == 0:
-                full_output += "--- CHIP ID ---\n"
-                full_output += result.stdout + "\n"
+            if info is not None:
                 self.log_serial("Chip info obtenida exitosamente", "rx")
+                self.log(f"Información del chip obtenida para {port}", "success")
+                self._show_chip_info_window(port, info)
+            elif error is not None:
+                messagebox.showerror("Error", f"Error obteniendo información del chip:\n\n{str(error)}")
+                self.log(f"Error en show_chip_info: {error}", "error")
+                self.log_debug(f"Exception: {repr(error)}")
             else:
-                full_output += "--- ERROR CHIP ID ---\n"
-                full_output += result.stderr + "\n"
-            
-            full_output += "\n" + "=" * 70 + "\n\n"
-            
-            if result_flash.returncode == 0:
-                full_output += "--- FLASH ID & DETAILS ---\n"
-                full_output += result_flash.stdout + "\n"
-            else:
-                full_output += "--- ERROR FLASH ID ---\n"
-                full_output += result_flash.stderr + "\n"
-            
-            full_output += "\n" + "=" * 70 + "\n\n"
+                messagebox.showerror("Sin respuesta",
+                    f"No se pudo obtener información del chip.\n\n"
+                    f"Verifica que:\n"
+                    f"• El chip esté conectado correctamente\n"
+                    f"• El puerto COM sea correcto\n"
+                    f"• El chip no esté siendo usado por otro programa")
+                self.log("No se pudo conectar para obtener chip info", "error")
+        
+        threading.Thread(target=collect, name=f"chip-info-{port}", daemon=True).start()
+    
+    def _collect_chip_info(self, port, esp=None):
+        """
+        Read chip info from the board and cache it by MAC
+        
+        Args:
+            port: Serial port of the board
+            esp: Open session to reuse; a short session is opened when None
+        
+        Returns:
+            ChipInfo, or None if the board did not answer
+        """
+        own_session = esp is None
+        if own_session:
+            # Any chip: the dialog reports what is really connected
+            esp = self.flash_manager.open_session(port, None, self.selected_baud.get())
+            if esp is None:
+                return None
+        try:
+            info = self.flash_manager.collect_chip_info(esp)
+        finally:
+            if own_session:
+                self.flash_manager.close_session(esp)
+        self.chip_info_cache.put(info, port)
+        return info
+    
+    def _show_chip_info_window(self, port, info):
+        """Popup with a ChipInfo report (copy / refresh buttons)"""
+        full_output = info.format_report()
+        age = info.age
+        if age > 2:
+            age_text = f"{age / 60:.0f} min" if age >= 60 else f"{age:.0f} s"
+            full_output += f"(Datos en caché, leídos hace {age_text} - usa 🔄 Actualizar para releer la placa)\n"
+        
+        # Create popup window with info
+        info_window = tk.Toplevel(self.root)
+        info_window.title(f"Información del Chip - {port}")
+        info_window.geometry("800x600")
+        
+        # Center window
+        info_window.update_idletasks()
+        x = (info_window.winfo_screenwidth() // 2) - (info_window.winfo_width() // 2)
+        y = (info_window.winfo_screenheight() // 2) - (info_window.winfo_height() // 2)
+        info_window.geometry(f"+{x}+{y}")
+        
+        # Create text widget with scrollbar
+        text_frame = ttk.Frame(info_window)
+        text_frame.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        scrollbar = ttk.Scrollbar(text_frame)
+        scrollbar.pack(side='right', fill='y')
+        
+        info_text = tk.Text(text_frame, wrap='word', yscrollcommand=scrollbar.set,
+                           font=('Consolas', 9), bg='#1e1e1e', fg='#d4d4d4')
+        info_text.pack(side='left', fill='both', expand=True)
+        scrollbar.config(command=info_text.yview)
+        
+        # Insert text
+        info_text.insert('1.0', full_output)
+        info_text.config(state='normal')  # Keep editable for copy-paste
+        
+        # Add copy button
+        button_frame = ttk.Frame(info_window)
+        button_frame.pack(fill='x', padx=10, pady=(0,10))
+        
+        def copy_to_clipboard():
+            info_window.clipboard_clear()
+            info_window.clipboard_append(full_output)
+            messagebox.showinfo("Copiado", "Información copiada al portapapeles", parent=info_window)
+        
+        def refresh():
+            info_window.destroy()
+            self.show_chip_info(refresh=True)
+        
+        copy_btn = ttk.Button(button_frame, text="📋 Copiar Todo", command=copy_to_clipboard)
+        copy_btn.pack(side='left', padx=5)
+        
+        refresh_btn = ttk.Button(button_frame, text="🔄 Actualizar", command=refresh)
+        refresh_btn.pack(side='left', padx=5)
+        
+        close_btn = ttk.Button(button_frame, text="Cerrar", command=info_window.destroy)
+        close_btn.pack(side='right', padx=5)
+        
+        self.log_debug(f"Chip info window opened")
+    
+    def _preflight_check(self, port, esp, mac, flash_files):
+        """
+        Pre-flight checks against the board's chip info (identity cached by MAC,
+        eFuse security state always re-read)
+        
+        Args:
+            port: Serial port
+            esp: Open session
+            mac: Base MAC already read over the session (None = read it now)
+            flash_files: (address, filepath, description) entries to be written
+        
+        Returns:
+            True if flashing may proceed
+        """
+        info = self.chip_info_cache.get(mac)
+        if info is None:
+            info = self._collect_chip_info(port, esp=esp)
+        else:
+            self.flash_manager.refresh_security_info(esp, info)
+            self.chip_info_cache.put(info, port)
+        if info is None:
+            return True
+        
+        highest_end = 0
+        for address, filepath, _ in flash_files:
+            try:
+                start = address if isinstance(address, int) else int(str(address), 16)
+                highest_end = max(highest_end, start + os.path.getsize(filepath))
+            except (OSError, ValueError):
+                continue
+        
+        ok = True
+        for level, message in info.preflight_issues(highest_end):
+            self.log(f"Pre-flight: {message}", level)
+            ok = ok and level != "error"
+        return ok
+    
+    def _data_partition(self, subtype, esp=None):
+        """Partition of a data subtype: project table first, then the table on the device"""
+        project = self._active_project()
+        table = project.partition_table() if project else load_partition_table(self.partitions_path)
+        if table is None and esp is not None:
+            table = self.flash_manager.read_partition_table(esp, PartitionTable.DEFAULT_OFFSET)
+        return table.find_first(PartitionTable.TYPE_DATA, subtype) if table else None
+    
+    def _nvs_partition(self, esp=None):
+        """(offset, size) of the NVS partition (the IDF default 0x9000/0x5000 without a table)"""
+        nvs = self._data_partition(PartitionTable.SUBTYPE_NVS, esp)
+        if nvs is None:
+            return 0x9000, 0x5000
+        return nvs.offset, nvs.size
+    
+    # Per-device image kinds: (partition subtype, label in the log)
+    DEVICE_IMAGE_KINDS = (("nvs", PartitionTable.SUBTYPE_NVS, "NVS"),
+                          ("spiffs", PartitionTable.SUBTYPE_SPIFFS, "SPIFFS"))
+    
+    def _device_image_files(self, esp, mac):
+        """
+        Per-device images of this board (NVS, SPIFFS) as flash_files entries
+        
+        Returns:
+            List of (address, filepath, description), or None when an image
+            exists but does not fit its partition
+        """
+        if not self.write_device_images.get():
+            return []
+        if self.provisioning is None:
+            self.log("Imágenes por dispositivo activadas pero no hay ninguna generada", "warning")
+            return []
+        
+        files = []
+        for kind, subtype, label in self.DEVICE_IMAGE_KINDS:
+            device_id, image_path = self.provisioning.image_for(mac, kind)
+            if image_path is None:
+                if self.provisioning.has_kind(kind):
+                    self.log(f"Sin imagen {label} para {mac} "
+                             f"(quedan {self.provisioning.remaining(kind)} series libres)", "warning")
+                continue
+            if not os.path.exists(image_path):
+                self.log(f"Imagen {label} de {device_id} no encontrada: {image_path}", "error")
+                return None
             
-            if result_security.returncode == 0:
-                full_output += "--- SECURITY INFO ---\n"
-                full_output += result_security.stdout + "\n"
+            if kind == "nvs":
+                offset, size = self._nvs_partition(esp)
             else:
-                full_output += "--- SECURITY INFO (Not Available) ---\n"
-                full_output += "Security info not available for this chip/configuration\n"
-            
-            full_output += "\n" + "=" * 70 + "\n"
-            
-            # Parse and highlight key information (deduplicated)
-            info_summary = "\n--- RESUMEN ---\n"
-            seen_lines = set()  # Track what we've already added
-            
-            for line in (result.stdout + "\n" + result_flash.stdout + "\n" + result_security.stdout).split('\n'):
-                # Clean line
-                line = line.strip()
-                
-                # Check for key information
-                if any(keyword in line for keyword in ["Chip type:", "Features:", "Crystal is", 
-                                                        "Crystal frequency:", "MAC:",
-                                                        "Flash size:", "Flash ID:", "Manufacturer:",
-                                                        "Device:", "Detected flash size:",
-                                                        "Flash Encryption:", "Secure Boot:"]):
-                    # Only add if we haven't seen this exact line
-                    if line not in seen_lines:
-                        info_summary += line + "\n"
-                        seen_lines.add(line)
-            
-            full_output += info_summary
-            
-            # Create popup window with info
-            info_window = tk.Toplevel(self.root)
-            info_window.title(f"Información del Chip - {port}")
-            info_window.geometry("800x600")
-            
-            # Center window
-            info_window.update_idletasks()
-            x = (info_window.winfo_screenwidth() // 2) - (info_window.winfo_width() // 2)
-            y = (info_window.winfo_screenheight() // 2) - (info_window.winfo_height() // 2)
-            info_window.geometry(f"+{x}+{y}")
-            
-            # Create text widget with scrollbar
-            text_frame = ttk.Frame(info_window)
-            text_frame.pack(fill='both', expand=True, padx=10, pady=10)
-            
-            scrollbar = ttk.Scrollbar(text_frame)
-            scrollbar.pack(side='right', fill='y')
-            
-            info_text = tk.Text(text_frame, wrap='word', yscrollcommand=scrollbar.set,
-                               font=('Consolas', 9), bg='#1e1e1e', fg='#d4d4d4')
-            info_text.pack(side='left', fill='both', expand=True)
-            scrollbar.config(command=info_text.yview)
-            
-            # Insert text
-            info_text.insert('1.0', full_output)
-            info_text.config(state='normal')  # Keep editable for copy-paste
-            
-            # Add copy button
-            button_frame = ttk.Frame(info_window)
-            button_frame.pack(fill='x', padx=10, pady=(0,10))
-            
-            def copy_to_clipboard():
-                info_window.clipboard_clear()
-                info_window.clipboard_append(full_output)
-                messagebox.showinfo("Copiado", "Información copiada al portapapeles", parent=info_window)
-            
-            copy_btn = ttk.Button(button_frame, text="📋 Copiar Todo", command=copy_to_clipboard)
-            copy_btn.pack(side='left', padx=5)
-            
-            close_btn = ttk.Button(button_frame, text="Cerrar", command=info_window.destroy)
-            close_btn.pack(side='right', padx=5)
-            
-            self.log(f"Información del chip obtenida para {port}", "success")
-            self.log_debug(f"Chip info window opened")
-            
-        except subprocess.TimeoutExpired:
-            progress_window.destroy()
-            messagebox.showerror("Timeout", 
-                f"No se pudo obtener información del chip.\n\n"
-                f"Verifica que:\n"
-                f"• El chip esté conectado correctamente\n"
-                f"• El puerto COM sea correcto\n"
-                f"• El chip no esté siendo usado por otro programa")
-            self.log("Timeout obteniendo chip info", "error")
-            
-        except Exception as e:
-            progress_window.destroy()
-            messagebox.showerror("Error", f"Error obteniendo información del chip:\n\n{str(e)}")
-            self.log(f"Error en show_chip_info: {e}", "error")
-            self.log_debug(f"Exception: {repr(e)}")
-
+                partition = self._data_partition(subtype, esp)
+                if partition is None:
+                    self.log(f"No hay partición {label} en la tabla para la imagen de {device_id}", "error")
+                    return None
+                offset, size = partition.offset, partition.size
+            image_size = os.path.getsize(image_path)
+            if image_size != size:
+                self.log(f"La imagen {label} de {device_id} ocupa 0x{image_size:X} pero la partición "
+                         f"es de 0x{size:X} @ 0x{offset:X} - regenera las imágenes con la tabla del proyecto", "error")
+                return None
+            self.log(f"📇 {label} de {device_id} → 0x{offset:X}", "info")
+            files.append((f"0x{offset:X}", image_path, f"{label} ({device_id})"))
+        return files
+    
     def flash_bootloader_only(self):
         """Flash only the bootloader - useful for recovery from invalid header errors"""
         if self.is_flashing:
@@ -1421,7 +2073,7 @@ class ESP32Flasher:
                 python_exe, "-m", "esptool",
                 "--chip", chip,
                 "--port", port,
-                "--baud", str(self.selected_baud.get()),
+                "--baud", self.get_operation_baud(port),
                 "--before", "default-reset",
                 "--after", "hard-reset",
                 "write-flash",
@@ -1451,22 +2103,21 @@ class ESP32Flasher:
                     match = re.search(r'(\d+\.\d+)%', line)
                     if match:
                         percent = float(match.group(1))
-                        self.progress['value'] = percent
-                        self.root.update_idletasks()
+                        self.set_progress(percent)
                     
                     # Update status label
                     if "Connecting" in line:
-                        self.status_label.config(text="🔌 Connecting to device...")
+                        self.set_status("🔌 Connecting to device...")
                     elif "Erasing" in line or "erase" in line.lower():
-                        self.status_label.config(text="🗑️ Erasing flash...")
+                        self.set_status("🗑️ Erasing flash...")
                     elif "Writing at" in line:
-                        self.status_label.config(text="📤 Uploading bootloader...")
+                        self.set_status("📤 Uploading bootloader...")
                     elif "Hash of data verified" in line:
-                        self.status_label.config(text="✅ Verifying bootloader...")
+                        self.set_status("✅ Verifying bootloader...")
                     elif "Compressed" in line:
-                        self.status_label.config(text="📦 Compressing bootloader...")
+                        self.set_status("📦 Compressing bootloader...")
                     elif "Uploading" in line:
-                        self.status_label.config(text="📤 Uploading stub...")
+                        self.set_status("📤 Uploading stub...")
                     
                     self.log_debug(f"esptool: {line}")
                     
@@ -1482,7 +2133,7 @@ class ESP32Flasher:
                 self.log("=" * 60, "success")
                 self.log("El chip debería reiniciarse automáticamente", "info")
                 self.log("Si persiste 'invalid header', verifica particiones y firmware", "info")
-                messagebox.showinfo(
+                self._ui(messagebox.showinfo,
                     "Éxito",
                     "✅ Bootloader flasheado correctamente\n\n"
                     "El chip debería reiniciarse automáticamente.\n"
@@ -1491,7 +2142,7 @@ class ESP32Flasher:
                 )
             else:
                 self.log(f"Error: esptool retornó código {process.returncode}", "error")
-                messagebox.showerror(
+                self._ui(messagebox.showerror,
                     "Error",
                     f"Error flasheando bootloader.\n\n"
                     f"Código de error: {process.returncode}\n\n"
@@ -1501,7 +2152,7 @@ class ESP32Flasher:
         except Exception as e:
             self.log(f"❌ ERROR flasheando bootloader: {e}", "error")
             self.log_debug(f"Exception: {repr(e)}")
-            messagebox.showerror("Error", f"Error flasheando bootloader:\n\n{str(e)}")
+            self._ui(messagebox.showerror, "Error", f"Error flasheando bootloader:\n\n{str(e)}")
         
         finally:
             self.is_flashing = False
@@ -1547,28 +2198,21 @@ class ESP32Flasher:
                     temp_bootloader = os.path.join(tempfile.gettempdir(), "extracted_bootloader.bin")
                     
                     # Leer bootloader desde el chip (si existe)
-                    python_exe = self._get_subprocess_python()
-                    cmd = [
-                        python_exe, "-m", "esptool",
-                        "--port", port,
-                        "--baud", "115200",
-                        "read-flash", "0x0", "0x5000", temp_bootloader
-                    ]
+                    def build_args(baud):
+                        return ["--port", port, "--baud", str(baud),
+                                "read-flash", "0x0", "0x5000", temp_bootloader]
                     
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+                    result = self._run_esptool_adaptive(port, build_args, timeout=30)
                     if result.returncode == 0 and os.path.exists(temp_bootloader):
                         # Verificar si el bootloader leído es válido
                         with open(temp_bootloader, 'rb') as f:
                             header = f.read(16)
                         if len(header) >= 16 and header[0] == 0xE9:
                             self.log("✅ Bootloader extraído del chip es válido", "success")
-                            # Copiarlo a la carpeta firmware
-                            dest_bootloader = os.path.join(firmware_dir, "extracted_bootloader.bin")
-                            os.makedirs(firmware_dir, exist_ok=True)
-                            with open(temp_bootloader, 'rb') as src, open(dest_bootloader, 'wb') as dst:
-                                dst.write(src.read())
-                            self.bootloader_path = dest_bootloader
-                            return dest_bootloader
+                            # Guardarlo en el almacén de artefactos (una sola copia por contenido)
+                            artifact = self.artifact_store.put(temp_bootloader, ref="bootloader:extracted")
+                            self.bootloader_path = artifact.path
+                            return artifact.path
             except:
                 pass
             
@@ -1576,14 +2220,11 @@ class ESP32Flasher:
             self.log("🔧 Generando bootloader básico para ESP32-S3...", "warning")
             bootloader_file = self.create_esp32s3_bootloader()
             if bootloader_file and os.path.exists(bootloader_file):
-                # Copiarlo a la carpeta firmware
-                dest_bootloader = os.path.join(firmware_dir, "generated_bootloader.bin")
-                os.makedirs(firmware_dir, exist_ok=True)
-                with open(bootloader_file, 'rb') as src, open(dest_bootloader, 'wb') as dst:
-                    dst.write(src.read())
-                self.bootloader_path = dest_bootloader
+                # Guardarlo en el almacén de artefactos (una sola copia por contenido)
+                artifact = self.artifact_store.put(bootloader_file, ref="bootloader:generated")
+                self.bootloader_path = artifact.path
                 self.log("⚠️ Usando bootloader generado básico - puede requerir ajustes", "warning")
-                return dest_bootloader
+                return artifact.path
             
             return None
             
@@ -1638,7 +2279,7 @@ class ESP32Flasher:
                 python_exe, "-m", "esptool",
                 "--chip", chip,
                 "--port", port,
-                "--baud", str(self.selected_baud.get()),
+                "--baud", self.get_operation_baud(port),
                 "erase-flash"
             ]
             
@@ -1683,7 +2324,7 @@ class ESP32Flasher:
                 python_exe, "-m", "esptool",
                 "--chip", chip,
                 "--port", port,
-                "--baud", str(self.selected_baud.get()),
+                "--baud", self.get_operation_baud(port),
                 "--before", "default-reset",
                 "--after", "hard-reset",
                 "write_flash",
@@ -1722,7 +2363,7 @@ class ESP32Flasher:
                 self.log("🎉 REPARACIÓN COMPLETADA EXITOSAMENTE!", "success")
                 self.log("=" * 50, "success")
                 self.log("El chip debería arrancar correctamente ahora.", "success")
-                messagebox.showinfo("Reparación Exitosa", 
+                self._ui(messagebox.showinfo, "Reparación Exitosa", 
                     "✅ Reparación completada exitosamente!\n\n"
                     "El ESP32-S3 debería arrancar correctamente ahora.\n"
                     "Puedes desconectar y reconectar el dispositivo.")
@@ -1731,10 +2372,10 @@ class ESP32Flasher:
                 
         except subprocess.TimeoutExpired:
             self.log("❌ TIMEOUT en reparación", "error")
-            messagebox.showerror("Timeout", "La reparación tomó demasiado tiempo. Verifica la conexión.")
+            self._ui(messagebox.showerror, "Timeout", "La reparación tomó demasiado tiempo. Verifica la conexión.")
         except Exception as e:
             self.log(f"❌ ERROR en reparación: {e}", "error")
-            messagebox.showerror("Error de Reparación", f"Error durante la reparación:\n\n{str(e)}")
+            self._ui(messagebox.showerror, "Error de Reparación", f"Error durante la reparación:\n\n{str(e)}")
         finally:
             self.is_flashing = False
             self.set_buttons_state('normal')
@@ -1846,7 +2487,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             spiffs_info = self._detect_spiffs_partition(port, chip)
             if not spiffs_info:
                 self.log("❌ No se pudo detectar la partición SPIFFS", "error")
-                messagebox.showerror("Error", 
+                self._ui(messagebox.showerror, "Error", 
                     "No se pudo detectar la partición SPIFFS en el dispositivo.\n\n"
                     "Asegúrate de que el dispositivo tenga una tabla de particiones válida\n"
                     "con una partición SPIFFS configurada.")
@@ -1863,8 +2504,13 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             script_dir = os.path.dirname(os.path.abspath(__file__))
             spiffs_image = os.path.join(script_dir, "data", "spiffs.bin")
             
+            # Provisioning: the board's own image (unique certificates) when one was generated
+            device_image = self._device_spiffs_image(port, chip, spiffs_size)
+            if device_image:
+                spiffs_image = device_image
+                self.log(f"📦 Tamaño: {os.path.getsize(spiffs_image)} bytes", "info")
             # Use the pre-built image from data/ folder
-            if os.path.exists(spiffs_image):
+            elif os.path.exists(spiffs_image):
                 self.log("✅ Imagen SPIFFS preparada (usando data/spiffs.bin)", "success")
                 self.log(f"📦 Tamaño: {os.path.getsize(spiffs_image)} bytes", "info")
                 self.log_debug(f"Using SPIFFS image: {spiffs_image}")
@@ -1880,94 +2526,101 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             # Step 2: Flash SPIFFS image
             self.log(f"📤 Paso 2/3: Flasheando SPIFFS a 0x{spiffs_offset:X}...", "info")
             
-            flash_cmd = [
-                python_exe, "-m", "esptool",
-                "--chip", chip,
-                "--port", port,
-                "--baud", str(self.selected_baud.get()),
-                "--before", "default-reset",
-                "--after", "hard-reset",
-                "write-flash",
-                "-z",
-                "--flash-mode", "dio",
-                "--flash-freq", "40m",
-                "--flash-size", "detect",
-                f"0x{spiffs_offset:X}", spiffs_image
-            ]
+            if self.flash_manager.esptool_available():
+                # Stream the cached pre-compressed image over an in-process session
+                ok = self.flash_manager.flash_spiffs(port, chip, self.selected_baud.get(),
+                                                     spiffs_image, spiffs_offset,
+                                                     progress_callback=self._on_flash_progress)
+                returncode = 0 if ok else 1
+            else:
+                flash_cmd = [
+                    python_exe, "-m", "esptool",
+                    "--chip", chip,
+                    "--port", port,
+                    "--baud", self.get_operation_baud(port),
+                    "--before", "default-reset",
+                    "--after", "hard-reset",
+                    "write-flash",
+                    "-z",
+                    "--flash-mode", "dio",
+                    "--flash-freq", "40m",
+                    "--flash-size", "detect",
+                    f"0x{spiffs_offset:X}", spiffs_image
+                ]
             
-            self.log_debug(f"Comando flash: {' '.join(flash_cmd)}")
+                self.log_debug(f"Comando flash: {' '.join(flash_cmd)}")
             
-            process = subprocess.Popen(
-                flash_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
+                process = subprocess.Popen(
+                    flash_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1
+                )
             
-            # Read output
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    line = line.strip()
-                    match = re.search(r'(\d+\.\d+)%', line)
-                    if match:
-                        percent = float(match.group(1))
-                        self.progress['value'] = percent
-                        self.root.update_idletasks()
+                # Read output
+                for line in iter(process.stdout.readline, ''):
+                    if line:
+                        line = line.strip()
+                        match = re.search(r'(\d+\.\d+)%', line)
+                        if match:
+                            percent = float(match.group(1))
+                            self.set_progress(percent)
                     
-                    # Update status label
-                    if "Connecting" in line:
-                        self.status_label.config(text="🔌 Connecting to device...")
-                    elif "Erasing" in line or "erase" in line.lower():
-                        self.status_label.config(text="🗑️ Erasing flash...")
-                    elif "Writing at" in line:
-                        self.status_label.config(text="📤 Uploading SPIFFS...")
-                    elif "Hash of data verified" in line:
-                        self.status_label.config(text="✅ Verifying SPIFFS...")
-                    elif "Compressed" in line:
-                        self.status_label.config(text="📦 Compressing SPIFFS...")
-                    elif "Uploading" in line:
-                        self.status_label.config(text="📤 Uploading stub...")
+                        # Update status label
+                        if "Connecting" in line:
+                            self.set_status("🔌 Connecting to device...")
+                        elif "Erasing" in line or "erase" in line.lower():
+                            self.set_status("🗑️ Erasing flash...")
+                        elif "Writing at" in line:
+                            self.set_status("📤 Uploading SPIFFS...")
+                        elif "Hash of data verified" in line:
+                            self.set_status("✅ Verifying SPIFFS...")
+                        elif "Compressed" in line:
+                            self.set_status("📦 Compressing SPIFFS...")
+                        elif "Uploading" in line:
+                            self.set_status("📤 Uploading stub...")
                     
-                    self.log_debug(f"esptool: {line}")
+                        self.log_debug(f"esptool: {line}")
                     
-                    if "Writing at" in line or "Wrote" in line or "Hash of data verified" in line:
-                        self.log(line, "info")
+                        if "Writing at" in line or "Wrote" in line or "Hash of data verified" in line:
+                            self.log(line, "info")
             
-            process.wait()
+                process.wait()
+                returncode = process.returncode
             
-            if process.returncode == 0:
+            if returncode == 0:
                 self.log("=" * 60, "success")
                 self.log("✅ DATA FOLDER SUBIDA EXITOSAMENTE", "success")
                 self.log("=" * 60, "success")
                 self.log("Los archivos están ahora disponibles en SPIFFS", "info")
                 self.log("ℹ️ Nota: El ESP32 inicializará el filesystem al arrancar", "info")
                 
-                messagebox.showinfo(
+                self._ui(messagebox.showinfo,
                     "Éxito",
                     "✅ Data folder subida exitosamente a SPIFFS\n\n"
                     "Los archivos están ahora disponibles en el ESP32.\n\n"
                     "El filesystem será inicializado cuando el ESP32 arranque."
                 )
             else:
-                self.log(f"❌ Error: esptool retornó código {process.returncode}", "error")
-                messagebox.showerror(
+                self.log(f"❌ Error: esptool retornó código {returncode}", "error")
+                self._ui(messagebox.showerror,
                     "Error",
                     f"Error subiendo data folder.\n\n"
-                    f"Código de error: {process.returncode}\n\n"
+                    f"Código de error: {returncode}\n\n"
                     f"Revisa el log para más detalles."
                 )
         
         except Exception as e:
             self.log(f"❌ ERROR subiendo data folder: {e}", "error")
             self.log_debug(f"Exception: {repr(e)}")
-            messagebox.showerror("Error", f"Error subiendo data folder:\n\n{str(e)}")
+            self._ui(messagebox.showerror, "Error", f"Error subiendo data folder:\n\n{str(e)}")
         
         finally:
             self.is_flashing = False
             self.set_buttons_state('normal')
-            self.progress['value'] = 0
-            self.status_label.config(text="Idle")
+            self.set_progress(0)
+            self.set_status("Idle")
     
     def _detect_spiffs_partition(self, port, chip):
         """Detect SPIFFS partition address and size from device"""
@@ -1976,19 +2629,13 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             script_dir = os.path.dirname(os.path.abspath(__file__))
             temp_file = os.path.join(script_dir, "temp_partitions.bin")
             
-            # Read partition table from device
-            cmd = [
-                python_exe, "-m", "esptool",
-                "--chip", chip,
-                "--port", port,
-                "--baud", "115200",
-                "read-flash",
-                "0x8000", "0x1000",  # Read 4KB partition table
-                temp_file
-            ]
+            # Read partition table from device (4KB) at the fastest working rate
+            def build_args(baud):
+                return ["--chip", chip, "--port", port, "--baud", str(baud),
+                        "read-flash", "0x8000", "0x1000", temp_file]
             
-            self.log_debug(f"Reading partition table: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            self.log_debug(f"Reading partition table from {port}")
+            result = self._run_esptool_adaptive(port, build_args, timeout=30)
             
             if result.returncode != 0 or not os.path.exists(temp_file):
                 self.log_debug(f"Failed to read partition table: {result.stderr}")
@@ -2371,19 +3018,13 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             
             check_size = 4096  # Just read first 4KB
             
-            read_cmd = [
-                python_exe, "-m", "esptool",
-                "--chip", chip,
-                "--port", port,
-                "--baud", "115200",  # Use slower baud for reliability
-                "read-flash",  # Use hyphenated version
-                "0x5F0000", str(check_size), temp_read
-            ]
-            
-            self.log_debug(f"Verificando SPIFFS: {' '.join(read_cmd)}")
+            # Read back at the fastest rate that works (steps down on checksum errors)
+            def build_args(baud):
+                return ["--chip", chip, "--port", port, "--baud", str(baud),
+                        "read-flash", "0x5F0000", str(check_size), temp_read]
             
-            esptool_args = ["--chip", chip, "--port", port, "--baud", "115200", "read-flash", "0x5F0000", str(check_size), temp_read]
-            result = self._run_esptool(esptool_args, capture_output=True, timeout=30)
+            self.log_debug(f"Verificando SPIFFS en 0x5F0000 ({check_size} bytes)")
+            result = self._run_esptool_adaptive(port, build_args, timeout=30)
 
             if result.returncode != 0:
                 self.log_debug(f"Error leyendo SPIFFS: {result.stderr}")
@@ -2466,7 +3107,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 self.log("✅ VERIFICACIÓN EXITOSA", "success")
                 self.log("=" * 60, "success")
                 self.log("La partición SPIFFS contiene datos", "info")
-                messagebox.showinfo(
+                self._ui(messagebox.showinfo,
                     "Verificación Exitosa",
                     "✅ Partición SPIFFS verificada\n\n"
                     "La partición contiene datos (no está vacía).\n\n"
@@ -2477,7 +3118,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 self.log("=" * 60, "warning")
                 self.log("⚠️ PARTICIÓN SPIFFS VACÍA", "warning")
                 self.log("=" * 60, "warning")
-                messagebox.showwarning(
+                self._ui(messagebox.showwarning,
                     "Partición Vacía",
                     "⚠️ La partición SPIFFS está vacía\n\n"
                     "Sube el data folder para escribir archivos."
@@ -2485,7 +3126,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         
         except Exception as e:
             self.log(f"❌ ERROR durante verificación: {e}", "error")
-            messagebox.showerror("Error", f"Error verificando SPIFFS:\n\n{str(e)}")
+            self._ui(messagebox.showerror, "Error", f"Error verificando SPIFFS:\n\n{str(e)}")
         
         finally:
             self.is_flashing = False
@@ -2518,7 +3159,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             except ImportError:
                 self.log("Error: esptool no está instalado", "error")
                 self.log_debug("esptool no encontrado - instala con: pip install esptool")
-                messagebox.showerror("Error", 
+                self._ui(messagebox.showerror, "Error", 
                     "esptool no está instalado.\n\n" +
                     "Instala las dependencias con:\n" +
                     "pip install -r requirements.txt")
@@ -2531,23 +3172,15 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             # Read partition table from device
             temp_file = os.path.join(script_dir, "temp_partitions.bin")
             
-            cmd = [
-                python_exe, "-m", "esptool",
-                "--chip", chip,
-                "--port", port,
-                "--baud", "115200",
-                "read-flash",
-                "0x8000", "0x1000",  # Read 4KB partition table
-                temp_file
-            ]
+            def build_args(baud):
+                return ["--chip", chip, "--port", port, "--baud", str(baud),
+                        "read-flash", "0x8000", "0x1000", temp_file]  # Read 4KB partition table
             
-            self.log(f"Comando: {' '.join(cmd)}", "info")
-            self.log_debug(f"Ejecutando esptool para leer particiones: {' '.join(cmd)}")
+            self.log(f"Leyendo particiones (0x8000, 4KB) desde {port}", "info")
             self.log_serial(f"Conectando a {port}...", "tx")
             
-            # Run esptool (try in-process first, fallback to subprocess)
-            esptool_args = ["--chip", chip, "--port", port, "--baud", "115200", "read-flash", "0x8000", "0x1000", temp_file]
-            result = self._run_esptool(esptool_args, capture_output=True, timeout=30)
+            # Run esptool (in-process first, fallback to subprocess) at the fastest working rate
+            result = self._run_esptool_adaptive(port, build_args, timeout=30)
 
             self.log_debug(f"Código de retorno: {result.returncode}", "verbose")
             if result.stdout:
@@ -2877,30 +3510,79 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             return "0x10000", False
     
     def log(self, message, tag="normal"):
-        """Agregar mensaje al log"""
+        """Agregar mensaje al log (desde cualquier hilo)"""
+        if self._off_ui_thread():
+            self._log_queue.put((message, tag))
+            return
         self.log_text.config(state='normal')
         self.log_text.insert(tk.END, message + "\n", tag)
         self.log_text.see(tk.END)
         self.log_text.config(state='disabled')
-        self.root.update()
+        self._flush_ui()
     
-    def search_firmware(self):
-        """Search for .bin file in firmware folder - called on startup"""
+    def _flush_ui(self):
+        """Process pending Tk events (a 'ui.update' span when tracing); Tk thread only"""
+        if self._draining_logs or self._off_ui_thread():
+            return
+        with TRACER.span("ui.update", "ui"):
+            self.root.update()
+    
+    def _on_first_paint(self):
+        """Report time-to-first-paint and start the deferred start-up scan"""
+        self.root.update_idletasks()
+        first_paint_ms = (time.perf_counter() - self._startup_t0) * 1000
+        self.log_debug(f"Time-to-first-paint: {first_paint_ms:.0f} ms")
+        
+        thread = threading.Thread(target=self._deferred_startup_thread)
+        thread.daemon = True
+        thread.start()
+    
+    def _deferred_startup_thread(self):
+        """Scan firmware folder and serial ports off the UI thread, then fill in the UI"""
+        t = time.perf_counter()
+        try:
+            firmware_scan = self._scan_firmware_dir()
+        except OSError as e:
+            firmware_scan = None
+            error = str(e)
+            self._ui(lambda: self.log(f"Error buscando firmware: {error}", "error"))
+        ports = list_serial_ports(self.network_ports.ports())
+        scan_ms = (time.perf_counter() - t) * 1000
+        
+        def apply():
+            if firmware_scan:
+                self._apply_firmware_scan(*firmware_scan)
+            self._apply_ports(ports)
+            self.log_debug(f"Escaneo inicial (firmware + puertos) en segundo plano: {scan_ms:.0f} ms")
+        
+        self._ui(apply)
+    
+    def _scan_firmware_dir(self):
+        """Filesystem part of search_firmware: returns (firmware_dir, created, bin_files)"""
         firmware_dir = os.path.join(os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) 
                                     else os.path.dirname(os.path.abspath(__file__)), "firmware")
         
         # Create firmware folder if it doesn't exist
         if not os.path.exists(firmware_dir):
             os.makedirs(firmware_dir)
+            return firmware_dir, True, []
+        
+        bin_files = [f for f in os.listdir(firmware_dir) if f.endswith('.bin') and 'firmware' in f.lower()]
+        return firmware_dir, False, bin_files
+    
+    def search_firmware(self):
+        """Search for .bin file in firmware folder"""
+        self._apply_firmware_scan(*self._scan_firmware_dir())
+    
+    def _apply_firmware_scan(self, firmware_dir, created, bin_files):
+        """Update the UI with the result of _scan_firmware_dir"""
+        if created:
             self.firmware_label.config(text="📁 Usa el botón 'Seleccionar' para elegir firmware", 
                                       foreground="gray")
             self.log("Carpeta 'firmware' creada en: " + firmware_dir, "info")
             self.log("Usa el botón 'Seleccionar' para elegir tu archivo .bin", "info")
             return
         
-        # Search for .bin files
-        bin_files = [f for f in os.listdir(firmware_dir) if f.endswith('.bin') and 'firmware' in f.lower()]
-        
         if not bin_files:
             self.firmware_label.config(text="📁 Usa el botón 'Seleccionar' para elegir firmware", 
                                       foreground="gray")
@@ -2931,15 +3613,46 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
     def refresh_ports(self):
         """Actualizar lista de puertos COM disponibles"""
         self.log_debug("Buscando puertos COM disponibles...")
-        ports = serial.tools.list_ports.comports()
-        port_list = [f"{port.device} - {port.description}" for port in ports]
+        self._apply_ports(list_serial_ports(self.network_ports.ports()))
+    
+    def edit_network_port(self):
+        """Add an rfc2217:// / socket:// endpoint, or remove the selected one (empty input)"""
+        selected = self.selected_port.get().split(' - ')[0]
+        current = selected if is_network_port(selected) else ""
+        url = simpledialog.askstring(
+            "Puerto de red",
+            "URL del puerto remoto:\n"
+            "  rfc2217://host:puerto  (esp_rfc2217_server, ser2net en modo telnet)\n"
+            "  socket://host:puerto   (puente TCP crudo, sin cambio de baudios)\n\n"
+            "Deja vacío para quitar el puerto de red seleccionado.",
+            initialvalue=current or "rfc2217://", parent=self.root)
+        if url is None:
+            return
+        url = url.strip()
+        if not url or url == "rfc2217://":
+            if current and self.network_ports.remove(current):
+                self.refresh_ports()
+            return
+        if not self.network_ports.add(url, f"Puerto de red ({url.split('://')[0]})"):
+            messagebox.showerror("Puerto de red", f"URL no válida: {url}\n\n"
+                                                  "Formato: rfc2217://host:puerto o socket://host:puerto")
+            return
+        self.refresh_ports()
+        for value in self.port_combo['values']:
+            if value.split(' - ')[0] == url:
+                self.selected_port.set(value)
+                break
+    
+    def _apply_ports(self, ports):
+        """Fill the port selector from a list of (device, description) tuples"""
+        port_list = [f"{device} - {description}" for device, description in ports]
         
         self.port_combo['values'] = port_list
         
         if port_list:
             self.port_combo.current(0)
             self.log(f"Puertos COM detectados: {len(port_list)}", "info")
-            self.log_debug(f"Puertos encontrados: {', '.join([p.device for p in ports])}")
+            self.log_debug(f"Puertos encontrados: {', '.join([device for device, _ in ports])}")
         else:
             self.log("No se detectaron puertos COM. Conecta tu ESP32 y actualiza.", "error")
             self.log_debug("No se encontraron puertos COM")
@@ -2959,7 +3672,10 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         return "0x8000"
     
     def set_buttons_state(self, state):
-        """Enable or disable all action buttons"""
+        """Enable or disable all action buttons (any thread)"""
+        if self._off_ui_thread():
+            self._ui(self.set_buttons_state, state)
+            return
         self.flash_btn.config(state=state)
         self.erase_btn.config(state=state)
         self.erase_nvs_btn.config(state=state)
@@ -2970,6 +3686,388 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         self.refresh_btn.config(state=state)
         self.connect_btn.config(state=state)
         self.serial_advanced_btn.config(state=state)
+        self.benchmark_btn.config(state=state)
+    
+    def start_baud_benchmark(self):
+        """Run the baud rate / compression sweep on the selected port"""
+        if self.is_flashing:
+            messagebox.showwarning("Ocupado", "Ya hay una operación en progreso")
+            return
+        if not self.selected_port.get():
+            messagebox.showerror("Error", "Selecciona un puerto COM primero")
+            return
+        
+        port = self.selected_port.get().split(' - ')[0]
+        if not messagebox.askyesno("Benchmark de Baud Rate",
+                                   f"Se probarán todas las velocidades en {port} escribiendo y leyendo "
+                                   f"una región de prueba de 64 KB al final del flash.\n\n"
+                                   f"La región se respalda y se restaura al terminar.\n\n¿Continuar?"):
+            return
+        
+        self.is_flashing = True
+        self.set_buttons_state('disabled')
+        thread = threading.Thread(target=self._baud_benchmark_thread, args=(port, self.selected_chip.get()))
+        thread.daemon = True
+        thread.start()
+    
+    def _baud_benchmark_thread(self, port, chip):
+        """Benchmark worker: logs the report and remembers the recommended rate"""
+        try:
+            self.log("=" * 60, "info")
+            self.log(f"BENCHMARK DE BAUD RATE en {port}", "info")
+            self.log("=" * 60, "info")
+            
+            benchmark = BaudBenchmark(logger=self._engine_log)
+            results = benchmark.run(port, chip, progress_callback=self._on_flash_progress)
+            if not results:
+                self.log("Benchmark cancelado: no se pudo conectar", "error")
+                return
+            
+            for line in BaudBenchmark.format_report(results).split('\n'):
+                self.log(line, "normal")
+            
+            best = BaudBenchmark.recommend(results)
+            if best:
+                # 'auto' starts from this rate next time
+                self.baud_manager.record_success(port, best.baud)
+                self.log(f"✓ {best.baud} baud guardado como velocidad preferida para {port}", "success")
+            else:
+                self.log("Ninguna velocidad fue estable - revisa el cable o el hub USB", "error")
+        except Exception as e:
+            self.log(f"Error en benchmark: {e}", "error")
+        finally:
+            self.is_flashing = False
+            self.set_buttons_state('normal')
+            self.set_status("Idle")
+    
+    def show_fleet_inventory(self):
+        """Inventory window: probe every connected ESP port in parallel (read-only)"""
+        window = tk.Toplevel(self.root)
+        window.title("Inventario de placas conectadas")
+        window.geometry("1100x450")
+        
+        columns = [name for name, _ in InventoryEntry.COLUMNS]
+        table_frame = ttk.Frame(window)
+        table_frame.pack(fill='both', expand=True, padx=10, pady=(10, 5))
+        tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        
+        entries = []
+        sort_state = {"column": "port", "reverse": False}
+        
+        def sort_key(entry, column):
+            value = getattr(entry, column)
+            if value is None:
+                return (1, "")
+            return (0, value if isinstance(value, (int, float)) else str(value).lower())
+        
+        def refresh_rows():
+            tree.delete(*tree.get_children())
+            ordered = sorted(entries, key=lambda e: sort_key(e, sort_state["column"]),
+                             reverse=sort_state["reverse"])
+            for entry in ordered:
+                tree.insert('', tk.END, values=entry.values(), tags=('' if entry.ok else 'error',))
+        
+        def sort_by(column):
+            if sort_state["column"] == column:
+                sort_state["reverse"] = not sort_state["reverse"]
+            else:
+                sort_state["column"], sort_state["reverse"] = column, False
+            refresh_rows()
+        
+        for name, header in InventoryEntry.COLUMNS:
+            tree.heading(name, text=header, command=lambda c=name: sort_by(c))
+            tree.column(name, width=70 if name in ("chip", "flash_size", "duration") else 110, anchor=tk.W)
+        tree.tag_configure('error', foreground='#c0392b')
+        
+        button_frame = ttk.Frame(window)
+        button_frame.pack(fill='x', padx=10, pady=(0, 10))
+        status = ttk.Label(button_frame, text="")
+        status.pack(side='left', padx=5)
+        
+        def add_entry(entry):
+            entries.append(entry)
+            if not window.winfo_exists():
+                return
+            refresh_rows()
+            status.config(text=f"{len(entries)} puerto(s) leído(s)...")
+        
+        def scan_thread(ports):
+            t = time.time()
+            inventory = FleetInventory(self.flash_manager, self.chip_info_cache, logger=self._engine_log)
+            results = inventory.scan(ports, self.selected_baud.get(),
+                                     on_entry=lambda e: self._ui(add_entry, e))
+            found = sum(1 for e in results if e.mac)
+            self._ui(lambda: finished(found, len(results), time.time() - t))
+        
+        def finished(found, total, elapsed):
+            self.is_flashing = False
+            self.set_buttons_state('normal')
+            if window.winfo_exists():
+                status.config(text=f"{found}/{total} placa(s) identificadas en {elapsed:.1f}s")
+                scan_btn.config(state='normal')
+        
+        def scan():
+            if self.is_flashing:
+                messagebox.showwarning("Ocupado", "Ya hay una operación en progreso", parent=window)
+                return
+            ports = [p for p in esp_ports() + [url for url, _ in self.network_ports.ports()]
+                     if not self.job_scheduler.has_pending(p)]
+            if not ports:
+                status.config(text="No hay placas ESP conectadas (o todas están flasheando)")
+                return
+            entries.clear()
+            refresh_rows()
+            self.is_flashing = True
+            self.set_buttons_state('disabled')
+            scan_btn.config(state='disabled')
+            status.config(text=f"Escaneando {len(ports)} puerto(s) en paralelo...")
+            threading.Thread(target=scan_thread, args=(ports,), daemon=True, name="inventory").start()
+        
+        def export():
+            if not entries:
+                messagebox.showinfo("Inventario", "No hay datos para exportar", parent=window)
+                return
+            path = filedialog.asksaveasfilename(parent=window, title="Guardar inventario",
+                                                defaultextension=".csv", filetypes=[("CSV", "*.csv")],
+                                                initialfile=f"inventario_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+            if not path:
+                return
+            try:
+                FleetInventory.export_csv(entries, path)
+                self.log(f"Inventario guardado: {path}", "success")
+            except OSError as e:
+                messagebox.showerror("Error", f"No se pudo guardar el inventario:\n\n{e}", parent=window)
+        
+        scan_btn = ttk.Button(button_frame, text="🔄 Escanear", command=scan)
+        scan_btn.pack(side='right', padx=5)
+        ttk.Button(button_frame, text="💾 Exportar CSV", command=export).pack(side='right', padx=5)
+        
+        scan()
+    
+    def _ask_backup_path(self, port):
+        """Save dialog for a backup file (an unfinished backup can be picked to resume it)"""
+        return filedialog.asksaveasfilename(
+            title="Guardar backup del flash",
+            defaultextension=".bin.z",
+            filetypes=[("Backup de flash", "*.bin.z"), ("Todos los archivos", "*.*")],
+            initialfile=f"backup_{os.path.basename(port)}_{time.strftime('%Y%m%d_%H%M%S')}.bin.z",
+            confirmoverwrite=False)
+    
+    def start_nvs_generation(self):
+        """Build one NVS image per row of a provisioning CSV (cached, in parallel processes)"""
+        csv_path = filedialog.askopenfilename(
+            title="CSV de dispositivos (MAC o serie, namespace/clave:codificación...)",
+            filetypes=[("CSV", "*.csv"), ("Todos los archivos", "*.*")])
+        if not csv_path:
+            return
+        output_dir = filedialog.askdirectory(
+            title="Carpeta para las imágenes NVS",
+            initialdir=os.path.dirname(csv_path))
+        if not output_dir:
+            return
+        
+        # Images must match the NVS partition of the project being flashed
+        offset, size = self._nvs_partition()
+        self.log(f"Generando imágenes NVS de 0x{size:X} (partición @ 0x{offset:X})...", "info")
+        
+        def generation_thread():
+            try:
+                manifest = self._provisioning_manifest(output_dir)
+                built, cached, failed = NvsBatch(output_dir, size, logger=self._engine_log).generate(
+                    csv_path, manifest)
+                self.provisioning = manifest
+                self.write_device_images.set(True)
+                summary = f"{built} generada(s), {cached} reutilizada(s) de caché"
+                if failed:
+                    messagebox.showwarning("Imágenes NVS", f"{summary}\n{failed} fila(s) con error (ver log)")
+                else:
+                    messagebox.showinfo("Imágenes NVS", f"{summary}\n\nSe escribirán al flashear cada placa.")
+            except (OSError, ValueError) as e:
+                self.log(f"Error generando imágenes NVS: {e}", "error")
+                messagebox.showerror("Error", f"No se pudieron generar las imágenes NVS:\n\n{e}")
+            finally:
+                self.nvs_generate_btn.config(state='normal')
+        
+        self.nvs_generate_btn.config(state='disabled')
+        threading.Thread(target=generation_thread, daemon=True, name="nvs-generate").start()
+    
+    def _provisioning_manifest(self, output_dir):
+        """Manifest of an output folder (the loaded one when NVS and SPIFFS share the folder)"""
+        if self.provisioning is not None and os.path.samefile(self.provisioning.base_dir, output_dir):
+            return self.provisioning
+        return ProvisioningManifest(output_dir, logger=self._engine_log)
+    
+    def start_spiffs_generation(self):
+        """Build one SPIFFS image per board from a certificate manifest over a shared data folder"""
+        spiffs = self._data_partition(PartitionTable.SUBTYPE_SPIFFS)
+        if spiffs is None:
+            messagebox.showerror("Error", "La tabla de particiones del proyecto no tiene partición SPIFFS.\n\n"
+                                          "Carga primero el proyecto (partitions.csv / partitions.bin).")
+            return
+        manifest_path = filedialog.askopenfilename(
+            title="Manifiesto de certificados (MAC o serie, /archivo.pem...)",
+            filetypes=[("CSV", "*.csv"), ("Todos los archivos", "*.*")])
+        if not manifest_path:
+            return
+        base_folder = filedialog.askdirectory(
+            title="Carpeta data/ con los archivos comunes (Cancelar = solo certificados)",
+            initialdir=os.path.dirname(manifest_path)) or None
+        output_dir = filedialog.askdirectory(
+            title="Carpeta para las imágenes SPIFFS",
+            initialdir=os.path.dirname(manifest_path))
+        if not output_dir:
+            return
+        
+        self.log(f"Generando imágenes SPIFFS de 0x{spiffs.size:X} (partición @ 0x{spiffs.offset:X})...", "info")
+        
+        def generation_thread():
+            try:
+                manifest = self._provisioning_manifest(output_dir)
+                built, cached, failed = SpiffsBatch(output_dir, spiffs.size, base_folder,
+                                                    logger=self._engine_log).generate(manifest_path, manifest)
+                self.provisioning = manifest
+                self.write_device_images.set(True)
+                summary = f"{built} generada(s), {cached} reutilizada(s) de caché"
+                if failed:
+                    messagebox.showwarning("Imágenes SPIFFS", f"{summary}\n{failed} fila(s) con error (ver log)")
+                else:
+                    messagebox.showinfo("Imágenes SPIFFS", f"{summary}\n\nSe escribirán al flashear cada placa.")
+            except (OSError, ValueError) as e:
+                self.log(f"Error generando imágenes SPIFFS: {e}", "error")
+                messagebox.showerror("Error", f"No se pudieron generar las imágenes SPIFFS:\n\n{e}")
+            finally:
+                self.spiffs_generate_btn.config(state='normal')
+        
+        self.spiffs_generate_btn.config(state='disabled')
+        threading.Thread(target=generation_thread, daemon=True, name="spiffs-generate").start()
+    
+    def _device_spiffs_image(self, port, chip, spiffs_size):
+        """Per-device SPIFFS image of the board on a port (its MAC is read first), or None"""
+        if not self.write_device_images.get() or self.provisioning is None \
+                or not self.provisioning.has_kind("spiffs") or not self.flash_manager.esptool_available():
+            return None
+        esp = self.flash_manager.open_session(port, chip, self.selected_baud.get())
+        if esp is None:
+            return None
+        try:
+            mac = self.flash_manager.read_mac(esp)
+        finally:
+            self.flash_manager.close_session(esp, reset_mode='no-reset')
+        device_id, image_path = self.provisioning.image_for(mac, "spiffs")
+        if image_path is None or not os.path.exists(image_path):
+            self.log(f"Sin imagen SPIFFS propia para {mac} - se usa la imagen común", "warning")
+            return None
+        if os.path.getsize(image_path) != spiffs_size:
+            self.log(f"La imagen SPIFFS de {device_id} no coincide con la partición "
+                     f"(0x{os.path.getsize(image_path):X} ≠ 0x{spiffs_size:X})", "error")
+            return None
+        self.log(f"📇 Imagen SPIFFS de {device_id} ({mac})", "info")
+        return image_path
+    
+    def start_backup(self):
+        """Dump the whole flash of the selected port to a compressed backup file"""
+        if self.is_flashing:
+            messagebox.showwarning("Ocupado", "Ya hay una operación en progreso")
+            return
+        if not self.selected_port.get():
+            messagebox.showerror("Error", "Selecciona un puerto COM primero")
+            return
+        if not self.flash_manager.esptool_available():
+            messagebox.showerror("Error", "esptool no está instalado.\n\nEjecuta: pip install esptool")
+            return
+        
+        port = self.selected_port.get().split(' - ')[0]
+        path = self._ask_backup_path(port)
+        if not path:
+            return
+        
+        def backup_thread():
+            try:
+                if self._backup_flash(port, path):
+                    messagebox.showinfo("Backup", f"Backup completo guardado en:\n\n{path}")
+                else:
+                    messagebox.showerror("Error", "El backup no se completó.\n\n"
+                                                  "Vuelve a ejecutarlo con el mismo archivo para reanudarlo.")
+            finally:
+                self.is_flashing = False
+                self.set_buttons_state('normal')
+                self.set_status("Idle")
+        
+        self.is_flashing = True
+        self.set_buttons_state('disabled')
+        self.set_progress(0)
+        threading.Thread(target=backup_thread, daemon=True, name=f"backup-{port}").start()
+    
+    def start_restore(self):
+        """Restore a backup onto the selected board, writing only the sectors that differ"""
+        if self.is_flashing:
+            messagebox.showwarning("Ocupado", "Ya hay una operación en progreso")
+            return
+        if not self.selected_port.get():
+            messagebox.showerror("Error", "Selecciona un puerto COM primero")
+            return
+        if not self.flash_manager.esptool_available():
+            messagebox.showerror("Error", "esptool no está instalado.\n\nEjecuta: pip install esptool")
+            return
+        
+        path = filedialog.askopenfilename(title="Seleccionar backup del flash",
+                                          filetypes=[("Backup de flash", "*.bin.z"), ("Todos los archivos", "*.*")])
+        if not path:
+            return
+        index = FlashBackup.load_index(path)
+        if index is None or not index.get("complete"):
+            messagebox.showerror("Error", "El backup no tiene índice o está incompleto.\n\n"
+                                          "Termina el backup antes de restaurarlo.")
+            return
+        
+        port = self.selected_port.get().split(' - ')[0]
+        created = time.strftime('%Y-%m-%d %H:%M', time.localtime(index.get("created", 0)))
+        if not messagebox.askyesno("Restaurar Backup",
+                                   f"Se restaurará el backup en {port}:\n\n"
+                                   f"• Placa original: {index.get('mac') or 'desconocida'} ({index.get('chip')})\n"
+                                   f"• Flash: {index['flash_size'] // 1024} KB\n"
+                                   f"• Fecha: {created}\n\n"
+                                   f"Solo se borran y escriben los sectores que difieren.\n\n¿Continuar?"):
+            return
+        
+        def restore_thread():
+            try:
+                self.log("=" * 60, "info")
+                self.log(f"RESTAURAR BACKUP en {port} ← {os.path.basename(path)}", "info")
+                self.log("=" * 60, "info")
+                self.set_status("♻️ Comparando sectores...")
+                backup = FlashBackup(self.flash_manager, logger=self._engine_log)
+                if backup.run_restore(port, self.selected_chip.get(), self.selected_baud.get(), path,
+                                      progress_callback=self._on_flash_progress):
+                    messagebox.showinfo("Restaurar", "Backup restaurado correctamente.")
+                else:
+                    messagebox.showerror("Error", "No se pudo restaurar el backup.\n\nRevisa el log para más detalles.")
+            finally:
+                self.is_flashing = False
+                self.set_buttons_state('normal')
+                self.set_status("Idle")
+        
+        self.is_flashing = True
+        self.set_buttons_state('disabled')
+        self.set_progress(0)
+        threading.Thread(target=restore_thread, daemon=True, name=f"restore-{port}").start()
+    
+    def _backup_flash(self, port, path):
+        """Full-flash backup at the negotiated baud rate (worker thread)"""
+        self.log("=" * 60, "info")
+        self.log(f"BACKUP DEL FLASH de {port} → {os.path.basename(path)}", "info")
+        self.log("=" * 60, "info")
+        self.set_status("💾 Leyendo flash...")
+        backup = FlashBackup(self.flash_manager, logger=self._engine_log)
+        ok = backup.run(port, self.selected_chip.get(), self.selected_baud.get(), path,
+                        progress_callback=self._on_flash_progress)
+        if ok:
+            self.log(f"✓ Backup guardado: {path}", "success")
+        return ok
     
     def start_flash(self):
         """Start flashing process in a separate thread"""
@@ -2978,23 +4076,15 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             return
         
         # Validations
-        if not self.firmware_path or not os.path.exists(self.firmware_path):
-            messagebox.showerror("Error", "Selecciona un archivo de firmware válido.")
+        error = self._validate_flash_plan()
+        if error:
+            messagebox.showerror("Error", error)
             return
         
         if not self.selected_port.get():
             messagebox.showerror("Error", "Selecciona un puerto COM.")
             return
         
-        # Check Complete mode requirements
-        if self.flash_mode.get() == "complete":
-            if not self.bootloader_path or not os.path.exists(self.bootloader_path):
-                messagebox.showerror("Error", "Complete Mode requiere bootloader.bin\n\nSelecciona el archivo o cambia a Simple Mode.")
-                return
-            if not self.partitions_path or not os.path.exists(self.partitions_path):
-                messagebox.showerror("Error", "Complete Mode requiere partitions.bin\n\nSelecciona el archivo o cambia a Simple Mode.")
-                return
-        
         # Extract port name
         port = self.selected_port.get().split(' - ')[0]
         
@@ -3019,14 +4109,163 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         # Start flashing thread
         self.is_flashing = True
         self.set_buttons_state('disabled')
-        self.progress['value'] = 0
+        self.set_progress(0)
         
         thread = threading.Thread(target=self.flash_firmware, args=(port,))
         thread.daemon = True
         thread.start()
     
-    def flash_firmware(self, port):
-        """Flash firmware using ESP-IDF inspired approach with flasher_args structure"""
+    def _validate_flash_plan(self):
+        """Check the selected files for the current mode. Returns an error message or None."""
+        if not self.firmware_path or not os.path.exists(self.firmware_path):
+            return "Selecciona un archivo de firmware válido."
+        
+        # Check Complete mode requirements
+        if self.flash_mode.get() == "complete":
+            if not self.bootloader_path or not os.path.exists(self.bootloader_path):
+                return "Complete Mode requiere bootloader.bin\n\nSelecciona el archivo o cambia a Simple Mode."
+            if not self.partitions_path or not os.path.exists(self.partitions_path):
+                return "Complete Mode requiere partitions.bin\n\nSelecciona el archivo o cambia a Simple Mode."
+        return None
+    
+    def _notify(self, interactive, kind, title, message):
+        """messagebox.<kind> when interactive, otherwise a log line (unattended flashing)"""
+        if interactive:
+            self._ui(getattr(messagebox, kind), title, message)
+        else:
+            summary = message.strip().split('\n')[0]
+            self.log(f"{title}: {summary}", "error" if kind == "showerror" else "success")
+    
+    # ------------------------------------------------------------------ #
+    #  Hot-plug auto-flash                                                 #
+    # ------------------------------------------------------------------ #
+    
+    def toggle_hotplug(self):
+        """Start/stop the USB hot-plug watcher from the advanced options checkbox"""
+        if self.hotplug_enabled.get():
+            error = self._validate_flash_plan()
+            if error:
+                self.hotplug_enabled.set(False)
+                messagebox.showerror("Auto-flash", error)
+                return
+            # Plan is built once and shared by every queued board
+            self._hotplug_plan = self._build_job_plan()
+            if self._hotplug_plan is None:
+                self.hotplug_enabled.set(False)
+                messagebox.showerror("Auto-flash", "No se pudo crear el plan de flasheo")
+                return
+            self.hotplug_watcher.start()
+            self.log("⚡ Auto-flash activo: las placas ESP conectadas se flashean sin confirmación", "warning")
+        else:
+            self.hotplug_watcher.stop()
+            self.job_scheduler.cancel_queued()
+            self.log("Auto-flash desactivado", "info")
+    
+    def _on_hotplug_added(self, port, info):
+        """Watcher thread callback - hand over to the Tk thread"""
+        self._ui(lambda: self._enqueue_hotplug(port))
+    
+    def _on_hotplug_removed(self, port):
+        # The next board on this port may be a different board or adapter
+        self.chip_info_cache.forget_port(port)
+        self.baud_manager.forget_port(port)
+        self._ui(lambda: self._dequeue_hotplug(port))
+    
+    def _enqueue_hotplug(self, port):
+        """Submit a newly connected board to the job scheduler"""
+        if not self.hotplug_enabled.get() or self._hotplug_plan is None:
+            return
+        if self.job_scheduler.has_pending(port):
+            return
+        # Boards re-enumerate when reset at the end of a flash - don't flash them twice
+        if time.time() < self._hotplug_cooldown.get(port, 0):
+            self.log_debug(f"Hot-plug: {port} ignorado (reconexión tras flasheo)")
+            return
+        
+        if self.serial_connected and self.selected_port.get().split(' - ')[0] == port:
+            self.disconnect_serial()
+        # Exclusive: an API client may have queued this port since the check above
+        if self.job_scheduler.submit(port, self._hotplug_plan, exclusive=True) is not None:
+            self.update_session_display()
+    
+    def _dequeue_hotplug(self, port):
+        if self.job_scheduler.cancel_port(port):
+            self.log(f"🔌 {port} desconectado - trabajos del puerto cancelados", "warning")
+            self.update_session_display()
+    
+    def _build_job_plan(self):
+        """FlashPlan for the job scheduler from the current selection and mode"""
+        mode = self.flash_mode.get()
+        if mode == "simple":
+            # None = boot app partition read from the device at flash time
+            address = None
+            if self.partitions_path and os.path.exists(self.partitions_path):
+                addr_str, _ = self.parse_partition_table_file(self.partitions_path)
+                address = int(addr_str, 16) if addr_str else None
+            files = [(address, self.firmware_path, "Firmware (app)")]
+        else:
+            flasher_args = self.build_flasher_args(mode)
+            if not flasher_args:
+                return None
+            files = [(int(addr, 16), path, desc) for addr, path, desc in flasher_args['flash_files']]
+        
+        return FlashPlan(self.selected_chip.get(), self.selected_baud.get(), files,
+                         erase_mode=mode,
+                         preserve_nvs=mode == "simple" or self.preserve_nvs.get(),
+                         partitions_path=self.partitions_path,
+                         skip_if_current=self._skip_if_current_applies(mode))
+    
+    def _skip_if_current_applies(self, mode):
+        """Skip-if-current is on, and the mode is not a full wipe (complete mode without NVS preservation)"""
+        return self.skip_if_current.get() and (mode == "simple" or self.preserve_nvs.get())
+    
+    def _firmware_is_current(self, esp, table=None):
+        """True if the device's active app has the selected firmware's project, version and ELF SHA"""
+        project = self._active_project()
+        expected = project.app_descriptor() if project else AppDescriptor.from_file(self.firmware_path)
+        if expected is None:
+            self.log_debug("El firmware seleccionado no tiene esp_app_desc_t - no se puede comparar")
+            return False
+        current, partition = self.flash_manager.read_app_descriptor(esp, table)
+        if current is None:
+            self.log_debug("El dispositivo no tiene una app válida - se flashea")
+            return False
+        self.log_debug(f"App en dispositivo ({partition.name} @ 0x{partition.offset:X}): {current}")
+        self.log_debug(f"Firmware seleccionado: {expected}")
+        if not expected.has_elf_sha:
+            self.log_debug("El firmware no incluye SHA del ELF - no se puede confirmar que sea el mismo build")
+        return current.matches(expected)
+    
+    def _on_job_update(self, job):
+        """Scheduler worker callback - hand over to the Tk thread"""
+        self._ui(lambda: self._apply_job_update(job))
+    
+    def _apply_job_update(self, job):
+        if job.state in (FlashJob.DONE, FlashJob.REJECTED, FlashJob.FAILED):
+            self._hotplug_cooldown[job.port] = time.time() + self.HOTPLUG_COOLDOWN_S
+        if job.state in (FlashJob.DONE, FlashJob.REJECTED):
+            self.total_flashes += 1
+        if job.state == FlashJob.DONE:
+            self.successful_flashes += 1
+            if job.mac:
+                self._add_session_mac(job.mac)
+        if job.state in (FlashJob.DONE, FlashJob.REJECTED) and not self.http_api.owns(job.id):
+            if job.state == FlashJob.REJECTED:
+                result = DeviceHistory.RESULT_REJECTED
+            else:
+                result = DeviceHistory.RESULT_SKIPPED if job.skipped else DeviceHistory.RESULT_OK
+            self._record_history(job.port, job.mac, result, job.plan.chip, job.plan.files,
+                                 flash_id=job.flash_id, timings=job.timings)
+        self.update_session_display()
+    
+    def flash_firmware(self, port, interactive=True):
+        """Flash firmware using ESP-IDF inspired approach with flasher_args structure
+        
+        interactive=False (hot-plug auto-flash) reports results in the log
+        instead of blocking the line with message boxes.
+        """
+        flash_ok = skipped = False
+        mac = flash_id = flasher_args = device_files = None
         try:
             # Check if esptool is available
             try:
@@ -3034,7 +4273,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             except ImportError:
                 self.log("Error: esptool no está instalado", "error")
                 self.log_debug("esptool no encontrado - instala con: pip install esptool")
-                messagebox.showerror("Error", 
+                self._notify(interactive, "showerror", "Error", 
                     "esptool no está instalado.\n\n" +
                     "Instala las dependencias con:\n" +
                     "pip install -r requirements.txt")
@@ -3048,6 +4287,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             # Track this flash attempt
             self.total_flashes += 1
             self.update_session_display()
+            self.stage_metrics.begin_run(port)
             
             # Get Python exe
             script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -3066,7 +4306,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             
             if not flasher_args:
                 self.log("Error: No se pudo crear plan de flasheo", "error")
-                messagebox.showerror("Error", "No se pudo crear el plan de flasheo")
+                self._notify(interactive, "showerror", "Error", "No se pudo crear el plan de flasheo")
                 return
             
             # Base command for esptool
@@ -3074,102 +4314,192 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 python_exe, "-m", "esptool",
                 "--chip", chip,
                 "--port", port,
-                "--baud", baud_rate,
+                "--baud", self.get_operation_baud(port),
                 "--before", "default-reset",
                 "--after", "hard-reset"
             ]
             
-            # STEP 1: Erase flash if needed
-            if mode == "simple":
-                # Detect the real firmware address from the device's partition table
-                # (handles OTA layouts where app is NOT at the default 0x10000)
-                detected_addr, _ = self.detect_firmware_address_for_simple_mode(
-                    python_exe, chip, port, baud_rate
-                )
-                # Update flasher_args so both erase and flash use the correct address
-                flasher_args['flash_files'] = [
-                    (detected_addr if "Firmware" in desc else addr, fp, desc)
-                    for addr, fp, desc in flasher_args['flash_files']
-                ]
-
-                # SIMPLE MODE: ALWAYS smart erase (only app region)
-                # NEVER touches: bootloader, partitions, NVS
-                self.log("PASO 1: Borrado inteligente - Solo firmware (preserva bootloader/partitions/NVS)...", "info")
-                self.log_debug("Simple mode: Borrando SOLO región de firmware")
-                success = self.smart_erase(base_cmd, flasher_args)
-                if not success:
-                    self.log("Error en borrado de firmware", "error")
-                    return
-                self.log("Firmware borrado (bootloader/partitions/NVS intactos)", "success")
-                self.log("", "normal")
-            else:
-                # COMPLETE MODE: User controls NVS preservation
-                if self.preserve_nvs.get():
-                    # Smart erase - keep NVS, erase everything else (will be reflashed)
-                    self.log("PASO 1: Borrado selectivo (preservando NVS)...", "info")
-                    self.log_debug("Complete mode: Borrando todo excepto NVS")
-                    success = self.smart_erase(base_cmd, flasher_args)
-                    if not success:
-                        self.log("Error en borrado selectivo", "error")
+            # One in-process session for the erase plan and every component:
+            # payloads are streamed pre-compressed from the shared cache instead
+            # of recompressed per board, and no subprocess reconnects in between
+            esp = None
+            if self.flash_manager.esptool_available():
+                esp = self.flash_manager.open_session(port, chip, baud_rate)
+                if esp is None:
+                    self.log("No se pudo abrir sesión esptool, usando un subproceso por paso", "warning")
+            
+            try:
+                if mode == "simple":
+                    # Detect the real firmware address from the device's partition table
+                    # (handles OTA layouts where app is NOT at the default 0x10000)
+                    # Timed as the partition_read stage where the table is actually read
+                    # (FlashManager.read_partition_table or the subprocess below)
+                    detected_addr, _ = self.detect_firmware_address_for_simple_mode(
+                        python_exe, chip, port, self.get_operation_baud(port), esp=esp
+                    )
+                    # Update flasher_args so both erase and flash use the correct address
+                    flasher_args['flash_files'] = [
+                        (detected_addr if "Firmware" in desc else addr, fp, desc)
+                        for addr, fp, desc in flasher_args['flash_files']
+                    ]
+                
+                # Flash size and eFuse security from the chip info (cached per MAC)
+                if esp is not None:
+                    mac = self.flash_manager.read_mac(esp)
+                    if not self._preflight_check(port, esp, mac, flasher_args['flash_files']):
+                        self.log("Pre-flight fallido: la placa no puede recibir este firmware", "error")
+                        self._notify(interactive, "showerror", "Pre-flight fallido",
+                                     "La placa no puede recibir este firmware.\n\nRevisa el log para detalles.")
                         return
-                else:
-                    # Full erase - everything gets wiped and reflashed
-                    self.log("PASO 1: Borrado completo del chip...", "info")
-                    self.log_debug("Complete mode: Borrado total - todo será reflasheado")
-                    if not self.execute_erase(base_cmd):
+                    
+                    # Provisioning: this board's own NVS / SPIFFS images are written with the firmware
+                    device_files = self._device_image_files(esp, mac)
+                    if device_files is None:
+                        self._notify(interactive, "showerror", "Error de aprovisionamiento",
+                                     "Una imagen del dispositivo no es válida.\n\nRevisa el log para detalles.")
                         return
-                self.log("Borrado completado", "success")
-                self.log("", "normal")
-            
-            # STEP 2: Flash all components
-            self.log(f"PASO 2: Flasheando componentes ({len(flasher_args['flash_files'])} archivos)...", "info")
-            
-            total_steps = len(flasher_args['flash_files'])
-            for idx, (address, filepath, description) in enumerate(flasher_args['flash_files'], 1):
-                self.log(f"[{idx}/{total_steps}] {description} → {address}...", "info")
+                    flasher_args['flash_files'] = flasher_args['flash_files'] + device_files
                 
-                if not self.flash_component(base_cmd, address, filepath, description):
-                    self.log(f"Error flasheando {description}", "error")
-                    messagebox.showerror("Error", f"Error flasheando {description}\n\nRevisa el log para detalles.")
-                    return
+                # Boards back from rework often already run this exact build
+                # (never skipped while provisioning: its own images still have to be written)
+                if (esp is not None and not device_files and self._skip_if_current_applies(mode)
+                        and self._firmware_is_current(esp)):
+                    skipped = True
+                    self.log("⏭️ La placa ya tiene este firmware (proyecto, versión y SHA del ELF coinciden) - "
+                             "no se borra ni se escribe nada", "success")
                 
-                self.log(f"✓ {description} flasheado exitosamente", "success")
-                self.log("", "normal")
+                if not skipped:
+                    # STEP 1: Erase flash if needed
+                    if esp is not None:
+                        if mode == "simple":
+                            self.log("PASO 1: Plan de borrado - Solo firmware (preserva bootloader/partitions/NVS)...", "info")
+                        elif self.preserve_nvs.get():
+                            self.log("PASO 1: Plan de borrado selectivo (preservando NVS)...", "info")
+                        else:
+                            self.log("PASO 1: Plan de borrado completo (excepto regiones que se escriben)...", "info")
+                        if not self.planned_erase(esp, flasher_args, mode):
+                            self.log("Error en borrado", "error")
+                            return
+                        self.log("Borrado completado", "success")
+                        self.log("", "normal")
+                    elif mode == "simple":
+                        # SIMPLE MODE: ALWAYS smart erase (only app region)
+                        # NEVER touches: bootloader, partitions, NVS
+                        self.log("PASO 1: Borrado inteligente - Solo firmware (preserva bootloader/partitions/NVS)...", "info")
+                        self.log_debug("Simple mode: Borrando SOLO región de firmware")
+                        with self.stage_metrics.stage("erase"):
+                            success = self.smart_erase(base_cmd, flasher_args)
+                        if not success:
+                            self.log("Error en borrado de firmware", "error")
+                            return
+                        self.log("Firmware borrado (bootloader/partitions/NVS intactos)", "success")
+                        self.log("", "normal")
+                    else:
+                        # COMPLETE MODE: User controls NVS preservation
+                        if self.preserve_nvs.get():
+                            # Smart erase - keep NVS, erase everything else (will be reflashed)
+                            self.log("PASO 1: Borrado selectivo (preservando NVS)...", "info")
+                            self.log_debug("Complete mode: Borrando todo excepto NVS")
+                            with self.stage_metrics.stage("erase"):
+                                success = self.smart_erase(base_cmd, flasher_args)
+                            if not success:
+                                self.log("Error en borrado selectivo", "error")
+                                return
+                        else:
+                            # Full erase - everything gets wiped and reflashed
+                            self.log("PASO 1: Borrado completo del chip...", "info")
+                            self.log_debug("Complete mode: Borrado total - todo será reflasheado")
+                            with self.stage_metrics.stage("erase"):
+                                erased = self.execute_erase(base_cmd)
+                            if not erased:
+                                return
+                        self.log("Borrado completado", "success")
+                        self.log("", "normal")
+                    
+                    # STEP 2: Flash all components
+                    self.log(f"PASO 2: Flasheando componentes ({len(flasher_args['flash_files'])} archivos)...", "info")
+                    
+                    total_steps = len(flasher_args['flash_files'])
+                    for idx, (address, filepath, description) in enumerate(flasher_args['flash_files'], 1):
+                        self.log(f"[{idx}/{total_steps}] {description} → {address}...", "info")
+                        
+                        if esp is not None:
+                            # The session records write/verify stages itself
+                            flashed = self.flash_component(base_cmd, address, filepath, description, esp=esp)
+                            retries = 0
+                            while not flashed and esp is not None and retries < self.WRITE_RETRIES:
+                                # Dropped link: reconnect and resume from the last verified sector
+                                # (the erase plan and earlier components are not repeated)
+                                retries += 1
+                                self.log(f"Reintentando {description} ({retries}/{self.WRITE_RETRIES}) - "
+                                         f"se reanuda desde el último sector verificado...", "warning")
+                                self.flash_manager.close_session(esp, reset_mode='no-reset')
+                                esp = self.flash_manager.open_session(port, chip, baud_rate)
+                                if esp is not None:
+                                    flashed = self.flash_component(base_cmd, address, filepath, description, esp=esp)
+                        else:
+                            with self.stage_metrics.stage(f"write:{description}"):
+                                flashed = self.flash_component(base_cmd, address, filepath, description)
+                        if not flashed:
+                            self.log(f"Error flasheando {description}", "error")
+                            self._notify(interactive, "showerror", "Error", f"Error flasheando {description}\n\nRevisa el log para detalles.")
+                            return
+                        
+                        self.log(f"✓ {description} flasheado exitosamente", "success")
+                        self.log("", "normal")
+                
+                if esp is not None:
+                    mac = mac or self.flash_manager.read_mac(esp)
+                    flash_id = self.flash_manager.read_flash_id(esp)
+            finally:
+                self.flash_manager.close_session(esp)
             
             # Success!
             self.log("=" * 60, "success")
-            self.log(" ¡FLASHEO COMPLETADO EXITOSAMENTE!", "success")
+            if skipped:
+                self.log(" FIRMWARE YA ACTUALIZADO - FLASHEO OMITIDO", "success")
+            else:
+                self.log(" ¡FLASHEO COMPLETADO EXITOSAMENTE!", "success")
             self.log("=" * 60, "success")
             
             # Update session stats
             self.successful_flashes += 1
+            flash_ok = True
             
-            # Try to get MAC address
+            # Try to get MAC address (read over the session above when possible)
             try:
-                mac_cmd = [
-                    python_exe, "-m", "esptool",
-                    "--chip", chip,
-                    "--port", port,
-                    "--baud", baud_rate,
-                    "read-mac"
-                ]
-                self.log_debug("Obteniendo MAC address del dispositivo...")
-                mac_result = subprocess.run(mac_cmd, capture_output=True, text=True, timeout=10)
-                if mac_result.returncode == 0 and "MAC:" in mac_result.stdout:
-                    # Extract MAC from output
-                    for line in mac_result.stdout.split('\n'):
-                        if "MAC:" in line:
-                            mac = line.split("MAC:")[1].strip().split()[0]
-                            self.flashed_devices.add(mac)
-                            self.log_debug(f"MAC detectada: {mac}")
-                            self.log_serial(f"MAC: {mac}", "rx")
-                            break
+                if not mac:
+                    mac_cmd = [
+                        python_exe, "-m", "esptool",
+                        "--chip", chip,
+                        "--port", port,
+                        "--baud", self.get_operation_baud(port),
+                        "read-mac"
+                    ]
+                    self.log_debug("Obteniendo MAC address del dispositivo...")
+                    with self.stage_metrics.stage("mac_read"), TRACER.span("esptool read-mac (subprocess)", "subprocess"):
+                        mac_result = subprocess.run(mac_cmd, capture_output=True, text=True, timeout=10)
+                    if mac_result.returncode == 0 and "MAC:" in mac_result.stdout:
+                        # Extract MAC from output
+                        for line in mac_result.stdout.split('\n'):
+                            if "MAC:" in line:
+                                mac = line.split("MAC:")[1].strip().split()[0]
+                                break
+                if mac:
+                    self._add_session_mac(mac)
+                    self.stage_metrics.set_device(mac)
+                    self.log_debug(f"MAC detectada: {mac}")
+                    self.log_serial(f"MAC: {mac}", "rx")
             except Exception as e:
                 self.log_debug(f"No se pudo obtener MAC: {e}", "verbose")
             
             self.update_session_display()
             
-            messagebox.showinfo("Éxito", f"¡Firmware flasheado exitosamente!\n\nModo: {mode.title()}")
+            if skipped:
+                self._notify(interactive, "showinfo", "Sin cambios",
+                             "La placa ya tiene este firmware instalado.\n\nNo fue necesario flashear.")
+            else:
+                self._notify(interactive, "showinfo", "Éxito", f"¡Firmware flasheado exitosamente!\n\nModo: {mode.title()}")
             
         except subprocess.TimeoutExpired as e:
             self.log("="*60, "error")
@@ -3177,7 +4507,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log(f"Detalles: {str(e)}", "error")
             self.log_debug(f"Timeout exception: {str(e)}")
             self.log("="*60, "error")
-            messagebox.showerror("Error de Timeout", 
+            self._notify(interactive, "showerror", "Error de Timeout", 
                 f"La operación de flasheo tardó demasiado.\n\n"
                 f"Posibles causas:\n"
                 f"• Cable USB defectuoso\n"
@@ -3190,7 +4520,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log(f"Detalles: {str(e)}", "error")
             self.log_debug(f"FileNotFoundError: {str(e)}")
             self.log("="*60, "error")
-            messagebox.showerror("Error de Archivo", 
+            self._notify(interactive, "showerror", "Error de Archivo", 
                 f"No se encontró un archivo necesario:\n\n{str(e)}\n\n"
                 f"Verifica que todos los archivos estén seleccionados correctamente.")
         except PermissionError as e:
@@ -3199,7 +4529,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log(f"Detalles: {str(e)}", "error")
             self.log_debug(f"PermissionError: {str(e)}")
             self.log("="*60, "error")
-            messagebox.showerror("Error de Permisos", 
+            self._notify(interactive, "showerror", "Error de Permisos", 
                 f"Permiso denegado:\n\n{str(e)}\n\n"
                 f"• Cierra otros programas que usen el puerto COM\n"
                 f"• Ejecuta como administrador\n"
@@ -3221,7 +4551,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                     self.log_debug(line, "verbose")
             self.log("="*60, "error")
             
-            messagebox.showerror("Error Crítico", 
+            self._notify(interactive, "showerror", "Error Crítico", 
                 f"Error inesperado durante el flasheo:\n\n"
                 f"{type(e).__name__}: {str(e)}\n\n"
                 f"Revisa el LOG PRINCIPAL (panel izquierdo) para detalles completos.\n\n"
@@ -3231,9 +4561,19 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 f"3. Revisa el panel de Debug")
         
         finally:
+            run = self.stage_metrics.end_run(flash_ok)
+            if run is not None:
+                if not flash_ok:
+                    result = DeviceHistory.RESULT_FAILED
+                else:
+                    result = DeviceHistory.RESULT_SKIPPED if skipped else DeviceHistory.RESULT_OK
+                self._record_history(port, mac, result,
+                                     self.selected_chip.get(), flasher_args['flash_files'] if flasher_args else [],
+                                     flash_id=flash_id, timings=run.stages)
+            self.update_session_display()
             self.is_flashing = False
             self.set_buttons_state('normal')
-            self.progress.stop()
+            self._ui(self.progress.stop)
     
     def build_flasher_args(self, mode):
         """Build flasher arguments structure (ESP-IDF style)"""
@@ -3263,8 +4603,13 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 # Complete mode: Flash bootloader + partitions + firmware
                 self.log("Construyendo plan de flasheo (Modo Completo)...", "info")
                 
-                # Parse partition table to get app address
-                app_address, has_ota = self.parse_partition_table_file(self.partitions_path)
+                # App address from the project index, else parse the partition table
+                project = self._active_project()
+                if project is not None and project.app_address is not None:
+                    app_address, has_ota = f"0x{project.app_address:X}", project.has_ota
+                    self.log_debug(f"Tabla de particiones desde el índice de '{project.name}'")
+                else:
+                    app_address, has_ota = self.parse_partition_table_file(self.partitions_path)
                 
                 # Check if bootloader should be preserved
                 skip_bootloader = self.preserve_bootloader.get()
@@ -3319,19 +4664,25 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         # to get the real address from the partition table on the device.
         return "0x10000"
 
-    def detect_firmware_address_for_simple_mode(self, python_exe, chip, port, baud_rate):
+    def detect_firmware_address_for_simple_mode(self, python_exe, chip, port, baud_rate, esp=None):
         """Detect the actual firmware flash address for Simple Mode.
 
         Strategy (in order):
         1. Parse self.partitions_path if it points to a valid file (fast, no device needed).
-        2. Read the partition table binary directly from the connected device at 0x8000.
+        2. Read the partition table binary directly from the connected device at 0x8000
+           (over the open esptool session esp when given, else with a subprocess).
         3. Fall back to 0x10000 (standard PlatformIO layout).
 
         Returns (address_str, has_ota), e.g. ("0x50000", True).
         """
         import tempfile
 
-        # --- Strategy 1: use the partitions file already loaded ---
+        # --- Strategy 1: use the partitions file already loaded (indexed for projects) ---
+        project = self._active_project()
+        if project is not None and project.app_address is not None:
+            addr = f"0x{project.app_address:X}"
+            self.log(f"Dirección de firmware desde el índice de '{project.name}': {addr}", "info")
+            return addr, project.has_ota
         if self.partitions_path and os.path.exists(self.partitions_path):
             try:
                 addr, has_ota = self.parse_partition_table_file(self.partitions_path)
@@ -3343,6 +4694,16 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
 
         # --- Strategy 2: read partition table from device ---
         self.log("Leyendo tabla de particiones del dispositivo para detectar dirección de firmware...", "info")
+        if esp is not None:
+            table = self.flash_manager.read_partition_table(esp)
+            app = table.boot_app() if table else None
+            if app is not None:
+                self.log(f"Dirección de firmware detectada desde dispositivo: 0x{app.offset:X} "
+                         f"(OTA: {table.has_ota})", "success")
+                return f"0x{app.offset:X}", table.has_ota
+            self.log("No se pudo detectar dirección de firmware; usando 0x10000 (layout estándar PlatformIO).", "warning")
+            return "0x10000", False
+        
         tmp_path = None
         try:
             with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as tmp:
@@ -3359,7 +4720,9 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 tmp_path
             ]
 
-            result = subprocess.run(read_cmd, capture_output=True, text=True, timeout=20)
+            with self.stage_metrics.stage("partition_read"), \
+                    TRACER.span("esptool read-flash (subprocess)", "subprocess"):
+                result = subprocess.run(read_cmd, capture_output=True, text=True, timeout=20)
 
             if result.returncode == 0 and os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
                 addr, has_ota = self.parse_partition_table_file(tmp_path)
@@ -3492,6 +4855,51 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log(f"Error creando OTA data: {e}", "error")
             return None
     
+    def planned_erase(self, esp, flasher_args, mode):
+        """Erase with the minimal plan on an open esptool session.
+        
+        Ranges are computed from the partition table and the flash plan:
+        sector-aligned, merged, and without the regions the write step already
+        erases (the stub picks block or sector erases inside each range).
+        Replaces the per-region erase-region subprocesses; complete mode still
+        erases the whole chip when neither the flash size nor the partition
+        table is known.
+        """
+        try:
+            writes = [(int(address, 16), os.path.getsize(filepath))
+                      for address, filepath, _ in flasher_args['flash_files']]
+            
+            table = None
+            preserve_nvs = mode != "simple" and self.preserve_nvs.get()
+            if mode != "simple":
+                # Project table first, else the one on the device: it marks where the flash ends
+                table = load_partition_table(self.partitions_path) or self.flash_manager.read_partition_table(esp)
+                if table is None and preserve_nvs:
+                    self.log("⚠️ NO SE PUDO LEER LA TABLA DE PARTICIONES: el borrado completo se reduce a las "
+                             "regiones que se escriben (el resto de la flash, NVS incluida, queda intacto)", "error")
+                    return self.flash_manager.erase_ranges(
+                        esp, ErasePlanner().plan(writes, "simple"), self._on_flash_progress)
+            
+            flash_size = self.flash_manager.session_flash_size(esp)
+            planner = ErasePlanner(table, flash_size)
+            if mode != "simple" and not planner.flash_end_known:
+                self.log("Tamaño de flash y tabla de particiones desconocidos - borrando el chip completo", "warning")
+                self.log_serial("CMD: erase-flash (FULL CHIP ERASE)", "tx")
+                return self.flash_manager.erase_chip(esp)
+            plan = planner.plan(writes, mode, preserve_nvs=preserve_nvs)
+            
+            self.log(f"Plan de borrado: {ErasePlanner.describe(plan)}", "info")
+            for erase_range in plan:
+                self.log_debug(f"  {erase_range}")
+            self.log_serial(f"CMD: erase-plan ({len(plan)} regiones)", "tx")
+            
+            return self.flash_manager.erase_ranges(esp, plan, self._on_flash_progress)
+            
+        except Exception as e:
+            self.log(f"Error en plan de borrado: {e}", "error")
+            self.log_debug(f"Exception in planned_erase: {repr(e)}")
+            return False
+    
     def execute_erase(self, base_cmd):
         """Execute full flash erase"""
         erase_cmd = base_cmd + ["erase-flash"]  # Updated: hyphenated
@@ -3501,33 +4909,34 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         self.log_serial("CMD: erase-flash (FULL CHIP ERASE)", "tx")
         
         try:
-            process = subprocess.Popen(
-                erase_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1
-            )
-            
-            for line in process.stdout:
-                line = line.strip()
-                if line:
-                    self.log_debug(f"esptool output: {line}", "verbose")
-                    
-                    # Log to serial monitor
-                    if "Chip erase" in line or "Erasing" in line:
-                        self.log_serial(line, "rx")
-                    
-                    if "Chip erase completed" in line:
-                        self.log(line, "success")
-                        self.log_serial("ERASE COMPLETE", "rx")
-                    elif "Error" in line or "error" in line.lower():
-                        self.log(line, "error")
-                        self.log_serial(f"ERROR: {line}", "rx")
-                    else:
-                        self.log(line, "normal")
-            
-            process.wait()
+            with TRACER.span("esptool erase-flash (subprocess)", "subprocess"):
+                process = subprocess.Popen(
+                    erase_cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    universal_newlines=True,
+                    bufsize=1
+                )
+                
+                for line in process.stdout:
+                    line = line.strip()
+                    if line:
+                        self.log_debug(f"esptool output: {line}", "verbose")
+                        
+                        # Log to serial monitor
+                        if "Chip erase" in line or "Erasing" in line:
+                            self.log_serial(line, "rx")
+                        
+                        if "Chip erase completed" in line:
+                            self.log(line, "success")
+                            self.log_serial("ERASE COMPLETE", "rx")
+                        elif "Error" in line or "error" in line.lower():
+                            self.log(line, "error")
+                            self.log_serial(f"ERROR: {line}", "rx")
+                        else:
+                            self.log(line, "normal")
+                
+                process.wait()
             
             if process.returncode != 0:
                 self.log(f"Error al borrar flash - código de retorno: {process.returncode}", "error")
@@ -3560,20 +4969,21 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                     
                     erase_cmd = base_cmd + ["erase-region", address, hex(size_aligned)]  # Updated: hyphenated
                     
-                    process = subprocess.Popen(
-                        erase_cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        universal_newlines=True,
-                        bufsize=1
-                    )
-                    
-                    for line in process.stdout:
-                        line = line.strip()
-                        if line:
-                            self.log(line, "normal")
-                    
-                    process.wait()
+                    with TRACER.span("esptool erase-region (subprocess)", "subprocess", address=address):
+                        process = subprocess.Popen(
+                            erase_cmd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            universal_newlines=True,
+                            bufsize=1
+                        )
+                        
+                        for line in process.stdout:
+                            line = line.strip()
+                            if line:
+                                self.log(line, "normal")
+                        
+                        process.wait()
                     
                     if process.returncode != 0:
                         return False
@@ -3584,14 +4994,20 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log(f"Error en borrado inteligente: {e}", "error")
             return False
     
-    def flash_component(self, base_cmd, address, filepath, description):
-        """Flash a single component to given address"""
+    def flash_component(self, base_cmd, address, filepath, description, esp=None):
+        """Flash a single component to given address.
+        If an open esptool session (esp) is given, the component is written over it
+        using the payload cache; otherwise a write-flash subprocess is started.
+        """
         try:
             if not os.path.exists(filepath):
                 self.log(f"ERROR: Archivo no encontrado: {filepath}", "error")
                 self.log_debug(f"File not found: {filepath}")
                 return False
             
+            if esp is not None:
+                return self._flash_component_cached(esp, address, filepath, description)
+            
             file_size = os.path.getsize(filepath)
             self.log_debug(f"Flasheando {description}: {filepath} ({file_size} bytes) -> {address}")
             
@@ -3612,65 +5028,65 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log_debug(f"Comando completo: {' '.join(cmd)}")
             self.log_serial(f"CMD: write-flash {address} {os.path.basename(filepath)}", "tx")
             
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1
-            )
-            
-            # Capture both stdout and stderr
-            output_lines = []
-            error_lines = []
-            
-            # Read stdout
-            for line in process.stdout:
-                line = line.strip()
-                if line:
-                    match = re.search(r'(\d+\.\d+)%', line)
-                    if match:
-                        percent = float(match.group(1))
-                        self.progress['value'] = percent
-                        self.root.update_idletasks()
-                    
-                    # Update status label based on esptool output
-                    if "Connecting" in line:
-                        self.status_label.config(text="🔌 Connecting to device...")
-                    elif "Erasing" in line or "erase" in line.lower():
-                        self.status_label.config(text="🗑️ Erasing flash...")
-                    elif "Writing at" in line:
-                        self.status_label.config(text="📤 Uploading data...")
-                    elif "Hash of data verified" in line:
-                        self.status_label.config(text="✅ Verifying upload...")
-                    elif "Compressed" in line:
-                        self.status_label.config(text="📦 Compressing data...")
-                    elif "Uploading" in line:
-                        self.status_label.config(text="📤 Uploading stub...")
-                    
-                    output_lines.append(line)
-                    self.log_debug(f"esptool: {line}", "verbose")
-                    
-                    # Log to serial monitor for visibility
-                    if "Connecting" in line:
-                        self.log_serial(line, "rx")
-                    elif "Writing at" in line or "Wrote" in line:
-                        self.log_serial(line, "rx")
-                    elif "Hash" in line or "Verifying" in line:
-                        self.log_serial(line, "rx")
-                    elif "error" in line.lower() or "failed" in line.lower():
-                        self.log_serial(f"ERROR: {line}", "rx")
-                    
-                    if "Hash of data verified" in line or "Wrote" in line or "Writing" in line:
-                        self.log(f"  {line}", "success")
-                    elif "A fatal error occurred" in line or "Failed to" in line or "error" in line.lower():
-                        self.log(f"  {line}", "error")
-                    else:
-                        # Only log important lines to avoid clutter
-                        if "Connecting" in line or "Chip is" in line or "Uploading" in line:
-                            self.log(f"  {line}", "info")
-            
-            process.wait()
+            with TRACER.span("esptool write-flash (subprocess)", "subprocess", address=address):
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    universal_newlines=True,
+                    bufsize=1
+                )
+                
+                # Capture both stdout and stderr
+                output_lines = []
+                error_lines = []
+                
+                # Read stdout
+                for line in process.stdout:
+                    line = line.strip()
+                    if line:
+                        match = re.search(r'(\d+\.\d+)%', line)
+                        if match:
+                            percent = float(match.group(1))
+                            self.set_progress(percent)
+                        
+                        # Update status label based on esptool output
+                        if "Connecting" in line:
+                            self.set_status("🔌 Connecting to device...")
+                        elif "Erasing" in line or "erase" in line.lower():
+                            self.set_status("🗑️ Erasing flash...")
+                        elif "Writing at" in line:
+                            self.set_status("📤 Uploading data...")
+                        elif "Hash of data verified" in line:
+                            self.set_status("✅ Verifying upload...")
+                        elif "Compressed" in line:
+                            self.set_status("📦 Compressing data...")
+                        elif "Uploading" in line:
+                            self.set_status("📤 Uploading stub...")
+                        
+                        output_lines.append(line)
+                        self.log_debug(f"esptool: {line}", "verbose")
+                        
+                        # Log to serial monitor for visibility
+                        if "Connecting" in line:
+                            self.log_serial(line, "rx")
+                        elif "Writing at" in line or "Wrote" in line:
+                            self.log_serial(line, "rx")
+                        elif "Hash" in line or "Verifying" in line:
+                            self.log_serial(line, "rx")
+                        elif "error" in line.lower() or "failed" in line.lower():
+                            self.log_serial(f"ERROR: {line}", "rx")
+                        
+                        if "Hash of data verified" in line or "Wrote" in line or "Writing" in line:
+                            self.log(f"  {line}", "success")
+                        elif "A fatal error occurred" in line or "Failed to" in line or "error" in line.lower():
+                            self.log(f"  {line}", "error")
+                        else:
+                            # Only log important lines to avoid clutter
+                            if "Connecting" in line or "Chip is" in line or "Uploading" in line:
+                                self.log(f"  {line}", "info")
+                
+                process.wait()
             
             # Read any remaining stderr
             stderr_output = process.stderr.read() if process.stderr else ""
@@ -3705,6 +5121,34 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             self.log_debug(f"Exception in flash_component: {repr(e)}")
             return False
 
+    def _flash_component_cached(self, esp, address, filepath, description):
+        """Flash a component over an open esptool session with a cached compressed payload"""
+        addr_int = int(address, 16)
+        self.log(f"  Comando: write-flash {address} {os.path.basename(filepath)} (payload cacheado)", "info")
+        self.log_serial(f"CMD: write-flash {address} {os.path.basename(filepath)}", "tx")
+        
+        if addr_int == esp.BOOTLOADER_FLASH_OFFSET:
+            # esptool patches flash mode/freq/size into the bootloader header,
+            # so the bootloader cannot be streamed unchanged from the cache
+            self.set_status("📤 Uploading bootloader...")
+            ok = self.flash_manager.write_file(esp, addr_int, filepath, label=description)
+            if ok:
+                self.log("  Hash of data verified.", "success")
+            else:
+                self.log_serial(f"FAILED: write-flash {address}", "rx")
+            return ok
+        
+        self.set_status("📦 Compressing data...")
+        payload = self.payload_cache.get(filepath)
+        self.log_debug(f"{description}: {payload}")
+        
+        self.set_status("📤 Uploading data...")
+        ok = self.flash_manager.write_payload(esp, addr_int, payload, progress_callback=self._on_flash_progress,
+                                              label=description)
+        self.log_serial(f"Wrote {payload.size} bytes ({payload.compressed_size} compressed) at {address}"
+                        if ok else f"FAILED: write-flash {address}", "rx")
+        return ok
+
     def start_erase(self):
         """Iniciar proceso de borrado de flash en un hilo separado"""
         if self.is_flashing:
@@ -3724,12 +5168,24 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                                    "Esta acción eliminará todo el contenido del ESP32."):
             return
         
+        # Offer a full dump first: the erase cannot be undone otherwise
+        backup_path = None
+        answer = messagebox.askyesnocancel("Backup antes de borrar",
+                                           "¿Guardar un backup completo del flash antes de borrarlo?\n\n"
+                                           "Podrás restaurarlo más tarde.")
+        if answer is None:
+            return
+        if answer:
+            backup_path = self._ask_backup_path(port)
+            if not backup_path:
+                return
+        
         # Iniciar borrado en un hilo separado
         self.is_flashing = True
         self.set_buttons_state('disabled')
-        self.progress['value'] = 0
+        self.set_progress(0)
         
-        thread = threading.Thread(target=self.erase_flash_chip, args=(port,))
+        thread = threading.Thread(target=self.erase_flash_chip, args=(port, backup_path))
         thread.daemon = True
         thread.start()
     
@@ -3759,7 +5215,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         # Iniciar borrado en un hilo separado
         self.is_flashing = True
         self.set_buttons_state('disabled')
-        self.progress['value'] = 0
+        self.set_progress(0)
         
         thread = threading.Thread(target=self.erase_nvs_partition, args=(port,))
         thread.daemon = True
@@ -3782,11 +5238,10 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 python_exe = self._get_subprocess_python()
             
             chip = self.selected_chip.get()
-            baud_rate = self.selected_baud.get()
+            baud_rate = self.get_operation_baud(port)
             
-            # NVS typically at 0x9000, size 0x5000 (20KB) for ESP32/ESP32-S3
-            nvs_offset = 0x9000
-            nvs_size = 0x5000
+            # NVS partition of the project's table (0x9000, 0x5000 when none is loaded)
+            nvs_offset, nvs_size = self._nvs_partition()
             
             self.log(f"Borrando partición NVS: offset=0x{nvs_offset:X}, size=0x{nvs_size:X}", "info")
             self.log_debug(f"NVS erase - chip: {chip}, baud: {baud_rate}")
@@ -3832,7 +5287,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 self.log(" ¡PARTICIÓN NVS BORRADA EXITOSAMENTE!", "success")
                 self.log("=" * 60, "success")
                 self.log_debug("NVS erase completed successfully")
-                messagebox.showinfo("Éxito", 
+                self._ui(messagebox.showinfo, "Éxito", 
                     "¡Partición NVS borrada completamente!\n\n"
                     "WiFi y configuraciones eliminadas.\n"
                     "Bootloader y firmware intactos.\n\n"
@@ -3842,7 +5297,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 self.log(f" Error al borrar NVS - código: {process.returncode}", "error")
                 self.log("=" * 60, "error")
                 self.log_debug(f"NVS erase failed with return code: {process.returncode}")
-                messagebox.showerror("Error", 
+                self._ui(messagebox.showerror, "Error", 
                     f"Error al borrar partición NVS.\n\n"
                     f"Código de error: {process.returncode}\n\n"
                     f"Revisa el log para más detalles.")
@@ -3850,16 +5305,22 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
         except Exception as e:
             self.log(f"Excepción: {str(e)}", "error")
             self.log_debug(f"Exception in erase_nvs_partition: {repr(e)}")
-            messagebox.showerror("Error", f"Error inesperado:\n{str(e)}")
+            self._ui(messagebox.showerror, "Error", f"Error inesperado:\n{str(e)}")
         
         finally:
             self.is_flashing = False
             self.set_buttons_state('normal')
-            self.progress.stop()
+            self._ui(self.progress.stop)
     
-    def erase_flash_chip(self, port):
-        """Borrar el flash completo del ESP32"""
+    def erase_flash_chip(self, port, backup_path=None):
+        """Borrar el flash completo del ESP32 (con backup previo opcional)"""
         try:
+            if backup_path and not self._backup_flash(port, backup_path):
+                self.log("Borrado cancelado: el backup no se completó", "error")
+                self._ui(messagebox.showerror, "Error", "El backup no se completó, no se ha borrado nada.\n\n"
+                                              "Revisa el log para más detalles.")
+                return
+            
             self.log("=" * 60, "info")
             self.log(f"Iniciando BORRADO COMPLETO del flash en {port}...", "info")
             self.log("=" * 60, "info")
@@ -3873,7 +5334,7 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 python_exe = self._get_subprocess_python()
             
             chip = self.selected_chip.get()
-            baud_rate = self.selected_baud.get()
+            baud_rate = self.get_operation_baud(port)
             
             cmd = [
                 python_exe, "-m", "esptool",
@@ -3911,21 +5372,21 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
                 self.log("=" * 60, "success")
                 self.log(" ¡FLASH BORRADO EXITOSAMENTE!", "success")
                 self.log("=" * 60, "success")
-                messagebox.showinfo("Éxito", "¡Flash borrado completamente!\n\nAhora puedes cargar el firmware.")
+                self._ui(messagebox.showinfo, "Éxito", "¡Flash borrado completamente!\n\nAhora puedes cargar el firmware.")
             else:
                 self.log("=" * 60, "error")
                 self.log(" Error al borrar el flash", "error")
                 self.log("=" * 60, "error")
-                messagebox.showerror("Error", "Error al borrar el flash.\nRevisa el log para más detalles.")
+                self._ui(messagebox.showerror, "Error", "Error al borrar el flash.\nRevisa el log para más detalles.")
                 
         except Exception as e:
             self.log(f"Excepción: {str(e)}", "error")
-            messagebox.showerror("Error", f"Error inesperado:\n{str(e)}")
+            self._ui(messagebox.showerror, "Error", f"Error inesperado:\n{str(e)}")
         
         finally:
             self.is_flashing = False
             self.set_buttons_state('normal')
-            self.progress.stop()
+            self._ui(self.progress.stop)
 
     def show_firmware_analysis(self):
         """Mostrar análisis del firmware en una ventana emergente"""
@@ -4139,11 +5600,18 @@ spiffs,      data, spiffs,  0x2A0000, 1472K
             return f"Error al analizar: {str(e)}"
 
 def main():
+    startup_t0 = time.perf_counter()
+    # NVS image generation uses a process pool (needed in the PyInstaller build)
+    import multiprocessing
+    multiprocessing.freeze_support()
+    start_from_env()
+    
     # Check dependencies before starting
     check_and_install_dependencies()
     
     root = tk.Tk()
-    app = ESP32Flasher(root)
+    with TRACER.span("startup", "ui"):
+        app = ESP32Flasher(root, startup_t0=startup_t0)
     root.mainloop()
 
 if __name__ == "__main__":
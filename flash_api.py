@@ -0,0 +1,508 @@
+"""
+Local HTTP/JSON API for the flash engine
+Lets a MES or test script submit flash, data upload and NVS erase jobs to the
+JobScheduler, follow their progress (polling or a server-sent event stream)
+and look up the flash history of a board. Handlers only queue work and read
+state; the scheduler's per-port workers (bounded by max_concurrent) do the
+flashing.
+
+Endpoints:
+    GET  /health            scheduler totals
+    GET  /ports             serial ports of this host
+    GET  /projects          project folders under proyect_firmware/
+    POST /jobs              {"port", "operation": flash|upload_data|erase_nvs, "project" | "files", ...}
+    GET  /jobs[?state=]     every job
+    GET  /jobs/{id}         one job
+    GET  /events            text/event-stream with one "job" event per state or stage change
+    GET  /devices/{mac}     flash history of a board
+
+Usage:
+    python flash_api.py [--listen 127.0.0.1:8765] [--concurrent 12]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from job_scheduler import FlashPlan, FlashJob
+
+
+DEFAULT_PORT = 8765
+
+
+class APIError(Exception):
+    """Request the API refuses (mapped to an HTTP status and a JSON error body)"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class FlashAPI:
+    """HTTP front end of a JobScheduler (shared with the GUI or standalone)"""
+
+    OPERATIONS = ("flash", "upload_data", "erase_nvs")
+    MAX_QUEUED = 64          # POST /jobs answers 429 above this many waiting jobs
+    EVENT_BACKLOG = 1000     # Events buffered per stream client before it is dropped
+    HEARTBEAT_S = 15.0       # Comment line on idle event streams (keeps proxies from closing them)
+
+    def __init__(self, scheduler, history=None, project_index=None, host="127.0.0.1", port=DEFAULT_PORT,
+                 network_ports=None, logger=None):
+        """
+        Initialize API
+
+        Args:
+            scheduler: JobScheduler that runs the jobs (its max_concurrent bounds parallel boards)
+            history: Optional DeviceHistory for GET /devices/{mac}, where the API's own flash jobs are recorded
+            project_index: Optional ProjectIndex, so jobs can name a project instead of files
+            host: Interface to listen on (keep 127.0.0.1 unless the MES runs on another host)
+            port: TCP port (0 = any free port, see address after start())
+            network_ports: Optional NetworkPorts listed by GET /ports
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.scheduler = scheduler
+        self.history = history
+        self.project_index = project_index
+        self.host = host
+        self.port = port
+        self.network_ports = network_ports
+        self.logger = logger or self._default_logger
+
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._meta = {}          # job id -> (operation, project, firmware sha256)
+        self._previous_update = None
+        self._server = None
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    # ------------------------------------------------------------------ #
+    #  Server                                                              #
+    # ------------------------------------------------------------------ #
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    def start(self):
+        """Serve in the background and start receiving the scheduler's job updates"""
+        if self.running:
+            return
+        api = self
+
+        class Handler(_Handler):
+            pass
+        Handler.api = api
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        # Chain in front of the callback the scheduler already has (the GUI's)
+        self._previous_update = self.scheduler.on_job_update
+        self.scheduler.on_job_update = self._on_job_update
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="flash-api").start()
+        self.log(f"API HTTP escuchando en http://{self.host}:{self.port}", "info")
+
+    def stop(self):
+        if not self.running:
+            return
+        if self.scheduler.on_job_update == self._on_job_update:
+            self.scheduler.on_job_update = self._previous_update
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for events in subscribers:
+            events.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self.log("API HTTP detenida", "info")
+
+    # ------------------------------------------------------------------ #
+    #  Jobs                                                                #
+    # ------------------------------------------------------------------ #
+
+    def submit(self, request):
+        """
+        Queue a job from a POST /jobs body
+
+        Returns:
+            FlashJob
+
+        Raises:
+            APIError: Invalid request (400), unknown project (404) or queue full (429)
+        """
+        port = request.get("port")
+        if not port or not isinstance(port, str):
+            raise APIError(400, "falta 'port'")
+        operation = request.get("operation", "flash")
+        if operation not in self.OPERATIONS:
+            raise APIError(400, f"'operation' debe ser uno de {', '.join(self.OPERATIONS)}")
+        if self.scheduler.queue_depth >= self.MAX_QUEUED:
+            raise APIError(429, f"cola llena ({self.MAX_QUEUED} trabajos en espera)")
+        if self.scheduler.has_pending(port):
+            raise APIError(409, f"{port} ya tiene un trabajo en curso")
+
+        plan, project, firmware_hash = self._plan(operation, request)
+        # Held across submit so the first update of the job already finds its metadata;
+        # the busy-port check is repeated atomically with the submit
+        with self._lock:
+            job = self.scheduler.submit(port, plan, project, exclusive=True)
+            if job is None:
+                raise APIError(409, f"{port} ya tiene un trabajo en curso")
+            self._meta[job.id] = (operation, project, firmware_hash)
+        self.log(f"API: trabajo #{job.id} ({operation}) en {port}", "info")
+        return job
+
+    @staticmethod
+    def valid_project_name(name):
+        """A plain folder name inside the projects root (no separators, '..' or drive)"""
+        return (isinstance(name, str) and name.strip() == name and name != "."
+                and ".." not in name and not any(sep in name for sep in ("/", "\\", ":", "\0")))
+
+    def _plan(self, operation, request):
+        """(FlashPlan, project name, firmware SHA-256) for a request"""
+        manifest = None
+        if request.get("project"):
+            if self.project_index is None:
+                raise APIError(400, "este servidor no tiene índice de proyectos")
+            if not self.valid_project_name(request["project"]):
+                raise APIError(400, f"nombre de proyecto no válido: {request['project']!r}")
+            manifest = self.project_index.get(request["project"])
+            if manifest is None:
+                raise APIError(404, f"proyecto desconocido: {request['project']}")
+
+        chip = request.get("chip") or (manifest.chip if manifest else None)
+        if not chip:
+            raise APIError(400, "falta 'chip'")
+        baud = request.get("baud", "auto")
+        partitions = request.get("partitions") or (manifest.file("partitions") if manifest else None)
+        project = manifest.name if manifest else request.get("project_name")
+
+        if operation == "erase_nvs":
+            return FlashPlan(chip, baud, [], erase_mode="none", partitions_path=partitions,
+                             erase_partitions=("nvs",)), project, None
+
+        if "files" in request:
+            files = [self._file_entry(entry) for entry in request["files"]]
+        elif operation == "upload_data":
+            image = manifest.file("spiffs") if manifest else None
+            if image is None:
+                raise APIError(400, "falta 'files' o un proyecto con data/spiffs.bin")
+            files = [("spiffs", image, "SPIFFS")]
+        elif manifest is not None:
+            files = self._project_files(manifest, request.get("erase_mode", "simple"))
+        else:
+            raise APIError(400, "falta 'project' o 'files'")
+        if not files:
+            raise APIError(400, "el trabajo no tiene archivos")
+
+        if operation == "upload_data":
+            return FlashPlan(chip, baud, files, erase_mode="none", partitions_path=partitions), project, None
+
+        erase_mode = request.get("erase_mode", "simple")
+        if erase_mode not in ("simple", "complete", "none"):
+            raise APIError(400, "'erase_mode' debe ser simple, complete o none")
+        plan = FlashPlan(chip, baud, files, erase_mode=erase_mode,
+                         preserve_nvs=bool(request.get("preserve_nvs", True)), partitions_path=partitions,
+                         skip_if_current=bool(request.get("skip_if_current", False)))
+        firmware_hash = manifest.digest("firmware") if manifest else self._sha256(plan.app_file)
+        return plan, project or os.path.splitext(os.path.basename(plan.app_file))[0], firmware_hash
+
+    @staticmethod
+    def _file_entry(entry):
+        """{"address": "0x10000" | 65536 | "spiffs" | null, "path", "description"} -> plan file"""
+        if not isinstance(entry, dict) or not entry.get("path"):
+            raise APIError(400, "cada archivo necesita 'path'")
+        path = entry["path"]
+        if not os.path.isfile(path):
+            raise APIError(400, f"no existe el archivo {path}")
+        address = entry.get("address")
+        if isinstance(address, str):
+            try:
+                address = int(address, 0)
+            except ValueError:
+                pass  # Partition name or subtype, resolved on the device
+        elif address is not None and not isinstance(address, int):
+            raise APIError(400, f"dirección inválida para {path}")
+        return address, path, entry.get("description") or os.path.basename(path)
+
+    @staticmethod
+    def _project_files(manifest, erase_mode):
+        """Plan files of a project: the app only (simple), or the full image set (complete)"""
+        firmware = (manifest.app_address, manifest.file("firmware"), "Firmware (app)")
+        if erase_mode != "complete":
+            return [firmware]
+        files = []
+        if manifest.file("bootloader"):
+            from esptool.targets import CHIP_DEFS
+            chip_def = CHIP_DEFS.get(manifest.chip or "esp32")
+            if chip_def is not None:
+                files.append((chip_def.BOOTLOADER_FLASH_OFFSET, manifest.file("bootloader"), "Bootloader (2nd stage)"))
+        if manifest.file("partitions"):
+            files.append((0x8000, manifest.file("partitions"), "Partition Table"))
+        table = manifest.partition_table()
+        if manifest.file("ota_data") and table is not None and table.otadata is not None:
+            files.append((table.otadata.offset, manifest.file("ota_data"), "OTA Data"))
+        return files + [firmware]
+
+    @staticmethod
+    def _sha256(path):
+        if not path or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def owns(self, job_id):
+        """True for jobs submitted through the API (they are recorded here, not by the GUI)"""
+        with self._lock:
+            return job_id in self._meta
+
+    def job_dict(self, job, meta=None):
+        stages = self.scheduler.stages(job.plan)
+        if meta is None:
+            with self._lock:
+                meta = self._meta.get(job.id)
+        operation, project, _ = meta or ("flash", job.project, None)
+        return {"id": job.id, "port": job.port, "operation": operation, "project": project,
+                "state": job.state, "stage": job.stage,
+                "progress": round(min(job.stage_index, len(stages)) / len(stages), 3) if stages else 0.0,
+                "runs": job.runs, "mac": job.mac, "flash_id": job.flash_id, "skipped": job.skipped,
+                "error": job.error, "created": job.created, "started": job.started, "finished": job.finished,
+                "timings": [[name, round(seconds, 4)] for name, seconds in job.timings]}
+
+    # ------------------------------------------------------------------ #
+    #  Events                                                              #
+    # ------------------------------------------------------------------ #
+
+    def subscribe(self):
+        events = queue.Queue(maxsize=self.EVENT_BACKLOG)
+        with self._lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+
+    def _on_job_update(self, job):
+        """Scheduler worker callback: keep the previous callback, record and broadcast"""
+        if self._previous_update is not None:
+            self._previous_update(job)
+        with self._lock:
+            meta = self._meta.get(job.id)
+            subscribers = list(self._subscribers)
+        if meta is not None and job.state in (FlashJob.DONE, FlashJob.REJECTED):
+            self._record(job, *meta)
+        data = json.dumps(self.job_dict(job, meta))
+        for events in subscribers:
+            try:
+                events.put_nowait(data)
+            except queue.Full:
+                # A client that stopped reading must not hold events (or memory) for everyone
+                self.unsubscribe(events)
+                events.queue.clear()
+                events.put_nowait(None)
+
+    def _record(self, job, operation, project, firmware_hash):
+        if self.history is None or operation != "flash":
+            return
+        from device_history import DeviceHistory
+        result = DeviceHistory.RESULT_REJECTED if job.state == FlashJob.REJECTED else \
+            DeviceHistory.RESULT_SKIPPED if job.skipped else DeviceHistory.RESULT_OK
+        self.history.record(job.mac, result, chip=job.plan.chip, flash_id=job.flash_id, project=project,
+                            firmware_hash=firmware_hash, port=job.port, stage_timings=job.timings)
+
+    # ------------------------------------------------------------------ #
+    #  Queries                                                             #
+    # ------------------------------------------------------------------ #
+
+    def ports(self):
+        from flash_utils import list_serial_ports
+        extra = self.network_ports.ports() if self.network_ports is not None else ()
+        return [{"port": device, "description": description, "busy": self.scheduler.has_pending(device)}
+                for device, description in list_serial_ports(extra)]
+
+    def projects(self):
+        if self.project_index is None:
+            return []
+        return [{"name": name} for name in self.project_index.projects()]
+
+    def device(self, mac):
+        if self.history is None:
+            raise APIError(404, "este servidor no tiene historial de dispositivos")
+        flashes = self.history.device(mac)
+        if not flashes:
+            raise APIError(404, f"dispositivo desconocido: {mac}")
+        return {"mac": flashes[0]["mac"], "flashes": flashes}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes requests to the FlashAPI bound to the handler class"""
+
+    api = None
+    protocol_version = "HTTP/1.1"
+    MAX_BODY = 1 << 20
+
+    def log_message(self, format, *args):
+        self.api.log(f"API {self.address_string()} {format % args}", "debug")
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.MAX_BODY:
+            raise APIError(413, "cuerpo demasiado grande")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise APIError(400, "el cuerpo no es JSON válido")
+        if not isinstance(body, dict):
+            raise APIError(400, "el cuerpo debe ser un objeto JSON")
+        return body
+
+    def _route(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = parse_qs(url.query)
+        api = self.api
+        if method == "GET" and parts == ["health"]:
+            return 200, dict(api.scheduler.stats(), ok=True)
+        if method == "GET" and parts == ["ports"]:
+            return 200, api.ports()
+        if method == "GET" and parts == ["projects"]:
+            return 200, api.projects()
+        if parts[:1] == ["jobs"]:
+            if method == "POST" and len(parts) == 1:
+                return 202, api.job_dict(api.submit(self._body()))
+            if method == "GET" and len(parts) == 1:
+                return 200, [api.job_dict(job) for job in api.scheduler.list_jobs(query.get("state", [None])[0])]
+            if method == "GET" and len(parts) == 2:
+                job = api.scheduler.job(int(parts[1])) if parts[1].isdigit() else None
+                if job is None:
+                    raise APIError(404, f"trabajo desconocido: {parts[1]}")
+                return 200, api.job_dict(job)
+        if method == "GET" and len(parts) == 2 and parts[0] == "devices":
+            return 200, api.device(parts[1])
+        raise APIError(404 if method == "GET" or parts[:1] == ["jobs"] else 405, f"ruta desconocida: {url.path}")
+
+    def _handle(self, method):
+        try:
+            status, payload = self._route(method)
+        except APIError as e:
+            status, payload = e.status, {"error": str(e)}
+        except Exception as e:
+            self.api.log(f"API: error en {method} {self.path}: {e}", "error")
+            status, payload = 500, {"error": str(e)}
+        self._send_json(status, payload)
+
+    def do_GET(self):
+        if urlsplit(self.path).path.rstrip('/') == "/events":
+            self._stream_events()
+        else:
+            self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _stream_events(self):
+        """Server-sent events until the client disconnects (one handler thread per stream)"""
+        events = self.api.subscribe()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                try:
+                    data = events.get(timeout=self.api.HEARTBEAT_S)
+                except queue.Empty:
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    continue
+                if data is None:
+                    break
+                self.wfile.write(f"event: job\ndata: {data}\n\n".encode('utf-8'))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            self.api.unsubscribe(events)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP local del motor de flasheo (integración MES)")
+    parser.add_argument("--listen", default=f"127.0.0.1:{DEFAULT_PORT}", help="host:puerto de escucha")
+    parser.add_argument("--concurrent", type=int, default=12, help="Placas flasheadas en paralelo")
+    args = parser.parse_args(argv)
+
+    from flash_utils import FlashManager
+    from payload_cache import PayloadCache
+    from baud_manager import BaudManager
+    from stage_metrics import SessionMetrics
+    from artifact_store import ArtifactStore
+    from chip_info import ChipInfoCache
+    from device_history import DeviceHistory
+    from project_index import ProjectIndex
+    from network_ports import NetworkPorts
+    from job_scheduler import JobScheduler
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    store = ArtifactStore(os.path.join(script_dir, ".artifacts"))
+    flash_manager = FlashManager(payload_cache=PayloadCache(store.compressed_dir, store=store),
+                                 baud_manager=BaudManager(os.path.join(script_dir, ".baud_profiles.json")),
+                                 metrics=SessionMetrics())
+    scheduler = JobScheduler(flash_manager, max_concurrent=args.concurrent,
+                             chip_info_cache=ChipInfoCache(os.path.join(script_dir, ".chip_info_cache.json")))
+    host, _, port = args.listen.rpartition(':')
+    api = FlashAPI(scheduler, history=DeviceHistory(os.path.join(script_dir, ".device_history.sqlite3")),
+                   project_index=ProjectIndex(os.path.join(script_dir, "proyect_firmware"), store=store),
+                   host=host or "127.0.0.1", port=int(port),
+                   network_ports=NetworkPorts(os.path.join(script_dir, ".network_ports.json")))
+    api.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+        scheduler.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
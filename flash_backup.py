@@ -0,0 +1,368 @@
+"""
+Flash Backup for ESP32 boards
+Streams the whole flash into a compressed backup file chunk by chunk, with a
+JSON index (per-chunk position/MD5 and per-sector MD5) that lets an
+interrupted backup resume, and restores a backup by writing only the
+sectors whose device-side hash differs
+
+Backup layout:
+    <name>.bin.z            independently zlib-compressed chunks, back to back
+    <name>.bin.z.index.json board identity, chunk table, sector hashes
+"""
+
+import os
+import json
+import time
+import zlib
+import hashlib
+
+from payload_cache import CompressedPayload
+from tracing import TRACER
+
+
+class FlashBackup:
+    """Chunked, resumable full-flash backup and sector-diff restore over an open esptool session"""
+
+    FORMAT_VERSION = 1
+    CHUNK_SIZE = 0x40000   # 256 KB read per request: resume granularity and peak memory
+    SECTOR_SIZE = 0x1000   # Flash erase unit - restores compare and write whole sectors
+    LEVEL = 6              # The serial link is the bottleneck, not zlib
+    READ_RETRIES = 2
+    DIFF_BLOCK = 0x10000   # Intermediate hash level between a chunk and a sector
+    MAX_RUN = 0x100000     # Coalesced restore writes are capped at 1 MB (memory / progress)
+    INDEX_SUFFIX = ".index.json"
+
+    def __init__(self, flash_manager, logger=None):
+        """
+        Initialize flash backup
+
+        Args:
+            flash_manager: FlashManager providing sessions and chip identity
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.flash_manager = flash_manager
+        self.logger = logger or self._default_logger
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    # ------------------------------------------------------------------ #
+    #  Index                                                               #
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def index_path(cls, path):
+        return path + cls.INDEX_SUFFIX
+
+    @classmethod
+    def load_index(cls, path):
+        """Index of a backup file, or None if missing/unreadable"""
+        try:
+            with open(cls.index_path(path), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return index if index.get("version") == cls.FORMAT_VERSION else None
+
+    def _save_index(self, path, index):
+        tmp_path = self.index_path(path) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path(path))
+
+    @classmethod
+    def read_chunk(cls, path, chunk):
+        """Decompressed bytes of one indexed chunk"""
+        with open(path, 'rb') as f:
+            f.seek(chunk["pos"])
+            return zlib.decompress(f.read(chunk["length"]))
+
+    @classmethod
+    def sector_hashes(cls, data):
+        return [hashlib.md5(data[i:i + cls.SECTOR_SIZE]).hexdigest()
+                for i in range(0, len(data), cls.SECTOR_SIZE)]
+
+    # ------------------------------------------------------------------ #
+    #  Backup                                                              #
+    # ------------------------------------------------------------------ #
+
+    def _resume_state(self, path, mac, flash_size):
+        """
+        Index to continue from, or None to start a new backup
+
+        An incomplete backup of the same board (MAC, flash size, chunk size)
+        is continued after its last indexed chunk.
+        """
+        index = self.load_index(path)
+        if index is None or not os.path.exists(path) or index.get("complete"):
+            return None
+        if (index.get("mac") != mac or index.get("flash_size") != flash_size
+                or index.get("chunk_size") != self.CHUNK_SIZE):
+            self.log("Backup incompleto de otra placa/configuración - se empieza de nuevo", "warning")
+            return None
+        return index
+
+    def backup(self, esp, path, progress_callback=None):
+        """
+        Dump the whole flash into path (resuming an interrupted backup of the same board)
+
+        Only one chunk is held in memory at a time; the index is rewritten after
+        every chunk, so at most one chunk is read again after an interruption.
+
+        Args:
+            esp: ESPLoader returned by open_session
+            path: Backup data file (the index is written next to it)
+            progress_callback: Optional callback(percent, message) for progress updates
+
+        Returns:
+            True if the backup is complete
+        """
+        flash_size = self.flash_manager.session_flash_size(esp)
+        if not flash_size:
+            self.log("No se pudo detectar el tamaño del flash - backup cancelado", "error")
+            return False
+        mac = self.flash_manager.read_mac(esp)
+
+        index = self._resume_state(path, mac, flash_size)
+        if index is None:
+            index = {
+                "version": self.FORMAT_VERSION,
+                "chip": esp.CHIP_NAME.lower().replace('-', ''),
+                "mac": mac,
+                "flash_size": flash_size,
+                "chunk_size": self.CHUNK_SIZE,
+                "sector_size": self.SECTOR_SIZE,
+                "created": time.time(),
+                "complete": False,
+                "chunks": [],
+            }
+            mode = 'wb'
+        else:
+            mode = 'r+b'
+            self.log(f"Reanudando backup en 0x{len(index['chunks']) * self.CHUNK_SIZE:X} "
+                     f"({len(index['chunks'])} bloque(s) ya guardados)", "info")
+
+        chunks = index["chunks"]
+        end_pos = chunks[-1]["pos"] + chunks[-1]["length"] if chunks else 0
+        offset = len(chunks) * self.CHUNK_SIZE
+        t = time.time()
+        read_bytes = 0
+
+        with open(path, mode) as f:
+            # Anything after the last indexed chunk is a partial write from the interruption
+            f.truncate(end_pos)
+            f.seek(end_pos)
+            while offset < flash_size:
+                size = min(self.CHUNK_SIZE, flash_size - offset)
+                data = self._read_chunk(esp, offset, size)
+                if data is None:
+                    self.log(f"Backup interrumpido en 0x{offset:X} - vuelve a ejecutarlo para reanudar", "error")
+                    return False
+
+                compressed = zlib.compress(data, self.LEVEL)
+                f.write(compressed)
+                f.flush()
+                os.fsync(f.fileno())
+                chunks.append({
+                    "offset": offset,
+                    "size": size,
+                    "pos": end_pos,
+                    "length": len(compressed),
+                    "md5": hashlib.md5(data).hexdigest(),
+                    "sectors": self.sector_hashes(data),
+                })
+                self._save_index(path, index)
+                end_pos += len(compressed)
+                offset += size
+                read_bytes += size
+
+                if progress_callback:
+                    percent = 100.0 * offset / flash_size
+                    progress_callback(percent, f"Leyendo flash 0x{offset:08x}... ({percent:.1f}%)")
+
+        index["complete"] = True
+        index["finished"] = time.time()
+        self._save_index(path, index)
+        elapsed = time.time() - t
+        rate = read_bytes / 1024 / elapsed if elapsed else 0
+        self.log(f"Backup completo: {flash_size // 1024} KB → {end_pos // 1024} KB comprimido "
+                 f"({rate:.1f} KB/s)", "success")
+        return True
+
+    def _read_chunk(self, esp, offset, size):
+        """One checksummed read, retried on transient link errors"""
+        for attempt in range(self.READ_RETRIES + 1):
+            try:
+                with TRACER.span("backup_read", "esptool", offset=f"0x{offset:X}", size=size):
+                    return esp.read_flash(offset, size)
+            except Exception as e:
+                self.log(f"Error leyendo 0x{offset:X} (intento {attempt + 1}): {e}", "warning")
+        return None
+
+    def run(self, port, chip, baud, path, progress_callback=None):
+        """
+        Back up the board on a port, reconnecting to resume if the link drops
+
+        Returns:
+            True if the backup is complete
+        """
+        for attempt in range(self.READ_RETRIES + 1):
+            esp = self.flash_manager.open_session(port, chip, baud)
+            if esp is None:
+                self.log(f"No se pudo conectar con {port} para el backup", "error")
+                return False
+            try:
+                with TRACER.span("flash backup", "run", port=port):
+                    if self.backup(esp, path, progress_callback):
+                        return True
+            finally:
+                self.flash_manager.close_session(esp)
+            index = self.load_index(path)
+            if index is None or not index["chunks"] or attempt == self.READ_RETRIES:
+                return False
+            self.log(f"Reconectando para reanudar el backup ({attempt + 1}/{self.READ_RETRIES})...", "warning")
+        return False
+
+    # ------------------------------------------------------------------ #
+    #  Restore                                                             #
+    # ------------------------------------------------------------------ #
+
+    def diff_sectors(self, esp, path, index, progress_callback=None):
+        """
+        Offsets of the sectors whose flash content differs from the backup
+
+        Hashes are compared top-down with device-side MD5: a whole chunk first,
+        then 64 KB blocks of a differing chunk, then the recorded sector hashes
+        of a differing block - an almost identical board costs a few dozen
+        round trips instead of one per sector.
+
+        Returns:
+            Sorted list of sector offsets
+        """
+        sector = index["sector_size"]
+        differing = []
+        chunks = index["chunks"]
+        for idx, chunk in enumerate(chunks):
+            offset, size = chunk["offset"], chunk["size"]
+            if esp.flash_md5sum(offset, size) != chunk["md5"]:
+                data = self.read_chunk(path, chunk)
+                for block in range(0, size, self.DIFF_BLOCK):
+                    block_data = data[block:block + self.DIFF_BLOCK]
+                    if esp.flash_md5sum(offset + block, len(block_data)) == hashlib.md5(block_data).hexdigest():
+                        continue
+                    for pos in range(block, block + len(block_data), sector):
+                        expected = chunk["sectors"][pos // sector]
+                        if esp.flash_md5sum(offset + pos, min(sector, size - pos)) != expected:
+                            differing.append(offset + pos)
+            if progress_callback:
+                percent = 100.0 * (idx + 1) / len(chunks)
+                progress_callback(percent, f"Comparando sectores 0x{offset + size:08x}... ({percent:.1f}%)")
+        return differing
+
+    @classmethod
+    def coalesce(cls, sectors, sector_size, max_run=None):
+        """
+        Merge adjacent sector offsets into (offset, size) write runs
+
+        Args:
+            sectors: Sorted sector offsets
+            sector_size: Bytes per sector
+            max_run: Maximum run size (default MAX_RUN)
+        """
+        max_run = max_run or cls.MAX_RUN
+        runs = []
+        for offset in sectors:
+            if runs and runs[-1][0] + runs[-1][1] == offset and runs[-1][1] + sector_size <= max_run:
+                runs[-1] = (runs[-1][0], runs[-1][1] + sector_size)
+            else:
+                runs.append((offset, sector_size))
+        return runs
+
+    @classmethod
+    def read_range(cls, path, index, offset, size):
+        """Backup bytes of [offset, offset + size) (may span chunks)"""
+        chunk_size = index["chunk_size"]
+        parts = []
+        end = offset + size
+        for chunk in index["chunks"][offset // chunk_size:(end - 1) // chunk_size + 1]:
+            data = cls.read_chunk(path, chunk)
+            start = max(offset, chunk["offset"]) - chunk["offset"]
+            stop = min(end, chunk["offset"] + chunk["size"]) - chunk["offset"]
+            parts.append(data[start:stop])
+        return b"".join(parts)
+
+    def restore(self, esp, path, progress_callback=None):
+        """
+        Restore a complete backup, writing only the sectors that differ
+
+        Args:
+            esp: ESPLoader returned by open_session
+            path: Backup data file
+            progress_callback: Optional callback(percent, message) for progress updates
+
+        Returns:
+            True if the flash matches the backup afterwards
+        """
+        index = self.load_index(path)
+        if index is None or not index.get("complete"):
+            self.log("El backup no existe o está incompleto - no se puede restaurar", "error")
+            return False
+        flash_size = self.flash_manager.session_flash_size(esp)
+        if flash_size and flash_size < index["flash_size"]:
+            self.log(f"El flash del chip ({flash_size // 1024} KB) es menor que el backup "
+                     f"({index['flash_size'] // 1024} KB)", "error")
+            return False
+        mac = self.flash_manager.read_mac(esp)
+        if index.get("mac") and mac and mac != index["mac"]:
+            self.log(f"El backup es de otra placa ({index['mac']}), se restaura en {mac}", "warning")
+
+        t = time.time()
+        with TRACER.span("restore_diff", "esptool"):
+            sectors = self.diff_sectors(esp, path, index, progress_callback)
+        runs = self.coalesce(sectors, index["sector_size"])
+        changed = sum(size for _, size in runs)
+        self.log(f"{len(sectors)} de {index['flash_size'] // index['sector_size']} sectores difieren "
+                 f"({changed // 1024} KB en {len(runs)} escritura(s)) - comparación en {time.time() - t:.1f}s",
+                 "info")
+
+        written = 0
+        for offset, size in runs:
+            data = self.read_range(path, index, offset, size)
+            payload = CompressedPayload(hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest(),
+                                        len(data), self.LEVEL, zlib.compress(data, self.LEVEL))
+            if not self.flash_manager.write_payload(esp, offset, payload, label="restore"):
+                self.log(f"Error restaurando 0x{offset:X}-0x{offset + size:X}", "error")
+                return False
+            written += size
+            if progress_callback and changed:
+                percent = 100.0 * written / changed
+                progress_callback(percent, f"Restaurando 0x{offset:08x}... ({percent:.1f}%)")
+
+        self.log(f"Restauración completa en {time.time() - t:.1f}s "
+                 f"({changed // 1024} KB escritos de {index['flash_size'] // 1024} KB)", "success")
+        return True
+
+    def run_restore(self, port, chip, baud, path, progress_callback=None):
+        """Open a session, restore the backup and reset the board (see restore)"""
+        esp = self.flash_manager.open_session(port, chip, baud)
+        if esp is None:
+            self.log(f"No se pudo conectar con {port} para restaurar", "error")
+            return False
+        try:
+            with TRACER.span("flash restore", "run", port=port):
+                return self.restore(esp, path, progress_callback)
+        finally:
+            self.flash_manager.close_session(esp)
@@ -0,0 +1,903 @@
+"""
+Flash Farm: coordinator and station agents
+The coordinator queues flash jobs and hands each one to the ready station port
+with the best measured throughput. Station agents run the local JobScheduler on
+their own ports and report progress, timings and device records back over TCP.
+Firmware travels once per station, by SHA-256, into each side's ArtifactStore.
+
+Usage:
+    python flash_farm.py coordinator --listen 0.0.0.0:7600 --firmware firmware.bin --chip esp32s3 [--count 20]
+    python flash_farm.py agent --coordinator 192.168.1.10:7600 [--name estacion-2] [--ports COM3,COM4]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+
+from artifact_store import ArtifactStore
+from job_scheduler import JobScheduler, FlashPlan, FlashJob
+
+
+DEFAULT_PORT = 7600
+
+
+# ---------------------------------------------------------------------- #
+#  Wire format                                                             #
+# ---------------------------------------------------------------------- #
+
+class Connection:
+    """
+    Framed messages over one TCP socket: a JSON header plus an optional
+    binary payload (firmware blobs), each frame prefixed with both lengths
+    """
+
+    HEADER = struct.Struct("!II")
+    MAX_HEADER = 1 << 20
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self.peer = "%s:%s" % sock.getpeername()[:2]
+
+    def send(self, message, payload=b""):
+        header = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        with self._send_lock:
+            self.sock.sendall(self.HEADER.pack(len(header), len(payload)) + header + payload)
+
+    def _recv_exact(self, size):
+        chunks = []
+        while size:
+            chunk = self.sock.recv(min(size, 1 << 16))
+            if not chunk:
+                raise ConnectionError("conexión cerrada")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def receive(self):
+        """(message, payload) - raises ConnectionError when the peer goes away"""
+        header_len, payload_len = self.HEADER.unpack(self._recv_exact(self.HEADER.size))
+        if header_len > self.MAX_HEADER:
+            raise ConnectionError(f"cabecera demasiado grande ({header_len} bytes)")
+        message = json.loads(self._recv_exact(header_len).decode('utf-8'))
+        return message, self._recv_exact(payload_len) if payload_len else b""
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def parse_address(value, default_port=DEFAULT_PORT):
+    """'host:port' / 'host' -> (host, port)"""
+    host, _, port = value.rpartition(':') if ':' in value else (value, '', '')
+    return host or "127.0.0.1", int(port) if port else default_port
+
+
+def _default_logger(message, level='info'):
+    """Default logger - just prints to console"""
+    prefix = {
+        'info': '📝',
+        'success': '✅',
+        'error': '❌',
+        'warning': '⚠️',
+        'debug': '🔍'
+    }.get(level, '•')
+    print(f"{prefix} {message}")
+
+
+# ---------------------------------------------------------------------- #
+#  Coordinator                                                             #
+# ---------------------------------------------------------------------- #
+
+class FarmJob:
+    """One board to flash somewhere in the farm"""
+
+    QUEUED = FlashJob.QUEUED
+    ASSIGNED = "assigned"
+    RUNNING = FlashJob.RUNNING
+    RETRYING = FlashJob.RETRYING
+    DONE = FlashJob.DONE
+    REJECTED = FlashJob.REJECTED
+    FINAL = (DONE, REJECTED)
+
+    def __init__(self, job_id, plan, project=None, station=None, port=None):
+        self.id = job_id
+        self.plan = plan                  # wire plan (files by SHA-256)
+        self.project = project
+        self.target_station = station     # None = any station
+        self.target_port = port           # None = any port of the station
+        self.auto = False                 # Created by run_plan for a ready board
+        self.station = None
+        self.port = None
+        self.state = self.QUEUED
+        self.stage = None
+        self.progress = 0.0
+        self.mac = None
+        self.flash_id = None
+        self.skipped = False
+        self.error = None
+        self.timings = []
+        self.created = time.time()
+        self.assigned = None
+        self.finished = None
+
+    @property
+    def cycle_time(self):
+        if self.assigned and self.finished:
+            return self.finished - self.assigned
+        return None
+
+    def to_dict(self):
+        return {"id": self.id, "project": self.project, "state": self.state, "stage": self.stage,
+                "progress": round(self.progress, 3), "station": self.station, "port": self.port,
+                "mac": self.mac, "flash_id": self.flash_id, "skipped": self.skipped, "error": self.error,
+                "timings": [[name, round(seconds, 4)] for name, seconds in self.timings],
+                "created": self.created, "assigned": self.assigned, "finished": self.finished}
+
+    def __repr__(self):
+        return f"FarmJob(#{self.id} {self.state} {self.station or '-'}:{self.port or '-'})"
+
+
+class StationPort:
+    """A port of a station agent and how fast it has been flashing"""
+
+    READY = "ready"        # board connected, waiting for a job
+    BUSY = "busy"
+    FLASHED = "flashed"    # board done and still connected (ready again when re-plugged or swapped)
+
+    def __init__(self, station, port):
+        self.station = station
+        self.port = port
+        self.state = self.READY
+        self.cycle_ewma = None
+        self.done = 0
+        self.failed = 0
+        self.last_mac = None   # Board of the last finished job (fixed ports keep it in place)
+
+    @property
+    def throughput_per_hour(self):
+        return 3600.0 / self.cycle_ewma if self.cycle_ewma else None
+
+    def to_dict(self):
+        return {"station": self.station, "port": self.port, "state": self.state, "done": self.done,
+                "failed": self.failed, "cycle_s": round(self.cycle_ewma, 2) if self.cycle_ewma else None,
+                "throughput_per_hour": round(self.throughput_per_hour, 1) if self.cycle_ewma else None}
+
+
+class Coordinator:
+    """Accepts station agents and assigns queued jobs to their ready ports"""
+
+    EWMA_ALPHA = 0.3  # Weight of the latest cycle time in a port's average
+    RECLAIM_GRACE_S = 45.0  # A lost station's jobs wait this long for it to reconnect and claim them
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, store=None, history=None,
+                 logger=None, on_job_update=None):
+        """
+        Initialize coordinator
+
+        Args:
+            host: Interface to listen on ('127.0.0.1' for a local test farm)
+            port: TCP port (0 = any free port, see address after start())
+            store: ArtifactStore the plan files are served from (default: .artifacts next to this file)
+            history: Optional DeviceHistory receiving every finished board
+            logger: Optional logger callback function(message, level='info')
+            on_job_update: Optional callback(FarmJob) on every change (network threads)
+        """
+        self.host = host
+        self.port = port
+        self.store = store or ArtifactStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".artifacts"))
+        self.history = history
+        self.logger = logger or _default_logger
+        self.on_job_update = on_job_update
+
+        self._lock = threading.Lock()
+        self._ids = 0
+        self.jobs = []
+        self.stations = {}            # name -> Connection
+        self.ports = {}               # (station, port) -> StationPort
+        self.auto_plan = None         # (wire plan, project, boards left or None) - one job per ready board
+        self._gone = {}               # station -> monotonic deadline to reconnect and claim its jobs
+        self._server = None
+        self._stop = threading.Event()
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    # ------------------------------------------------------------------ #
+    #  Plans                                                               #
+    # ------------------------------------------------------------------ #
+
+    def wire_plan(self, plan):
+        """FlashPlan -> JSON plan whose files are store blobs (added to the store here)"""
+        def blob(path, ref):
+            return self.store.put(path, ref=ref).sha256 if path else None
+        return {"chip": plan.chip, "baud": plan.baud, "erase_mode": plan.erase_mode,
+                "preserve_nvs": plan.preserve_nvs, "skip_if_current": plan.skip_if_current,
+                "erase_partitions": list(plan.erase_partitions),
+                "partitions": blob(plan.partitions_path, "farm:partitions"),
+                "files": [[addr, blob(path, f"farm:{description}"), description]
+                          for addr, path, description in plan.files]}
+
+    @staticmethod
+    def app_hash(wire):
+        """SHA-256 of the plan's application image"""
+        for _, sha256, description in wire["files"]:
+            if "Firmware" in (description or ""):
+                return sha256
+        return wire["files"][-1][1] if wire["files"] else None
+
+    # ------------------------------------------------------------------ #
+    #  Jobs                                                                #
+    # ------------------------------------------------------------------ #
+
+    def _new_job(self, wire, project, station=None, port=None):
+        """Create a job (caller holds the lock)"""
+        self._ids += 1
+        job = FarmJob(self._ids, wire, project, station, port)
+        self.jobs.append(job)
+        return job
+
+    def submit(self, plan, project=None, station=None, port=None):
+        """
+        Queue one board
+
+        Args:
+            plan: FlashPlan with local file paths
+            project: Project name for the device records
+            station, port: Pin the job to a station (and port); None = best free port
+
+        Returns:
+            FarmJob
+        """
+        wire = self.wire_plan(plan)
+        with self._lock:
+            job = self._new_job(wire, project, station, port)
+        self.log(f"Trabajo #{job.id} en cola", "info")
+        self._dispatch()
+        return job
+
+    def run_plan(self, plan, project=None, count=None):
+        """Flash every board that becomes ready with this plan (count boards, None = until stopped)"""
+        wire = self.wire_plan(plan)
+        with self._lock:
+            self.auto_plan = [wire, project, count]
+        self._dispatch()
+
+    def job(self, job_id):
+        with self._lock:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    def _dispatch(self):
+        """
+        Assign queued jobs to ready ports, fastest port first
+
+        Ports never measured go first (unknown cycle time counts as 0), so
+        every port gets measured before the load follows throughput.
+        """
+        assignments = []
+        with self._lock:
+            ready = [p for p in self.ports.values() if p.state == StationPort.READY]
+            for job in [j for j in self.jobs if j.state == FarmJob.QUEUED]:
+                candidates = [p for p in ready
+                              if job.target_station in (None, p.station) and job.target_port in (None, p.port)]
+                if not candidates:
+                    continue
+                best = min(candidates, key=lambda p: p.cycle_ewma or 0.0)
+                ready.remove(best)
+                assignments.append((job, best))
+            if self.auto_plan is not None:
+                wire, project, left = self.auto_plan
+                for station_port in sorted(ready, key=lambda p: p.cycle_ewma or 0.0):
+                    if left is not None and left <= 0:
+                        break
+                    job = self._new_job(wire, project)
+                    job.auto = True
+                    assignments.append((job, station_port))
+                    if left is not None:
+                        left -= 1
+                self.auto_plan[2] = left
+            for job, station_port in assignments:
+                station_port.state = StationPort.BUSY
+                job.state = FarmJob.ASSIGNED
+                job.station, job.port = station_port.station, station_port.port
+                job.assigned = time.time()
+            connections = {job.id: self.stations.get(job.station) for job, _ in assignments}
+
+        for job, station_port in assignments:
+            self.log(f"Trabajo #{job.id} → {job.station}:{job.port}"
+                     f"{f' (~{station_port.cycle_ewma:.0f}s/placa)' if station_port.cycle_ewma else ''}", "info")
+            message = {"type": "assign", "job": job.id, "port": job.port, "plan": job.plan, "project": job.project}
+            if job.auto and station_port.last_mac:
+                # A fixed port is offered again while the flashed board is still in place:
+                # the agent cancels the job unless another board is there now
+                message["exclude_macs"] = [station_port.last_mac]
+            try:
+                connections[job.id].send(message)
+            except (OSError, AttributeError) as e:
+                self.log(f"No se pudo enviar el trabajo #{job.id} a {job.station}: {e}", "warning")
+                self._requeue(job)
+            self._notify(job)
+
+    def _requeue(self, job):
+        with self._lock:
+            job.state = FarmJob.QUEUED
+            job.station = job.port = job.assigned = None
+            job.stage, job.progress = None, 0.0
+
+    def _notify(self, job):
+        if self.on_job_update:
+            try:
+                self.on_job_update(job)
+            except Exception as e:
+                self.log(f"Error en callback de trabajo: {e}", "debug")
+
+    # ------------------------------------------------------------------ #
+    #  Network                                                             #
+    # ------------------------------------------------------------------ #
+
+    def start(self):
+        """Listen for agents in the background"""
+        self._stop.clear()
+        self._server = socket.create_server((self.host, self.port), reuse_port=False)
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True, name="farm-accept").start()
+        self.log(f"Coordinador escuchando en {self.host}:{self.port}", "info")
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            connections = list(self.stations.values())
+        for connection in connections:
+            connection.close()
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(Connection(sock),), daemon=True,
+                             name="farm-agent").start()
+
+    def _serve(self, connection):
+        """One agent connection: hello first, then its reports"""
+        station = None
+        try:
+            message, _ = connection.receive()
+            if message.get("type") != "hello" or not message.get("station"):
+                raise ConnectionError("se esperaba hello")
+            station = message["station"]
+            claimed = set(message.get("jobs", []))
+            with self._lock:
+                previous = self.stations.get(station)
+                self.stations[station] = connection
+                self._gone.pop(station, None)
+                for port in message.get("ports", []):
+                    self.ports.setdefault((station, port), StationPort(station, port)).state = StationPort.READY
+                # Jobs the agent still runs (or finished while disconnected) stay with it;
+                # the ones it does not know about were lost with the old connection
+                lost = []
+                for job in self.jobs:
+                    if job.station != station or job.state in FarmJob.FINAL:
+                        continue
+                    if job.id in claimed:
+                        self.ports.setdefault((station, job.port),
+                                              StationPort(station, job.port)).state = StationPort.BUSY
+                    else:
+                        lost.append(job)
+            if previous is not None:
+                previous.close()
+            self.log(f"Estación {station} conectada desde {connection.peer} "
+                     f"({len(message.get('ports', []))} puerto(s) listos"
+                     f"{f', {len(claimed)} trabajo(s) en curso' if claimed else ''})", "success")
+            for job in lost:
+                self.log(f"Trabajo #{job.id} reencolado (la estación {station} no lo tiene)", "warning")
+                self._requeue(job)
+                self._notify(job)
+            self._dispatch()
+            while not self._stop.is_set():
+                message, payload = connection.receive()
+                self._handle(station, connection, message)
+        except (ConnectionError, OSError, ValueError) as e:
+            if station and not self._stop.is_set():
+                self.log(f"Estación {station} desconectada ({e})", "warning")
+        finally:
+            connection.close()
+            if station:
+                self._station_gone(station, connection)
+
+    def _station_gone(self, station, connection):
+        """
+        Drop the station's ports; its unfinished jobs stay assigned for
+        RECLAIM_GRACE_S so a reconnecting agent can claim them (the boards keep
+        flashing meanwhile), then go to other stations
+        """
+        with self._lock:
+            if self.stations.get(station) is not connection:
+                return  # Reconnected meanwhile
+            del self.stations[station]
+            for key in [key for key in self.ports if key[0] == station]:
+                del self.ports[key]
+            pending = sum(1 for job in self.jobs if job.station == station and job.state not in FarmJob.FINAL)
+            if pending:
+                self._gone[station] = time.monotonic() + self.RECLAIM_GRACE_S
+        if pending and not self._stop.is_set():
+            self.log(f"{pending} trabajo(s) de {station} esperan su reconexión "
+                     f"({self.RECLAIM_GRACE_S:.0f}s)", "warning")
+            timer = threading.Timer(self.RECLAIM_GRACE_S, self._reclaim_expired, args=(station,))
+            timer.daemon = True
+            timer.start()
+
+    def _reclaim_expired(self, station):
+        """Grace period over: requeue the jobs of a station that did not come back"""
+        with self._lock:
+            deadline = self._gone.get(station)
+            if deadline is None or time.monotonic() < deadline:
+                return  # Reconnected (claims settled in hello) or lost again later
+            del self._gone[station]
+            orphaned = [job for job in self.jobs if job.station == station and job.state not in FarmJob.FINAL]
+        for job in orphaned:
+            self.log(f"Trabajo #{job.id} reencolado (estación {station} perdida)", "warning")
+            self._requeue(job)
+            self._notify(job)
+        self._dispatch()
+
+    def _handle(self, station, connection, message):
+        kind = message.get("type")
+        if kind == "blob_request":
+            sha256 = message.get("sha256", "")
+            path = self.store.blob_path(sha256)
+            if self.store.get(sha256) is None or not os.path.exists(path):
+                connection.send({"type": "blob", "sha256": sha256, "error": "desconocido"})
+                return
+            with open(path, 'rb') as f:
+                connection.send({"type": "blob", "sha256": sha256}, f.read())
+        elif kind == "port_ready":
+            with self._lock:
+                station_port = self.ports.setdefault((station, message["port"]), StationPort(station, message["port"]))
+                if station_port.state != StationPort.BUSY:
+                    station_port.state = StationPort.READY
+            self._dispatch()
+        elif kind == "port_gone":
+            with self._lock:
+                station_port = self.ports.get((station, message["port"]))
+                if station_port is not None and station_port.state != StationPort.BUSY:
+                    del self.ports[(station, message["port"])]
+        elif kind == "job_update":
+            self._job_update(station, message)
+        elif kind == "log":
+            self.log(f"[{station}] {message.get('message', '')}", message.get("level", "info"))
+
+    def _job_update(self, station, message):
+        job = self.job(message.get("job"))
+        if job is None or job.station != station or job.state in FarmJob.FINAL:
+            return
+        if job.auto and message.get("state") == FlashJob.FAILED:
+            self._unchanged(job)
+            return
+        for field in ("state", "stage", "progress", "mac", "flash_id", "skipped", "error"):
+            if field in message:
+                setattr(job, field, message[field])
+        # A job requeued by the station's scheduler is still the station's job
+        if job.state == FlashJob.QUEUED:
+            job.state = FarmJob.RETRYING
+        elif job.state == FlashJob.FAILED:
+            job.state = FarmJob.REJECTED
+        if message.get("timings"):
+            job.timings = [(name, seconds) for name, seconds in message["timings"]]
+        if job.state in FarmJob.FINAL:
+            job.finished = time.time()
+            self._finish(job)
+        self._notify(job)
+
+    def _unchanged(self, job):
+        """
+        An auto job found the board already flashed on its port: forget the job
+        and give its board back to the auto plan (no record, no count)
+        """
+        with self._lock:
+            self.jobs.remove(job)
+            station_port = self.ports.get((job.station, job.port))
+            if station_port is not None:
+                station_port.state = StationPort.FLASHED
+            if self.auto_plan is not None and self.auto_plan[2] is not None:
+                self.auto_plan[2] += 1
+        self.log(f"{job.station}:{job.port} sin placa nueva todavía", "debug")
+
+    def _finish(self, job):
+        """Update the port's throughput, free it and record the board"""
+        with self._lock:
+            station_port = self.ports.get((job.station, job.port))
+            if station_port is not None:
+                station_port.state = StationPort.FLASHED
+                station_port.last_mac = job.mac or station_port.last_mac
+                if job.state == FarmJob.DONE:
+                    station_port.done += 1
+                    cycle = job.cycle_time
+                    station_port.cycle_ewma = cycle if station_port.cycle_ewma is None else \
+                        self.EWMA_ALPHA * cycle + (1 - self.EWMA_ALPHA) * station_port.cycle_ewma
+                else:
+                    station_port.failed += 1
+        level = "success" if job.state == FarmJob.DONE else "error"
+        self.log(f"Trabajo #{job.id} {job.state} en {job.station}:{job.port} "
+                 f"({job.cycle_time:.1f}s){f' MAC {job.mac}' if job.mac else ''}"
+                 f"{f' - {job.error}' if job.error else ''}", level)
+        if self.history is not None:
+            from device_history import DeviceHistory
+            result = DeviceHistory.RESULT_REJECTED if job.state == FarmJob.REJECTED else \
+                DeviceHistory.RESULT_SKIPPED if job.skipped else DeviceHistory.RESULT_OK
+            self.history.record(job.mac, result, chip=job.plan["chip"], flash_id=job.flash_id,
+                                project=job.project, firmware_hash=self.app_hash(job.plan),
+                                port=f"{job.station}:{job.port}", stage_timings=job.timings)
+
+    # ------------------------------------------------------------------ #
+    #  Metrics                                                             #
+    # ------------------------------------------------------------------ #
+
+    def stats(self):
+        """Farm totals plus per-port throughput"""
+        with self._lock:
+            jobs = list(self.jobs)
+            ports = sorted(self.ports.values(), key=lambda p: (p.station, p.port))
+            auto_left = self.auto_plan[2] if self.auto_plan else None
+        return {
+            "stations": len({p.station for p in ports}),
+            "queued": sum(1 for j in jobs if j.state == FarmJob.QUEUED),
+            "running": sum(1 for j in jobs if j.state in (FarmJob.ASSIGNED, FarmJob.RUNNING, FarmJob.RETRYING)),
+            "done": sum(1 for j in jobs if j.state == FarmJob.DONE),
+            "rejected": sum(1 for j in jobs if j.state == FarmJob.REJECTED),
+            "auto_left": auto_left,
+            "throughput_per_hour": round(sum(p.throughput_per_hour or 0 for p in ports), 1),
+            "ports": [p.to_dict() for p in ports],
+        }
+
+    def idle(self):
+        """True when nothing is queued or running (and an auto plan, if any, is used up)"""
+        stats = self.stats()
+        return not stats["queued"] and not stats["running"] and stats["auto_left"] in (None, 0)
+
+
+# ---------------------------------------------------------------------- #
+#  Station agent                                                           #
+# ---------------------------------------------------------------------- #
+
+class StationAgent:
+    """Headless station: runs the coordinator's jobs on the local ports"""
+
+    RECONNECT_MAX = 30.0
+    BLOB_TIMEOUT = 120.0
+    NEXT_BOARD_POLL_S = 5.0  # Fixed port still holding the flashed board: offer it again after this
+
+    def __init__(self, coordinator, name=None, flash_manager=None, ports=None, store=None,
+                 max_concurrent=4, logger=None):
+        """
+        Initialize station agent
+
+        Args:
+            coordinator: (host, port) of the coordinator
+            name: Station name (default: host name)
+            flash_manager: FlashManager for the local ports (default: one with baud negotiation and stage timings)
+            ports: Fixed list of ports (also rfc2217:// / socket:// URLs), offered again after every
+                board (auto jobs skip a board that was not swapped); None = ESP USB ports, offered
+                when a board is plugged in
+            store: ArtifactStore where firmware received from the coordinator is kept
+            max_concurrent: Boards flashed at the same time on this station
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.coordinator = coordinator
+        self.name = name or socket.gethostname()
+        self.logger = logger or _default_logger
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.store = store or ArtifactStore(os.path.join(script_dir, ".artifacts"), logger=self._local_log)
+        if flash_manager is None:
+            from flash_utils import FlashManager
+            from payload_cache import PayloadCache
+            from baud_manager import BaudManager
+            from stage_metrics import SessionMetrics
+            flash_manager = FlashManager(logger=self.log,
+                                         payload_cache=PayloadCache(self.store.compressed_dir, logger=self._local_log,
+                                                                    store=self.store),
+                                         baud_manager=BaudManager(os.path.join(script_dir, ".baud_profiles.json")),
+                                         metrics=SessionMetrics())
+        self.flash_manager = flash_manager
+        self.scheduler = JobScheduler(flash_manager, max_concurrent=max_concurrent, logger=self.log,
+                                      on_job_update=self._on_job_update)
+        self.fixed_ports = list(ports) if ports else None
+        self.watcher = None
+        if self.fixed_ports is None:
+            from hotplug_watcher import HotplugWatcher
+            self.watcher = HotplugWatcher(lambda port, info: self._port_event("port_ready", port),
+                                          lambda port: self._port_event("port_gone", port), logger=self._local_log)
+
+        self._connection = None
+        self._jobs_lock = threading.Lock()
+        self._farm_jobs = {}     # port -> farm job id running there
+        self._unreported = {}    # farm job id -> (final job_update, port) not delivered to the coordinator
+        self._blobs = {}         # sha256 -> threading.Event
+        self._stop = threading.Event()
+
+    def _local_log(self, message, level='info'):
+        self.logger(message, level)
+
+    def log(self, message, level='info'):
+        """Log locally and forward to the coordinator (except debug)"""
+        self.logger(message, level)
+        connection = self._connection
+        if connection is not None and level != 'debug':
+            try:
+                connection.send({"type": "log", "level": level, "message": message})
+            except OSError:
+                pass
+
+    def _send(self, message, payload=b""):
+        connection = self._connection
+        if connection is None:
+            return False
+        try:
+            connection.send(message, payload)
+            return True
+        except OSError:
+            return False
+
+    def ready_ports(self):
+        """Ports with a board the coordinator may use now"""
+        with self._jobs_lock:
+            busy = set(self._farm_jobs) | {port for _, port in self._unreported.values()}
+        if self.fixed_ports is not None:
+            return [port for port in self.fixed_ports if port not in busy]
+        from fleet_inventory import esp_ports
+        return [port for port in esp_ports() if port not in busy and not self.scheduler.has_pending(port)]
+
+    def claimed_jobs(self):
+        """Farm job ids this station still owns: running, or finished but not reported"""
+        with self._jobs_lock:
+            return sorted(set(self._farm_jobs.values()) | set(self._unreported))
+
+    def _port_event(self, kind, port):
+        self.log(f"{'Placa conectada' if kind == 'port_ready' else 'Placa retirada'}: {port}", "debug")
+        self._send({"type": kind, "port": port})
+
+    # ------------------------------------------------------------------ #
+    #  Connection                                                          #
+    # ------------------------------------------------------------------ #
+
+    def run(self):
+        """Serve the coordinator until stop(), reconnecting with backoff"""
+        delay = 1.0
+        if self.watcher is not None:
+            self.watcher.start()
+        while not self._stop.is_set():
+            try:
+                sock = socket.create_connection(self.coordinator, timeout=10)
+                sock.settimeout(None)
+            except OSError as e:
+                self._local_log(f"Coordinador {self.coordinator[0]}:{self.coordinator[1]} no disponible ({e}), "
+                                f"reintento en {delay:.0f}s", "warning")
+                self._stop.wait(delay)
+                delay = min(self.RECONNECT_MAX, delay * 2)
+                continue
+            delay = 1.0
+            connection = Connection(sock)
+            try:
+                connection.send({"type": "hello", "station": self.name, "ports": self.ready_ports(),
+                                 "jobs": self.claimed_jobs()})
+                self._connection = connection
+                self._local_log(f"Conectado al coordinador {connection.peer} como '{self.name}'", "success")
+                with self._jobs_lock:
+                    unreported = list(self._unreported.items())
+                for farm_id, (message, port) in unreported:
+                    if self._report_final(message, port):
+                        with self._jobs_lock:
+                            self._unreported.pop(farm_id, None)
+                while not self._stop.is_set():
+                    message, payload = connection.receive()
+                    self._handle(message, payload)
+            except (ConnectionError, OSError, ValueError) as e:
+                if not self._stop.is_set():
+                    self._local_log(f"Conexión con el coordinador perdida ({e})", "warning")
+            finally:
+                self._connection = None
+                connection.close()
+        if self.watcher is not None:
+            self.watcher.stop()
+
+    def stop(self):
+        self._stop.set()
+        connection = self._connection
+        if connection is not None:
+            connection.close()
+        self.scheduler.shutdown()
+
+    def _handle(self, message, payload):
+        kind = message.get("type")
+        if kind == "assign":
+            # Blob downloads need this reader thread: prepare the job elsewhere
+            threading.Thread(target=self._start_job, args=(message,), daemon=True,
+                             name=f"farm-job-{message.get('job')}").start()
+        elif kind == "blob":
+            sha256 = message.get("sha256")
+            if payload and not message.get("error"):
+                artifact = self.store.put_bytes(payload, ref=f"farm:{sha256}")
+                if artifact.sha256 != sha256:
+                    self._local_log(f"Blob recibido con hash distinto ({sha256[:12]})", "error")
+            event = self._blobs.get(sha256)
+            if event is not None:
+                event.set()
+
+    def _blob(self, sha256):
+        """Local path of a plan file, fetched from the coordinator when missing"""
+        if sha256 is None:
+            return None
+        artifact = self.store.get(sha256)
+        if artifact is None or not os.path.exists(artifact.path):
+            event = self._blobs.setdefault(sha256, threading.Event())
+            event.clear()
+            if not self._send({"type": "blob_request", "sha256": sha256}) or not event.wait(self.BLOB_TIMEOUT):
+                raise ConnectionError(f"no se pudo descargar {sha256[:12]}")
+            artifact = self.store.get(sha256)
+            if artifact is None:
+                raise ValueError(f"el coordinador no tiene {sha256[:12]}")
+            self._local_log(f"Firmware {sha256[:12]} recibido ({artifact.size // 1024} KB)", "debug")
+        return artifact.path
+
+    def _start_job(self, message):
+        farm_id, port, wire = message["job"], message["port"], message["plan"]
+        # The coordinator gives a port one job at a time, so the port identifies the farm job
+        # (claimed from here on if the connection drops while the firmware downloads)
+        with self._jobs_lock:
+            self._farm_jobs[port] = farm_id
+        try:
+            files = [(addr, self._blob(sha256), description) for addr, sha256, description in wire["files"]]
+            plan = FlashPlan(wire["chip"], wire["baud"], files, erase_mode=wire["erase_mode"],
+                             preserve_nvs=wire["preserve_nvs"], partitions_path=self._blob(wire.get("partitions")),
+                             skip_if_current=wire["skip_if_current"],
+                             erase_partitions=wire.get("erase_partitions", ()),
+                             exclude_macs=message.get("exclude_macs", ()))
+        except (ConnectionError, ValueError, KeyError, TypeError) as e:
+            self.log(f"Trabajo #{farm_id} no se pudo preparar: {e}", "error")
+            self._finished(farm_id, port, {"type": "job_update", "job": farm_id, "state": FarmJob.REJECTED,
+                                           "error": str(e), "timings": []})
+            return
+        self.scheduler.submit(port, plan, message.get("project"))
+
+    def _finished(self, farm_id, port, message):
+        """Report a final job_update, kept for the next connection if it cannot be sent now"""
+        with self._jobs_lock:
+            self._farm_jobs.pop(port, None)
+            self._unreported[farm_id] = (message, port)
+        if self._report_final(message, port):
+            with self._jobs_lock:
+                self._unreported.pop(farm_id, None)
+
+    def _report_final(self, message, port):
+        if not self._send(message):
+            return False
+        if self.fixed_ports is not None:
+            # No hot-plug events on fixed ports (fixtures, network bridges): offer the port again,
+            # after a pause if the previous board is still there
+            if message.get("state") == FlashJob.FAILED:
+                timer = threading.Timer(self.NEXT_BOARD_POLL_S, self._port_event, args=("port_ready", port))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._send({"type": "port_ready", "port": port})
+        return True
+
+    def _on_job_update(self, job):
+        """Scheduler worker callback: report state, stage progress and, at the end, timings"""
+        with self._jobs_lock:
+            farm_id = self._farm_jobs.get(job.port)
+        if farm_id is None:
+            return
+        stages = self.scheduler.stages(job.plan)
+        message = {"type": "job_update", "job": farm_id, "state": job.state, "stage": job.stage,
+                   "progress": job.stage_index / len(stages) if stages else 0.0, "mac": job.mac,
+                   "flash_id": job.flash_id, "skipped": job.skipped, "error": job.error}
+        if job.state in (FlashJob.DONE, FlashJob.REJECTED, FlashJob.FAILED):
+            message["timings"] = [[name, seconds] for name, seconds in job.timings]
+            self._finished(farm_id, job.port, message)
+        else:
+            self._send(message)
+
+
+# ---------------------------------------------------------------------- #
+#  CLI                                                                     #
+# ---------------------------------------------------------------------- #
+
+def _build_plan(args):
+    """FlashPlan from the coordinator command line"""
+    if args.mode == "simple":
+        # Address resolved by each agent from the partition table
+        files = [(None, args.firmware, "Firmware (app)")]
+    else:
+        from esptool.targets import CHIP_DEFS
+        from partition_table import load_partition_table
+        table = load_partition_table(args.partitions)
+        app = table.boot_app() if table else None
+        files = []
+        if args.bootloader:
+            files.append((CHIP_DEFS[args.chip].BOOTLOADER_FLASH_OFFSET, args.bootloader, "Bootloader (2nd stage)"))
+        if args.partitions:
+            files.append((0x8000, args.partitions, "Partition Table"))
+        files.append((app.offset if app else 0x10000, args.firmware, "Firmware (app)"))
+    return FlashPlan(args.chip, args.baud, files, erase_mode=args.mode, preserve_nvs=not args.erase_nvs,
+                     partitions_path=args.partitions, skip_if_current=args.skip_if_current)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Granja de flasheo: coordinador y agentes de estación")
+    sub = parser.add_subparsers(dest="role", required=True)
+
+    coordinator = sub.add_parser("coordinator", help="Reparte trabajos entre las estaciones")
+    coordinator.add_argument("--listen", default=f"0.0.0.0:{DEFAULT_PORT}", help="host:puerto de escucha")
+    coordinator.add_argument("--firmware", required=True, help="Imagen de la aplicación")
+    coordinator.add_argument("--bootloader", default=None)
+    coordinator.add_argument("--partitions", default=None, help="Tabla de particiones (.bin o .csv)")
+    coordinator.add_argument("--chip", default="esp32s3")
+    coordinator.add_argument("--baud", default="auto")
+    coordinator.add_argument("--mode", choices=("simple", "complete", "none"), default="simple")
+    coordinator.add_argument("--erase-nvs", action="store_true", help="No preservar NVS en modo completo")
+    coordinator.add_argument("--skip-if-current", action="store_true")
+    coordinator.add_argument("--count", type=int, default=None, help="Placas a flashear (por defecto: sin límite)")
+    coordinator.add_argument("--history", default=None, help="Base de datos SQLite de dispositivos")
+
+    agent = sub.add_parser("agent", help="Flashea en los puertos locales lo que asigne el coordinador")
+    agent.add_argument("--coordinator", required=True, help="host:puerto del coordinador")
+    agent.add_argument("--name", default=None, help="Nombre de la estación (por defecto: nombre del equipo)")
+    agent.add_argument("--ports", default=None, help="Puertos fijos separados por comas (por defecto: placas ESP USB)")
+    agent.add_argument("--concurrent", type=int, default=4, help="Placas en paralelo en esta estación")
+    args = parser.parse_args(argv)
+
+    if args.role == "agent":
+        ports = [p.strip() for p in args.ports.split(',') if p.strip()] if args.ports else None
+        station = StationAgent(parse_address(args.coordinator), args.name, ports=ports,
+                               max_concurrent=args.concurrent)
+        try:
+            station.run()
+        except KeyboardInterrupt:
+            station.stop()
+        return 0
+
+    history = None
+    if args.history:
+        from device_history import DeviceHistory
+        history = DeviceHistory(args.history)
+    host, port = parse_address(args.listen)
+    farm = Coordinator(host, port, history=history)
+    farm.start()
+    farm.run_plan(_build_plan(args), os.path.splitext(os.path.basename(args.firmware))[0], args.count)
+    try:
+        while not (args.count is not None and farm.idle()):
+            time.sleep(5)
+            stats = farm.stats()
+            print(f"📊 {stats['stations']} estación(es) · {stats['running']} en curso · {stats['done']} ok · "
+                  f"{stats['rejected']} rechazadas · {stats['throughput_per_hour']:.0f} placas/h")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        farm.stop()
+    stats = farm.stats()
+    for entry in stats["ports"]:
+        print(f"  {entry['station']}:{entry['port']:<24} {entry['done']:>4} ok {entry['failed']:>3} fallos  "
+              f"{entry['cycle_s'] or '-'} s/placa")
+    return 0 if not stats["rejected"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,19 +8,65 @@ import sys
 import re
 import os
 import shutil
+import time
+import zlib
+import hashlib
+import struct
+import threading
+from collections import deque
+
+from tracing import TRACER
+from network_ports import is_network_port, supports_baud_change, tune
+
+
+def list_serial_ports(extra=()):
+    """
+    Enumerate serial ports (same source as the GUI port selector)
+    
+    Args:
+        extra: (url, description) network endpoints appended after the local ports
+    
+    Returns:
+        List of (device, description) tuples
+    """
+    import serial.tools.list_ports
+    return [(port.device, port.description) for port in serial.tools.list_ports.comports()] + list(extra)
 
 
 class FlashManager:
     """Manages ESP32 firmware and SPIFFS flashing"""
     
-    def __init__(self, logger=None):
+    DEFAULT_BAUD = 460800
+    ROM_BAUD = 115200
+    PROBE_SIZE = 0x4000  # Bytes read back to validate a negotiated baud rate
+    RESUME_ALIGN = 0x1000       # Resumed writes start on a flash sector (erase unit)
+    RESUME_BACKOFF = 0x10000    # Second resume candidate, in case the stub had not flushed its buffer
+    DELTA_BLOCK = 0x10000       # Delta writes compare 64 KB blocks first...
+    DELTA_SECTOR = 0x1000       # ...then the 4 KB sectors of the blocks that differ
+    DELTA_MAX_CHANGED = 0.5     # Above this fraction of differing blocks a full write is cheaper
+    PIPELINE_DEPTH = 2          # Requests in flight on network ports (the stub buffers one command while running another)
+    
+    def __init__(self, logger=None, payload_cache=None, baud_manager=None, metrics=None):
         """
         Initialize flash manager
         
         Args:
             logger: Optional logger callback function(message, level='info')
+            payload_cache: Optional PayloadCache shared between flash operations.
+                When set, payloads are compressed once and streamed pre-compressed
+                over an in-process esptool session.
+            baud_manager: Optional BaudManager used to negotiate and remember
+                the fastest stable baud rate per port.
+            metrics: Optional SessionMetrics; session operations are timed as
+                stages of the calling thread's current run.
         """
         self.logger = logger or self._default_logger
+        self.payload_cache = payload_cache
+        self.baud_manager = baud_manager
+        self.metrics = metrics
+        # (port, address, image MD5) -> bytes the device acknowledged before a write failed
+        self._resume_points = {}
+        self._resume_lock = threading.Lock()
     
     @staticmethod
     def _default_logger(message, level='info'):
@@ -38,6 +84,10 @@ class FlashManager:
         """Log a message"""
         self.logger(message, level)
     
+    def _stage(self, name):
+        """Context manager timing a stage (trace span only without metrics)"""
+        return self.metrics.stage(name) if self.metrics is not None else TRACER.span(name, "esptool")
+    
     def flash_binary(self, port, chip, baud, binary_path, offset, 
                      flash_mode='dio', flash_freq='40m', 
                      progress_callback=None):
@@ -61,6 +111,18 @@ class FlashManager:
             self.log(f"Binary file not found: {binary_path}", "error")
             return False
         
+        # Fast path: stream the cached pre-compressed payload in-process
+        if self.payload_cache is not None and self.esptool_available():
+            addr_int = offset if isinstance(offset, int) else int(str(offset), 16)
+            esp = self.open_session(port, chip, baud)
+            if esp is not None:
+                try:
+                    payload = self.payload_cache.get(binary_path)
+                    return self.write_payload(esp, addr_int, payload, progress_callback)
+                finally:
+                    self.close_session(esp)
+            self.log("Session open failed, falling back to esptool subprocess", "warning")
+        
         try:
             python_exe = shutil.which('pythonw') or shutil.which('python') or sys.executable
             
@@ -77,7 +139,7 @@ class FlashManager:
                 python_exe, "-m", "esptool",
                 "--chip", chip,
                 "--port", port,
-                "--baud", str(baud),
+                "--baud", str(self.resolve_baud(port, baud)),
                 "--before", "default-reset",
                 "--after", "hard-reset",
                 "write-flash",
@@ -90,32 +152,33 @@ class FlashManager:
             
             self.log(f"Command: {' '.join(cmd)}", "debug")
             
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
-            
-            # Read output
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    line = line.strip()
-                    
-                    # Extract progress percentage
-                    match = re.search(r'(\d+\.\d+)%', line)
-                    if match and progress_callback:
-                        percent = float(match.group(1))
-                        progress_callback(percent, line)
-                    
-                    # Log important lines
-                    if any(x in line for x in ['Connecting', 'Erasing', 'Writing', 'Hash', 'Uploading']):
-                        self.log(line, "debug")
-                        if progress_callback:
-                            progress_callback(None, line)
-            
-            process.wait()
+            with TRACER.span("esptool write-flash (subprocess)", "subprocess", port=port, offset=offset_str):
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1
+                )
+                
+                # Read output
+                for line in iter(process.stdout.readline, ''):
+                    if line:
+                        line = line.strip()
+                        
+                        # Extract progress percentage
+                        match = re.search(r'(\d+\.\d+)%', line)
+                        if match and progress_callback:
+                            percent = float(match.group(1))
+                            progress_callback(percent, line)
+                        
+                        # Log important lines
+                        if any(x in line for x in ['Connecting', 'Erasing', 'Writing', 'Hash', 'Uploading']):
+                            self.log(line, "debug")
+                            if progress_callback:
+                                progress_callback(None, line)
+                
+                process.wait()
             
             if process.returncode == 0:
                 self.log(f"Flash successful: {binary_path}", "success")
@@ -156,3 +219,673 @@ class FlashManager:
             flash_freq=flash_freq,
             progress_callback=progress_callback
         )
+
+    # ------------------------------------------------------------------ #
+    #  In-process esptool session                                          #
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def esptool_available():
+        """Return True if esptool can be imported in-process"""
+        try:
+            import esptool  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def open_session(self, port, chip, baud):
+        """
+        Connect to the device once and keep the stub flasher running.
+        
+        With a baud_manager the fastest stable rate is negotiated: each rate is
+        probed with a checksummed flash read and the next lower one is tried on
+        link errors. The rate that works is remembered for the port.
+        
+        Args:
+            port: COM port (e.g., 'COM3')
+            chip: Expected chip type (e.g., 'esp32s3'), or None to accept any
+            baud: Baud rate used after the stub is loaded ('auto' to negotiate)
+            
+        Returns:
+            esptool ESPLoader (stub) instance, or None on failure
+        """
+        if not supports_baud_change(port):
+            # Raw TCP bridge: the remote UART stays at the ROM rate
+            from esptool.loader import ESPLoader
+            return self._try_open_session(port, chip, ESPLoader.ESP_ROM_BAUD)[0]
+        if self.baud_manager is None:
+            return self._try_open_session(port, chip, self.resolve_baud(port, baud))[0]
+        
+        rates = self.baud_manager.candidates(port, baud)
+        for idx, rate in enumerate(rates):
+            esp, link_error = self._try_open_session(port, chip, rate, probe=True)
+            if esp is not None:
+                self.baud_manager.record_success(port, rate)
+                return esp
+            if not link_error or idx == len(rates) - 1:
+                return None
+            self.baud_manager.record_failure(port, rate)
+        return None
+    
+    def resolve_baud(self, port, baud):
+        """
+        Concrete baud rate for a single-shot operation
+        
+        Returns the selected rate, or for 'auto' the remembered best rate for
+        the port (DEFAULT_BAUD when the port was never negotiated). Raw
+        socket:// bridges always get the ROM rate: esptool cannot change the
+        remote UART's speed through them.
+        """
+        if not supports_baud_change(port):
+            return self.ROM_BAUD
+        if str(baud).strip().lower() != "auto":
+            return int(baud)
+        if self.baud_manager is not None:
+            return self.baud_manager.best_rate(port, self.DEFAULT_BAUD)
+        return self.DEFAULT_BAUD
+    
+    def _try_open_session(self, port, chip, baud, probe=False):
+        """
+        Open a session at a fixed rate; optionally probe the link with a flash read
+        
+        Returns:
+            (esp or None, link_error) - link_error is True when the failure looks
+            speed-related, so a lower rate is worth trying
+        """
+        esp = None
+        serial_port = None
+        try:
+            from esptool.cmds import detect_chip, run_stub, attach_flash, detect_flash_size
+            from esptool.loader import ESPLoader
+            from esptool.util import flash_size_bytes
+            
+            self.log(f"Opening esptool session on {port}...", "debug")
+            TRACER.instant("open_session", "esptool", port=port, baud=baud)
+            with self._stage("port_open"):
+                serial_port = self._open_port(port)
+            with self._stage("sync"):
+                esp = detect_chip(port=serial_port, baud=ESPLoader.ESP_ROM_BAUD, connect_mode="default-reset")
+            
+            detected = esp.CHIP_NAME.lower().replace('-', '')
+            if chip and detected != chip:
+                esp._port.close()
+                self.log(f"Chip mismatch: expected {chip}, detected {detected}", "error")
+                return None, False
+            
+            with self._stage("stub_upload"):
+                esp = run_stub(esp)
+                if baud and int(baud) != ESPLoader.ESP_ROM_BAUD and supports_baud_change(port):
+                    esp.change_baud(int(baud))
+            
+            with self._stage("flash_attach"):
+                attach_flash(esp)
+                flash_size = detect_flash_size(esp)
+                if flash_size:
+                    esp.flash_set_parameters(flash_size_bytes(flash_size))
+            
+            if probe:
+                # Bulk read with MD5 digest check - fails fast on a marginal link
+                with self._stage("baud_probe"):
+                    esp.read_flash(0, self.PROBE_SIZE)
+            
+            self.log(f"Session open: {esp.CHIP_NAME} @ {baud} baud (flash {flash_size or 'unknown'})", "debug")
+            return esp, False
+        
+        except Exception as e:
+            link_error = esp is not None and self._is_link_error(e)
+            if serial_port is not None:
+                try:
+                    serial_port.close()
+                except Exception:
+                    pass
+            level = "warning" if link_error else "error"
+            self.log(f"Error opening esptool session at {baud} baud: {e}", level)
+            return None, link_error
+    
+    @staticmethod
+    def _open_port(port):
+        """
+        Open the serial port the way esptool does (so opening and syncing can
+        be timed separately); the open port is handed to detect_chip.
+        rfc2217:// and socket:// URLs open the remote port over TCP.
+        """
+        import serial
+        serial_port = serial.serial_for_url(port, exclusive=True, do_not_open=True)
+        if sys.platform == "win32":
+            # RTS/DTR are active low: pull them high so opening doesn't reset the chip
+            serial_port.rts = False
+            serial_port.dtr = False
+        serial_port.open()
+        if is_network_port(port):
+            tune(serial_port)
+        return serial_port
+    
+    def _is_link_error(self, error):
+        if self.baud_manager is not None:
+            return self.baud_manager.is_link_error(error)
+        return False
+    
+    def close_session(self, esp, reset_mode='hard-reset'):
+        """
+        Reset the device and release the serial port
+        
+        Args:
+            esp: ESPLoader returned by open_session
+            reset_mode: esptool reset mode ('hard-reset', 'no-reset', ...)
+        """
+        if esp is None:
+            return
+        try:
+            from esptool.cmds import reset_chip
+            with self._stage("reset"):
+                reset_chip(esp, reset_mode)
+        except Exception as e:
+            self.log(f"Reset after session failed: {e}", "debug")
+        finally:
+            try:
+                esp._port.close()
+            except Exception:
+                pass
+    
+    def write_payload(self, esp, address, payload, progress_callback=None, label=None):
+        """
+        Stream a pre-compressed payload to flash and verify it with the device MD5.
+        
+        If an earlier write of the same image to the same port and address failed
+        part-way, the prefix written so far is checked with a device-side MD5 and
+        only the rest of the image is sent.
+        
+        Args:
+            esp: ESPLoader returned by open_session
+            address: Flash offset (int)
+            payload: CompressedPayload from PayloadCache
+            progress_callback: Optional callback(percent, message) for progress updates
+            label: Component name for stage timing (default: the address)
+            
+        Returns:
+            True if written and verified, False otherwise
+        """
+        key = (self._session_port(esp), address, payload.md5)
+        try:
+            from esptool.loader import DEFAULT_TIMEOUT, ERASE_WRITE_TIMEOUT_PER_MB, timeout_per_mb
+            
+            label = label or f"0x{address:X}"
+            start, data = self._resume_offset(esp, address, payload, key, label)
+            size = payload.size - start
+            block_size = esp.FLASH_WRITE_SIZE
+            num_blocks = esp.flash_defl_begin(size, len(data), address + start)
+            if start:
+                self.log(f"Resuming at 0x{address + start:X}: {start} bytes already verified, "
+                         f"writing the remaining {size} bytes ({len(data)} compressed)...", "info")
+            else:
+                self.log(f"Writing {payload.size} bytes ({payload.compressed_size} compressed, "
+                         f"cached) at 0x{address:X}...", "info")
+            
+            decompress = zlib.decompressobj()
+            timeout = DEFAULT_TIMEOUT
+            acked = start
+            t = time.time()
+            
+            with self._stage(f"write:{label}"):
+                try:
+                    for seq in range(num_blocks):
+                        block = data[seq * block_size:(seq + 1) * block_size]
+                        raw_size = len(decompress.decompress(block))
+                        # Same per-block timeout esptool computes from the real write size
+                        block_timeout = max(DEFAULT_TIMEOUT,
+                                            timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, raw_size))
+                        if not esp.IS_STUB:
+                            timeout = block_timeout
+                        esp.flash_defl_block(block, seq, timeout=timeout)
+                        acked += raw_size
+                        if esp.IS_STUB:
+                            timeout = block_timeout
+                        
+                        if progress_callback:
+                            percent = 100.0 * acked / payload.size
+                            progress_callback(percent, f"Writing at 0x{address + acked:08x}... ({percent:.1f}%)")
+                    
+                    if esp.IS_STUB:
+                        # Last block is only written once this command is acknowledged
+                        esp.flash_defl_finish(reboot=False, timeout=timeout)
+                except Exception:
+                    with self._resume_lock:
+                        self._resume_points[key] = acked
+                    raise
+            
+            elapsed = time.time() - t
+            self.log(f"Wrote {size} bytes ({len(data)} compressed) "
+                     f"at 0x{address + start:08x} in {elapsed:.1f} seconds", "debug")
+            
+            with self._stage(f"verify:{label}"):
+                device_md5 = esp.flash_md5sum(address, payload.size)
+            with self._resume_lock:
+                self._resume_points.pop(key, None)
+            if device_md5 != payload.md5:
+                self.log(f"MD5 mismatch at 0x{address:X}: file {payload.md5}, flash {device_md5}", "error")
+                return False
+            
+            self.log("Hash of data verified.", "success")
+            if progress_callback:
+                progress_callback(None, "Hash of data verified.")
+            return True
+        
+        except Exception as e:
+            self.log(f"Error writing cached payload: {e}", "error")
+            return False
+    
+    @staticmethod
+    def _session_port(esp):
+        return getattr(getattr(esp, "_port", None), "port", None)
+    
+    def _resume_offset(self, esp, address, payload, key, label):
+        """
+        Verified prefix of an interrupted write and the compressed stream of the rest
+        
+        Returns:
+            (start, data): bytes to skip (0 = write everything) and the compressed
+            data to send from address + start
+        """
+        with self._resume_lock:
+            acked = self._resume_points.get(key)
+        if not acked:
+            return 0, payload.data
+        
+        image = zlib.decompress(payload.data)
+        with self._stage(f"resume_check:{label}"):
+            for candidate in (acked, acked - self.RESUME_BACKOFF):
+                start = (address + candidate) // self.RESUME_ALIGN * self.RESUME_ALIGN - address
+                if start <= 0:
+                    break
+                try:
+                    device_md5 = esp.flash_md5sum(address, start)
+                except Exception as e:
+                    self.log(f"Could not check written prefix: {e}", "debug")
+                    break
+                if device_md5 == hashlib.md5(image[:start]).hexdigest():
+                    return start, zlib.compress(image[start:], payload.level)
+                self.log(f"Written prefix of {start} bytes does not match, trying further back", "debug")
+        
+        with self._resume_lock:
+            self._resume_points.pop(key, None)
+        return 0, payload.data
+    
+    def session_flash_size(self, esp):
+        """
+        Flash size in bytes of the chip behind an open session
+        
+        Returns:
+            Size in bytes, or None if it cannot be detected
+        """
+        try:
+            from esptool.cmds import detect_flash_size
+            from esptool.util import flash_size_bytes
+            flash_size = detect_flash_size(esp)
+            return flash_size_bytes(flash_size) if flash_size else None
+        except Exception as e:
+            self.log(f"Could not detect flash size: {e}", "debug")
+            return None
+    
+    def erase_ranges(self, esp, ranges, progress_callback=None):
+        """
+        Erase a list of ranges on an open session (one erase-region command each;
+        the stub chooses block or sector erases within a range)
+        
+        Args:
+            esp: ESPLoader returned by open_session (stub required)
+            ranges: List of EraseRange from ErasePlanner
+            progress_callback: Optional callback(percent, message) for progress updates
+            
+        Returns:
+            True if every range was erased, False otherwise
+        """
+        total = sum(r.size for r in ranges)
+        done = 0
+        try:
+            with self._stage("erase"):
+                for erase_range in ranges:
+                    self.log(f"Erasing 0x{erase_range.offset:08X}-0x{erase_range.end:08X}...", "debug")
+                    t = time.time()
+                    with TRACER.span("erase_region", "esptool", offset=f"0x{erase_range.offset:X}",
+                                     size=erase_range.size):
+                        esp.erase_region(erase_range.offset, erase_range.size)
+                    done += erase_range.size
+                    self.log(f"Erased {erase_range.size // 1024} KB in {time.time() - t:.1f} seconds", "debug")
+                    
+                    if progress_callback and total:
+                        percent = 100.0 * done / total
+                        progress_callback(percent, f"Erasing at 0x{erase_range.offset:08x}... ({percent:.1f}%)")
+            return True
+        
+        except Exception as e:
+            self.log(f"Error erasing region: {e}", "error")
+            return False
+    
+    def erase_chip(self, esp):
+        """
+        Erase the whole flash on an open session (complete erase when the
+        flash size and the partition table are both unknown)
+        
+        Returns:
+            True if the chip was erased, False otherwise
+        """
+        try:
+            with self._stage("erase"):
+                t = time.time()
+                with TRACER.span("erase_flash", "esptool"):
+                    esp.erase_flash()
+            self.log(f"Chip erased in {time.time() - t:.1f} seconds", "debug")
+            return True
+        except Exception as e:
+            self.log(f"Error erasing chip: {e}", "error")
+            return False
+    
+    def write_file(self, esp, address, filepath, progress_callback=None, label=None):
+        """
+        Write one image over an open session (cached payload, MD5 verified)
+        
+        The bootloader is written through esptool's write_flash instead, because
+        esptool patches flash mode/freq/size into its header.
+        
+        Args:
+            esp: ESPLoader returned by open_session
+            address: Flash offset (int)
+            filepath: Binary to write
+            progress_callback: Optional callback(percent, message) for progress updates
+            label: Component name for stage timing (default: file name)
+            
+        Returns:
+            True if written and verified, False otherwise
+        """
+        label = label or os.path.basename(filepath)
+        if address == esp.BOOTLOADER_FLASH_OFFSET:
+            try:
+                from esptool.cmds import write_flash
+                # write_flash verifies internally: write and verify are one stage here
+                with self._stage(f"write:{label}"):
+                    write_flash(esp, [(address, filepath)], flash_mode='dio', flash_freq='80m',
+                                flash_size='detect', compress=True)
+                return True
+            except Exception as e:
+                self.log(f"Error writing bootloader: {e}", "error")
+                return False
+        
+        if self.payload_cache is None:
+            from payload_cache import PayloadCache
+            self.payload_cache = PayloadCache(logger=self.logger)
+        payload = self.payload_cache.get(filepath)
+        return self.write_payload(esp, address, payload, progress_callback, label)
+    
+    def write_delta(self, esp, address, filepath, progress_callback=None, label=None):
+        """
+        Write only the sectors of an image that differ from what is in flash
+        
+        Device-side MD5s of the whole image, then of 64 KB blocks, then of the
+        4 KB sectors of differing blocks decide what is sent; adjacent differing
+        sectors are written as one run. When most blocks differ (a shifted
+        build) the image is written in full instead. Not for the bootloader,
+        whose header esptool patches (use write_file).
+        
+        Args:
+            esp: ESPLoader returned by open_session
+            address: Flash offset (int)
+            filepath: Binary to write
+            progress_callback: Optional callback(percent, message) for progress updates
+            label: Component name for stage timing (default: file name)
+            
+        Returns:
+            Bytes written (0 = flash already matched), or None on failure
+        """
+        from payload_cache import CompressedPayload, PayloadCache
+        
+        label = label or os.path.basename(filepath)
+        with open(filepath, 'rb') as f:
+            image = PayloadCache.pad_image(f.read())
+        try:
+            with self._stage(f"delta_diff:{label}"):
+                if esp.flash_md5sum(address, len(image)) == hashlib.md5(image).hexdigest():
+                    self.log(f"{label}: flash already matches, nothing to write", "info")
+                    return 0
+                blocks = self._differing(esp, address, image,
+                                         range(0, len(image), self.DELTA_BLOCK), self.DELTA_BLOCK)
+                if len(blocks) * self.DELTA_BLOCK > self.DELTA_MAX_CHANGED * len(image):
+                    self.log(f"{label}: {len(blocks)} 64 KB blocks differ - writing the full image", "info")
+                    return len(image) if self.write_file(esp, address, filepath, progress_callback, label) else None
+                sectors = self._differing(esp, address, image,
+                                          [pos for block in blocks for pos in
+                                           range(block, min(block + self.DELTA_BLOCK, len(image)), self.DELTA_SECTOR)],
+                                          self.DELTA_SECTOR)
+        except Exception as e:
+            self.log(f"Error comparing {label} with flash: {e}", "error")
+            return None
+        
+        runs = []
+        for pos in sectors:
+            if runs and runs[-1][0] + runs[-1][1] == pos:
+                runs[-1][1] += self.DELTA_SECTOR
+            else:
+                runs.append([pos, self.DELTA_SECTOR])
+        changed = sum(min(size, len(image) - pos) for pos, size in runs)
+        self.log(f"{label}: {len(sectors)} sector(s) differ - writing {changed // 1024} KB "
+                 f"of {len(image) // 1024} KB in {len(runs)} run(s)", "info")
+        
+        written = 0
+        for pos, size in runs:
+            data = image[pos:pos + size]
+            payload = CompressedPayload(hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest(),
+                                        len(data), PayloadCache.DEFAULT_LEVEL,
+                                        zlib.compress(data, PayloadCache.DEFAULT_LEVEL))
+            if not self.write_payload(esp, address + pos, payload, label=f"{label}+0x{pos:X}"):
+                return None
+            written += len(data)
+            if progress_callback:
+                percent = 100.0 * written / changed
+                progress_callback(percent, f"Writing delta at 0x{address + pos:08x}... ({percent:.1f}%)")
+        
+        with self._stage(f"verify:{label}"):
+            if esp.flash_md5sum(address, len(image)) != hashlib.md5(image).hexdigest():
+                self.log(f"{label}: flash MD5 does not match after the delta write", "error")
+                return None
+        return written
+    
+    def _differing(self, esp, address, image, offsets, size):
+        """Offsets (relative to address) whose size-byte slice of image differs from the flash"""
+        offsets = list(offsets)
+        ranges = [(address + pos, len(image[pos:pos + size])) for pos in offsets]
+        device = self.flash_md5_ranges(esp, ranges)
+        return [pos for pos, md5 in zip(offsets, device) if md5 != hashlib.md5(image[pos:pos + size]).hexdigest()]
+    
+    def flash_md5_ranges(self, esp, ranges):
+        """
+        Device-side MD5 of several (offset, size) flash ranges
+        
+        Over a network port with the stub loaded, the next request is sent
+        before the previous answer arrives (PIPELINE_DEPTH in flight), so the
+        TCP round trip is not paid once per range. The stub answers an MD5
+        request only after computing it, and holds one more command in its
+        second receive buffer meanwhile - data blocks are not pipelined,
+        because the stub acknowledges those before writing them.
+        
+        Returns:
+            List of lowercase hex digests, in the order of ranges
+        """
+        if not (esp.IS_STUB and is_network_port(self._session_port(esp))):
+            return [esp.flash_md5sum(offset, size) for offset, size in ranges]
+        
+        from esptool.loader import MD5_TIMEOUT_PER_MB, timeout_per_mb
+        op = esp.ESP_CMDS["SPI_FLASH_MD5"]
+        digests = []
+        pending = deque()
+        
+        def receive():
+            # The oldest answer may wait for every request queued ahead of it
+            timeout = timeout_per_mb(MD5_TIMEOUT_PER_MB, sum(pending))
+            pending.popleft()
+            digests.append(esp.check_command("calculate md5sum", None, resp_data_len=16, timeout=timeout).hex())
+        
+        for offset, size in ranges:
+            if len(pending) == self.PIPELINE_DEPTH:
+                receive()
+            esp.command(op, struct.pack("<IIII", offset, size, 0, 0), wait_response=False)
+            pending.append(size)
+        while pending:
+            receive()
+        return digests
+    
+    def read_partition_table(self, esp, offset=0x8000):
+        """
+        Read and parse the partition table from an open session
+        
+        Returns:
+            PartitionTable, or None if missing/invalid
+        """
+        from partition_table import PartitionTable
+        try:
+            with self._stage("partition_read"):
+                data = esp.read_flash(offset, PartitionTable.MAX_SIZE)
+            return PartitionTable.from_binary(data)
+        except Exception as e:
+            self.log(f"Could not read partition table: {e}", "warning")
+            return None
+    
+    def read_app_descriptor(self, esp, table=None):
+        """
+        esp_app_desc_t of the app the bootloader will start, read from an open session
+        
+        Only the otadata select entries and the first bytes of the active app
+        partition are read.
+        
+        Args:
+            esp: ESPLoader returned by open_session
+            table: PartitionTable of the device (read from flash if None)
+            
+        Returns:
+            (AppDescriptor or None, Partition or None)
+        """
+        from app_descriptor import AppDescriptor
+        from partition_table import PartitionTable
+        
+        table = table or self.read_partition_table(esp)
+        if table is None:
+            return None, None
+        try:
+            with self._stage("app_check"):
+                entries = []
+                otadata = table.otadata
+                if otadata is not None:
+                    entries = [esp.read_flash(otadata.offset + sector, PartitionTable.OTA_SELECT_ENTRY_SIZE)
+                               for sector in (0, PartitionTable.OTA_SELECT_SECTOR)]
+                app = table.active_app(entries)
+                if app is None:
+                    return None, None
+                descriptor = AppDescriptor.from_image(esp.read_flash(app.offset, AppDescriptor.READ_SIZE))
+            return descriptor, app
+        except Exception as e:
+            self.log(f"Could not read app descriptor: {e}", "warning")
+            return None, None
+    
+    def read_mac(self, esp):
+        """
+        Base MAC address of the chip behind an open session
+        
+        Returns:
+            MAC as 'aa:bb:cc:dd:ee:ff', or None
+        """
+        try:
+            with self._stage("mac_read"):
+                mac = esp.read_mac("BASE_MAC")
+            mac = ':'.join(f'{b:02x}' for b in mac) if mac else None
+            if self.metrics is not None:
+                self.metrics.set_device(mac)
+            return mac
+        except Exception as e:
+            self.log(f"Could not read MAC: {e}", "debug")
+            return None
+    
+    def read_flash_id(self, esp):
+        """
+        JEDEC ID of the SPI flash behind an open session
+        
+        Returns:
+            ID as '0xMMDDCC' (manufacturer, memory type, capacity), or None
+        """
+        try:
+            flash_id = esp.flash_id()
+            return f"0x{flash_id & 0xFF:02X}{(flash_id >> 8) & 0xFF:02X}{(flash_id >> 16) & 0xFF:02X}"
+        except Exception as e:
+            self.log(f"Could not read flash ID: {e}", "debug")
+            return None
+
+    def collect_chip_info(self, esp):
+        """
+        Chip, flash and eFuse security summary of the board behind an open session
+
+        Every value is read over the same connection; anything the chip or the
+        stub does not support is left as None.
+
+        Returns:
+            ChipInfo (mac is None if even the MAC could not be read)
+        """
+        from chip_info import ChipInfo
+
+        query = self._chip_query
+        with self._stage("chip_info"):
+            info = ChipInfo(chip=esp.CHIP_NAME.lower().replace('-', ''),
+                            description=query(esp.get_chip_description),
+                            features=query(esp.get_chip_features),
+                            crystal_mhz=query(esp.get_crystal_freq))
+            major = query(esp.get_major_chip_version)
+            minor = query(esp.get_minor_chip_version)
+            if major is not None and minor is not None:
+                info.revision = f"v{major}.{minor}"
+            mac = query(esp.read_mac, "BASE_MAC")
+            info.mac = ':'.join(f'{b:02x}' for b in mac) if mac else None
+
+            flash_id = query(esp.flash_id)
+            if flash_id is not None:
+                info.flash_id = f"0x{flash_id & 0xFF:02X}{(flash_id >> 8) & 0xFF:02X}{(flash_id >> 16) & 0xFF:02X}"
+                info.flash_manufacturer = f"0x{flash_id & 0xFF:02x}"
+                info.flash_device = f"0x{(flash_id >> 8) & 0xFF:02x}{(flash_id >> 16) & 0xFF:02x}"
+                from esptool.cmds import detect_flash_size
+                info.flash_size = query(detect_flash_size, esp)
+
+            self._read_security(esp, info)
+
+        if self.metrics is not None and info.mac:
+            self.metrics.set_device(info.mac)
+        return info
+    
+    def refresh_security_info(self, esp, info):
+        """
+        Re-read the eFuse security state of a cached ChipInfo over an open session
+        
+        Flash encryption and secure boot can be burnt at any time (e.g. the first
+        boot of a release firmware), so pre-flight checks never trust cached
+        values; chip and flash identity do not change and are kept.
+        
+        Returns:
+            info, updated in place
+        """
+        with self._stage("security_read"):
+            self._read_security(esp, info)
+        info.collected = time.time()
+        return info
+    
+    def _read_security(self, esp, info):
+        query = self._chip_query
+        info.flash_encryption = query(esp.get_flash_encryption_enabled)
+        info.secure_boot = query(esp.get_secure_boot_enabled)
+        # ROM command: not implemented on the original ESP32
+        security = query(esp.get_security_info)
+        if security:
+            info.security_flags = security["flags"]
+            info.flash_crypt_cnt = security["flash_crypt_cnt"]
+            info.key_purposes = list(security["key_purposes"])
+    
+    def _chip_query(self, getter, *args):
+        """Value of one chip query, None when the chip or stub does not support it"""
+        try:
+            return getter(*args)
+        except Exception as e:
+            self.log(f"Chip info: {getattr(getter, '__name__', getter)} not available: {e}", "debug")
+            return None
@@ -0,0 +1,260 @@
+"""
+Fleet Inventory for ESP32 boards
+Probes every connected ESP serial port at the same time and reports which
+board (MAC, chip, flash) runs which firmware (partition layout, active app)
+
+Usage:
+    python fleet_inventory.py [--ports COM3,COM4] [--baud auto] [--csv inventario.csv]
+"""
+
+import sys
+import csv
+import time
+import argparse
+import threading
+
+from flash_utils import FlashManager
+from baud_manager import BaudManager
+from hotplug_watcher import ESP_USB_IDS
+from partition_table import PartitionTable
+from tracing import TRACER
+
+
+class InventoryEntry:
+    """What was found on one port"""
+
+    # (attribute, column header) in table / CSV order
+    COLUMNS = (
+        ("port", "Puerto"),
+        ("mac", "MAC"),
+        ("chip", "Chip"),
+        ("flash_size", "Flash"),
+        ("flash_id", "Flash ID"),
+        ("table_hash", "Tabla particiones"),
+        ("app_partition", "Partición activa"),
+        ("project", "Proyecto"),
+        ("version", "Versión"),
+        ("elf_sha", "ELF SHA"),
+        ("duration", "Tiempo (s)"),
+        ("error", "Error"),
+    )
+
+    def __init__(self, port):
+        self.port = port
+        self.mac = None
+        self.chip = None
+        self.flash_size = None
+        self.flash_id = None
+        self.table_hash = None
+        self.app_partition = None
+        self.project = None
+        self.version = None
+        self.elf_sha = None
+        self.duration = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def values(self):
+        """Row values in COLUMNS order ('' for unknown)"""
+        row = []
+        for name, _ in self.COLUMNS:
+            value = getattr(self, name)
+            if name == "duration" and value is not None:
+                value = f"{value:.1f}"
+            row.append("" if value is None else str(value))
+        return row
+
+    def __repr__(self):
+        return f"InventoryEntry({self.port} {self.mac or '-'} {self.project or '-'} {self.version or ''})"
+
+
+def esp_ports():
+    """Serial ports whose USB VID/PID belongs to an ESP board or USB-UART bridge"""
+    import serial.tools.list_ports
+    return [info.device for info in serial.tools.list_ports.comports()
+            if info.vid is not None and (info.vid, info.pid) in ESP_USB_IDS]
+
+
+class FleetInventory:
+    """Parallel read-only probe of many boards (one thread per port)"""
+
+    PARTITION_OFFSETS = (PartitionTable.DEFAULT_OFFSET, 0x9000)
+
+    def __init__(self, flash_manager=None, chip_info_cache=None, max_concurrent=16, logger=None):
+        """
+        Initialize fleet inventory
+
+        Args:
+            flash_manager: FlashManager used for the sessions (a private one if None)
+            chip_info_cache: Optional ChipInfoCache updated with what the scan reads
+            max_concurrent: Ports probed at the same time
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.logger = logger or self._default_logger
+        self.flash_manager = flash_manager or FlashManager(logger=self.logger)
+        self.chip_info_cache = chip_info_cache
+        self._slots = threading.Semaphore(max_concurrent)
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def probe(self, port, baud="auto"):
+        """
+        Read identity and firmware of the board on one port (nothing is written)
+
+        Returns:
+            InventoryEntry (error set when the board did not answer)
+        """
+        entry = InventoryEntry(port)
+        t = time.perf_counter()
+        with self._slots, TRACER.span("inventory", "run", port=port):
+            # Any chip: the inventory reports what is really connected
+            esp = self.flash_manager.open_session(port, None, baud)
+            if esp is None:
+                entry.error = "sin respuesta"
+                entry.duration = time.perf_counter() - t
+                return entry
+            try:
+                info = self.flash_manager.collect_chip_info(esp)
+                entry.mac = info.mac
+                entry.chip = info.chip
+                entry.flash_size = info.flash_size
+                entry.flash_id = info.flash_id
+                if self.chip_info_cache is not None:
+                    self.chip_info_cache.put(info, port)
+
+                table = None
+                for offset in self.PARTITION_OFFSETS:
+                    table = self.flash_manager.read_partition_table(esp, offset)
+                    if table is not None:
+                        break
+                if table is None:
+                    entry.error = "sin tabla de particiones"
+                    return entry
+                entry.table_hash = table.fingerprint
+
+                descriptor, partition = self.flash_manager.read_app_descriptor(esp, table)
+                entry.app_partition = partition.name if partition else None
+                if descriptor is not None:
+                    entry.project = descriptor.project_name
+                    entry.version = descriptor.version
+                    entry.elf_sha = descriptor.elf_sha256[:16]
+                elif partition is not None:
+                    entry.error = "app sin descriptor"
+            except Exception as e:
+                entry.error = str(e)
+            finally:
+                self.flash_manager.close_session(esp)
+                entry.duration = time.perf_counter() - t
+        return entry
+
+    def scan(self, ports=None, baud="auto", on_entry=None):
+        """
+        Probe every port in parallel
+
+        Args:
+            ports: Ports to probe (default: every ESP USB serial port)
+            baud: Baud rate or 'auto'
+            on_entry: Optional callback(entry) as each port finishes (scan threads)
+
+        Returns:
+            List of InventoryEntry in port order
+        """
+        ports = list(esp_ports() if ports is None else ports)
+        if not ports:
+            self.log("No se encontraron puertos ESP conectados", "warning")
+            return []
+        self.log(f"Inventario: escaneando {len(ports)} puerto(s) en paralelo...", "info")
+
+        entries = {}
+        lock = threading.Lock()
+        t = time.perf_counter()
+
+        def worker(port):
+            try:
+                entry = self.probe(port, baud)
+            except Exception as e:
+                entry = InventoryEntry(port)
+                entry.error = str(e)
+            with lock:
+                entries[port] = entry
+            if on_entry:
+                try:
+                    on_entry(entry)
+                except Exception as e:
+                    self.log(f"Error en callback de inventario: {e}", "debug")
+
+        threads = [threading.Thread(target=worker, args=(port,), daemon=True, name=f"inventory-{port}")
+                   for port in ports]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        found = sum(1 for e in entries.values() if e.mac)
+        self.log(f"Inventario: {found}/{len(ports)} placa(s) identificadas en "
+                 f"{time.perf_counter() - t:.1f}s", "success" if found else "warning")
+        return [entries[port] for port in ports]
+
+    @staticmethod
+    def export_csv(entries, path):
+        """Write the inventory as CSV (header + one row per port)"""
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow([header for _, header in InventoryEntry.COLUMNS])
+            for entry in entries:
+                writer.writerow(entry.values())
+        return len(entries)
+
+    @staticmethod
+    def format_report(entries):
+        """Plain text table for the console"""
+        lines = []
+        for entry in entries:
+            if entry.mac:
+                lines.append(f"{entry.port:<14} {entry.mac}  {entry.chip or '?':<9} {entry.flash_size or '?':>5}  "
+                             f"tabla {entry.table_hash or '-':<12}  {entry.project or '-'} {entry.version or ''}"
+                             f"{f'  ({entry.error})' if entry.error else ''}")
+            else:
+                lines.append(f"{entry.port:<14} {entry.error}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inventario de placas ESP32 conectadas")
+    parser.add_argument("--ports", default=None, help="Puertos separados por comas, también rfc2217://host:puerto y socket://host:puerto (por defecto: todos los ESP)")
+    parser.add_argument("--baud", default="auto", help="Baud rate o 'auto'")
+    parser.add_argument("--csv", default=None, help="Guardar el inventario en un archivo CSV")
+    args = parser.parse_args(argv)
+
+    ports = [p.strip() for p in args.ports.split(',') if p.strip()] if args.ports else None
+    inventory = FleetInventory(FlashManager(logger=lambda message, level='info': None,
+                                            baud_manager=BaudManager()))
+    entries = inventory.scan(ports, args.baud)
+    if not entries:
+        return 1
+    print(FleetInventory.format_report(entries))
+    if args.csv:
+        FleetInventory.export_csv(entries, args.csv)
+        print(f"CSV guardado: {args.csv}")
+    return 0 if any(e.mac for e in entries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
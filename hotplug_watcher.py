@@ -0,0 +1,153 @@
+"""
+USB Hot-plug Watcher for ESP32 boards
+Notices newly connected serial devices (port enumeration diff, or udev on
+Linux when pyudev is installed) and filters them by ESP USB VID/PID
+"""
+
+import sys
+import time
+import threading
+
+
+# USB bridges and native USB found on ESP32 boards: (VID, PID)
+ESP_USB_IDS = {
+    (0x303A, 0x1001),  # Espressif USB-Serial/JTAG (ESP32-S3/C3/C6 native USB)
+    (0x303A, 0x0002),  # Espressif USB CDC (ESP32-S2/S3 TinyUSB)
+    (0x10C4, 0xEA60),  # Silicon Labs CP210x
+    (0x1A86, 0x7523),  # WCH CH340
+    (0x1A86, 0x55D4),  # WCH CH9102
+    (0x0403, 0x6001),  # FTDI FT232R
+    (0x0403, 0x6010),  # FTDI FT2232 (ESP-Prog)
+    (0x0403, 0x6015),  # FTDI FT231X
+}
+
+
+class HotplugWatcher:
+    """Calls back when ESP serial devices are plugged in or removed"""
+
+    def __init__(self, on_added, on_removed=None, usb_ids=None, interval=0.5, logger=None):
+        """
+        Initialize hot-plug watcher
+
+        Args:
+            on_added: Callback(port, info) for a new matching device (runs on the watcher thread)
+            on_removed: Optional callback(port) when a device disappears
+            usb_ids: Set of (VID, PID) to accept (default ESP_USB_IDS, empty = any USB device)
+            interval: Polling interval in seconds
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.usb_ids = ESP_USB_IDS if usb_ids is None else set(usb_ids)
+        self.interval = interval
+        self.logger = logger or self._default_logger
+
+        self._known = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def matches(self, info):
+        """True if a list_ports entry looks like an ESP board"""
+        if info.vid is None:
+            return False
+        return not self.usb_ids or (info.vid, info.pid) in self.usb_ids
+
+    def snapshot(self):
+        """Current matching devices: {port: ListPortInfo}"""
+        import serial.tools.list_ports
+        return {info.device: info for info in serial.tools.list_ports.comports() if self.matches(info)}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start watching. Devices already connected are not reported."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._known = self.snapshot()
+        target = self._udev_loop if self._udev_available() else self._poll_loop
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        self.log(f"Hot-plug activo ({'udev' if target == self._udev_loop else 'sondeo'}), "
+                 f"{len(self._known)} dispositivo(s) ya conectados", "debug")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _diff(self):
+        """Compare enumeration with the last snapshot and fire callbacks"""
+        current = self.snapshot()
+        added = [p for p in current if p not in self._known]
+        removed = [p for p in self._known if p not in current]
+        self._known = current
+
+        for port in removed:
+            self.log(f"Dispositivo desconectado: {port}", "debug")
+            if self.on_removed:
+                self._safe_call(self.on_removed, port)
+        for port in added:
+            info = current[port]
+            self.log(f"Dispositivo conectado: {port} ({info.vid:04X}:{info.pid:04X} {info.description})", "debug")
+            self._safe_call(self.on_added, port, info)
+
+    def _safe_call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.log(f"Error en callback de hot-plug: {e}", "error")
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._diff()
+            except Exception as e:
+                self.log(f"Error enumerando puertos: {e}", "warning")
+
+    @staticmethod
+    def _udev_available():
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            import pyudev  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def _udev_loop(self):
+        """Block on tty udev events instead of polling (Linux + pyudev)"""
+        import pyudev
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by(subsystem='tty')
+        monitor.start()
+        while not self._stop.is_set():
+            device = monitor.poll(timeout=self.interval)
+            if device is None:
+                continue
+            # The tty node can appear slightly before list_ports sees its USB parent
+            time.sleep(0.2)
+            try:
+                self._diff()
+            except Exception as e:
+                self.log(f"Error enumerando puertos: {e}", "warning")
@@ -0,0 +1,583 @@
+"""
+Job Scheduler for ESP32 production flashing
+Queues flash jobs, runs them on one worker per port, retries failed stages
+with backoff (resuming at the failed stage) and keeps a reject list
+"""
+
+import os
+import time
+import queue
+import itertools
+import threading
+
+from erase_planner import ErasePlanner, EraseRange
+from app_descriptor import AppDescriptor
+from partition_table import PartitionTable, load_partition_table
+
+
+class FlashPlan:
+    """What to flash on a board - built once per project, shared by every job"""
+
+    def __init__(self, chip, baud, files, erase_mode="simple", preserve_nvs=True,
+                 partitions_path=None, skip_if_current=False, erase_partitions=(), exclude_macs=()):
+        """
+        Args:
+            chip: Chip type (e.g. 'esp32s3')
+            baud: Baud rate or 'auto'
+            files: List of (address, path, description). An address of None means
+                "boot app partition from the device's partition table" (simple mode);
+                a string is a partition name or data subtype (e.g. 'spiffs').
+            erase_mode: 'simple', 'complete' or 'none'
+            preserve_nvs: Keep NVS intact in complete mode
+            partitions_path: Partition table file of the project (optional)
+            skip_if_current: Skip erase/writes when the board already runs this
+                app build (same esp_app_desc_t project, version and ELF SHA)
+            erase_partitions: Partition names or data subtypes erased whole
+                (e.g. ('nvs',) for a factory reset without flashing)
+            exclude_macs: Boards this plan must not run on (the board a fixture
+                already flashed and still holds): pre-flight cancels the job
+        """
+        self.chip = chip
+        self.baud = baud
+        self.files = list(files)
+        self.erase_mode = erase_mode
+        self.preserve_nvs = preserve_nvs
+        self.partitions_path = partitions_path
+        self.skip_if_current = skip_if_current
+        self.erase_partitions = tuple(erase_partitions)
+        self.exclude_macs = tuple(exclude_macs)
+
+    @property
+    def app_file(self):
+        """Path of the application image ('Firmware' entry, else the last file)"""
+        for _, path, description in self.files:
+            if "Firmware" in (description or ""):
+                return path
+        return self.files[-1][1] if self.files else None
+
+
+class FlashJob:
+    """One board to flash: a plan bound to a port, plus its progress"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    RETRYING = "retrying"
+    DONE = "done"
+    FAILED = "failed"
+    REJECTED = "rejected"
+
+    _ids = itertools.count(1)
+
+    def __init__(self, port, plan, project=None):
+        self.id = next(self._ids)
+        self.port = port
+        self.plan = plan
+        self.project = project
+        self.state = self.QUEUED
+        self.stage_index = 0          # First stage not yet completed - retries resume here
+        self.stage = None
+        self.runs = 0                 # Times the job was dispatched to a worker
+        self.stage_retries = {}       # stage name -> retries used
+        self.error = None
+        self.mac = None
+        self.flash_id = None
+        self.skipped = False          # Board already ran this build - nothing written
+        self.timings = []             # (stage, seconds) of every run
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()  # Set to stop a running job at the next stage
+
+    @property
+    def board_id(self):
+        """MAC once known, otherwise the port"""
+        return self.mac or self.port
+
+    @property
+    def cycle_time(self):
+        if self.started and self.finished:
+            return self.finished - self.started
+        return None
+
+    def __repr__(self):
+        return f"FlashJob(#{self.id} {self.port} {self.state} stage={self.stage})"
+
+
+class StageError(Exception):
+    """A stage did not complete (the job can be retried from that stage)"""
+
+
+class PreflightError(StageError):
+    """The board cannot take this plan (flash too small, encryption on): retrying won't help"""
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while running (board unplugged, or not swapped yet)"""
+
+
+class JobScheduler:
+    """Dispatches FlashJobs to per-port workers with stage-level retries"""
+
+    THROUGHPUT_WINDOW_S = 900  # Sliding window of the throughput metric
+
+    def __init__(self, flash_manager, max_concurrent=4, max_stage_retries=3,
+                 max_job_runs=2, backoff_base=1.0, backoff_max=15.0,
+                 logger=None, on_job_update=None, chip_info_cache=None):
+        """
+        Initialize job scheduler
+
+        Args:
+            flash_manager: FlashManager used for sessions, erase and writes
+            max_concurrent: Boards flashed at the same time (others wait in the queue)
+            max_stage_retries: Retries of a single stage before the run fails
+            max_job_runs: Runs of a job before the board goes to the reject list
+            backoff_base: First retry delay in seconds (doubles on each retry)
+            backoff_max: Maximum retry delay in seconds
+            logger: Optional logger callback function(message, level='info')
+            on_job_update: Optional callback(job) on every state or stage change (worker thread)
+            chip_info_cache: Optional ChipInfoCache; pre-flight checks reuse the chip
+                info of boards seen before instead of reading it again
+        """
+        self.flash_manager = flash_manager
+        self.chip_info_cache = chip_info_cache
+        self.max_stage_retries = max_stage_retries
+        self.max_job_runs = max_job_runs
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger or self._default_logger
+        self.on_job_update = on_job_update
+
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._workers = {}        # port -> (queue.Queue, thread)
+        self.jobs = []
+        self.rejected = []        # Jobs of boards that kept failing
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    # ------------------------------------------------------------------ #
+    #  Queue                                                               #
+    # ------------------------------------------------------------------ #
+
+    def submit(self, port, plan, project=None, exclusive=False):
+        """
+        Queue a job for a port
+
+        Args:
+            port: Serial port of the board
+            plan: FlashPlan
+            project: Project name for the device records
+            exclusive: Only queue it when the port has nothing queued or running
+                (checked atomically with the submit)
+
+        Returns:
+            FlashJob, or None if exclusive and the port was busy
+        """
+        job = FlashJob(port, plan, project)
+        with self._lock:
+            if exclusive and self._pending(port):
+                return None
+            self.jobs.append(job)
+        self._dispatch(job)
+        self.log(f"[{port}] Trabajo #{job.id} en cola ({self.queue_depth} pendiente(s))", "info")
+        return job
+
+    def _dispatch(self, job):
+        """Hand a job to the worker of its port, starting the worker if needed"""
+        with self._lock:
+            worker = self._workers.get(job.port)
+            if worker is None or not worker[1].is_alive():
+                jobs = queue.Queue()
+                thread = threading.Thread(target=self._worker_loop, args=(job.port, jobs), daemon=True,
+                                          name=f"flash-{job.port}")
+                worker = (jobs, thread)
+                self._workers[job.port] = worker
+                thread.start()
+        worker[0].put(job)
+
+    def _worker_loop(self, port, jobs):
+        """One worker per port: serial ports cannot be shared"""
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            with self._slots:
+                if job.state != FlashJob.QUEUED:
+                    continue  # Cancelled while waiting
+                self._run(job)
+
+    def has_pending(self, port):
+        """True if the port has a job queued or running"""
+        with self._lock:
+            return self._pending(port)
+
+    def _pending(self, port):
+        """has_pending() for a caller holding the lock"""
+        return any(j.port == port and j.state in (FlashJob.QUEUED, FlashJob.RUNNING, FlashJob.RETRYING)
+                   for j in self.jobs)
+
+    def job(self, job_id):
+        """Job by id, None if unknown"""
+        with self._lock:
+            return next((job for job in self.jobs if job.id == job_id), None)
+
+    def list_jobs(self, state=None):
+        """Snapshot of the jobs (optionally only those in one state), oldest first"""
+        with self._lock:
+            return [job for job in self.jobs if state is None or job.state == state]
+
+    def cancel_queued(self, port=None):
+        """
+        Cancel jobs that have not started yet (all ports, or one port)
+
+        Returns:
+            Number of jobs cancelled
+        """
+        cancelled = []
+        with self._lock:
+            for job in self.jobs:
+                if job.state == FlashJob.QUEUED and (port is None or job.port == port):
+                    job.state = FlashJob.FAILED
+                    job.error = "cancelado"
+                    job.finished = time.time()
+                    cancelled.append(job)
+        for job in cancelled:
+            self._notify(job)
+        return len(cancelled)
+
+    def cancel_port(self, port):
+        """
+        Cancel every job of a port: queued ones at once, running or retrying
+        ones at their next stage (or during their backoff)
+
+        Returns:
+            Number of jobs cancelled
+        """
+        with self._lock:
+            running = [job for job in self.jobs if job.port == port
+                       and job.state in (FlashJob.RUNNING, FlashJob.RETRYING)]
+        for job in running:
+            job._cancel.set()
+        return self.cancel_queued(port) + len(running)
+
+    def shutdown(self):
+        """Stop all workers after their current job"""
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        for jobs, _ in workers:
+            jobs.put(None)
+
+    # ------------------------------------------------------------------ #
+    #  Stages                                                              #
+    # ------------------------------------------------------------------ #
+
+    def stages(self, plan):
+        """Ordered (name, function) stages for a plan"""
+        stages = [("connect", self._stage_connect),
+                  ("partition_read", self._stage_partition_read),
+                  ("preflight", self._stage_preflight)]
+        if plan.skip_if_current:
+            stages.append(("app_check", self._stage_app_check))
+        if plan.erase_mode != "none" or plan.erase_partitions:
+            stages.append(("erase", self._stage_erase))
+        for idx, (_, path, description) in enumerate(plan.files):
+            stages.append((f"write:{description or os.path.basename(path)}",
+                           lambda job, ctx, i=idx: self._stage_write(job, ctx, i)))
+        stages += [("mac", self._stage_mac), ("reset", self._stage_reset)]
+        return stages
+
+    def _stage_connect(self, job, ctx):
+        ctx["esp"] = self.flash_manager.open_session(job.port, job.plan.chip, job.plan.baud)
+        if ctx["esp"] is None:
+            raise StageError("no se pudo abrir la sesión")
+
+    def _stage_partition_read(self, job, ctx):
+        """Resolve the partition table (project file first, then device) and app addresses"""
+        plan = job.plan
+        needs_table = any(not isinstance(addr, int) for addr, _, _ in plan.files) or \
+            plan.erase_mode == "complete" or bool(plan.erase_partitions)
+        table = load_partition_table(plan.partitions_path)
+        if table is None and needs_table:
+            table = self.flash_manager.read_partition_table(ctx["esp"])
+        ctx["table"] = table
+
+        boot_app = table.boot_app() if table else None
+        files = []
+        for addr, path, desc in plan.files:
+            if addr is None:
+                addr = boot_app.offset if boot_app else 0x10000
+            elif isinstance(addr, str):
+                partition = self._partition(table, addr)
+                if os.path.getsize(path) > partition.size:
+                    raise PreflightError(f"{desc or os.path.basename(path)} no cabe en '{partition.name}' "
+                                         f"({os.path.getsize(path)} > {partition.size} bytes)")
+                addr = partition.offset
+            files.append((addr, path, desc))
+        ctx["files"] = files
+        ctx["erase_partitions"] = [self._partition(table, name) for name in plan.erase_partitions]
+
+    @staticmethod
+    def _partition(table, key):
+        """Partition by name, else the first data partition of that subtype"""
+        partition = None
+        if table is not None:
+            partition = table.by_name(key)
+            if partition is None and key in PartitionTable.SUBTYPE_NAMES:
+                partition = table.find_first(PartitionTable.TYPE_DATA, PartitionTable.SUBTYPE_NAMES[key])
+        if partition is None:
+            raise PreflightError(f"no hay partición '{key}' en la tabla de particiones")
+        return partition
+
+    def _stage_preflight(self, job, ctx):
+        """Check the plan against the board's flash size and eFuse security state"""
+        esp = ctx["esp"]
+        job.mac = self.flash_manager.read_mac(esp)
+        if job.mac is not None and job.mac in job.plan.exclude_macs:
+            raise JobCancelled(f"la placa {job.mac} ya fue flasheada")
+        # Only the chip and flash identity come from the cache: security is re-read
+        info = self.chip_info_cache.get(job.mac) if self.chip_info_cache is not None else None
+        if info is None:
+            info = self.flash_manager.collect_chip_info(esp)
+        else:
+            self.flash_manager.refresh_security_info(esp, info)
+        if self.chip_info_cache is not None:
+            self.chip_info_cache.put(info, job.port)
+
+        highest_end = max((addr + os.path.getsize(path) for addr, path, _ in ctx["files"]), default=0)
+        errors = []
+        for level, message in info.preflight_issues(highest_end):
+            self.log(f"[{job.port}] Pre-flight: {message}", level)
+            if level == "error":
+                errors.append(message)
+        if errors:
+            raise PreflightError("; ".join(errors))
+
+    def _stage_app_check(self, job, ctx):
+        """Mark the job as skipped when the device already runs the plan's app build"""
+        expected = AppDescriptor.from_file(job.plan.app_file)
+        if expected is None:
+            return
+        current, partition = self.flash_manager.read_app_descriptor(ctx["esp"], ctx.get("table"))
+        if current is not None and current.matches(expected):
+            job.skipped = True
+            self.log(f"[{job.port}] Ya tiene {expected} en {partition.name} - se omite el flasheo", "success")
+
+    def _stage_erase(self, job, ctx):
+        plan = []
+        if job.plan.erase_mode != "none":
+            writes = [(addr, os.path.getsize(path)) for addr, path, _ in ctx["files"]]
+            planner = ErasePlanner(ctx.get("table"), self.flash_manager.session_flash_size(ctx["esp"]))
+            mode = job.plan.erase_mode
+            if mode == "complete" and planner.partition_table is None and job.plan.preserve_nvs:
+                self.log(f"[{job.port}] Sin tabla de particiones: el borrado completo se reduce a las "
+                         f"regiones que se escriben para no borrar NVS", "error")
+                mode = "simple"
+            if mode == "complete" and not planner.flash_end_known:
+                self.log(f"[{job.port}] Tamaño de flash y tabla desconocidos - borrando el chip completo", "warning")
+                if not self.flash_manager.erase_chip(ctx["esp"]):
+                    raise StageError("borrado fallido")
+            else:
+                plan = planner.plan(writes, mode, job.plan.preserve_nvs)
+        plan += [EraseRange(p.offset, p.size) for p in ctx["erase_partitions"]]
+        self.log(f"[{job.port}] Plan de borrado: {ErasePlanner.describe(plan)}", "debug")
+        if not self.flash_manager.erase_ranges(ctx["esp"], plan):
+            raise StageError("borrado fallido")
+
+    def _stage_write(self, job, ctx, idx):
+        addr, path, description = ctx["files"][idx]
+        if not self.flash_manager.write_file(ctx["esp"], addr, path, label=description):
+            raise StageError(f"escritura de {description} en 0x{addr:X} fallida")
+
+    def _stage_mac(self, job, ctx):
+        job.mac = self.flash_manager.read_mac(ctx["esp"])
+        job.flash_id = self.flash_manager.read_flash_id(ctx["esp"])
+
+    def _stage_reset(self, job, ctx):
+        self.flash_manager.close_session(ctx.pop("esp", None))
+
+    # ------------------------------------------------------------------ #
+    #  Execution                                                           #
+    # ------------------------------------------------------------------ #
+
+    def _notify(self, job):
+        if self.on_job_update:
+            try:
+                self.on_job_update(job)
+            except Exception as e:
+                self.log(f"Error en callback de trabajo: {e}", "debug")
+
+    def _end_metrics(self, job, success):
+        """Close the stage-timing run of this worker thread (if metrics are enabled)"""
+        metrics = getattr(self.flash_manager, "metrics", None)
+        if metrics is not None:
+            run = metrics.end_run(success, job.mac)
+            if run is not None:
+                job.timings.extend(run.stages)
+
+    def _board_changed(self, job, ctx):
+        """
+        After a reconnect, check the board is the one the completed stages ran on
+
+        A different MAC means the board was swapped during a backoff or requeue:
+        the job restarts at stage 0 so the new board gets the whole plan.
+
+        Returns:
+            True if the job was restarted
+        """
+        if job.mac is None:
+            return False  # Not identified yet: nothing was written
+        mac = self.flash_manager.read_mac(ctx["esp"])
+        if mac is None or mac == job.mac:
+            return False
+        self.log(f"[{job.port}] Placa cambiada ({job.mac} -> {mac}) - el trabajo #{job.id} "
+                 f"empieza de nuevo", "warning")
+        self.flash_manager.close_session(ctx.pop("esp", None), reset_mode='no-reset')
+        ctx.clear()
+        job.stage_index = 0
+        job.stage_retries.clear()
+        job.skipped = False
+        job.mac = None
+        job.flash_id = None
+        return True
+
+    def _backoff(self, retry):
+        return min(self.backoff_max, self.backoff_base * (2 ** (retry - 1)))
+
+    def _run(self, job):
+        """Run a job's stages, resuming at job.stage_index"""
+        job.runs += 1
+        job.state = FlashJob.RUNNING
+        job.started = job.started or time.time()
+        metrics = getattr(self.flash_manager, "metrics", None)
+        if metrics is not None:
+            metrics.begin_run(job.port)
+        self._notify(job)
+
+        stages = self.stages(job.plan)
+        ctx = {}
+        try:
+            while job.stage_index < len(stages):
+                if job._cancel.is_set():
+                    raise JobCancelled()
+                name, stage = stages[job.stage_index]
+                if job.stage != name:
+                    job.stage = name
+                    self._notify(job)
+                if job.skipped and (name == "erase" or name.startswith("write:")):
+                    job.stage_index += 1
+                    continue
+                try:
+                    # After a retry or a requeue the session and the resolved
+                    # addresses are rebuilt; completed erase/writes are not repeated
+                    # unless another board is on the port now
+                    if name not in ("connect", "reset") and ctx.get("esp") is None:
+                        self._stage_connect(job, ctx)
+                        if self._board_changed(job, ctx):
+                            continue
+                    if (name in ("preflight", "erase") or name.startswith("write:")) and "files" not in ctx:
+                        self._stage_partition_read(job, ctx)
+                    stage(job, ctx)
+                    job.stage_index += 1
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    retries = job.stage_retries.get(name, 0) + 1
+                    job.stage_retries[name] = retries
+                    job.error = f"{name}: {e}"
+                    self.flash_manager.close_session(ctx.pop("esp", None), reset_mode='no-reset')
+                    if retries > self.max_stage_retries or isinstance(e, PreflightError):
+                        raise
+                    delay = self._backoff(retries)
+                    job.state = FlashJob.RETRYING
+                    self.log(f"[{job.port}] {name} falló ({e}) - reintento {retries}/{self.max_stage_retries} "
+                             f"en {delay:.0f}s", "warning")
+                    self._notify(job)
+                    job._cancel.wait(delay)
+                    job.state = FlashJob.RUNNING
+
+            job.state = FlashJob.DONE
+            job.error = None
+            job.finished = time.time()
+            self._end_metrics(job, True)
+            self.log(f"[{job.port}] Trabajo #{job.id} completado en {job.cycle_time:.1f}s"
+                     f"{f' (MAC {job.mac})' if job.mac else ''}", "success")
+        except JobCancelled as e:
+            # Hard reset: a board left in place (already flashed) goes back to its app
+            self.flash_manager.close_session(ctx.pop("esp", None))
+            job.state = FlashJob.FAILED
+            job.error = str(e) or "cancelado"
+            job.finished = time.time()
+            self._end_metrics(job, False)
+            self.log(f"[{job.port}] Trabajo #{job.id} cancelado en {job.stage}: {job.error}", "warning")
+        except Exception as e:
+            self.flash_manager.close_session(ctx.pop("esp", None), reset_mode='no-reset')
+            job.error = job.error or str(e)
+            self._end_metrics(job, False)
+            if job.runs < self.max_job_runs and not isinstance(e, PreflightError):
+                # Requeue at the back: other boards go first, the board gets a fresh run
+                job.state = FlashJob.QUEUED
+                job.stage_retries.clear()
+                self.log(f"[{job.port}] Trabajo #{job.id} falló en {job.stage} - reencolado", "warning")
+                self._notify(job)
+                self._dispatch(job)
+                return
+            job.state = FlashJob.REJECTED
+            job.finished = time.time()
+            with self._lock:
+                self.rejected.append(job)
+            self.log(f"[{job.port}] Placa {job.board_id} RECHAZADA: {job.error}", "error")
+        self._notify(job)
+
+    # ------------------------------------------------------------------ #
+    #  Metrics                                                             #
+    # ------------------------------------------------------------------ #
+
+    @property
+    def queue_depth(self):
+        """Jobs waiting for a worker"""
+        with self._lock:
+            return sum(1 for j in self.jobs if j.state == FlashJob.QUEUED)
+
+    def stats(self):
+        """
+        Queue and throughput metrics
+
+        Throughput counts the jobs finished in the last THROUGHPUT_WINDOW_S
+        seconds, so it follows the current pace of the line (idle pauses and
+        the first boards of the session fade out).
+
+        Returns:
+            Dict with queued, running, done, rejected, throughput_per_hour, avg_cycle_s
+        """
+        with self._lock:
+            jobs = list(self.jobs)
+        done = [j for j in jobs if j.state == FlashJob.DONE]
+        now = time.time()
+        first_start = min((j.started for j in jobs if j.started), default=now)
+        window_start = max(now - self.THROUGHPUT_WINDOW_S, first_start)
+        recent = sum(1 for j in done if j.finished and j.finished >= window_start)
+        elapsed = now - window_start
+        cycles = [j.cycle_time for j in done if j.cycle_time]
+        return {
+            "queued": sum(1 for j in jobs if j.state == FlashJob.QUEUED),
+            "running": sum(1 for j in jobs if j.state in (FlashJob.RUNNING, FlashJob.RETRYING)),
+            "done": len(done),
+            "rejected": sum(1 for j in jobs if j.state == FlashJob.REJECTED),
+            "throughput_per_hour": recent * 3600 / elapsed if elapsed > 0 else 0.0,
+            "avg_cycle_s": sum(cycles) / len(cycles) if cycles else 0.0,
+        }
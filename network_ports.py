@@ -0,0 +1,142 @@
+"""
+Network Serial Ports for ESP32 flashing
+rfc2217:// and socket:// endpoints for boards plugged into another host
+(esp_rfc2217_server, ser2net...), remembered across sessions and tuned for
+throughput when opened
+"""
+
+import os
+import re
+import json
+import socket
+import threading
+
+
+SCHEMES = ("rfc2217://", "socket://")
+URL_RE = re.compile(r'^(rfc2217|socket)://[^\s:/?]+:\d{1,5}(\?\S*)?$')
+
+# Socket buffers big enough to hold several compressed flash blocks in flight
+SOCKET_BUFFER = 1 << 20
+
+
+def is_network_port(port):
+    """True for rfc2217:// and socket:// URLs"""
+    return str(port or "").lower().startswith(SCHEMES)
+
+
+def supports_baud_change(port):
+    """
+    False for raw socket:// bridges: the remote UART rate is fixed, so esptool
+    must stay at the ROM rate (rfc2217 forwards baud changes to the remote port)
+    """
+    return not str(port or "").lower().startswith("socket://")
+
+
+def tune(serial_port):
+    """
+    Tune the TCP socket behind an open network port: no Nagle delay (esptool
+    waits for every small response) and large send/receive buffers
+
+    Returns:
+        True if the port is a network port and was tuned
+    """
+    sock = getattr(serial_port, "_socket", None)
+    if sock is None:
+        return False
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+    except OSError:
+        return False
+    return True
+
+
+class NetworkPorts:
+    """Remote serial endpoints added by the user, persisted as a JSON list"""
+
+    def __init__(self, path=None, logger=None):
+        """
+        Initialize network port list
+
+        Args:
+            path: JSON file where the endpoints are stored (None = memory only)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.path = path
+        self.logger = logger or self._default_logger
+        self._lock = threading.Lock()
+        self._ports = self._load()
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return [entry for entry in json.load(f).get("ports", []) if self.is_valid(entry.get("url"))]
+        except (OSError, ValueError, AttributeError):
+            return []
+
+    def _save(self):
+        """Write the list to disk (caller holds the lock)"""
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"ports": self._ports}, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.log(f"No se pudieron guardar los puertos de red: {e}", "warning")
+
+    @staticmethod
+    def is_valid(url):
+        return bool(url) and bool(URL_RE.match(url.strip()))
+
+    def ports(self):
+        """[(url, description)] in the order they were added"""
+        with self._lock:
+            return [(entry["url"], entry.get("description") or "Puerto de red") for entry in self._ports]
+
+    def add(self, url, description=""):
+        """
+        Remember an endpoint (updates the description if it is already known)
+
+        Returns:
+            True if added or updated, False if the URL is not valid
+        """
+        url = url.strip()
+        if not self.is_valid(url):
+            return False
+        with self._lock:
+            self._ports = [entry for entry in self._ports if entry["url"] != url]
+            self._ports.append({"url": url, "description": description})
+            self._save()
+        self.log(f"Puerto de red guardado: {url}", "info")
+        return True
+
+    def remove(self, url):
+        with self._lock:
+            count = len(self._ports)
+            self._ports = [entry for entry in self._ports if entry["url"] != url]
+            if len(self._ports) == count:
+                return False
+            self._save()
+        self.log(f"Puerto de red eliminado: {url}", "info")
+        return True
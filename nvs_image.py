@@ -0,0 +1,412 @@
+"""
+NVS Partition Images for ESP32 provisioning
+Builds ESP-IDF NVS partition images (format version 2: 4 KB pages, 32-byte
+entries, CRC32 headers, multi-page blobs) in-process, and generates one image
+per device from a CSV of device rows in parallel, cached by row hash
+
+Device CSV:
+    The first column identifies the board (MAC or serial number); every other
+    header is "namespace/key:encoding", e.g.
+
+        mac,cfg/serial:string,cal/offset:i32,keys/aes:hex2bin,certs/ca:file
+        24:6f:28:aa:bb:cc,SN-0001,-12,00112233445566778899aabbccddeeff,ca.pem
+
+    Encodings: u8 i8 u16 i16 u32 i32 u64 i64 string hex2bin base64 file
+    ('file' stores the contents of the named file, relative to the CSV, as a blob).
+"""
+
+import os
+import csv
+import json
+import zlib
+import base64
+import struct
+import hashlib
+
+
+class NvsError(ValueError):
+    """Data that cannot be stored in an NVS image"""
+
+
+class NvsImage:
+    """One NVS partition image, filled entry by entry like nvs_partition_gen.py"""
+
+    PAGE_SIZE = 4096
+    ENTRY_SIZE = 32
+    ENTRIES_PER_PAGE = 126
+    HEADER_SIZE = 32
+    BITMAP_SIZE = 32
+    FIRST_ENTRY_OFFSET = HEADER_SIZE + BITMAP_SIZE
+
+    PAGE_ACTIVE = 0xFFFFFFFE
+    PAGE_FULL = 0xFFFFFFFC
+    VERSION2 = 0xFE
+    CHUNK_ANY = 0xFF
+
+    MAX_KEY_LENGTH = 15
+    MAX_STRING_SIZE = 4000
+    MAX_BLOB_SIZE = 508000
+    MAX_NAMESPACES = 254
+
+    # encoding -> (entry type, struct format)
+    PRIMITIVES = {
+        "u8": (0x01, "<B"), "i8": (0x11, "<b"),
+        "u16": (0x02, "<H"), "i16": (0x12, "<h"),
+        "u32": (0x04, "<I"), "i32": (0x14, "<i"),
+        "u64": (0x08, "<Q"), "i64": (0x18, "<q"),
+    }
+    TYPE_STRING = 0x21
+    TYPE_BLOB_DATA = 0x42
+    TYPE_BLOB_INDEX = 0x48
+
+    def __init__(self, size):
+        """
+        Args:
+            size: Partition size in bytes (multiple of 4 KB, at least 3 pages)
+        """
+        if size % self.PAGE_SIZE or size < 3 * self.PAGE_SIZE:
+            raise NvsError(f"Tamaño de partición NVS inválido: 0x{size:X} (mínimo 0x3000, múltiplo de 4 KB)")
+        self.size = size
+        self.pages = []
+        self.entry_num = 0
+        self.namespaces = {}
+        self._new_page()
+
+    # ------------------------------------------------------------------ #
+    #  Pages and entries                                                   #
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def _crc(data):
+        return zlib.crc32(data, 0xFFFFFFFF) & 0xFFFFFFFF
+
+    def _new_page(self):
+        # One page must stay free for the NVS garbage collector
+        if (len(self.pages) + 2) * self.PAGE_SIZE > self.size:
+            raise NvsError(f"Los datos no caben en una partición NVS de {self.size // 1024} KB")
+        if self.pages:
+            struct.pack_into('<I', self.pages[-1], 0, self.PAGE_FULL)
+        page = bytearray(b'\xff') * self.PAGE_SIZE
+        struct.pack_into('<II', page, 0, self.PAGE_ACTIVE, len(self.pages))
+        page[8] = self.VERSION2
+        struct.pack_into('<I', page, 28, self._crc(bytes(page[4:28])))
+        self.pages.append(page)
+        self.entry_num = 0
+
+    @property
+    def free_entries(self):
+        return self.ENTRIES_PER_PAGE - self.entry_num
+
+    def _write_entries(self, data, count):
+        """Copy data into the next count entries of the current page and mark them written"""
+        page = self.pages[-1]
+        start = self.FIRST_ENTRY_OFFSET + self.entry_num * self.ENTRY_SIZE
+        page[start:start + len(data)] = data
+        for _ in range(count):
+            # Two bits per entry: 0b11 empty -> 0b10 written
+            bit = self.entry_num * 2
+            page[self.HEADER_SIZE + bit // 8] &= ~(1 << (bit % 8)) & 0xFF
+            self.entry_num += 1
+
+    def _entry(self, ns_index, entry_type, span, key, chunk_index=CHUNK_ANY):
+        if len(key) > self.MAX_KEY_LENGTH:
+            raise NvsError(f"Clave NVS demasiado larga (máx. {self.MAX_KEY_LENGTH}): '{key}'")
+        entry = bytearray(b'\xff') * self.ENTRY_SIZE
+        entry[0:4] = bytes((ns_index, entry_type, span, chunk_index))
+        entry[8:24] = key.encode('utf-8').ljust(16, b'\x00')
+        return entry
+
+    def _seal(self, entry):
+        """Entry CRC32 covers everything except the CRC field itself"""
+        struct.pack_into('<I', entry, 4, self._crc(bytes(entry[0:4] + entry[8:32])))
+        return entry
+
+    def _write_primitive(self, ns_index, key, encoding, value):
+        entry_type, fmt = self.PRIMITIVES[encoding]
+        entry = self._entry(ns_index, entry_type, 1, key)
+        try:
+            struct.pack_into(fmt, entry, 24, value)
+        except struct.error:
+            raise NvsError(f"Valor fuera de rango para {encoding}: {key}={value}")
+        if self.free_entries < 1:
+            self._new_page()
+        self._write_entries(self._seal(entry), 1)
+
+    def _write_string(self, ns_index, key, data):
+        if len(data) > self.MAX_STRING_SIZE:
+            raise NvsError(f"Cadena demasiado larga para NVS ({len(data)} bytes): {key}")
+        data_entries = (len(data) + self.ENTRY_SIZE - 1) // self.ENTRY_SIZE
+        # Strings never span pages (same strict check as nvs_partition_gen.py)
+        if self.entry_num + data_entries + 1 >= self.ENTRIES_PER_PAGE:
+            self._new_page()
+        entry = self._entry(ns_index, self.TYPE_STRING, data_entries + 1, key)
+        struct.pack_into('<HHI', entry, 24, len(data), 0xFFFF, self._crc(data))
+        self._write_entries(self._seal(entry), 1)
+        self._write_entries(data, data_entries)
+
+    def _write_blob(self, ns_index, key, data):
+        """Blob split into per-page BLOB_DATA chunks followed by a BLOB_IDX entry"""
+        if len(data) > self.MAX_BLOB_SIZE:
+            raise NvsError(f"Blob demasiado grande para NVS ({len(data)} bytes): {key}")
+        offset = 0
+        chunk_count = 0
+        while True:
+            if self.free_entries < 2:
+                self._new_page()
+            tailroom = (self.free_entries - 1) * self.ENTRY_SIZE
+            chunk = data[offset:offset + tailroom]
+            data_entries = (len(chunk) + self.ENTRY_SIZE - 1) // self.ENTRY_SIZE
+            entry = self._entry(ns_index, self.TYPE_BLOB_DATA, data_entries + 1, key, chunk_index=chunk_count)
+            struct.pack_into('<HHI', entry, 24, len(chunk), 0xFFFF, self._crc(chunk))
+            self._write_entries(self._seal(entry), 1)
+            self._write_entries(chunk, data_entries)
+            chunk_count += 1
+            offset += len(chunk)
+            if offset >= len(data):
+                break
+        if self.free_entries < 1:
+            self._new_page()
+        entry = self._entry(ns_index, self.TYPE_BLOB_INDEX, 1, key)
+        struct.pack_into('<IBB', entry, 24, len(data), chunk_count, 0)
+        self._write_entries(self._seal(entry), 1)
+
+    # ------------------------------------------------------------------ #
+    #  Public API                                                          #
+    # ------------------------------------------------------------------ #
+
+    def namespace(self, name):
+        """Index of a namespace, writing its entry the first time it is used"""
+        if name not in self.namespaces:
+            if len(self.namespaces) >= self.MAX_NAMESPACES:
+                raise NvsError("Demasiados namespaces NVS")
+            self.namespaces[name] = len(self.namespaces) + 1
+            self._write_primitive(0, name, "u8", self.namespaces[name])
+        return self.namespaces[name]
+
+    def add(self, namespace, key, encoding, value):
+        """
+        Store one key
+
+        Args:
+            namespace: Namespace name (max 15 characters)
+            key: Key name (max 15 characters)
+            encoding: u8..i64, string, hex2bin, base64 or binary
+            value: int for primitives, str for string/hex2bin/base64, bytes for binary
+        """
+        ns_index = self.namespace(namespace)
+        encoding = encoding.lower()
+        if encoding in self.PRIMITIVES:
+            self._write_primitive(ns_index, key, encoding, int(value, 0) if isinstance(value, str) else value)
+        elif encoding == "string":
+            self._write_string(ns_index, key, value.encode('utf-8') + b'\x00')
+        elif encoding == "hex2bin":
+            self._write_blob(ns_index, key, bytes.fromhex(value.strip()))
+        elif encoding == "base64":
+            self._write_blob(ns_index, key, base64.b64decode(value))
+        elif encoding == "binary":
+            self._write_blob(ns_index, key, value)
+        else:
+            raise NvsError(f"Codificación NVS no soportada: {encoding}")
+
+    def to_bytes(self):
+        """
+        The partition image. Pages after the last used one are left erased,
+        which is how the NVS library itself leaves unused pages.
+        """
+        data = b"".join(bytes(page) for page in self.pages)
+        return data + b'\xff' * (self.size - len(data))
+
+
+# ---------------------------------------------------------------------- #
+#  Per-device generation                                                  #
+# ---------------------------------------------------------------------- #
+
+FORMAT_TAG = "nvs-v2-1"  # Part of every row hash: bump when the image layout changes
+
+
+def parse_columns(header):
+    """
+    Column layout of a device CSV header
+
+    Returns:
+        List of (namespace, key, encoding) for every column after the first
+    """
+    columns = []
+    for name in header[1:]:
+        try:
+            path, encoding = name.strip().rsplit(':', 1)
+            namespace, key = path.split('/', 1)
+        except ValueError:
+            raise NvsError(f"Columna inválida '{name}' (formato: namespace/clave:codificación)")
+        encoding = encoding.strip().lower()
+        if encoding not in NvsImage.PRIMITIVES and encoding not in ("string", "hex2bin", "base64", "file"):
+            raise NvsError(f"Codificación no soportada en la columna '{name}'")
+        columns.append((namespace.strip(), key.strip(), encoding))
+    return columns
+
+
+def _resolve_value(encoding, value, base_dir):
+    """(encoding used by NvsImage, value) - 'file' columns become binary blobs"""
+    if encoding == "file":
+        with open(os.path.join(base_dir, value), 'rb') as f:
+            return "binary", f.read()
+    return encoding, value
+
+
+def row_hash(columns, row, size, base_dir):
+    """Cache key of one device image: layout, values (file contents for 'file') and size"""
+    digest = hashlib.sha256(f"{FORMAT_TAG};{size};".encode('utf-8'))
+    for (namespace, key, encoding), value in zip(columns, row[1:]):
+        digest.update(f"{namespace}/{key}:{encoding}=".encode('utf-8'))
+        if encoding == "file" and value:
+            with open(os.path.join(base_dir, value), 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        else:
+            digest.update(value.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def build_device_image(columns, row, size, base_dir):
+    """NVS image bytes of one device row (empty cells are not stored)"""
+    image = NvsImage(size)
+    for (namespace, key, encoding), value in zip(columns, row[1:]):
+        if value == "":
+            continue
+        image.add(namespace, key, *_resolve_value(encoding, value, base_dir))
+    return image.to_bytes()
+
+
+def _build_job(job):
+    """Process-pool worker: build and store one image, returns (device_id, digest, error)"""
+    columns, row, size, base_dir, out_path = job
+    try:
+        data = build_device_image(columns, row, size, base_dir)
+        tmp_path = out_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
+        return row[0], None
+    except (OSError, ValueError) as e:
+        return row[0], str(e)
+
+
+class NvsBatch:
+    """Builds one NVS image per CSV row across a process pool, cached by row hash"""
+
+    # Below this many images to build, a process pool costs more than it saves
+    POOL_THRESHOLD = 64
+
+    def __init__(self, output_dir, size=0x5000, max_workers=None, logger=None):
+        """
+        Initialize NVS batch generator
+
+        Args:
+            output_dir: Directory for the images and the manifest
+            size: NVS partition size in bytes
+            max_workers: Worker processes (default: CPU count)
+            logger: Optional logger callback function(message, level='info')
+        """
+        self.output_dir = output_dir
+        self.size = size
+        self.max_workers = max_workers
+        self.logger = logger or self._default_logger
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def generate(self, csv_path, manifest):
+        """
+        Build the image of every row not already cached and register it
+
+        Args:
+            csv_path: Device CSV (see module docstring)
+            manifest: ProvisioningManifest where device -> image is recorded
+
+        Returns:
+            (built, cached, failed) counts
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        base_dir = os.path.dirname(os.path.abspath(csv_path))
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = [row for row in csv.reader(f) if row and any(cell.strip() for cell in row)]
+        if len(rows) < 2:
+            raise NvsError("El CSV no tiene filas de dispositivos")
+        columns = parse_columns(rows[0])
+
+        jobs = []
+        images = {}
+        failed = 0
+        for row in rows[1:]:
+            row = [cell.strip() for cell in row] + [""] * (len(columns) + 1 - len(row))
+            try:
+                digest = row_hash(columns, row, self.size, base_dir)
+            except OSError as e:
+                self.log(f"{row[0]}: {e}", "error")
+                failed += 1
+                continue
+            out_path = os.path.join(self.output_dir, f"{digest}.nvs.bin")
+            images[row[0]] = (out_path, digest)
+            if not os.path.exists(out_path):
+                jobs.append((columns, row, self.size, base_dir, out_path))
+
+        cached = len(images) - len(jobs)
+        self.log(f"NVS: {len(images)} dispositivo(s), {cached} en caché, {len(jobs)} por generar", "info")
+        if len(jobs) >= self.POOL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(_build_job, jobs, chunksize=max(1, len(jobs) // 64)))
+        else:
+            results = [_build_job(job) for job in jobs]
+
+        for device_id, error in results:
+            if error:
+                self.log(f"{device_id}: {error}", "error")
+                images.pop(device_id, None)
+                failed += 1
+        for device_id, (path, digest) in images.items():
+            manifest.add(device_id, path, digest)
+        manifest.save()
+        built = len(jobs) - sum(1 for _, error in results if error)
+        self.log(f"NVS: {built} generada(s), {cached} reutilizada(s), {failed} con error",
+                 "success" if not failed else "warning")
+        return built, cached, failed
+
+
+def main(argv=None):
+    import argparse
+    from provisioning import ProvisioningManifest
+
+    parser = argparse.ArgumentParser(description="Genera una imagen NVS por dispositivo desde un CSV")
+    parser.add_argument("csv", help="CSV de dispositivos (primera columna: MAC o número de serie)")
+    parser.add_argument("--out", default="nvs_images", help="Directorio de salida (imágenes + provisioning.json)")
+    parser.add_argument("--size", default="0x5000", help="Tamaño de la partición NVS (p.ej. 0x5000)")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto: núcleos)")
+    args = parser.parse_args(argv)
+
+    try:
+        batch = NvsBatch(args.out, int(args.size, 0), args.workers)
+        built, cached, failed = batch.generate(args.csv, ProvisioningManifest(args.out))
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    return 0 if not failed else 2
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Partition Table Utilities for ESP32
+Parses ESP-IDF partition tables from binary images or CSV files
+"""
+
+import os
+import zlib
+import hashlib
+import struct
+
+from tracing import TRACER
+
+
+class Partition:
+    """A single entry of an ESP-IDF partition table"""
+
+    def __init__(self, name, ptype, subtype, offset, size, flags=0):
+        self.name = name
+        self.type = ptype
+        self.subtype = subtype
+        self.offset = offset
+        self.size = size
+        self.flags = flags
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    @property
+    def type_name(self):
+        return {PartitionTable.TYPE_APP: "app", PartitionTable.TYPE_DATA: "data"}.get(self.type, f"type_{self.type}")
+
+    def __repr__(self):
+        return f"Partition({self.name}: {self.type_name}/0x{self.subtype:02X} @ 0x{self.offset:X}, size 0x{self.size:X})"
+
+
+class PartitionTable:
+    """ESP-IDF partition table (list of Partition entries)"""
+
+    MAGIC = b'\xAA\x50'
+    ENTRY_SIZE = 32
+    DEFAULT_OFFSET = 0x8000
+    MAX_SIZE = 0xC00  # 3 KB - room for 95 entries + MD5 entry
+
+    TYPE_APP = 0x00
+    TYPE_DATA = 0x01
+
+    SUBTYPE_FACTORY = 0x00
+    SUBTYPE_OTA_0 = 0x10
+    SUBTYPE_OTA_1 = 0x11
+    SUBTYPE_OTA_DATA = 0x00
+    SUBTYPE_PHY = 0x01
+    SUBTYPE_NVS = 0x02
+    SUBTYPE_COREDUMP = 0x03
+    SUBTYPE_NVS_KEYS = 0x04
+    SUBTYPE_FAT = 0x81
+    SUBTYPE_SPIFFS = 0x82
+    SUBTYPE_LITTLEFS = 0x83
+
+    TYPE_NAMES = {'app': TYPE_APP, 'data': TYPE_DATA}
+    SUBTYPE_NAMES = {
+        'factory': 0x00, 'ota_0': 0x10, 'ota_1': 0x11, 'ota_2': 0x12, 'ota_3': 0x13, 'test': 0x20,
+        'ota': 0x00, 'phy': 0x01, 'nvs': 0x02, 'coredump': 0x03, 'nvs_keys': 0x04,
+        'efuse': 0x05, 'undefined': 0x06, 'fat': 0x81, 'spiffs': 0x82, 'littlefs': 0x83,
+    }
+
+    def __init__(self, partitions=None):
+        self.partitions = list(partitions or [])
+
+    def __iter__(self):
+        return iter(self.partitions)
+
+    def __len__(self):
+        return len(self.partitions)
+
+    # ------------------------------------------------------------------ #
+    #  Parsing                                                             #
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def from_binary(cls, data):
+        """
+        Parse a binary partition table.
+
+        Args:
+            data: Raw bytes read from the partition table offset
+
+        Returns:
+            PartitionTable, or None if the magic bytes are missing
+        """
+        if len(data) < cls.ENTRY_SIZE or data[0:2] != cls.MAGIC:
+            return None
+
+        partitions = []
+        offset = 0
+        while offset + cls.ENTRY_SIZE <= len(data):
+            entry = data[offset:offset + cls.ENTRY_SIZE]
+            if entry[0:2] != cls.MAGIC:
+                break
+            ptype, subtype = entry[2], entry[3]
+            p_offset, p_size = struct.unpack('<II', entry[4:12])
+            label = entry[12:28].split(b'\x00', 1)[0].decode('utf-8', errors='ignore')
+            flags = struct.unpack('<I', entry[28:32])[0]
+            partitions.append(Partition(label, ptype, subtype, p_offset, p_size, flags))
+            offset += cls.ENTRY_SIZE
+
+        return cls(partitions)
+
+    @staticmethod
+    def _parse_int(value):
+        """Parse CSV numbers: decimal, 0x hex, or K/M suffixed sizes"""
+        value = value.strip().upper().replace(' ', '')
+        if value.startswith('0X'):
+            return int(value, 16)
+        if value.endswith('K'):
+            return int(value[:-1], 0) * 1024
+        if value.endswith('M'):
+            return int(value[:-1], 0) * 1024 * 1024
+        return int(value, 0)
+
+    @classmethod
+    def from_csv(cls, text):
+        """
+        Parse a CSV partition table (ESP-IDF format).
+        Empty offsets are placed after the previous partition, like gen_esp32part.py.
+
+        Args:
+            text: CSV file contents
+
+        Returns:
+            PartitionTable, or None if no entries were found
+        """
+        partitions = []
+        next_offset = cls.DEFAULT_OFFSET + 0x1000
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = [p.strip() for p in line.split(',')]
+            if len(parts) < 5:
+                continue
+
+            name, ptype, subtype, offset, size = parts[:5]
+            type_num = cls.TYPE_NAMES.get(ptype.lower())
+            if type_num is None:
+                type_num = cls._parse_int(ptype)
+            subtype_num = cls.SUBTYPE_NAMES.get(subtype.lower())
+            if subtype_num is None:
+                subtype_num = cls._parse_int(subtype) if subtype else 0
+
+            align = 0x10000 if type_num == cls.TYPE_APP else 0x1000
+            if offset:
+                offset_int = cls._parse_int(offset)
+            else:
+                offset_int = (next_offset + align - 1) // align * align
+            size_int = cls._parse_int(size)
+
+            partitions.append(Partition(name, type_num, subtype_num, offset_int, size_int))
+            next_offset = offset_int + size_int
+
+        return cls(partitions) if partitions else None
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Parse a partition table file (CSV or BIN, detected by content)
+
+        Returns:
+            PartitionTable, or None if the file is not a valid table
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if data[0:2] == cls.MAGIC:
+            return cls.from_binary(data)
+
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        if path.lower().endswith('.csv') or ',' in text:
+            return cls.from_csv(text)
+        return None
+
+    # ------------------------------------------------------------------ #
+    #  Queries                                                             #
+    # ------------------------------------------------------------------ #
+
+    def find(self, ptype, subtype=None):
+        """Return all partitions matching type (and subtype, if given)"""
+        return [p for p in self.partitions
+                if p.type == ptype and (subtype is None or p.subtype == subtype)]
+
+    def find_first(self, ptype, subtype=None):
+        matches = self.find(ptype, subtype)
+        return matches[0] if matches else None
+
+    def by_name(self, name):
+        for p in self.partitions:
+            if p.name == name:
+                return p
+        return None
+
+    @property
+    def app_partitions(self):
+        return self.find(self.TYPE_APP)
+
+    @property
+    def has_ota(self):
+        return self.find_first(self.TYPE_DATA, self.SUBTYPE_OTA_DATA) is not None
+
+    @property
+    def otadata(self):
+        return self.find_first(self.TYPE_DATA, self.SUBTYPE_OTA_DATA)
+
+    @property
+    def nvs_partitions(self):
+        return self.find(self.TYPE_DATA, self.SUBTYPE_NVS) + self.find(self.TYPE_DATA, self.SUBTYPE_NVS_KEYS)
+
+    @property
+    def spiffs(self):
+        return self.find_first(self.TYPE_DATA, self.SUBTYPE_SPIFFS)
+
+    def boot_app(self):
+        """Partition where firmware is flashed: factory > ota_0 (same priority as the GUI)"""
+        return (self.find_first(self.TYPE_APP, self.SUBTYPE_FACTORY)
+                or self.find_first(self.TYPE_APP, self.SUBTYPE_OTA_0))
+
+    # otadata: two esp_ota_select_entry_t copies, one per flash sector
+    OTA_SELECT_ENTRY_SIZE = 32
+    OTA_SELECT_SECTOR = 0x1000
+    OTA_STATE_INVALID = 3
+    OTA_STATE_ABORTED = 4
+
+    @classmethod
+    def ota_sequence(cls, entries):
+        """
+        Highest valid OTA sequence number among otadata select entries
+
+        Args:
+            entries: Raw esp_ota_select_entry_t blobs (32 bytes each)
+
+        Returns:
+            Sequence number, or None if no entry is valid (blank otadata)
+        """
+        best = None
+        for entry in entries:
+            if len(entry) < cls.OTA_SELECT_ENTRY_SIZE:
+                continue
+            # ota_seq, seq_label[20], ota_state, crc (CRC-32 of ota_seq only)
+            seq, state, crc = struct.unpack_from('<I20xII', entry)
+            if seq == 0xFFFFFFFF or crc != zlib.crc32(struct.pack('<I', seq), 0xFFFFFFFF):
+                continue
+            if state in (cls.OTA_STATE_INVALID, cls.OTA_STATE_ABORTED):
+                continue
+            best = seq if best is None else max(best, seq)
+        return best
+
+    def active_app(self, otadata_entries=None):
+        """
+        Partition the bootloader will start
+
+        With valid otadata the selected OTA slot is ((seq - 1) % number of OTA
+        apps), otherwise factory > ota_0 like the bootloader.
+
+        Args:
+            otadata_entries: esp_ota_select_entry_t blobs read from the otadata partition
+        """
+        ota_apps = [p for p in self.app_partitions
+                    if self.SUBTYPE_OTA_0 <= p.subtype < self.SUBTYPE_OTA_0 + 16]
+        seq = self.ota_sequence(otadata_entries or [])
+        if seq and ota_apps:
+            slot = self.find_first(self.TYPE_APP, self.SUBTYPE_OTA_0 + (seq - 1) % len(ota_apps))
+            if slot is not None:
+                return slot
+        return self.boot_app()
+
+    @property
+    def end(self):
+        """First address after the last partition"""
+        return max((p.end for p in self.partitions), default=0)
+
+    @property
+    def fingerprint(self):
+        """
+        Short hash of the layout (names, types, offsets, sizes, flags), so a table
+        read from a device and one built from a CSV compare equal
+        """
+        digest = hashlib.sha256()
+        for p in self.partitions:
+            digest.update(f"{p.name},{p.type},{p.subtype},{p.offset},{p.size},{p.flags};".encode('utf-8'))
+        return digest.hexdigest()[:12]
+
+    def __repr__(self):
+        return f"PartitionTable({len(self.partitions)} entries, end 0x{self.end:X})"
+
+
+def load_partition_table(path):
+    """Convenience wrapper: parse a partition table file, None if missing/invalid"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with TRACER.span("read_partition_table", "io", file=os.path.basename(path)):
+            return PartitionTable.from_file(path)
+    except (OSError, ValueError):
+        return None
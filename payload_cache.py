@@ -0,0 +1,255 @@
+"""
+Payload Cache for ESP32 flashing
+Keeps zlib-compressed flash payloads in memory and on disk so identical
+binaries are compressed only once per station
+"""
+
+import os
+import zlib
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from tracing import TRACER
+
+
+class CompressedPayload:
+    """A flash image already padded and compressed, ready to stream to the device"""
+
+    def __init__(self, sha256, md5, size, level, data, source=None):
+        """
+        Args:
+            sha256: SHA-256 of the original file contents (cache key)
+            md5: MD5 of the padded image (what the device reports after writing)
+            size: Size of the padded, uncompressed image in bytes
+            level: zlib compression level used
+            data: Compressed bytes
+            source: Optional path of the file the payload was built from
+        """
+        self.sha256 = sha256
+        self.md5 = md5
+        self.size = size
+        self.level = level
+        self.data = data
+        self.source = source
+
+    @property
+    def compressed_size(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return (f"CompressedPayload({self.sha256[:12]}, level={self.level}, "
+                f"{self.size} -> {self.compressed_size} bytes)")
+
+
+class PayloadCache:
+    """Caches compressed flash payloads keyed by file hash and compression level"""
+
+    DEFAULT_LEVEL = 9  # Same level esptool uses for write-flash -z
+
+    def __init__(self, cache_dir=None, max_memory_entries=16, logger=None, store=None):
+        """
+        Initialize payload cache
+
+        Args:
+            cache_dir: Directory for compressed payloads on disk (None = memory only)
+            max_memory_entries: Number of payloads kept in memory (LRU)
+            logger: Optional logger callback function(message, level='info')
+            store: Optional ArtifactStore whose persisted digests replace hashing the
+                files it already holds (project and bootloader artifacts). Other files
+                (per-device NVS/SPIFFS images) are hashed here and never copied into it;
+                only payloads of stored blobs are kept on disk, where the store's GC
+                removes them with their blob
+        """
+        self.cache_dir = cache_dir
+        self.store = store
+        self.max_memory_entries = max_memory_entries
+        self.logger = logger or self._default_logger
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # (sha256, level) -> CompressedPayload
+        self._in_flight = {}           # (sha256, level) -> threading.Event
+        self._digests = {}             # (path, mtime_ns, size) -> (sha256, md5, padded_size)
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    @staticmethod
+    def pad_image(data):
+        """Pad image to a 4-byte boundary with 0xFF (same as esptool)"""
+        return data + b'\xff' * (-len(data) % 4)
+
+    def _digest_file(self, path):
+        """
+        Return (sha256, md5, padded_size, raw_bytes_or_None) for a file.
+
+        Digests are memoized by path, mtime and size so a repeated lookup of
+        an unchanged file does not re-read it. raw_bytes is only returned when
+        the file actually had to be read.
+        """
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            cached = self._digests.get(key)
+        if cached:
+            return cached + (None,)
+
+        artifact = self.store.lookup(path) if self.store is not None else None
+        if artifact is not None:
+            # Hashed once per unique blob, remembered across sessions
+            digest = (artifact.sha256, artifact.md5, artifact.padded_size)
+            with self._lock:
+                self._digests[key] = digest
+            return digest + (None,)
+
+        with TRACER.span("read_file", "io", file=os.path.basename(path)):
+            with open(path, 'rb') as f:
+                raw = f.read()
+        image = self.pad_image(raw)
+        digest = (hashlib.sha256(raw).hexdigest(), hashlib.md5(image).hexdigest(), len(image))
+
+        with self._lock:
+            self._digests[key] = digest
+        return digest + (raw,)
+
+    def file_sha256(self, path):
+        """SHA-256 of a file's contents (memoized with the payload digests)"""
+        return self._digest_file(path)[0]
+
+    def _disk_path(self, sha256, level):
+        return os.path.join(self.cache_dir, f"{sha256}_z{level}.bin")
+
+    def _remember(self, key, payload):
+        """Store payload in the in-memory LRU (caller holds the lock)"""
+        self._memory[key] = payload
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, path, level=DEFAULT_LEVEL):
+        """
+        Get the compressed payload for a file, compressing it only if needed.
+
+        Lookup order: memory → disk → compress. When several threads ask for
+        the same payload at once, only the first one compresses and the others
+        wait for its result.
+
+        Args:
+            path: Path to binary file
+            level: zlib compression level (1-9)
+
+        Returns:
+            CompressedPayload
+        """
+        sha256, md5, size, raw = self._digest_file(path)
+        key = (sha256, level)
+
+        while True:
+            with self._lock:
+                payload = self._memory.get(key)
+                if payload:
+                    self._memory.move_to_end(key)
+                    self.log(f"Payload cache hit (memory): {os.path.basename(path)}", "debug")
+                    return payload
+
+                event = self._in_flight.get(key)
+                if event is None:
+                    # This thread builds the payload
+                    event = threading.Event()
+                    self._in_flight[key] = event
+                    break
+
+            # Another thread is compressing the same file - wait and retry
+            event.wait()
+
+        try:
+            payload = self._load_from_disk(sha256, md5, size, level, path)
+            if payload is None:
+                if raw is None:
+                    with TRACER.span("read_file", "io", file=os.path.basename(path)):
+                        with open(path, 'rb') as f:
+                            raw = f.read()
+                payload = self._compress(raw, sha256, md5, size, level, path)
+                self._save_to_disk(payload)
+
+            with self._lock:
+                self._remember(key, payload)
+            return payload
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def _compress(self, raw, sha256, md5, size, level, path):
+        """Compress a padded image"""
+        image = self.pad_image(raw)
+        with TRACER.span("compress", "cpu", file=os.path.basename(path), level=level):
+            data = zlib.compress(image, level)
+        self.log(f"Payload comprimido: {os.path.basename(path)} "
+                 f"({size} → {len(data)} bytes, nivel {level})", "debug")
+        return CompressedPayload(sha256, md5, size, level, data, source=path)
+
+    def _persists(self, sha256):
+        """Payloads go to disk unless a store is attached and does not hold the blob"""
+        return bool(self.cache_dir) and (self.store is None or self.store.get(sha256) is not None)
+
+    def _load_from_disk(self, sha256, md5, size, level, path):
+        """Load a compressed payload from the disk cache, or None on miss"""
+        if not self._persists(sha256):
+            return None
+
+        disk_path = self._disk_path(sha256, level)
+        if not os.path.exists(disk_path):
+            return None
+
+        try:
+            with TRACER.span("read_cached_payload", "io", file=os.path.basename(path)):
+                with open(disk_path, 'rb') as f:
+                    data = f.read()
+            self.log(f"Payload cache hit (disk): {os.path.basename(path)}", "debug")
+            return CompressedPayload(sha256, md5, size, level, data, source=path)
+        except OSError as e:
+            self.log(f"Error leyendo payload cacheado {disk_path}: {e}", "warning")
+            return None
+
+    def _save_to_disk(self, payload):
+        """Atomically write a payload to the disk cache (safe across processes)"""
+        if not self._persists(payload.sha256):
+            return
+
+        disk_path = self._disk_path(payload.sha256, payload.level)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload.data)
+            os.replace(tmp_path, disk_path)
+        except OSError as e:
+            self.log(f"No se pudo guardar payload en disco: {e}", "warning")
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+
+    def clear_memory(self):
+        """Drop all in-memory payloads (disk cache is kept)"""
+        with self._lock:
+            self._memory.clear()
+            self._digests.clear()
@@ -0,0 +1,292 @@
+"""
+Project Index for the firmware projects in proyect_firmware/
+One manifest per project folder (component files with sizes and SHA-256/MD5,
+parsed partition table, app descriptor, target chip and flash addresses),
+built once and rebuilt only when a file in the folder changes
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from partition_table import PartitionTable, Partition
+from app_descriptor import AppDescriptor
+
+
+class ProjectManifest:
+    """Precomputed description of one project folder"""
+
+    # role -> candidate file names inside the project folder (first existing wins)
+    COMPONENTS = (
+        ("firmware", ("firmware.bin",)),
+        ("bootloader", ("bootloader.bin",)),
+        ("partitions", ("partitions.bin", "partition-table.bin")),
+        ("partitions_csv", ("partitions.csv",)),
+        ("ota_data", ("ota_data_initial.bin",)),
+        ("spiffs", ("data/spiffs.bin", "data/spiffs_pio.bin")),
+    )
+
+    def __init__(self, name, path, components=None, partitions=None, app=None, chip=None, built=None):
+        self.name = name
+        self.path = path
+        self.components = components or {}  # role -> {"file", "size", "mtime_ns", "sha256", "md5" (padded)}
+        self.partitions = partitions or []  # [name, type, subtype, offset, size, flags]
+        self.app = app                      # AppDescriptor fields, None without descriptor
+        self.chip = chip
+        self.built = built or time.time()
+
+    # ------------------------------------------------------------------ #
+    #  Building                                                            #
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def signature(cls, path):
+        """(file, size, mtime) of every candidate component - changes when the folder must be re-indexed"""
+        signature = []
+        for _, names in cls.COMPONENTS:
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                signature.append([name, stat.st_size, stat.st_mtime_ns])
+        return signature
+
+    @staticmethod
+    def _digests(path):
+        """(sha256, md5 of the 4-byte padded image) - the MD5 the device reports after writing"""
+        sha256, md5 = hashlib.sha256(), hashlib.md5()
+        size = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(block)
+                md5.update(block)
+                size += len(block)
+        md5.update(b'\xff' * (-size % 4))
+        return sha256.hexdigest(), md5.hexdigest()
+
+    @classmethod
+    def build(cls, name, path, store=None):
+        """
+        Index a project folder (reads and hashes every component once)
+
+        With an ArtifactStore the components are added to it under
+        'project:<name>/<role>' references, and their digests, chip and app
+        descriptor come from the store instead of being computed again.
+        """
+        manifest = cls(name, path)
+        artifacts = {}
+        if store is not None:
+            store.release(f"project:{name}/")
+        for role, names in cls.COMPONENTS:
+            for file_name in names:
+                file_path = os.path.join(path, file_name)
+                if not os.path.isfile(file_path):
+                    continue
+                stat = os.stat(file_path)
+                if store is not None:
+                    artifacts[role] = store.put(file_path, ref=f"project:{name}/{role}")
+                    sha256, md5 = artifacts[role].sha256, artifacts[role].md5
+                else:
+                    sha256, md5 = cls._digests(file_path)
+                manifest.components[role] = {"file": file_name, "size": stat.st_size,
+                                             "mtime_ns": stat.st_mtime_ns, "sha256": sha256, "md5": md5}
+                break
+
+        table = None
+        for role in ("partitions", "partitions_csv"):
+            if role in manifest.components:
+                table = PartitionTable.from_file(manifest.file(role))
+                if table is not None:
+                    break
+        if table is not None:
+            manifest.partitions = [[p.name, p.type, p.subtype, p.offset, p.size, p.flags] for p in table]
+
+        if "firmware" in artifacts:
+            manifest.app = artifacts["firmware"].app
+            manifest.chip = artifacts["firmware"].chip
+        elif "firmware" in manifest.components:
+            with open(manifest.file("firmware"), 'rb') as f:
+                head = f.read(AppDescriptor.READ_SIZE)
+            descriptor = AppDescriptor.from_image(head)
+            if descriptor is not None:
+                manifest.app = descriptor.to_dict()
+            manifest.chip = AppDescriptor.image_chip(head)
+        return manifest
+
+    def to_dict(self):
+        return {"name": self.name, "path": self.path, "components": self.components,
+                "partitions": self.partitions, "app": self.app, "chip": self.chip, "built": self.built}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["path"], data.get("components"), data.get("partitions"),
+                   data.get("app"), data.get("chip"), data.get("built"))
+
+    def is_stale(self):
+        """True if a component appeared, disappeared or changed since the manifest was built"""
+        current = {name: (size, mtime) for name, size, mtime in self.signature(self.path)}
+        indexed = {c["file"]: (c["size"], c["mtime_ns"]) for c in self.components.values()}
+        # Only the files that win their role matter, plus new higher-priority candidates
+        for role, names in self.COMPONENTS:
+            winner = next((name for name in names if name in current), None)
+            component = self.components.get(role)
+            if (component["file"] if component else None) != winner:
+                return True
+            if winner and current[winner] != indexed[winner]:
+                return True
+        return False
+
+    # ------------------------------------------------------------------ #
+    #  Queries                                                             #
+    # ------------------------------------------------------------------ #
+
+    def file(self, role):
+        """Absolute path of a component, None if the project does not have it"""
+        component = self.components.get(role)
+        return os.path.join(self.path, component["file"]) if component else None
+
+    def digest(self, role, kind="sha256"):
+        component = self.components.get(role)
+        return component[kind] if component else None
+
+    def partition_table(self):
+        return PartitionTable([Partition(*entry) for entry in self.partitions]) if self.partitions else None
+
+    def app_descriptor(self):
+        return AppDescriptor(**self.app) if self.app else None
+
+    @property
+    def app_address(self):
+        """Offset where the firmware goes (factory > ota_0), None without a partition table"""
+        table = self.partition_table()
+        app = table.boot_app() if table else None
+        return app.offset if app else None
+
+    @property
+    def has_ota(self):
+        table = self.partition_table()
+        return bool(table and table.has_ota)
+
+    def summary(self):
+        """One-line Spanish description for the log"""
+        parts = [self.name]
+        if self.app:
+            parts.append(f"{self.app['project_name']} {self.app['version']}")
+        if self.chip:
+            parts.append(self.chip)
+        if self.app_address is not None:
+            parts.append(f"app @ 0x{self.app_address:X}{' (OTA)' if self.has_ota else ''}")
+        parts.append(f"{len(self.components)} componente(s)")
+        return " · ".join(parts)
+
+    def __repr__(self):
+        return f"ProjectManifest({self.summary()})"
+
+
+class ProjectIndex:
+    """Manifests of every project folder under a root, persisted as one JSON file"""
+
+    INDEX_FILENAME = ".project_index.json"
+
+    def __init__(self, root, index_path=None, logger=None, store=None):
+        """
+        Initialize project index
+
+        Args:
+            root: Folder holding one subfolder per project (proyect_firmware/)
+            index_path: JSON file where the manifests are stored (default: inside root)
+            logger: Optional logger callback function(message, level='info')
+            store: Optional ArtifactStore the project components are recorded in
+        """
+        self.root = root
+        self.store = store
+        self.index_path = index_path or os.path.join(root, self.INDEX_FILENAME)
+        self.logger = logger or self._default_logger
+        self._lock = threading.Lock()
+        self._manifests = {}
+        for name, data in self._load().items():
+            try:
+                self._manifests[name] = ProjectManifest.from_dict(data)
+            except (KeyError, TypeError):
+                continue
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("projects", {})
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _save(self):
+        """Write the index to disk (caller holds the lock)"""
+        try:
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"projects": {name: m.to_dict() for name, m in self._manifests.items()}}, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            self.log(f"No se pudo guardar el índice de proyectos: {e}", "warning")
+
+    def projects(self):
+        """Names of the project folders (those with a firmware.bin), sorted"""
+        try:
+            names = sorted(os.listdir(self.root), key=str.lower)
+        except OSError:
+            return []
+        return [name for name in names
+                if os.path.isfile(os.path.join(self.root, name, "firmware.bin"))]
+
+    def get(self, name):
+        """
+        Manifest of a project, rebuilt first if its files changed
+
+        Returns:
+            ProjectManifest, or None if the folder does not exist
+        """
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            return None
+        with self._lock:
+            manifest = self._manifests.get(name)
+            if manifest is not None and manifest.path == path and not manifest.is_stale():
+                return manifest
+            t = time.perf_counter()
+            manifest = ProjectManifest.build(name, path, self.store)
+            self._manifests[name] = manifest
+            self._save()
+        self.log(f"Proyecto '{name}' indexado en {(time.perf_counter() - t) * 1000:.0f} ms", "debug")
+        return manifest
+
+    def refresh(self):
+        """Bring every project up to date and drop folders that no longer exist"""
+        names = self.projects()
+        with self._lock:
+            removed = [name for name in self._manifests if name not in names]
+            for name in removed:
+                del self._manifests[name]
+                if self.store is not None:
+                    self.store.release(f"project:{name}/")
+            if removed:
+                self._save()
+        return [self.get(name) for name in names]
@@ -0,0 +1,157 @@
+"""
+Provisioning Manifest for ESP32 boards
+Maps each device (MAC or serial number) to its per-device images, and hands
+serial-numbered rows to boards in order as their MACs are read at the station
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+
+MAC_RE = re.compile(r'^[0-9a-fA-F]{2}([:\-]?[0-9a-fA-F]{2}){5}$')
+
+
+def normalize_mac(value):
+    """'24-6F-28-AA-BB-CC' / '246f28aabbcc' -> '24:6f:28:aa:bb:cc' (None if not a MAC)"""
+    value = (value or "").strip()
+    if not MAC_RE.match(value):
+        return None
+    digits = re.sub(r'[:\-]', '', value).lower()
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+class ProvisioningManifest:
+    """
+    JSON manifest next to the generated images:
+
+        {"devices": {device_id: {kind: {"image": relative path, "sha256": digest}}},
+         "assigned": {mac: serial}}
+
+    kind is the partition the image is for ("nvs", "spiffs", ...).
+    """
+
+    FILENAME = "provisioning.json"
+
+    def __init__(self, path, logger=None):
+        """
+        Initialize provisioning manifest
+
+        Args:
+            path: Manifest file, or the directory holding provisioning.json
+            logger: Optional logger callback function(message, level='info')
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, self.FILENAME)
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.logger = logger or self._default_logger
+        self._lock = threading.Lock()
+        data = self._load()
+        self._devices = data.get("devices", {})
+        self._assigned = data.get("assigned", {})
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.log(f"Manifiesto de aprovisionamiento ilegible ({e}), se crea uno nuevo", "warning")
+            return {}
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        """Write the manifest to disk (caller holds the lock)"""
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"devices": self._devices, "assigned": self._assigned,
+                           "updated": time.time()}, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.log(f"No se pudo guardar el manifiesto de aprovisionamiento: {e}", "warning")
+
+    @staticmethod
+    def device_key(device_id):
+        """MACs are stored normalized, anything else (serial numbers) as written"""
+        return normalize_mac(device_id) or device_id.strip()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def add(self, device_id, image_path, digest, kind="nvs"):
+        """Record the image of one device (call save() after a batch)"""
+        rel_path = os.path.relpath(os.path.abspath(image_path), self.base_dir)
+        with self._lock:
+            entry = self._devices.setdefault(self.device_key(device_id), {})
+            entry[kind] = {"image": rel_path.replace(os.sep, '/'), "sha256": digest}
+
+    def _image_path(self, device_key, kind):
+        entry = self._devices.get(device_key, {}).get(kind)
+        return os.path.join(self.base_dir, entry["image"]) if entry else None
+
+    def image_for(self, mac, kind="nvs"):
+        """
+        Image of the board with this MAC
+
+        Rows keyed by MAC are used directly. Otherwise the board keeps the serial
+        it was given before, or gets the next serial with no board yet.
+
+        Returns:
+            (device_id, image path), or (None, None) if nothing is left for it
+        """
+        mac = normalize_mac(mac)
+        if not mac:
+            return None, None
+        with self._lock:
+            path = self._image_path(mac, kind)
+            if path:
+                return mac, path
+
+            serial = self._assigned.get(mac)
+            if serial is None:
+                taken = set(self._assigned.values())
+                serial = next((device_id for device_id, entry in self._devices.items()
+                               if kind in entry and not normalize_mac(device_id) and device_id not in taken),
+                              None)
+                if serial is None:
+                    return None, None
+                self._assigned[mac] = serial
+                self._save()
+                self.log(f"Serie {serial} asignado a {mac}", "info")
+            return serial, self._image_path(serial, kind)
+
+    def has_kind(self, kind):
+        """True if any device has an image of this kind"""
+        with self._lock:
+            return any(kind in entry for entry in self._devices.values())
+
+    def remaining(self, kind="nvs"):
+        """Serial-numbered images not yet given to a board"""
+        with self._lock:
+            taken = set(self._assigned.values())
+            return sum(1 for device_id, entry in self._devices.items()
+                       if kind in entry and not normalize_mac(device_id) and device_id not in taken)
@@ -0,0 +1,370 @@
+"""
+SPIFFS Images for ESP32 provisioning
+Builds SPIFFS filesystem images in-process (same on-disk layout as mkspiffs /
+spiffsgen.py) and generates one image per device from a certificate manifest:
+the shared files are laid out once and every device image only adds its own files
+
+Certificate manifest (CSV):
+    The first column identifies the board (MAC or serial number); every other
+    header is the path of a file inside SPIFFS and each cell the file to store
+    there, relative to the manifest, e.g.
+
+        mac,/hermesTestClientCert.pem,/hermesTestClientKey.pem
+        24:6f:28:aa:bb:cc,certs/0001-cert.pem,certs/0001-key.pem
+
+    Empty cells fall back to the file of the same name in the base data folder.
+"""
+
+import os
+import csv
+import copy
+import struct
+import hashlib
+
+
+class SpiffsError(ValueError):
+    """Files that cannot be stored in a SPIFFS image"""
+
+
+class SpiffsImage:
+    """
+    SPIFFS image filled file by file, like spiffsgen.py.
+
+    Defaults match the images this tool already flashes (mkspiffs -p 256 -b 4096
+    from PlatformIO): 32-byte names, no metadata, index tables aligned to their
+    2-byte entries and a magic without the block count term. Pass meta_len=4 /
+    magic_length=True for ESP-IDF sdkconfig defaults.
+    """
+
+    FLAG_DATA = 0xFC    # used + final
+    FLAG_INDEX = 0xF8   # used + final + index
+    TYPE_FILE = 1
+    INDEX_ID_FLAG = 0x8000
+    HEADER_LEN = 5      # obj_id u16, span_ix u16, flags u8
+    HEADER_ALIGNED = 8  # object index header starts with the header padded to 4 bytes
+
+    def __init__(self, size, page_size=256, block_size=4096, name_len=32, meta_len=0,
+                 magic_length=False, aligned_index=True):
+        if size % block_size:
+            raise SpiffsError(f"Tamaño SPIFFS 0x{size:X} no es múltiplo del bloque (0x{block_size:X})")
+        self.size = size
+        self.page_size = page_size
+        self.block_size = block_size
+        self.name_len = name_len
+        self.meta_len = meta_len
+        self.magic_length = magic_length
+
+        self.block_count = size // block_size
+        self.pages_per_block = block_size // page_size
+        self.lookup_pages = -(-self.pages_per_block * 2 // page_size)
+        self.usable_pages = self.pages_per_block - self.lookup_pages
+        self.data_len = page_size - self.HEADER_LEN
+        ix_header = self.HEADER_ALIGNED + 4 + 1 + name_len + meta_len
+        self.index_pad = ix_header % 2 if aligned_index else 0
+        ix_header += self.index_pad
+        self.head_refs = (page_size - ix_header) // 2
+        self.refs = (page_size - self.HEADER_ALIGNED) // 2
+
+        self.blocks = []      # open blocks: list of pages (dicts)
+        self.prefix = b""     # finished blocks, already serialized
+        self.prefix_blocks = 0
+        self.next_id = 1
+        self.names = []
+
+    # ------------------------------------------------------------------ #
+    #  Layout                                                              #
+    # ------------------------------------------------------------------ #
+
+    def _page(self, page):
+        """Place one page in the last block (new block when full), returns its page index"""
+        if not self.blocks or len(self.blocks[-1]) >= self.usable_pages:
+            if self.prefix_blocks + len(self.blocks) >= self.block_count:
+                raise SpiffsError(f"Los archivos no caben en una imagen SPIFFS de {self.size // 1024} KB")
+            self.blocks.append([])
+        block = self.blocks[-1]
+        block.append(page)
+        bix = self.prefix_blocks + len(self.blocks) - 1
+        return bix * self.pages_per_block + self.lookup_pages + len(block) - 1
+
+    def add_file(self, name, data):
+        """
+        Store one file
+
+        Args:
+            name: Path inside SPIFFS (e.g. '/cert.pem')
+            data: File contents (bytes)
+        """
+        if not name.startswith('/'):
+            name = '/' + name
+        if len(name.encode('utf-8')) >= self.name_len:
+            raise SpiffsError(f"Nombre demasiado largo para SPIFFS (máx. {self.name_len - 1}): {name}")
+        obj_id = self.next_id
+        self.next_id += 1
+        self.names.append(name)
+
+        index = {"id": obj_id, "span": 0, "size": len(data), "name": name, "refs": []}
+        self._page(index)
+        for span, start in enumerate(range(0, len(data), self.data_len)):
+            limit = self.head_refs if index["span"] == 0 else self.refs
+            if len(index["refs"]) >= limit:
+                # Object index full: continue in a new index page of the same object
+                index = {"id": obj_id, "span": index["span"] + 1, "refs": []}
+                self._page(index)
+            index["refs"].append(self._page({"id": obj_id, "span": span, "data": data[start:start + self.data_len]}))
+
+    def fork(self):
+        """
+        Copy for adding more files. Every block but the last is final between
+        files, so it is serialized once here and shared by all the copies.
+        """
+        if len(self.blocks) > 1:
+            done = self.blocks[:-1]
+            self.prefix += b"".join(self._block_bytes(self.prefix_blocks + i, pages)
+                                    for i, pages in enumerate(done))
+            self.prefix_blocks += len(done)
+            self.blocks = self.blocks[-1:]
+        clone = copy.copy(self)
+        clone.blocks = copy.deepcopy(self.blocks)
+        clone.names = list(self.names)
+        return clone
+
+    # ------------------------------------------------------------------ #
+    #  Serialization                                                       #
+    # ------------------------------------------------------------------ #
+
+    def _page_bytes(self, page):
+        if "data" in page:
+            body = struct.pack('<HHB', page["id"], page["span"], self.FLAG_DATA) + page["data"]
+        else:
+            body = struct.pack('<HHB', page["id"] | self.INDEX_ID_FLAG, page["span"], self.FLAG_INDEX)
+            body += b'\xff' * (self.HEADER_ALIGNED - self.HEADER_LEN)
+            if page["span"] == 0:
+                name = page["name"].encode('utf-8')
+                body += struct.pack('<IB', page["size"], self.TYPE_FILE)
+                # Name, metadata and alignment byte are zero-filled, as mkspiffs writes them
+                body += name + b'\x00' * (self.name_len - len(name) + self.meta_len + self.index_pad)
+            body += struct.pack(f'<{len(page["refs"])}H', *page["refs"])
+        return body + b'\xff' * (self.page_size - len(body))
+
+    def _block_bytes(self, bix, pages):
+        lookup = bytearray(b'\xff') * (self.lookup_pages * self.page_size)
+        for i, page in enumerate(pages):
+            obj_id = page["id"] if "data" in page else page["id"] | self.INDEX_ID_FLAG
+            struct.pack_into('<H', lookup, i * 2, obj_id)
+        # Magic and erase count: last two obj_id slots of the last lookup page
+        magic = 0x20140529 ^ self.page_size
+        if self.magic_length:
+            magic ^= self.block_count - bix
+        struct.pack_into('<HH', lookup, len(lookup) - 4, magic & 0xFFFF, 0)
+        data = bytes(lookup) + b"".join(self._page_bytes(page) for page in pages)
+        return data + b'\xff' * (self.block_size - len(data))
+
+    def to_bytes(self):
+        data = [self.prefix]
+        for i, pages in enumerate(self.blocks):
+            data.append(self._block_bytes(self.prefix_blocks + i, pages))
+        for bix in range(self.prefix_blocks + len(self.blocks), self.block_count):
+            data.append(self._block_bytes(bix, []))
+        return b"".join(data)
+
+
+def folder_files(folder):
+    """(SPIFFS path, file path) of every file under a data folder, sorted like mkspiffs input"""
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            files.append(('/' + os.path.relpath(path, folder).replace(os.sep, '/'), path))
+    return files
+
+
+# ---------------------------------------------------------------------- #
+#  Per-device generation                                                  #
+# ---------------------------------------------------------------------- #
+
+FORMAT_TAG = "spiffs-2"  # Part of every row hash: bump when the image layout changes
+
+_worker_base = None
+
+
+def _init_worker(base):
+    """Process-pool initializer: the shared base image is sent once per worker"""
+    global _worker_base
+    _worker_base = base
+
+
+def _build_job(job):
+    """Build and store one device image from the worker's base, returns (device_id, error)"""
+    device_id, files, out_path = job
+    try:
+        image = _worker_base.fork()
+        for name, path in files:
+            with open(path, 'rb') as f:
+                image.add_file(name, f.read())
+        tmp_path = out_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image.to_bytes())
+        os.replace(tmp_path, out_path)
+        return device_id, None
+    except (OSError, ValueError) as e:
+        return device_id, str(e)
+
+
+class SpiffsBatch:
+    """Builds one SPIFFS image per certificate manifest row over a process pool, cached by row hash"""
+
+    # Below this many images to build, a process pool costs more than it saves
+    POOL_THRESHOLD = 32
+
+    def __init__(self, output_dir, size, base_folder=None, max_workers=None, logger=None, **image_options):
+        """
+        Initialize SPIFFS batch generator
+
+        Args:
+            output_dir: Directory for the images and the manifest
+            size: SPIFFS partition size in bytes
+            base_folder: Data folder with the files every board shares (optional)
+            max_workers: Worker processes (default: CPU count)
+            logger: Optional logger callback function(message, level='info')
+            image_options: SpiffsImage parameters (page_size, block_size, meta_len, ...)
+        """
+        self.output_dir = output_dir
+        self.size = size
+        self.base_folder = base_folder
+        self.max_workers = max_workers
+        self.image_options = image_options
+        self.logger = logger or self._default_logger
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    @staticmethod
+    def _default_logger(message, level='info'):
+        """Default logger - just prints to console"""
+        prefix = {
+            'info': '📝',
+            'success': '✅',
+            'error': '❌',
+            'warning': '⚠️',
+            'debug': '🔍'
+        }.get(level, '•')
+        print(f"{prefix} {message}")
+
+    def log(self, message, level='info'):
+        """Log a message"""
+        self.logger(message, level)
+
+    @staticmethod
+    def _file_digest(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def generate(self, manifest_path, manifest):
+        """
+        Build the image of every device not already cached and register it
+
+        Args:
+            manifest_path: Certificate manifest CSV (see module docstring)
+            manifest: ProvisioningManifest where device -> image is recorded
+
+        Returns:
+            (built, cached, failed) counts
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        with open(manifest_path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = [row for row in csv.reader(f) if row and any(cell.strip() for cell in row)]
+        if len(rows) < 2:
+            raise SpiffsError("El manifiesto no tiene filas de dispositivos")
+        device_names = ['/' + name.strip().lstrip('/') for name in rows[0][1:]]
+
+        # Shared layout: base folder files that no device overrides, laid out once
+        base_files = dict(folder_files(self.base_folder)) if self.base_folder else {}
+        base = SpiffsImage(self.size, **self.image_options)
+        base_digest = hashlib.sha256(f"{FORMAT_TAG};{self.size};{sorted(self.image_options.items())}".encode('utf-8'))
+        for name, path in base_files.items():
+            if name in device_names:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            base.add_file(name, data)
+            base_digest.update(f"{name}={hashlib.sha256(data).hexdigest()};".encode('utf-8'))
+        base_digest = base_digest.hexdigest()
+
+        jobs = []
+        images = {}
+        failed = 0
+        for row in rows[1:]:
+            row = [cell.strip() for cell in row] + [""] * (len(device_names) + 1 - len(row))
+            device_id = row[0]
+            try:
+                files = []
+                digest = hashlib.sha256(base_digest.encode('utf-8'))
+                for name, cell in zip(device_names, row[1:]):
+                    path = os.path.join(base_dir, cell) if cell else base_files.get(name)
+                    if path is None:
+                        continue
+                    files.append((name, path))
+                    digest.update(f"{name}={self._file_digest(path)};".encode('utf-8'))
+            except OSError as e:
+                self.log(f"{device_id}: {e}", "error")
+                failed += 1
+                continue
+            digest = digest.hexdigest()
+            out_path = os.path.join(self.output_dir, f"{digest}.spiffs.bin")
+            images[device_id] = (out_path, digest)
+            if not os.path.exists(out_path):
+                jobs.append((device_id, files, out_path))
+
+        cached = len(images) - len(jobs)
+        self.log(f"SPIFFS: {len(images)} dispositivo(s), {len(base.names)} archivo(s) comunes, "
+                 f"{cached} en caché, {len(jobs)} por generar", "info")
+        if len(jobs) >= self.POOL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                     initargs=(base,)) as pool:
+                results = list(pool.map(_build_job, jobs, chunksize=max(1, len(jobs) // 64)))
+        else:
+            _init_worker(base)
+            results = [_build_job(job) for job in jobs]
+
+        for device_id, error in results:
+            if error:
+                self.log(f"{device_id}: {error}", "error")
+                images.pop(device_id, None)
+                failed += 1
+        for device_id, (path, digest) in images.items():
+            manifest.add(device_id, path, digest, kind="spiffs")
+        manifest.save()
+        built = len(jobs) - sum(1 for _, error in results if error)
+        self.log(f"SPIFFS: {built} generada(s), {cached} reutilizada(s), {failed} con error",
+                 "success" if not failed else "warning")
+        return built, cached, failed
+
+
+def main(argv=None):
+    import argparse
+    from provisioning import ProvisioningManifest
+
+    parser = argparse.ArgumentParser(description="Genera una imagen SPIFFS por dispositivo desde un manifiesto de certificados")
+    parser.add_argument("manifest", help="CSV: MAC o serie, luego una columna por archivo SPIFFS (/cert.pem)")
+    parser.add_argument("--base", default=None, help="Carpeta data/ con los archivos comunes")
+    parser.add_argument("--size", required=True, help="Tamaño de la partición SPIFFS (p.ej. 0x160000)")
+    parser.add_argument("--out", default="spiffs_images", help="Directorio de salida (imágenes + provisioning.json)")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto: núcleos)")
+    parser.add_argument("--meta-len", type=int, default=0, help="SPIFFS_OBJ_META_LEN del firmware (ESP-IDF: 4)")
+    parser.add_argument("--magic-length", action="store_true", help="SPIFFS_USE_MAGIC_LENGTH activado en el firmware")
+    args = parser.parse_args(argv)
+
+    try:
+        batch = SpiffsBatch(args.out, int(args.size, 0), args.base, args.workers,
+                            meta_len=args.meta_len, magic_length=args.magic_length)
+        built, cached, failed = batch.generate(args.manifest, ProvisioningManifest(args.out))
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    return 0 if not failed else 2
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
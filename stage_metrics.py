@@ -0,0 +1,179 @@
+"""
+Stage Metrics for ESP32 flashing
+Times every stage of a flash run (port open, sync, stub upload, erase,
+write/verify per component, MAC read, reset...) per device, and reports
+p50/p95 per stage with CSV/JSON export
+"""
+
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from tracing import TRACER
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile (pct in 0-100) of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+class StageRun:
+    """Timings of one flash run on one board"""
+
+    def __init__(self, port):
+        self.port = port
+        self.device = None        # MAC once known
+        self.started = time.time()
+        self.finished = None
+        self.success = None
+        self.stages = []          # [(stage, seconds)]
+        self.traced = False       # a trace span is open for this run
+
+    @property
+    def total(self):
+        return sum(duration for _, duration in self.stages)
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "device": self.device,
+            "started": self.started,
+            "finished": self.finished,
+            "success": self.success,
+            "stages": [{"stage": name, "seconds": round(duration, 4)} for name, duration in self.stages],
+        }
+
+
+class SessionMetrics:
+    """Collects StageRuns for the session; the active run is tracked per thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.runs = []
+
+    # ------------------------------------------------------------------ #
+    #  Recording                                                           #
+    # ------------------------------------------------------------------ #
+
+    def begin_run(self, port):
+        """Start a run for the calling thread (stages recorded on this thread go to it)"""
+        run = StageRun(port)
+        self._local.run = run
+        with self._lock:
+            self.runs.append(run)
+        run.traced = TRACER.begin("flash run", "run", port=port)
+        return run
+
+    def current(self):
+        return getattr(self._local, "run", None)
+
+    def end_run(self, success, device=None):
+        run = self.current()
+        if run is None:
+            return None
+        run.success = success
+        run.device = device or run.device
+        run.finished = time.time()
+        self._local.run = None
+        if run.traced:
+            TRACER.end(device=run.device, success=success)
+        return run
+
+    def set_device(self, device):
+        run = self.current()
+        if run is not None and device:
+            run.device = device
+
+    def record(self, stage, seconds):
+        """Add a stage duration to the calling thread's run (ignored outside a run)"""
+        run = self.current()
+        if run is not None:
+            with self._lock:
+                run.stages.append((stage, seconds))
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as a stage (also a trace span): with metrics.stage('erase'): ..."""
+        t = time.perf_counter()
+        try:
+            with TRACER.span(name, "stage"):
+                yield
+        finally:
+            self.record(name, time.perf_counter() - t)
+
+    def clear(self):
+        with self._lock:
+            self.runs.clear()
+
+    # ------------------------------------------------------------------ #
+    #  Reporting                                                           #
+    # ------------------------------------------------------------------ #
+
+    def summary(self):
+        """
+        Per-stage statistics, in first-seen stage order
+
+        Returns:
+            Dict stage -> {count, p50, p95, mean, total}
+        """
+        durations = {}
+        with self._lock:
+            for run in self.runs:
+                for name, seconds in run.stages:
+                    durations.setdefault(name, []).append(seconds)
+            cycles = [run.total for run in self.runs if run.finished]
+
+        result = {}
+        for name, values in durations.items():
+            result[name] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "mean": sum(values) / len(values),
+                "total": sum(values),
+            }
+        if cycles:
+            result["TOTAL"] = {"count": len(cycles), "p50": percentile(cycles, 50),
+                               "p95": percentile(cycles, 95),
+                               "mean": sum(cycles) / len(cycles), "total": sum(cycles)}
+        return result
+
+    def format_summary(self):
+        """Compact text table for the session panel"""
+        summary = self.summary()
+        if not summary:
+            return "Sin datos de etapas todavía"
+        width = max(len(name) for name in summary)
+        lines = [f"{'Etapa':<{width}}  {'p50':>6} {'p95':>6}   n"]
+        for name, stats in summary.items():
+            lines.append(f"{name:<{width}}  {stats['p50']:6.2f} {stats['p95']:6.2f} {stats['count']:3}")
+        return "\n".join(lines)
+
+    def export_csv(self, path):
+        """One row per recorded stage: run, port, device, success, stage, seconds"""
+        with self._lock:
+            runs = list(self.runs)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["run", "started", "port", "device", "success", "stage", "seconds"])
+            for idx, run in enumerate(runs, 1):
+                started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run.started))
+                for name, seconds in run.stages:
+                    writer.writerow([idx, started, run.port, run.device or "", run.success,
+                                     name, f"{seconds:.4f}"])
+
+    def export_json(self, path):
+        """Runs with their stages plus the per-stage summary"""
+        with self._lock:
+            runs = [run.to_dict() for run in self.runs]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"summary": self.summary(), "runs": runs}, f, indent=2)
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+from async_engine import AsyncFlashEngine, EngineTimeout
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+class _SlowFlashManager:
+    """open_session takes `delay` seconds and holds its worker meanwhile"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.opened = []
+        self.closed = []
+
+    def open_session(self, port, chip, baud):
+        time.sleep(self.delay)
+        self.opened.append(port)
+        return object()
+
+    def close_session(self, esp, reset_mode='hard-reset'):
+        self.closed.append(esp)
+
+
+def test_queued_calls_are_not_on_the_clock():
+    manager = _SlowFlashManager(0.2)
+    engine = AsyncFlashEngine(manager, max_workers=1, logger=_quiet)
+
+    async def main():
+        # One worker: the last connect waits 0.6 s in the queue, but only runs for 0.2 s
+        return await asyncio.gather(*(engine.connect(f"P{i}", timeout=0.5) for i in range(4)))
+
+    sessions = asyncio.run(main())
+    assert [session.port for session in sessions] == ["P0", "P1", "P2", "P3"]
+    engine.shutdown()
+
+
+def test_running_call_still_times_out():
+    manager = _SlowFlashManager(0.5)
+    engine = AsyncFlashEngine(manager, max_workers=1, logger=_quiet)
+
+    async def main():
+        with pytest.raises(EngineTimeout):
+            await engine.connect("P0", timeout=0.1)
+        # The session that opened after giving up is released
+        await asyncio.sleep(0.6)
+
+    asyncio.run(main())
+    assert len(manager.closed) == 1
+    engine.shutdown()
+
+
+def test_cancelled_queued_call_never_runs():
+    manager = _SlowFlashManager(0.2)
+    engine = AsyncFlashEngine(manager, max_workers=1, logger=_quiet)
+
+    async def main():
+        first = asyncio.ensure_future(engine.connect("P0"))
+        queued = asyncio.ensure_future(engine.connect("P1"))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await first
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        await asyncio.sleep(0.3)
+
+    asyncio.run(main())
+    assert manager.opened == ["P0"]
+    engine.shutdown()
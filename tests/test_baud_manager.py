@@ -0,0 +1,139 @@
+import socket
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from baud_manager import BaudManager
+from flash_utils import FlashManager
+
+
+class _Listing(list):
+    """comports() result that also counts the enumerations"""
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    """Fake comports() listing; returns the list so tests can add adapters"""
+    import serial.tools.list_ports
+    listing = _Listing()
+    calls = []
+
+    def comports():
+        calls.append(1)
+        return listing
+
+    monkeypatch.setattr(serial.tools.list_ports, "comports", comports)
+    monkeypatch.setattr(BaudManager, "_keys", {})
+    listing.calls = calls
+    return listing
+
+
+def _adapter(device, serial_number, vid=0x10C4, pid=0xEA60):
+    return SimpleNamespace(device=device, vid=vid, pid=pid, serial_number=serial_number)
+
+
+def test_unique_serial_follows_the_adapter(ports):
+    ports.append(_adapter("COM3", "A50285BI"))
+    assert BaudManager.port_key("COM3") == "usb:10C4:EA60:A50285BI"
+
+
+def test_non_unique_serial_falls_back_to_port_name(ports):
+    ports.extend([_adapter("COM3", "0001"), _adapter("COM4", "0001")])
+    assert BaudManager.port_key("COM3") == "port:COM3"
+    assert BaudManager.port_key("COM4") == "port:COM4"
+
+
+def test_port_key_is_resolved_once(ports):
+    ports.append(_adapter("COM3", "A50285BI"))
+    manager = BaudManager()
+    manager.record_success("COM3", 921600)
+    manager.candidates("COM3")
+    manager.best_rate("COM3")
+    assert len(ports.calls) == 1
+    BaudManager.forget_port("COM3")
+    BaudManager.port_key("COM3")
+    assert len(ports.calls) == 2
+
+
+def test_failure_lowers_then_probes_back_up(ports):
+    manager = BaudManager(logger=lambda message, level='info': None)
+    assert manager.record_failure("COM3", 2000000) == 1500000
+    assert manager.candidates("COM3")[0] == 1500000
+
+    for _ in range(BaudManager.PROBE_AFTER):
+        manager.record_success("COM3", 1500000)
+    assert manager.candidates("COM3")[0] == 2000000
+
+    # Probe failed again: back to the lower rate and a fresh success streak
+    manager.record_failure("COM3", 2000000)
+    assert manager.candidates("COM3")[0] == 1500000
+
+    for _ in range(BaudManager.PROBE_AFTER):
+        manager.record_success("COM3", 1500000)
+    manager.record_success("COM3", 2000000)
+    assert manager.candidates("COM3")[0] == 2000000
+    assert "lowered_from" not in manager._profiles["port:COM3"]
+
+
+def test_probe_climbs_one_step_at_a_time(ports):
+    manager = BaudManager(logger=lambda message, level='info': None)
+    manager.record_failure("COM3", 2000000)
+    manager.record_failure("COM3", 1500000)
+    for _ in range(BaudManager.PROBE_AFTER):
+        manager.record_success("COM3", 921600)
+    assert manager.candidates("COM3")[:2] == [1500000, 921600]
+    manager.record_success("COM3", 1500000)
+    assert manager.candidates("COM3")[0] == 1500000
+    assert manager.candidates("COM3", 921600)[0] == 921600
+
+
+@pytest.fixture
+def bridge():
+    """Local socket:// bridge that echoes what it receives (a raw TCP serial server)"""
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                while True:
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    conn.sendall(data)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f"socket://127.0.0.1:{server.getsockname()[1]}"
+    server.close()
+
+
+def test_raw_socket_bridge_stays_at_rom_baud(ports, bridge):
+    manager = BaudManager(logger=lambda message, level='info': None)
+    manager.record_success(bridge, 921600)  # e.g. remembered from before the fix
+    flash_manager = FlashManager(logger=lambda message, level='info': None, baud_manager=manager)
+    assert flash_manager.resolve_baud(bridge, "auto") == BaudManager.ROM_BAUD
+    assert flash_manager.resolve_baud(bridge, "921600") == BaudManager.ROM_BAUD
+    assert manager.candidates(bridge) == [BaudManager.ROM_BAUD]
+
+    rates = []
+
+    def operation(baud):
+        rates.append(baud)
+        serial_port = FlashManager._open_port(bridge)
+        try:
+            serial_port.write(b"sync")
+            return SimpleNamespace(returncode=0 if serial_port.read(4) == b"sync" else 1)
+        finally:
+            serial_port.close()
+
+    assert manager.run(bridge, operation, "auto").returncode == 0
+    assert rates == [BaudManager.ROM_BAUD]
+
+
+def test_rfc2217_ports_still_negotiate(ports):
+    manager = BaudManager(logger=lambda message, level='info': None)
+    assert manager.candidates("rfc2217://127.0.0.1:4000")[0] == BaudManager.RATES[0]
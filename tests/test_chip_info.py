@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+from baud_manager import BaudManager
+from chip_info import ChipInfo, ChipInfoCache
+
+
+def test_forget_port_after_the_board_is_unplugged(monkeypatch):
+    import serial.tools.list_ports
+    listing = [SimpleNamespace(device="COM3", vid=0x303A, pid=0x1001, serial_number="F4:12:FA:00:11:22")]
+    monkeypatch.setattr(serial.tools.list_ports, "comports", lambda: listing)
+    monkeypatch.setattr(BaudManager, "_keys", {})
+
+    cache = ChipInfoCache(None, logger=lambda message, level='info': None)
+    cache.put(ChipInfo(mac="F4:12:FA:00:11:22", chip="esp32s3"), "COM3")
+    assert cache.for_port("COM3").mac == "F4:12:FA:00:11:22"
+
+    # Unplugged: the port is gone from the listing and its resolved key expired
+    listing.clear()
+    BaudManager.forget_port("COM3")
+    cache.forget_port("COM3")
+    assert cache.for_port("COM3") is None
+    assert cache.get("f4:12:fa:00:11:22") is not None
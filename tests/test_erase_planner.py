@@ -0,0 +1,73 @@
+import pytest
+
+from erase_planner import ErasePlanner, EraseRange
+from partition_table import PartitionTable
+
+PARTITIONS = """
+# Name,   Type, SubType, Offset,   Size
+nvs,      data, nvs,     0x9000,   0x5000
+otadata,  data, ota,     0xe000,   0x2000
+app0,     app,  ota_0,   0x10000,  0x140000
+app1,     app,  ota_1,   0x150000, 0x140000
+spiffs,   data, spiffs,  0x290000, 0x160000
+nvs_key,  data, nvs_keys,0x3F0000, 0x1000
+"""
+
+FLASH_SIZE = 0x400000
+
+
+def _ranges(plan):
+    return [(r.offset, r.end) for r in plan]
+
+
+def _planner():
+    return ErasePlanner(PartitionTable.from_csv(PARTITIONS), FLASH_SIZE)
+
+
+def test_simple_mode_is_covered_by_the_writes():
+    writes = [(0x1000, 0x5000), (0x8000, 0xC00), (0x10000, 0x12345)]
+    assert _planner().plan(writes, "simple") == []
+
+
+def test_write_coverage_aligns_and_coalesces():
+    writes = [(0x10000, 0x800), (0x10800, 0x1000), (0x12000, 0x10), (0x20000, 0x1000)]
+    assert ErasePlanner.write_coverage(writes) == [(0x10000, 0x13000), (0x20000, 0x21000)]
+
+
+def test_complete_mode_coalesces_gaps_between_writes():
+    writes = [(0x1000, 0x5000), (0x8000, 0xC00), (0x10000, 0x100000)]
+    plan = ErasePlanner(None, FLASH_SIZE).plan(writes, "complete")
+    assert _ranges(plan) == [(0x0, 0x1000), (0x6000, 0x8000), (0x9000, 0x10000), (0x110000, FLASH_SIZE)]
+    assert all(isinstance(r, EraseRange) for r in plan)
+
+
+def test_complete_mode_preserves_nvs_partitions():
+    writes = [(0x1000, 0x5000), (0x8000, 0xC00), (0x10000, 0x100000)]
+    plan = _planner().plan(writes, "complete", preserve_nvs=True)
+    assert _ranges(plan) == [(0x0, 0x1000), (0x6000, 0x8000), (0xE000, 0x10000),
+                             (0x110000, 0x3F0000), (0x3F1000, FLASH_SIZE)]
+    for nvs in PartitionTable.from_csv(PARTITIONS).nvs_partitions:
+        assert not any(r.offset < nvs.end and nvs.offset < r.end for r in plan)
+
+
+def test_complete_mode_without_preserve_erases_nvs():
+    plan = _planner().plan([(0x10000, 0x1000)], "complete")
+    assert _ranges(plan) == [(0x0, 0x10000), (0x11000, FLASH_SIZE)]
+
+
+def test_flash_end_defaults_to_partition_table_end():
+    plan = ErasePlanner(PartitionTable.from_csv(PARTITIONS)).plan([(0x10000, 0x1000)], "complete")
+    assert plan[-1].end == 0x3F1000
+
+
+def test_describe():
+    assert ErasePlanner.describe([]).startswith("nada que borrar")
+    assert ErasePlanner.describe([EraseRange(0x0, 0x1000), EraseRange(0x6000, 0x2000)]) == "2 rango(s), 12 KB"
+
+
+def test_complete_mode_needs_the_flash_end():
+    planner = ErasePlanner(None, None)
+    assert not planner.flash_end_known
+    assert planner.plan([(0x10000, 0x1000)], "simple") == []
+    with pytest.raises(ValueError):
+        planner.plan([(0x10000, 0x1000)], "complete")
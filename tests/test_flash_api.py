@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from flash_api import APIError, FlashAPI
+from job_scheduler import FlashPlan, JobScheduler
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+class _BlockingFlashManager:
+    """Sessions never open until released: submitted jobs stay pending"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def open_session(self, port, chip, baud):
+        self.release.wait(5)
+        return None
+
+    def close_session(self, esp, reset_mode='hard-reset'):
+        pass
+
+
+class _ProjectIndex:
+    def __init__(self):
+        self.asked = []
+
+    def get(self, name):
+        self.asked.append(name)
+        return None
+
+
+@pytest.fixture
+def api():
+    manager = _BlockingFlashManager()
+    scheduler = JobScheduler(manager, max_stage_retries=0, max_job_runs=1, logger=_quiet)
+    api = FlashAPI(scheduler, project_index=_ProjectIndex(), logger=_quiet)
+    yield api
+    manager.release.set()
+    scheduler.shutdown()
+
+
+def test_concurrent_submits_to_one_port_queue_one_job(api, monkeypatch):
+    def plan(operation, request):
+        time.sleep(0.05)  # Every request passes the early busy-port check before any submit
+        return FlashPlan("esp32s3", "auto", []), None, None
+
+    monkeypatch.setattr(api, "_plan", plan)
+    start = threading.Barrier(8)
+    results = []
+
+    def submit():
+        start.wait()
+        try:
+            results.append(api.submit({"port": "COM3"}).id)
+        except APIError as e:
+            results.append(e.status)
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(409) == 7
+    assert len(api.scheduler.jobs) == 1
+
+
+@pytest.mark.parametrize("name", ["../secrets", "..", "a/b", "a\\b", "C:\\temp", "/etc", ".", "proj\0"])
+def test_project_names_with_paths_are_rejected(api, name):
+    with pytest.raises(APIError) as error:
+        api.submit({"port": "COM3", "project": name})
+    assert error.value.status == 400
+    assert api.project_index.asked == []
+
+
+def test_plain_project_name_reaches_the_index(api):
+    with pytest.raises(APIError) as error:
+        api.submit({"port": "COM3", "project": "Hermes_sender"})
+    assert error.value.status == 404
+    assert api.project_index.asked == ["Hermes_sender"]
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import zlib
+
+import pytest
+
+from flash_backup import FlashBackup
+
+FLASH_SIZE = 0x9800   # Two whole chunks and a partial one ending mid-sector
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+class _SmallBackup(FlashBackup):
+    CHUNK_SIZE = 0x4000
+    DIFF_BLOCK = 0x2000
+
+
+class _FakeEsp:
+    """Flash contents in memory with the reads an esptool session offers"""
+
+    CHIP_NAME = "ESP32-S3"
+
+    def __init__(self, data, fail_at=None):
+        self.flash = bytearray(data)
+        self.fail_at = fail_at    # read_flash raises from this offset on
+        self.reads = []
+        self.md5_calls = []
+
+    def read_flash(self, offset, size):
+        if self.fail_at is not None and offset >= self.fail_at:
+            raise OSError("link lost")
+        self.reads.append(offset)
+        return bytes(self.flash[offset:offset + size])
+
+    def flash_md5sum(self, offset, size):
+        assert offset + size <= len(self.flash), "md5 past the end of the flash"
+        self.md5_calls.append((offset, size))
+        return hashlib.md5(self.flash[offset:offset + size]).hexdigest()
+
+
+class _FakeFlashManager:
+    def __init__(self, flash_size=FLASH_SIZE):
+        self.flash_size = flash_size
+        self.written = []
+
+    def session_flash_size(self, esp):
+        return self.flash_size
+
+    def read_mac(self, esp):
+        return "24:6f:28:00:00:01"
+
+    def write_payload(self, esp, offset, payload, label=None):
+        data = zlib.decompress(payload.data)
+        esp.flash[offset:offset + len(data)] = data
+        self.written.append((offset, len(data)))
+        return True
+
+
+def _contents(size=FLASH_SIZE):
+    return bytes((i * 7 + i // 251) & 0xFF for i in range(size))
+
+
+@pytest.fixture
+def backed_up(tmp_path):
+    """A complete backup of a fake board: (backup, esp, path, index)"""
+    backup = _SmallBackup(_FakeFlashManager(), logger=_quiet)
+    esp = _FakeEsp(_contents())
+    path = str(tmp_path / "board.bin.z")
+    assert backup.backup(esp, path)
+    return backup, esp, path, backup.load_index(path)
+
+
+def test_backup_chunks_cover_the_flash(backed_up):
+    backup, esp, path, index = backed_up
+    assert index["complete"]
+    assert [(c["offset"], c["size"]) for c in index["chunks"]] == [(0, 0x4000), (0x4000, 0x4000), (0x8000, 0x1800)]
+    assert len(index["chunks"][-1]["sectors"]) == 2
+    assert b"".join(backup.read_chunk(path, c) for c in index["chunks"]) == _contents()
+
+
+def test_coalesce_merges_adjacent_sectors():
+    sectors = [0x0, 0x1000, 0x2000, 0x5000, 0x6000]
+    assert FlashBackup.coalesce(sectors, 0x1000) == [(0x0, 0x3000), (0x5000, 0x2000)]
+
+
+def test_coalesce_splits_runs_at_max_run():
+    sectors = [i * 0x1000 for i in range(5)]
+    assert FlashBackup.coalesce(sectors, 0x1000, max_run=0x2000) == [(0x0, 0x2000), (0x2000, 0x2000),
+                                                                     (0x4000, 0x1000)]
+    runs = FlashBackup.coalesce([i * 0x1000 for i in range(0x101)], 0x1000)
+    assert runs == [(0x0, FlashBackup.MAX_RUN), (FlashBackup.MAX_RUN, 0x1000)]
+
+
+def test_read_range_spans_two_chunks(backed_up):
+    backup, esp, path, index = backed_up
+    assert backup.read_range(path, index, 0x3800, 0x1000) == _contents()[0x3800:0x4800]
+    assert backup.read_range(path, index, 0x3000, 0x6800) == _contents()[0x3000:]
+
+
+def test_identical_board_has_no_differing_sectors(backed_up):
+    backup, esp, path, index = backed_up
+    assert backup.diff_sectors(esp, path, index) == []
+    assert len(esp.md5_calls) == 3   # One device hash per chunk
+
+
+def test_diff_finds_sectors_in_the_partial_last_chunk(backed_up):
+    backup, esp, path, index = backed_up
+    esp.flash[0x1000] ^= 0xFF
+    esp.flash[0x97FF] ^= 0xFF       # Last byte of the flash, in the half sector
+    assert backup.diff_sectors(esp, path, index) == [0x1000, 0x9000]
+    assert (0x9000, 0x800) in esp.md5_calls
+
+
+def test_restore_writes_only_differing_sectors(backed_up):
+    backup, esp, path, index = backed_up
+    esp.flash[0x3FFF] ^= 0xFF
+    esp.flash[0x4000] ^= 0xFF
+    esp.flash[0x9100] ^= 0xFF
+    assert backup.restore(esp, path)
+    assert backup.flash_manager.written == [(0x3000, 0x2000), (0x9000, 0x800)]
+    assert bytes(esp.flash) == _contents()
+
+
+def test_interrupted_backup_resumes_after_the_last_chunk(tmp_path):
+    backup = _SmallBackup(_FakeFlashManager(), logger=_quiet)
+    path = str(tmp_path / "board.bin.z")
+    assert not backup.backup(_FakeEsp(_contents(), fail_at=0x8000), path)
+    index = backup.load_index(path)
+    assert not index["complete"] and len(index["chunks"]) == 2
+
+    # Partial write of the next chunk that never made it into the index
+    end_pos = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b"\x00" * 100)
+
+    esp = _FakeEsp(_contents())
+    assert backup.backup(esp, path)
+    assert esp.reads == [0x8000]
+    index = backup.load_index(path)
+    assert index["complete"] and index["chunks"][2]["pos"] == end_pos
+    assert os.path.getsize(path) == end_pos + index["chunks"][2]["length"]
+    assert backup.read_range(path, index, 0, FLASH_SIZE) == _contents()
+
+
+def test_backup_of_another_board_starts_over(tmp_path):
+    backup = _SmallBackup(_FakeFlashManager(), logger=_quiet)
+    path = str(tmp_path / "board.bin.z")
+    assert not backup.backup(_FakeEsp(_contents(), fail_at=0x4000), path)
+
+    backup.flash_manager.read_mac = lambda esp: "24:6f:28:00:00:02"
+    esp = _FakeEsp(_contents())
+    assert backup.backup(esp, path)
+    assert esp.reads == [0x0, 0x4000, 0x8000]
+    assert backup.load_index(path)["mac"] == "24:6f:28:00:00:02"
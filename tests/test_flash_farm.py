@@ -0,0 +1,169 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from artifact_store import ArtifactStore
+from chip_info import ChipInfo
+from flash_farm import Connection, Coordinator, FarmJob, StationAgent
+from job_scheduler import FlashPlan
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def farm(tmp_path):
+    firmware = tmp_path / "firmware.bin"
+    firmware.write_bytes(b"\xe9" + bytes(4095))
+    coordinator = Coordinator("127.0.0.1", 0, store=ArtifactStore(str(tmp_path / "store"), logger=_quiet),
+                              logger=_quiet)
+    coordinator.start()
+    plan = FlashPlan("esp32s3", "auto", [(0x10000, str(firmware), "Firmware")])
+    yield coordinator, plan
+    coordinator.stop()
+
+
+def _agent(coordinator, ports=(), jobs=()):
+    """Raw agent connection that has said hello"""
+    connection = Connection(socket.create_connection(coordinator.address))
+    connection.send({"type": "hello", "station": "st1", "ports": list(ports), "jobs": list(jobs)})
+    return connection
+
+
+def _assigned(coordinator, plan):
+    connection = _agent(coordinator, ports=["P1"])
+    job = coordinator.submit(plan)
+    message, _ = connection.receive()
+    assert message["type"] == "assign" and message["job"] == job.id
+    return connection, job
+
+
+def test_reconnecting_station_keeps_its_jobs(farm):
+    coordinator, plan = farm
+    connection, job = _assigned(coordinator, plan)
+    connection.close()
+    assert _wait(lambda: "st1" not in coordinator.stations)
+    assert job.state == FarmJob.ASSIGNED and job.station == "st1"
+
+    connection = _agent(coordinator, jobs=[job.id])
+    assert _wait(lambda: "st1" in coordinator.stations)
+    connection.send({"type": "job_update", "job": job.id, "state": FarmJob.DONE, "mac": "aa:bb:cc:dd:ee:ff",
+                     "timings": [["connect", 1.0]]})
+    assert _wait(lambda: job.state == FarmJob.DONE)
+    assert job.station == "st1" and job.mac == "aa:bb:cc:dd:ee:ff"
+    connection.close()
+
+
+def test_unclaimed_jobs_are_requeued_on_reconnect(farm):
+    coordinator, plan = farm
+    connection, job = _assigned(coordinator, plan)
+    connection.close()
+    assert _wait(lambda: "st1" not in coordinator.stations)
+
+    connection = _agent(coordinator)
+    assert _wait(lambda: job.state == FarmJob.QUEUED)
+    assert job.station is None
+    connection.close()
+
+
+def test_jobs_are_requeued_after_the_grace_period(farm):
+    coordinator, plan = farm
+    coordinator.RECLAIM_GRACE_S = 0.2
+    connection, job = _assigned(coordinator, plan)
+    connection.close()
+    assert _wait(lambda: "st1" not in coordinator.stations)
+    assert job.state == FarmJob.ASSIGNED
+    assert _wait(lambda: job.state == FarmJob.QUEUED)
+
+
+def test_agent_offers_fixed_port_again_after_preparation_failure(tmp_path):
+    agent = StationAgent(("127.0.0.1", 1), name="st1", flash_manager=object(), ports=["P1"],
+                         store=ArtifactStore(str(tmp_path / "store"), logger=_quiet), logger=_quiet)
+    sent = []
+
+    def send(message, payload=b""):
+        sent.append(message)
+        return message["type"] != "blob_request"  # Firmware cannot be downloaded
+
+    agent._send = send
+    agent._start_job({"job": 7, "port": "P1", "plan": {"chip": "esp32s3", "baud": "auto",
+                                                       "files": [[65536, "0" * 64, "Firmware"]]}})
+    assert [m["type"] for m in sent] == ["blob_request", "job_update", "port_ready"]
+    assert sent[1]["state"] == FarmJob.REJECTED
+    assert agent.ready_ports() == ["P1"] and agent.claimed_jobs() == []
+
+
+def test_agent_claims_jobs_finished_while_disconnected(tmp_path):
+    agent = StationAgent(("127.0.0.1", 1), name="st1", flash_manager=object(), ports=["P1", "P2"],
+                         store=ArtifactStore(str(tmp_path / "store"), logger=_quiet), logger=_quiet)
+    agent._finished(7, "P1", {"type": "job_update", "job": 7, "state": FarmJob.DONE, "timings": []})
+    assert agent.claimed_jobs() == [7]
+    assert agent.ready_ports() == ["P2"]
+
+
+class _FixtureFlashManager:
+    """The board in a fixed-port fixture: stays in place until `mac` changes"""
+
+    def __init__(self, mac):
+        self.mac = mac
+        self.written = []
+
+    def open_session(self, port, chip, baud):
+        return object()
+
+    def close_session(self, esp, reset_mode='hard-reset'):
+        pass
+
+    def read_mac(self, esp):
+        return self.mac
+
+    def read_flash_id(self, esp):
+        return 0x1640EF
+
+    def collect_chip_info(self, esp):
+        return ChipInfo(mac=self.mac, chip="esp32s3", flash_size="4MB")
+
+    def session_flash_size(self, esp):
+        return 0x400000
+
+    def erase_ranges(self, esp, ranges):
+        return True
+
+    def write_file(self, esp, addr, path, label=None):
+        self.written.append(self.mac)
+        return True
+
+
+def test_fixed_port_flashes_each_board_once(farm, tmp_path):
+    coordinator, plan = farm
+    manager = _FixtureFlashManager("24:6f:28:00:00:01")
+    agent = StationAgent(coordinator.address, name="st1", flash_manager=manager, ports=["P1"],
+                         store=ArtifactStore(str(tmp_path / "agent"), logger=_quiet), logger=_quiet)
+    agent.NEXT_BOARD_POLL_S = 0.05
+    threading.Thread(target=agent.run, daemon=True).start()
+    try:
+        coordinator.run_plan(plan, count=2)
+        assert _wait(lambda: coordinator.stats()["done"] == 1)
+        time.sleep(0.5)  # The port is offered again several times while the board stays
+        stats = coordinator.stats()
+        assert stats["done"] == 1 and stats["auto_left"] == 1
+        assert manager.written == ["24:6f:28:00:00:01"]
+
+        manager.mac = "24:6f:28:00:00:02"  # Operator swaps the board
+        assert _wait(coordinator.idle)
+        assert manager.written == ["24:6f:28:00:00:01", "24:6f:28:00:00:02"]
+        assert [job.mac for job in coordinator.jobs] == manager.written
+    finally:
+        agent.stop()
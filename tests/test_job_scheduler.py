@@ -0,0 +1,273 @@
+import time
+
+import pytest
+
+from chip_info import ChipInfo, ChipInfoCache
+from job_scheduler import FlashJob, FlashPlan, JobScheduler, PreflightError
+from partition_table import PartitionTable
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+def _job(port, state, started=None, finished=None):
+    job = FlashJob(port, FlashPlan("esp32s3", "auto", []))
+    job.state = state
+    job.started = started
+    job.finished = finished
+    return job
+
+
+def test_cancel_queued_notifies_each_job():
+    updates = []
+    scheduler = JobScheduler(None, logger=_quiet, on_job_update=updates.append)
+    queued = [_job("COM3", FlashJob.QUEUED), _job("COM4", FlashJob.QUEUED)]
+    running = _job("COM5", FlashJob.RUNNING, started=time.time())
+    scheduler.jobs.extend(queued + [running])
+
+    assert scheduler.cancel_queued() == 2
+    assert updates == queued
+    assert all(job.state == FlashJob.FAILED and job.finished for job in queued)
+    assert running.state == FlashJob.RUNNING
+
+
+def test_cancel_queued_one_port():
+    updates = []
+    scheduler = JobScheduler(None, logger=_quiet, on_job_update=updates.append)
+    scheduler.jobs.extend([_job("COM3", FlashJob.QUEUED), _job("COM4", FlashJob.QUEUED)])
+    assert scheduler.cancel_queued("COM4") == 1
+    assert [job.port for job in updates] == ["COM4"]
+
+
+def test_throughput_uses_a_sliding_window():
+    scheduler = JobScheduler(None, logger=_quiet)
+    now = time.time()
+    window = JobScheduler.THROUGHPUT_WINDOW_S
+    # A busy hour long ago, then 10 boards in the current window
+    scheduler.jobs.extend(_job("COM3", FlashJob.DONE, now - 7200 + i, now - 7190 + i) for i in range(100))
+    scheduler.jobs.extend(_job("COM3", FlashJob.DONE, now - window + i * 60, now - window + i * 60 + 30)
+                          for i in range(10))
+
+    stats = scheduler.stats()
+    assert stats["done"] == 110
+    assert stats["throughput_per_hour"] == pytest.approx(10 * 3600 / window, rel=0.01)
+
+
+def test_throughput_of_a_new_session_counts_from_the_first_start():
+    scheduler = JobScheduler(None, logger=_quiet)
+    now = time.time()
+    scheduler.jobs.extend(_job("COM3", FlashJob.DONE, now - 60 + i * 20, now - 50 + i * 20) for i in range(3))
+    assert scheduler.stats()["throughput_per_hour"] == pytest.approx(3 * 60, rel=0.01)
+
+
+class _FakeFlashManager:
+    """Session-less FlashManager: a board whose flash encryption was burnt after it was cached"""
+
+    def __init__(self, encrypted):
+        self.encrypted = encrypted
+        self.collected = 0
+
+    def read_mac(self, esp):
+        return "24:6f:28:aa:bb:cc"
+
+    def collect_chip_info(self, esp):
+        self.collected += 1
+        return ChipInfo(mac="24:6f:28:aa:bb:cc", chip="esp32s3", flash_size="4MB",
+                        flash_encryption=self.encrypted)
+
+    def refresh_security_info(self, esp, info):
+        info.flash_encryption = self.encrypted
+        return info
+
+
+def test_preflight_rereads_security_of_cached_boards(tmp_path):
+    cache = ChipInfoCache(None, logger=_quiet)
+    cache.put(ChipInfo(mac="24:6f:28:aa:bb:cc", chip="esp32s3", flash_size="4MB", flash_encryption=False))
+    manager = _FakeFlashManager(encrypted=True)
+    scheduler = JobScheduler(manager, logger=_quiet, chip_info_cache=cache)
+    image = tmp_path / "app.bin"
+    image.write_bytes(b"\xe9" * 1024)
+    job = FlashJob("COM3", FlashPlan("esp32s3", "auto", []))
+
+    with pytest.raises(PreflightError):
+        scheduler._stage_preflight(job, {"esp": object(), "files": [(0x10000, str(image), "Firmware")]})
+    assert manager.collected == 0
+    assert cache.get("24:6f:28:aa:bb:cc").flash_encryption is True
+
+
+class _ScriptedFlashManager:
+    """Records every call; writes fail `fail_writes` times, the board on the port is `mac`"""
+
+    def __init__(self, mac="24:6f:28:aa:bb:cc", fail_writes=0):
+        self.mac = mac
+        self.fail_writes = fail_writes
+        self.calls = []
+        self.erased = []
+        self.on_write_failure = None
+        self.flash_size = 0x400000
+        self.table = None
+
+    def open_session(self, port, chip, baud):
+        self.calls.append(("open", self.mac))
+        return object()
+
+    def close_session(self, esp, reset_mode='hard-reset'):
+        pass
+
+    def read_mac(self, esp):
+        return self.mac
+
+    def read_flash_id(self, esp):
+        return 0x1640EF
+
+    def collect_chip_info(self, esp):
+        return ChipInfo(mac=self.mac, chip="esp32s3", flash_size="4MB")
+
+    def session_flash_size(self, esp):
+        return self.flash_size
+
+    def read_partition_table(self, esp):
+        return self.table
+
+    def erase_ranges(self, esp, ranges):
+        self.calls.append(("erase", self.mac))
+        self.erased.append([(r.offset, r.end) for r in ranges])
+        return True
+
+    def erase_chip(self, esp):
+        self.calls.append(("erase_chip", self.mac))
+        return True
+
+    def write_file(self, esp, addr, path, label=None):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            if self.on_write_failure:
+                self.on_write_failure()
+            return False
+        self.calls.append(("write", self.mac))
+        return True
+
+
+@pytest.fixture
+def plan(tmp_path):
+    image = tmp_path / "app.bin"
+    image.write_bytes(b"\xe9" * 1024)
+    return FlashPlan("esp32s3", "auto", [(0x10000, str(image), "Firmware")], erase_mode="complete",
+                     preserve_nvs=False)
+
+
+def _scheduler(manager, **kwargs):
+    kwargs.setdefault("backoff_base", 0.01)
+    return JobScheduler(manager, logger=_quiet, **kwargs)
+
+
+def test_failed_stage_is_retried_and_resumes_after_reconnect(plan):
+    manager = _ScriptedFlashManager(fail_writes=2)
+    scheduler = _scheduler(manager, max_stage_retries=3)
+    job = FlashJob("COM3", plan)
+    scheduler._run(job)
+
+    assert job.state == FlashJob.DONE
+    assert job.stage_retries == {"write:Firmware": 2}
+    # Every retry reconnects but the erase is not repeated
+    assert [call for call, _ in manager.calls] == ["open", "erase", "open", "open", "write"]
+
+
+def test_board_swapped_during_backoff_restarts_the_plan(plan):
+    manager = _ScriptedFlashManager(fail_writes=1)
+    manager.on_write_failure = lambda: setattr(manager, "mac", "24:6f:28:11:22:33")
+    scheduler = _scheduler(manager)
+    job = FlashJob("COM3", plan)
+    scheduler._run(job)
+
+    assert job.state == FlashJob.DONE
+    assert job.mac == "24:6f:28:11:22:33"
+    # The new board gets the erase too, not only the remaining write
+    new_board = [call for call, mac in manager.calls if mac == "24:6f:28:11:22:33"]
+    assert new_board == ["open", "open", "erase", "write"]
+
+
+def test_board_that_keeps_failing_goes_to_the_reject_list(plan):
+    manager = _ScriptedFlashManager(fail_writes=100)
+    updates = []
+    scheduler = _scheduler(manager, max_stage_retries=1, max_job_runs=2, on_job_update=updates.append)
+    job = FlashJob("COM3", plan)
+    scheduler.jobs.append(job)
+    scheduler._run(job)
+    assert job.state == FlashJob.QUEUED and job.runs == 1  # Requeued for a fresh run
+
+    assert _wait(lambda: job.state == FlashJob.REJECTED)
+    scheduler.shutdown()
+    assert job.runs == 2
+    assert scheduler.rejected == [job]
+    assert job.error.startswith("write:Firmware")
+
+
+def test_preflight_errors_are_rejected_without_retries(plan):
+    manager = _ScriptedFlashManager()
+    manager.collect_chip_info = lambda esp: ChipInfo(mac=manager.mac, chip="esp32s3", flash_size="4MB",
+                                                     flash_encryption=True)
+    scheduler = _scheduler(manager)
+    job = FlashJob("COM3", plan)
+    scheduler._run(job)
+    assert job.state == FlashJob.REJECTED and job.runs == 1
+    assert job.stage_retries == {"preflight": 1}
+
+
+def test_cancel_port_stops_a_job_in_backoff(plan):
+    manager = _ScriptedFlashManager(fail_writes=100)
+    scheduler = _scheduler(manager, backoff_base=30, backoff_max=30)
+    job = scheduler.submit("COM3", plan)
+    assert _wait(lambda: job.state == FlashJob.RETRYING)
+
+    assert scheduler.cancel_port("COM3") == 1
+    assert _wait(lambda: job.state == FlashJob.FAILED)
+    scheduler.shutdown()
+    assert job.error == "cancelado"
+    assert scheduler.rejected == []
+    assert not scheduler.has_pending("COM3")
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _erase_stage(manager, plan):
+    scheduler = _scheduler(manager)
+    job = FlashJob("COM3", plan)
+    ctx = {"esp": object()}
+    scheduler._stage_partition_read(job, ctx)
+    scheduler._stage_erase(job, ctx)
+    return manager
+
+
+def test_complete_erase_reads_the_device_table_when_flash_size_is_unknown(plan):
+    manager = _ScriptedFlashManager()
+    manager.flash_size = None
+    manager.table = PartitionTable.from_csv("nvs, data, nvs, 0x9000, 0x5000\n"
+                                            "app0, app, ota_0, 0x10000, 0x100000\n"
+                                            "spiffs, data, spiffs, 0x110000, 0x100000\n")
+    _erase_stage(manager, plan)
+    # Everything up to the end of the SPIFFS partition, not only up to the app
+    assert manager.erased == [[(0x0, 0x10000), (0x11000, 0x210000)]]
+
+
+def test_complete_erase_without_flash_size_or_table_erases_the_chip(plan):
+    manager = _ScriptedFlashManager()
+    manager.flash_size = None
+    _erase_stage(manager, plan)
+    assert ("erase_chip", manager.mac) in manager.calls
+
+
+def test_complete_erase_preserving_nvs_without_table_only_erases_the_writes(plan):
+    manager = _ScriptedFlashManager()
+    plan.preserve_nvs = True
+    _erase_stage(manager, plan)
+    assert manager.erased == [[]]
+    assert ("erase_chip", manager.mac) not in manager.calls
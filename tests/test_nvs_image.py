@@ -0,0 +1,191 @@
+import base64
+import os
+import struct
+import subprocess
+import sys
+import zlib
+
+import pytest
+
+from nvs_image import NvsBatch, NvsError, NvsImage, build_device_image, parse_columns
+from provisioning import ProvisioningManifest
+
+# Built with esp-idf-nvs-partition-gen 0.3.0 from the CSV of _golden_csv():
+#   python -m esp_idf_nvs_partition_gen generate golden.csv nvs_golden.bin 0x6000 --version 2
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nvs_golden.bin")
+GOLDEN_SIZE = 0x6000
+
+BLOB = bytes((i * 7) % 256 for i in range(6000))   # Spans two pages
+GOLDEN_ENTRIES = [
+    ("cfg", "serial", "string", "SN-0001"),
+    ("cfg", "boot_count", "u8", "7"),
+    ("cfg", "offset", "i32", "-12"),
+    ("cfg", "big", "u64", "1234567890123"),
+    ("cfg", "long", "string", "x" * 1500),           # Spans 48 entries
+    ("cal", "aes", "hex2bin", "00112233445566778899aabbccddeeff"),
+    ("cal", "blob", "hex2bin", BLOB.hex()),
+    ("cal", "b64", "base64", base64.b64encode(b"hello nvs").decode()),
+    ("cal", "neg8", "i8", "-5"),
+]
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+def _crc(data):
+    return zlib.crc32(data, 0xFFFFFFFF) & 0xFFFFFFFF
+
+
+def _golden_image():
+    image = NvsImage(GOLDEN_SIZE)
+    for entry in GOLDEN_ENTRIES:
+        image.add(*entry)
+    return image.to_bytes()
+
+
+def _golden_csv():
+    rows = ["key,type,encoding,value"]
+    namespace = None
+    for ns, key, encoding, value in GOLDEN_ENTRIES:
+        if ns != namespace:
+            rows.append(f"{ns},namespace,,")
+            namespace = ns
+        rows.append(f"{key},data,{encoding},{value}")
+    return "\n".join(rows) + "\n"
+
+
+def _parse(image):
+    """
+    Read an NVS v2 image back, checking every CRC and the entry state bitmap
+
+    Returns:
+        ({(namespace, key): value}, number of pages in use)
+    """
+    sizes = {0x01: "<B", 0x11: "<b", 0x02: "<H", 0x12: "<h", 0x04: "<I", 0x14: "<i", 0x08: "<Q", 0x18: "<q"}
+    namespaces, values, chunks = {}, {}, {}
+    used = 0
+    for pix in range(len(image) // NvsImage.PAGE_SIZE):
+        page = image[pix * NvsImage.PAGE_SIZE:(pix + 1) * NvsImage.PAGE_SIZE]
+        if page == b'\xff' * NvsImage.PAGE_SIZE:
+            continue
+        used += 1
+        state, seq, version = struct.unpack_from('<IIB', page)
+        assert state in (NvsImage.PAGE_ACTIVE, NvsImage.PAGE_FULL)
+        assert (seq, version) == (pix, NvsImage.VERSION2)
+        assert struct.unpack_from('<I', page, 28)[0] == _crc(page[4:28])
+
+        bitmap = int.from_bytes(page[32:64], 'little')
+        states = [(bitmap >> (2 * i)) & 0b11 for i in range(NvsImage.ENTRIES_PER_PAGE)]
+        i = 0
+        while i < NvsImage.ENTRIES_PER_PAGE and states[i] == 0b10:
+            entry = page[64 + 32 * i:96 + 32 * i]
+            ns, kind, span, chunk = entry[:4]
+            assert struct.unpack_from('<I', entry, 4)[0] == _crc(entry[:4] + entry[8:])
+            assert all(s == 0b10 for s in states[i:i + span])
+            key = entry[8:24].split(b'\x00')[0].decode()
+            data = page[96 + 32 * i:64 + 32 * (i + span)]
+            if ns == 0:
+                namespaces[entry[24]] = key
+            elif kind in sizes:
+                values[(ns, key)] = struct.unpack_from(sizes[kind], entry, 24)[0]
+            elif kind in (NvsImage.TYPE_STRING, NvsImage.TYPE_BLOB_DATA):
+                size, _, crc = struct.unpack_from('<HHI', entry, 24)
+                assert _crc(data[:size]) == crc
+                if kind == NvsImage.TYPE_STRING:
+                    values[(ns, key)] = data[:size - 1].decode()
+                else:
+                    chunks.setdefault((ns, key), {})[chunk] = data[:size]
+            elif kind == NvsImage.TYPE_BLOB_INDEX:
+                size, count = struct.unpack_from('<IB', entry, 24)
+                parts = chunks.pop((ns, key))
+                assert sorted(parts) == list(range(count))
+                values[(ns, key)] = b"".join(parts[c] for c in range(count))
+                assert len(values[(ns, key)]) == size
+            i += span
+        assert all(s == 0b11 for s in states[i:])
+    return {(namespaces[ns], key): value for (ns, key), value in values.items()}, used
+
+
+def test_matches_esp_idf_nvs_partition_gen():
+    with open(GOLDEN, 'rb') as f:
+        assert _golden_image() == f.read()
+
+
+def test_matches_installed_nvs_partition_gen(tmp_path):
+    pytest.importorskip("esp_idf_nvs_partition_gen")
+    (tmp_path / "golden.csv").write_text(_golden_csv())
+    subprocess.run([sys.executable, "-m", "esp_idf_nvs_partition_gen", "generate", "golden.csv", "out.bin",
+                    hex(GOLDEN_SIZE), "--version", "2"], cwd=tmp_path, check=True, capture_output=True)
+    assert _golden_image() == (tmp_path / "out.bin").read_bytes()
+
+
+def test_round_trip_of_every_key():
+    image = _golden_image()
+    values, used = _parse(image)
+    assert values == {
+        ("cfg", "serial"): "SN-0001", ("cfg", "boot_count"): 7, ("cfg", "offset"): -12,
+        ("cfg", "big"): 1234567890123, ("cfg", "long"): "x" * 1500,
+        ("cal", "aes"): bytes.fromhex("00112233445566778899aabbccddeeff"), ("cal", "blob"): BLOB,
+        ("cal", "b64"): b"hello nvs", ("cal", "neg8"): -5,
+    }
+    assert used == 3
+    # Unused pages are left erased, the last one always (NVS garbage collector)
+    assert image[used * NvsImage.PAGE_SIZE:] == b'\xff' * (GOLDEN_SIZE - used * NvsImage.PAGE_SIZE)
+
+
+def test_strings_never_span_pages():
+    image = NvsImage(0x4000)
+    image.add("cfg", "pad", "string", "p" * 3000)    # 95 entries + header on page 0
+    image.add("cfg", "next", "string", "n" * 1200)   # 39 entries: does not fit the 30 left
+    data = image.to_bytes()
+    assert struct.unpack_from('<I', data)[0] == NvsImage.PAGE_FULL
+    assert _parse(data)[0][("cfg", "next")] == "n" * 1200
+    assert b"next" in data[NvsImage.PAGE_SIZE:2 * NvsImage.PAGE_SIZE]
+
+
+def test_last_page_is_reserved():
+    image = NvsImage(0x3000)
+    image.add("cfg", "fits", "binary", bytes(7000))  # Two pages: the third one stays free
+    with pytest.raises(NvsError):
+        NvsImage(0x3000).add("cfg", "too_big", "binary", bytes(9000))
+
+
+@pytest.mark.parametrize("encoding, value", [("u8", "256"), ("i8", "-129"), ("u16", "-1"), ("u32", str(1 << 32))])
+def test_out_of_range_values_are_rejected(encoding, value):
+    with pytest.raises(NvsError):
+        NvsImage(0x3000).add("cfg", "value", encoding, value)
+
+
+def test_long_keys_and_unknown_encodings_are_rejected():
+    with pytest.raises(NvsError):
+        NvsImage(0x3000).add("cfg", "k" * 16, "u8", 1)
+    with pytest.raises(NvsError):
+        NvsImage(0x3000).add("cfg", "key", "float", "1.0")
+    with pytest.raises(NvsError):
+        NvsImage(0x1000)
+
+
+@pytest.mark.parametrize("column", ["serial:string", "cfg/serial", "cfg/serial:float"])
+def test_invalid_csv_columns(column):
+    with pytest.raises(NvsError):
+        parse_columns(["mac", column])
+
+
+def test_device_csv_builds_one_image_per_row(tmp_path):
+    (tmp_path / "ca.pem").write_bytes(b"-----BEGIN CERTIFICATE-----")
+    (tmp_path / "devices.csv").write_text(
+        "mac,cfg/serial:string,cal/offset:i32,certs/ca:file\n"
+        "24:6f:28:aa:bb:01,SN-0001,-12,ca.pem\n"
+        "24:6f:28:aa:bb:02,SN-0002,,ca.pem\n"
+        "24:6f:28:aa:bb:03,SN-0003,not-a-number,ca.pem\n")
+    batch = NvsBatch(str(tmp_path / "out"), size=0x3000, logger=_quiet)
+    manifest = ProvisioningManifest(str(tmp_path / "out"), logger=_quiet)
+
+    assert batch.generate(str(tmp_path / "devices.csv"), manifest) == (2, 0, 1)
+    assert batch.generate(str(tmp_path / "devices.csv"), manifest) == (0, 2, 1)
+
+    columns = parse_columns(["mac", "cfg/serial:string", "cal/offset:i32", "certs/ca:file"])
+    values, _ = _parse(build_device_image(columns, ["24:6f:28:aa:bb:02", "SN-0002", "", "ca.pem"], 0x3000,
+                                          str(tmp_path)))
+    assert values == {("cfg", "serial"): "SN-0002", ("certs", "ca"): b"-----BEGIN CERTIFICATE-----"}
@@ -0,0 +1,52 @@
+import os
+import struct
+
+from app_descriptor import AppDescriptor
+from artifact_store import Artifact, ArtifactStore
+from payload_cache import PayloadCache
+
+
+def _quiet(message, level='info'):
+    pass
+
+
+def _app_image(chip_id=9):
+    header = bytes([AppDescriptor.IMAGE_MAGIC]) + bytes(11) + struct.pack('<H', chip_id) + bytes(10)
+    segment = bytes(8)
+    descriptor = struct.pack(AppDescriptor._FORMAT, AppDescriptor.MAGIC, 0, b"1.2.0", b"hermes", b"12:00:00",
+                             b"Jan  1 2026", b"v5.1", bytes(range(32)))
+    return header + segment + descriptor.ljust(AppDescriptor.SIZE, b'\x00') + bytes(1024)
+
+
+def test_device_images_are_not_copied_into_the_store(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"), logger=_quiet)
+    cache = PayloadCache(store.compressed_dir, logger=_quiet, store=store)
+    nvs = tmp_path / "nvs_24-6f-28-aa-bb-cc.bin"
+    nvs.write_bytes(os.urandom(0x5000))
+
+    payload = cache.get(str(nvs))
+    assert store.stats()[0] == 0
+    assert store.get(payload.sha256) is None
+    assert os.listdir(store.compressed_dir) == []
+
+
+def test_stored_artifacts_reuse_digests_and_persist_payloads(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"), logger=_quiet)
+    firmware = tmp_path / "firmware.bin"
+    firmware.write_bytes(_app_image())
+    artifact = store.put(str(firmware), ref="project:hermes/firmware")
+    cache = PayloadCache(store.compressed_dir, logger=_quiet, store=store)
+
+    payload = cache.get(str(firmware))
+    assert (payload.sha256, payload.md5) == (artifact.sha256, artifact.md5)
+    assert os.listdir(store.compressed_dir) == [f"{artifact.sha256}_z{PayloadCache.DEFAULT_LEVEL}.bin"]
+    assert store.gc() == (0, 0)
+
+
+def test_image_metadata_is_parsed_in_one_place():
+    image = _app_image(chip_id=5)
+    kind, chip, app = Artifact.describe(image)
+    assert (kind, chip) == (Artifact.KIND_APP, "esp32c3")
+    assert app == AppDescriptor.from_image(image).to_dict()
+    assert AppDescriptor(**app).project_name == "hermes"
+    assert AppDescriptor.image_chip(b"\x00" * 32) is None
@@ -0,0 +1,126 @@
+import os
+import struct
+
+import pytest
+
+from spiffs_image import SpiffsImage
+
+GOLDEN_PIO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "proyect_firmware", "Hermes_sender", "data", "spiffs_pio.bin")
+
+PAGE = 256
+BLOCK = 4096
+
+
+def _live_pages(image, page_size=PAGE, block_size=BLOCK):
+    """{page index: page bytes} of every page the lookup table marks as in use"""
+    pages = {}
+    per_block = block_size // page_size
+    lookup_pages = -(-per_block * 2 // page_size)
+    for bix in range(len(image) // block_size):
+        block = image[bix * block_size:(bix + 1) * block_size]
+        for i in range(per_block - lookup_pages):
+            obj_id = struct.unpack_from('<H', block, i * 2)[0]
+            if obj_id in (0x0000, 0xFFFF):  # deleted / free
+                continue
+            pix = bix * per_block + lookup_pages + i
+            page = image[pix * page_size:(pix + 1) * page_size]
+            assert struct.unpack_from('<H', page)[0] == obj_id
+            pages[pix] = page
+    return pages
+
+
+def _objects(image, name_len=32, refs_at=46):
+    """{name: (index header page, [data pages by span])} of an image"""
+    pages = _live_pages(image)
+    objects = {}
+    for page in pages.values():
+        obj_id, span, flags = struct.unpack_from('<HHB', page)
+        if obj_id & 0x8000 and span == 0:
+            name = page[13:13 + name_len].split(b'\x00')[0].decode()
+            count = -(-struct.unpack_from('<I', page, 8)[0] // (PAGE - 5))
+            refs = struct.unpack_from(f'<{count}H', page, refs_at)
+            objects[name] = (page, [pages[ref] for ref in refs])
+    return objects
+
+
+def _golden_files(image):
+    """(name, contents) of every file of an mkspiffs image, in creation (object id) order"""
+    files = []
+    for name, (index, data) in _objects(image).items():
+        size = struct.unpack_from('<I', index, 8)[0]
+        obj_id = struct.unpack_from('<H', index)[0] & 0x7FFF
+        files.append((obj_id, name, b"".join(page[5:] for page in data)[:size]))
+    return [(name, contents) for _, name, contents in sorted(files)]
+
+
+@pytest.mark.skipif(not os.path.exists(GOLDEN_PIO), reason="imagen mkspiffs de referencia no disponible")
+def test_pio_defaults_match_mkspiffs_image():
+    with open(GOLDEN_PIO, 'rb') as f:
+        golden = f.read()
+    files = _golden_files(golden)
+    assert len(files) == 3
+
+    image = SpiffsImage(len(golden))
+    for name, contents in files:
+        image.add_file(name, contents)
+    ours = image.to_bytes()
+    assert len(ours) == len(golden)
+
+    # mkspiffs runs the spiffs write path (sparse object ids, index pages
+    # rewritten and deleted, uninitialized header padding): every live page
+    # must match except the object id and the 3 padding bytes of index headers
+    golden_objects = _objects(golden)
+    our_objects = _objects(ours)
+    assert golden_objects.keys() == our_objects.keys()
+    for name, (golden_index, golden_data) in golden_objects.items():
+        our_index, our_data = our_objects[name]
+        assert our_index[2:5] == golden_index[2:5]
+        assert our_index[8:46] == golden_index[8:46]
+        refs_end = 46 + 2 * len(golden_data)
+        assert our_index[refs_end:] == golden_index[refs_end:]
+        assert [page[2:] for page in our_data] == [page[2:] for page in golden_data]
+
+    # Magic and erase count of every block, free space erased
+    for bix in range(len(golden) // BLOCK):
+        tail = slice(bix * BLOCK + PAGE - 4, bix * BLOCK + PAGE)
+        assert ours[tail] == golden[tail]
+    for image in (ours, golden):
+        for bix in range(len(image) // BLOCK):
+            for i in range(BLOCK // PAGE - 1):
+                if image[bix * BLOCK + i * 2:bix * BLOCK + i * 2 + 2] == b'\xff\xff':
+                    start = bix * BLOCK + (i + 1) * PAGE
+                    assert image[start:start + PAGE] == b'\xff' * PAGE
+
+
+def test_esp_idf_settings_layout():
+    image = SpiffsImage(2 * BLOCK, meta_len=4, magic_length=True)
+    image.add_file("/a.txt", b"hello")
+    ours = image.to_bytes()
+
+    # spiffs_nucleus.h with SPIFFS_OBJ_META_LEN=4 and SPIFFS_USE_MAGIC_LENGTH:
+    # 49-byte index header aligned to 50, magic xor'ed with the remaining blocks
+    lookup = bytearray(b'\xff' * PAGE)
+    struct.pack_into('<HH', lookup, 0, 0x8001, 0x0001)
+    struct.pack_into('<HH', lookup, PAGE - 4, (0x20140529 ^ PAGE ^ 2) & 0xFFFF, 0)
+    index = struct.pack('<HHB', 0x8001, 0, 0xF8) + b'\xff' * 3
+    index += struct.pack('<IB', 5, 1) + b"/a.txt".ljust(32 + 4 + 1, b'\x00') + struct.pack('<H', 2)
+    data = struct.pack('<HHB', 0x0001, 0, 0xFC) + b"hello"
+    block0 = bytes(lookup) + index.ljust(PAGE, b'\xff') + data.ljust(PAGE, b'\xff')
+    block1 = bytearray(b'\xff' * BLOCK)
+    struct.pack_into('<HH', block1, PAGE - 4, (0x20140529 ^ PAGE ^ 1) & 0xFFFF, 0)
+    expected = block0.ljust(BLOCK, b'\xff') + bytes(block1)
+
+    assert ours == expected
+
+
+def test_esp_idf_settings_multi_page_file():
+    contents = bytes(range(256)) * 40
+    image = SpiffsImage(16 * BLOCK, meta_len=4, magic_length=True)
+    image.add_file("/big.bin", contents)
+    objects = _objects(image.to_bytes(), refs_at=50)
+    index, data = objects["/big.bin"]
+    assert struct.unpack_from('<IB', index, 8) == (len(contents), 1)
+    assert index[13 + 8:13 + 36] == b'\x00' * 28
+    assert [struct.unpack_from('<H', page, 2)[0] for page in data] == list(range(len(data)))
+    assert b"".join(page[5:] for page in data)[:len(contents)] == contents
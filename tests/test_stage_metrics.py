@@ -0,0 +1,96 @@
+import csv
+import json
+
+import pytest
+
+from stage_metrics import SessionMetrics, percentile
+
+
+def _metrics(runs):
+    """Session with finished runs given as [(port, device, success, [(stage, seconds)])]"""
+    metrics = SessionMetrics()
+    for port, device, success, stages in runs:
+        metrics.begin_run(port)
+        for stage, seconds in stages:
+            metrics.record(stage, seconds)
+        metrics.end_run(success, device)
+    return metrics
+
+
+def test_percentile_of_no_samples_is_zero():
+    assert percentile([], 50) == 0.0
+
+
+def test_percentile_of_one_sample_is_that_sample():
+    assert percentile([2.5], 50) == 2.5
+    assert percentile([2.5], 95) == 2.5
+
+
+def test_percentile_of_two_samples_interpolates():
+    assert percentile([3.0, 1.0], 0) == 1.0
+    assert percentile([3.0, 1.0], 50) == pytest.approx(2.0)
+    assert percentile([3.0, 1.0], 95) == pytest.approx(2.9)
+    assert percentile([3.0, 1.0], 100) == 3.0
+
+
+def test_summary_per_stage_in_first_seen_order():
+    metrics = _metrics([
+        ("P1", "aa:aa", True, [("sync", 1.0), ("erase", 4.0), ("write", 10.0)]),
+        ("P2", "bb:bb", False, [("sync", 3.0), ("erase", 2.0)]),
+    ])
+    summary = metrics.summary()
+    assert list(summary) == ["sync", "erase", "write", "TOTAL"]
+    assert summary["sync"] == {"count": 2, "p50": 2.0, "p95": pytest.approx(2.9), "mean": 2.0, "total": 4.0}
+    assert summary["write"]["count"] == 1 and summary["write"]["p95"] == 10.0
+    assert summary["TOTAL"]["count"] == 2 and summary["TOTAL"]["total"] == 20.0
+
+
+def test_unfinished_runs_stay_out_of_the_total():
+    metrics = _metrics([("P1", None, True, [("sync", 1.0)])])
+    metrics.begin_run("P2")
+    metrics.record("sync", 5.0)
+    summary = metrics.summary()
+    assert summary["sync"]["count"] == 2
+    assert summary["TOTAL"]["count"] == 1 and summary["TOTAL"]["total"] == 1.0
+    metrics.end_run(False)
+
+
+def test_stages_outside_a_run_are_ignored():
+    metrics = SessionMetrics()
+    metrics.record("sync", 1.0)
+    assert metrics.summary() == {}
+    assert metrics.format_summary() == "Sin datos de etapas todavía"
+
+
+def test_format_summary_lists_every_stage():
+    lines = _metrics([("P1", None, True, [("sync", 1.0), ("erase", 4.0)])]).format_summary().splitlines()
+    assert [line.split()[0] for line in lines] == ["Etapa", "sync", "erase", "TOTAL"]
+    assert lines[2].split()[1:] == ["4.00", "4.00", "1"]
+
+
+def test_export_csv_has_one_row_per_stage(tmp_path):
+    metrics = _metrics([
+        ("P1", "aa:aa", True, [("sync", 1.0), ("write", 10.0)]),
+        ("P2", None, False, [("sync", 0.12345)]),
+    ])
+    path = tmp_path / "metrics.csv"
+    metrics.export_csv(str(path))
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["run", "started", "port", "device", "success", "stage", "seconds"]
+    assert [row[:1] + row[2:] for row in rows[1:]] == [
+        ["1", "P1", "aa:aa", "True", "sync", "1.0000"],
+        ["1", "P1", "aa:aa", "True", "write", "10.0000"],
+        ["2", "P2", "", "False", "sync", "0.1235"],
+    ]
+
+
+def test_export_json_has_runs_and_summary(tmp_path):
+    metrics = _metrics([("P1", "aa:aa", True, [("sync", 1.0), ("write", 10.0)])])
+    path = tmp_path / "metrics.json"
+    metrics.export_json(str(path))
+    data = json.loads(path.read_text(encoding='utf-8'))
+    assert data["summary"] == json.loads(json.dumps(metrics.summary()))
+    (run,) = data["runs"]
+    assert run["port"] == "P1" and run["device"] == "aa:aa" and run["success"] is True
+    assert run["stages"] == [{"stage": "sync", "seconds": 1.0}, {"stage": "write", "seconds": 10.0}]
@@ -0,0 +1,154 @@
+"""
+Span Tracing for ESP32 flashing
+Opt-in recorder of nested timing spans (esptool calls, subprocesses, file
+reads, UI flushes) exported as Chrome trace-event JSON for Perfetto /
+chrome://tracing
+
+Usage:
+    from tracing import TRACER
+    TRACER.start()
+    with TRACER.span("flash", "app", port="COM3"):
+        with TRACER.span("erase", "esptool"):
+            ...
+    TRACER.export("flash_trace.json")
+
+Setting SENSEAI_TRACE=<file.json> enables tracing from start-up and writes
+the trace when the program exits.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+
+class Tracer:
+    """Records complete ('X') trace events per thread; a no-op until started"""
+
+    # Span arguments inherited by nested spans on the same thread
+    INHERITED_ARGS = ("port",)
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._events = []
+        self._threads = {}  # tid -> thread name
+        self._pid = os.getpid()
+        self._t0 = time.perf_counter()
+
+    def _now_us(self):
+        return (time.perf_counter() - self._t0) * 1e6
+
+    def start(self):
+        """Start a new recording (previous events are discarded)"""
+        with self._lock:
+            self._events = []
+            self._threads = {}
+            self._t0 = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    @property
+    def event_count(self):
+        with self._lock:
+            return len(self._events)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def begin(self, name, cat="app", **args):
+        """
+        Open a span on the calling thread; close it with end()
+
+        Args:
+            name: Span name shown in the timeline
+            cat: Category (esptool, subprocess, io, ui, stage...)
+            **args: Extra arguments; 'port' is inherited by nested spans
+
+        Returns:
+            True if a span was opened (tracing enabled), so end() must be called
+        """
+        if not self.enabled:
+            return False
+        stack = self._stack()
+        if stack:
+            for key in self.INHERITED_ARGS:
+                if key in stack[-1]["args"] and key not in args:
+                    args[key] = stack[-1]["args"][key]
+        stack.append({"name": name, "cat": cat, "args": args, "ts": self._now_us()})
+        return True
+
+    def end(self, **args):
+        """Close the innermost open span of the calling thread (extra args are merged in)"""
+        stack = self._stack()
+        if not stack:
+            return
+        span = stack.pop()
+        span["args"].update(args)
+        self._add({"name": span["name"], "cat": span["cat"], "ph": "X", "ts": span["ts"],
+                   "dur": self._now_us() - span["ts"], "args": span["args"]})
+
+    @contextmanager
+    def span(self, name, cat="app", **args):
+        """Time a block as a span (see begin)"""
+        if not self.begin(name, cat, **args):
+            yield
+            return
+        try:
+            yield
+        finally:
+            self.end()
+
+    def instant(self, name, cat="app", **args):
+        """Record a point-in-time event"""
+        if self.enabled:
+            self._add({"name": name, "cat": cat, "ph": "i", "s": "t", "ts": self._now_us(), "args": args})
+
+    def _add(self, event):
+        thread = threading.current_thread()
+        event["pid"] = self._pid
+        event["tid"] = thread.ident
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append(event)
+
+    def export(self, path):
+        """Write the recording as Chrome trace-event JSON"""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self._pid, "tid": 0,
+                     "args": {"name": "SenseAI Firmware Loader"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in threads.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+# Process-wide tracer shared by every module (like the logging module's root logger)
+TRACER = Tracer()
+
+
+def start_from_env(variable="SENSEAI_TRACE"):
+    """
+    Enable tracing when the environment variable names an output file;
+    the trace is written at exit
+
+    Returns:
+        Output path, or None if tracing was not requested
+    """
+    path = os.environ.get(variable)
+    if not path:
+        return None
+    TRACER.start()
+    atexit.register(TRACER.export, path)
+    return path
@@ -0,0 +1,100 @@
+"""
+Virtual List widget for Tkinter
+Sorted list that only renders the rows currently visible, so inserting
+into a list of tens of thousands of entries stays cheap
+"""
+
+import bisect
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualListbox(ttk.Frame):
+    """Listbox showing a window of a sorted in-memory list, with its own scrollbar"""
+
+    def __init__(self, parent, height=4, width=35, font=None):
+        """
+        Args:
+            parent: Parent widget
+            height: Visible rows
+            width: Width in characters
+            font: Row font
+        """
+        super().__init__(parent)
+        self.items = []
+        self.first = 0
+        self.rows = height
+
+        self.listbox = tk.Listbox(self, height=height, width=width, font=font, activestyle='none',
+                                  exportselection=False, borderwidth=1, highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scroll)
+        self.listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.columnconfigure(0, weight=1)
+
+        # The listbox only ever holds the visible rows: scrolling moves the window
+        self.listbox.bind("<MouseWheel>", lambda e: self._scroll_by(-1 if e.delta > 0 else 1))
+        self.listbox.bind("<Button-4>", lambda e: self._scroll_by(-1))
+        self.listbox.bind("<Button-5>", lambda e: self._scroll_by(1))
+
+    def __len__(self):
+        return len(self.items)
+
+    def insert_sorted(self, item):
+        """
+        Insert an item at its sorted position (no-op if already present)
+
+        Returns:
+            True if the item was added
+        """
+        idx = bisect.bisect_left(self.items, item)
+        if idx < len(self.items) and self.items[idx] == item:
+            return False
+        self.items.insert(idx, item)
+        if idx < self.first + self.rows:
+            self._render()
+        else:
+            self._update_scrollbar()
+        return True
+
+    def set_items(self, items):
+        self.items = sorted(set(items))
+        self.first = 0
+        self._render()
+
+    def clear(self):
+        self.set_items([])
+
+    def _max_first(self):
+        return max(0, len(self.items) - self.rows)
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self.first + rows)
+        return "break"
+
+    def _scroll_to(self, first):
+        first = min(max(0, first), self._max_first())
+        if first != self.first:
+            self.first = first
+            self._render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == tk.MOVETO:
+            self._scroll_to(int(float(amount) * len(self.items)))
+        elif action == tk.SCROLL:
+            step = self.rows if unit == tk.PAGES else 1
+            self._scroll_by(int(amount) * step)
+
+    def _render(self):
+        self.first = min(self.first, self._max_first())
+        self.listbox.delete(0, tk.END)
+        for item in self.items[self.first:self.first + self.rows]:
+            self.listbox.insert(tk.END, item)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = len(self.items)
+        if total <= self.rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.first / total, (self.first + self.rows) / total)